@@ -1,134 +1,50 @@
 from flask import Flask, request, jsonify, send_file, render_template
 import tempfile
 import os
-import scipy
+import time
 import numpy as np
+import hashlib
+import logging
+import request_log
+from token_budget import SAVE_INTERVAL, TokenBudgetEstimator
+from seeding import resolve_seed, seeded
+from clone_preflight import ClonePreflight
+from tts_engine import SynthesisRequest, create_engine, parse_model_keys, sampling_config, LOAD_MODELS
+from audio_output import encode_wav
+from disk_cache import DiskCache, content_key, write_atomic
+from request_log import RequestLog, log_event
+
+logger = request_log.get_logger('app')
 
 app = Flask(__name__, template_folder='templates')
 
 # 创建输出目录
 OUTPUT_DIR = os.path.join(os.path.dirname(__file__), 'output')
 os.makedirs(OUTPUT_DIR, exist_ok=True)
-print(f"音频输出目录: {OUTPUT_DIR}")
+log_event(logger, logging.INFO, '音频输出目录', path=OUTPUT_DIR)
 
-print("Qwen-TTS服务正在启动，正在加载模型...")
+# max_new_tokens预算估计器（统计持久化到输出目录）
+token_budget = TokenBudgetEstimator(os.path.join(OUTPUT_DIR, 'token_budget_stats.json'), save_interval=SAVE_INTERVAL)
 
-# 初始化模型变量
-model_base = None
-model_voice_design = None
-model_custom_voice = None
+# 声音克隆预检：按参考音频缓存ICL/x-vector判断与克隆提示
+clone_preflight = ClonePreflight()
 
-# 0.6B模型变量
-model_base_0_6b = None
-model_voice_design_0_6b = None
-model_custom_voice_0_6b = None
+# 生成结果的共享磁盘缓存：按请求内容寻址，与其他工作进程共用
+result_cache = DiskCache(os.path.join(OUTPUT_DIR, 'cache'))
 
-# 尝试导入Qwen-TTS模型
-print("Qwen-TTS服务正在启动...")
-try:
-    # 解决SoX缺失的问题，先导入并处理
-    import warnings
-    warnings.filterwarnings("ignore")
-    
-    # 尝试导入Qwen-TTS模型
-    from qwen_tts import Qwen3TTSModel
-    
-    print("✅ Qwen-TTS模型类导入成功！")
-    print("📌 注意：SoX缺失不会影响基本功能，只会影响某些高级功能。")
-    
-    # 加载Base模型（用于语音克隆）
-    print("\n📁 加载 Base 模型...")
-    try:
-        model_base = Qwen3TTSModel.from_pretrained(
-            "./Qwen3-TTS-12Hz-1.7B-Base", 
-            trust_remote_code=True, 
-            device_map="cpu"
-        )
-        print("✅ Base 模型加载成功！")
-    except Exception as e:
-        print(f"❌ Base 模型加载失败: {e}")
-        model_base = None
-    
-    # 加载VoiceDesign模型（使用完整版）
-    print("\n📁 加载 VoiceDesign 模型...")
-    try:
-        model_voice_design = Qwen3TTSModel.from_pretrained(
-            "./Qwen3-TTS-12Hz-1.7B-VoiceDesign-Full", 
-            trust_remote_code=True, 
-            device_map="cpu"
-        )
-        print("✅ VoiceDesign 模型加载成功！")
-    except Exception as e:
-        print(f"❌ VoiceDesign 模型加载失败: {e}")
-        model_voice_design = None
-    
-    # 加载CustomVoice模型（使用完整版）
-    print("\n📁 加载 CustomVoice 模型...")
-    try:
-        model_custom_voice = Qwen3TTSModel.from_pretrained(
-            "./Qwen3-TTS-12Hz-1.7B-CustomVoice-Full", 
-            trust_remote_code=True, 
-            device_map="cpu"
-        )
-        print("✅ CustomVoice 模型加载成功！")
-    except Exception as e:
-        print(f"❌ CustomVoice 模型加载失败: {e}")
-        model_custom_voice = None
-    
-    # 加载0.6B Base模型
-    print("\n📁 加载 0.6B Base 模型...")
-    try:
-        model_base_0_6b = Qwen3TTSModel.from_pretrained(
-            "./Qwen3-TTS-12Hz-0.6B-Base", 
-            trust_remote_code=True, 
-            device_map="cpu"
-        )
-        print("✅ 0.6B Base 模型加载成功！")
-    except Exception as e:
-        print(f"❌ 0.6B Base 模型加载失败: {e}")
-        model_base_0_6b = None
-    
-    # 加载0.6B VoiceDesign模型
-    print("\n📁 加载 0.6B VoiceDesign 模型...")
-    try:
-        model_voice_design_0_6b = Qwen3TTSModel.from_pretrained(
-            "./Qwen3-TTS-12Hz-0.6B-VoiceDesign", 
-            trust_remote_code=True, 
-            device_map="cpu"
-        )
-        print("✅ 0.6B VoiceDesign 模型加载成功！")
-    except Exception as e:
-        print(f"❌ 0.6B VoiceDesign 模型加载失败: {e}")
-        model_voice_design_0_6b = None
-    
-    # 加载0.6B CustomVoice模型
-    print("\n📁 加载 0.6B CustomVoice 模型...")
-    try:
-        model_custom_voice_0_6b = Qwen3TTSModel.from_pretrained(
-            "./Qwen3-TTS-12Hz-0.6B-CustomVoice", 
-            trust_remote_code=True, 
-            device_map="cpu"
-        )
-        print("✅ 0.6B CustomVoice 模型加载成功！")
-    except Exception as e:
-        print(f"❌ 0.6B CustomVoice 模型加载失败: {e}")
-        model_custom_voice_0_6b = None
+print("Qwen-TTS服务正在启动，正在加载模型...")
 
-except Exception as e:
-    print(f"❌ 模型类导入失败: {e}")
-    print("📝 将使用模拟音频生成功能。")
+# 合成引擎：标准版默认直接调用模型（QWEN_TTS_ENGINE 可切换为 optimized / stub 后端）
+engine = create_engine(default='eager')
+engine.load(parse_model_keys(LOAD_MODELS))
 
 print("\n✅ 服务启动成功！")
 print("🔗 请在浏览器中访问: http://localhost:5000")
 print("💡 当前状态：")
-if model_voice_design is not None or model_custom_voice is not None:
-    print("   - Qwen3-TTS模型：已加载（真实语音生成）")
-    if model_voice_design:
-        print("     ✓ VoiceDesign 模型：可用")
-    if model_custom_voice:
-        print("     ✓ CustomVoice 模型：可用")
-    if model_base:
-        print("     ✓ Base 模型：可用（语音克隆）")
+if engine.models:
+    print(f"   - Qwen3-TTS模型：已加载（{engine.name} 后端）")
+    for name in engine.available():
+        print(f"     ✓ {name} 模型：可用")
 else:
     print("   - Qwen3-TTS模型：使用模拟音频生成")
     print("   - 建议：检查模型文件是否完整")
@@ -1378,18 +1294,18 @@ def index():
 
 @app.route('/tts', methods=['POST'])
 def text_to_speech():
+    # 每个请求输出一条汇总日志（见 request_log）
+    log = RequestLog('tts')
     try:
         data = request.json
         text = data.get('text', '')
         mode = data.get('mode', 'voice-design')
 
         if not text:
+            log.finish('invalid', error='empty_text')
             return jsonify({'success': False, 'error': '请输入要合成的文本'})
 
-        # 打印请求信息
-        print(f"\n=== 语音生成请求 ===")
-        print(f"模式: {mode}")
-        print(f"文本: {text[:50]}...")
+        log.note(mode=mode, chars=len(text))
         
         # 默认参数
         language = data.get('language', 'auto')
@@ -1417,120 +1333,60 @@ def text_to_speech():
         speaker = data.get('speaker', 'Vivian')
         style = data.get('style', '')
         model_version = data.get('model_version', 'full')  # 获取模型版本参数
+        seed = resolve_seed(data.get('seed'))  # 可选随机种子
         
-        if mode == 'voice-design':
-            print(f"语言: {language}")
-            print(f"声音描述: {voice_description[:50]}...")
-            print(f"模型版本: {model_version}")
-        elif mode == 'voice-clone':
-            print(f"语言: {language}")
-            print(f"参考文本: {reference_text[:50]}...")
-            print(f"模型版本: {model_version}")
-        elif mode == 'tts-custom':
-            print(f"语言: {language}")
-            print(f"说话人: {speaker}")
-            print(f"风格: {style}")
-            print(f"模型版本: {model_version}")
-        print(f"====================\n")
+        log.note(language=language, model_version=model_version)
+        log.verbose(text=text[:50], speaker=speaker, style=style,
+                    voice_description=voice_description[:50], reference_text=reference_text[:50])
 
+        # 文件名按请求内容寻址：不同请求不会互相覆盖，相同请求直接复用缓存中的结果
+        reference_audio = data.get('reference_audio', '')
+        digest = content_key(text, mode, language, model_version, speaker, style,
+                             voice_description, reference_audio, reference_text, seed)
+        
         # 使用Qwen-TTS模型生成语音
         try:
-            import time
-            start_time = time.time()
+            # 未固定种子时每次生成的音频不同，不读也不写缓存
+            with result_cache.claim(digest, bypass=seed is None) as entry:
+                if entry.hit:
+                    log.finish('ok', cached=True, waited_for_other_worker=entry.waited, digest=digest[:12])
+                    return jsonify({
+                        'success': True,
+                        'audio_url': f'/audio/{digest}.wav',
+                        'seed': seed
+                    })
             
-            # 性能优化：使用更快的生成参数
-            # 降低max_new_tokens以加速生成，根据文本长度动态调整
-            text_length = len(text)
+                start_time = time.time()
             
-            # 根据模型版本调整参数
-            if model_version == 'small':
-                # 轻量版：更快的生成速度，稍微降低质量
-                max_tokens = min(1024, max(256, text_length * 6))
-                temperature = 0.5
-                top_p = 0.7
-                top_k = 30
-                print(f"使用轻量版模型参数以加速生成")
-            else:
-                # 完整版：最高质量
-                max_tokens = min(2048, max(512, text_length * 8))
-                temperature = 0.6
-                top_p = 0.8
-                top_k = 50
+                # 采样参数按模型版本选择（兼容旧版的 full / small）
+                # max_new_tokens由预算估计器根据历史帧/字符比按请求计算
+                generation_config = sampling_config(model_version)
             
-            generation_config = {
-                'do_sample': True,
-                'temperature': temperature,
-                'top_p': top_p,
-                'top_k': top_k,
-                'max_new_tokens': max_tokens,
-                'num_beams': 1,
-                'early_stopping': True,
-            }
+                # token预算统计使用的说话人标识
+                reference_audio = data.get('reference_audio', '')
+                if mode == 'tts-custom':
+                    speaker_key = speaker
+                elif mode == 'voice-clone':
+                    speaker_key = f"clone:{reference_audio}"
+                else:
+                    speaker_key = f"design:{hashlib.md5(voice_description.encode('utf-8')).hexdigest()[:8]}"
             
-            # 根据model_version选择模型大小（0.6b或1.7b）
-            use_0_6b = (model_version == '0.6b')
+                # 未知模式默认使用语音设计模式
+                if mode not in ('voice-design', 'voice-clone', 'tts-custom'):
+                    mode = 'voice-design'
+                _, model_name = engine.select_model(mode, model_version)
+                max_tokens = token_budget.budget(text, language, model_name, speaker_key)
+                generation_config['max_new_tokens'] = max_tokens
+                req = SynthesisRequest(
+                    text=text, mode=mode, language=language, model_version=model_version,
+                    speaker=speaker, style=style, voice_description=voice_description,
+                    generation_config=generation_config,
+                )
             
-            # 根据不同模式调用不同的生成方法
-            if mode == 'voice-design':
-                # 语音设计模式 - 选择VoiceDesign模型
-                if use_0_6b and model_voice_design_0_6b is not None:
-                    selected_model = model_voice_design_0_6b
-                    model_name = "0.6B VoiceDesign"
-                elif model_voice_design is not None:
-                    selected_model = model_voice_design
-                    model_name = "1.7B VoiceDesign"
-                else:
-                    selected_model = None
-                    model_name = "None"
-                
-                if selected_model is not None:
-                    print(f"使用{model_name}模型生成语音...")
-                    print(f"开始时间: {time.strftime('%H:%M:%S')}")
-                    print(f"优化参数: max_tokens={max_tokens}")
-                    
-                    # 尝试使用优化的生成方法
-                    try:
-                        # 使用更快的推理设置
-                        wavs, sample_rate = selected_model.generate_voice_design(
-                            text=text,
-                            language=language,
-                            voice_description=voice_description,
-                            instruct=voice_description,
-                            **generation_config
-                        )
-                    except TypeError as e:
-                        print(f"优化参数不支持: {e}，使用默认参数")
-                        # 如果模型不支持这些参数，使用默认参数
-                        wavs, sample_rate = selected_model.generate_voice_design(
-                            text=text,
-                            language=language,
-                            voice_description=voice_description,
-                            instruct=voice_description
-                        )
-                else:
-                    raise Exception("VoiceDesign模型未加载")
-                    
-            elif mode == 'voice-clone':
-                # 语音克隆模式 - 使用Base模型的generate_voice_clone方法
-                if use_0_6b and model_base_0_6b is not None:
-                    selected_model = model_base_0_6b
-                    model_name = "0.6B Base"
-                elif model_base is not None:
-                    selected_model = model_base
-                    model_name = "1.7B Base"
-                else:
-                    selected_model = None
-                    model_name = "None"
-                
-                if selected_model is not None:
-                    print(f"使用{model_name}模型进行声音克隆...")
-                    print(f"开始时间: {time.strftime('%H:%M:%S')}")
-                    
-                    # 获取参考音频路径
-                    reference_audio = data.get('reference_audio', '')
+                if mode == 'voice-clone':
                     if not reference_audio:
                         raise Exception("请上传参考音频文件")
-                    
+                
                     # 构建参考音频的完整路径（从output目录查找）
                     ref_audio_path = os.path.join(OUTPUT_DIR, reference_audio)
                     if not os.path.exists(ref_audio_path):
@@ -1539,142 +1395,55 @@ def text_to_speech():
                     if not os.path.exists(ref_audio_path):
                         # 如果还是找不到，使用原路径
                         ref_audio_path = reference_audio
-                    
-                    print(f"参考音频: {ref_audio_path}")
-                    print(f"参考文本: {reference_text[:50] if reference_text else 'None'}...")
-                    
-                    try:
-                        # 使用Base模型的generate_voice_clone方法
-                        wavs, sample_rate = selected_model.generate_voice_clone(
-                            text=text,
-                            language=language,
-                            ref_audio=ref_audio_path,
-                            ref_text=reference_text if reference_text else None,
-                            x_vector_only_mode=False,  # 使用ICL模式以获得更好的克隆效果
-                            **generation_config
-                        )
-                    except Exception as e:
-                        print(f"声音克隆失败: {e}")
-                        print("尝试使用x_vector_only_mode=True模式...")
-                        # 如果ICL模式失败，尝试仅使用x_vector模式
-                        wavs, sample_rate = selected_model.generate_voice_clone(
-                            text=text,
-                            language=language,
-                            ref_audio=ref_audio_path,
-                            x_vector_only_mode=True,
-                            **generation_config
-                        )
-                else:
-                    raise Exception("Base模型未加载，声音克隆功能不可用")
-                    
-            elif mode == 'tts-custom':
-                # 自定义语音模式 - 选择CustomVoice模型
-                if use_0_6b and model_custom_voice_0_6b is not None:
-                    selected_model = model_custom_voice_0_6b
-                    model_name = "0.6B CustomVoice"
-                elif model_custom_voice is not None:
-                    selected_model = model_custom_voice
-                    model_name = "1.7B CustomVoice"
-                else:
-                    selected_model = None
-                    model_name = "None"
+                    log.verbose(reference_audio=ref_audio_path)
                 
-                if selected_model is not None:
-                    print(f"使用{model_name}模型生成语音...")
-                    print(f"开始时间: {time.strftime('%H:%M:%S')}")
-                    print(f"优化参数: max_tokens={max_tokens}")
-                    
-                    # 将style转换为instruct（如果提供了style）
-                    instruct_text = style if style else None
-                    
-                    try:
-                        if instruct_text:
-                            wavs, sample_rate = selected_model.generate_custom_voice(
-                                text=text,
-                                language=language,
-                                speaker=speaker,
-                                instruct=instruct_text,
-                                **generation_config
-                            )
-                        else:
-                            wavs, sample_rate = selected_model.generate_custom_voice(
-                                text=text,
-                                language=language,
-                                speaker=speaker,
-                                **generation_config
-                            )
-                    except TypeError as e:
-                        print(f"优化参数不支持: {e}，使用默认参数")
-                        if instruct_text:
-                            wavs, sample_rate = selected_model.generate_custom_voice(
-                                text=text,
-                                language=language,
-                                speaker=speaker,
-                                instruct=instruct_text
-                            )
-                        else:
-                            wavs, sample_rate = selected_model.generate_custom_voice(
-                                text=text,
-                                language=language,
-                                speaker=speaker
-                            )
-                else:
-                    raise Exception("CustomVoice模型未加载")
-                    
-            else:
-                # 默认使用语音设计模式
-                if use_0_6b and model_voice_design_0_6b is not None:
-                    default_model = model_voice_design_0_6b
-                    default_name = "0.6B VoiceDesign"
-                elif model_voice_design is not None:
-                    default_model = model_voice_design
-                    default_name = "1.7B VoiceDesign"
-                else:
-                    default_model = None
-                    default_name = "None"
-                    
-                if default_model is not None:
-                    print(f"使用默认{default_name}模型生成语音...")
-                    try:
-                        wavs, sample_rate = default_model.generate_voice_design(
-                            text=text,
-                            language=language,
-                            voice_description=voice_description,
-                            instruct=voice_description,
-                            **generation_config
-                        )
-                    except TypeError:
-                        wavs, sample_rate = default_model.generate_voice_design(
-                            text=text,
-                            language=language,
-                            voice_description=voice_description,
-                            instruct=voice_description
-                        )
-                else:
-                    raise Exception("VoiceDesign模型未加载")
+                    # 预检决定ICL或x-vector模式并缓存克隆提示
+                    req.clone_prompt, _ = clone_preflight.prompt_for(
+                        model_name, ref_audio_path, reference_text,
+                        lambda ref_audio, ref_text, x_vector_only: engine.create_clone_prompt(model_name, ref_audio, ref_text, x_vector_only)
+                    )
             
-            end_time = time.time()
-            generation_duration = end_time - start_time
-            print(f"语音生成完成，耗时: {generation_duration:.2f}秒")
+                log.note(model=model_name, max_tokens=max_tokens)
+                generate_start = time.time()
+                log.add_timing('prepare', generate_start - start_time)
             
-            # 处理生成的音频（所有分支都需要执行这里）
-            print(f"语音生成成功，采样率: {sample_rate}")
-            audio_data = wavs[0]  # 取第一个生成的音频
+                # 可选随机种子：固定后相同请求生成相同音频
+                with seeded(seed):
+                    result = engine.generate(req)
+                wavs, sample_rate = result.wavs, result.sample_rate
             
-            # 将生成的音频保存到output目录
-            audio_path = os.path.join(OUTPUT_DIR, f"qwen_tts_output_{hash(text)}.wav")
-            scipy.io.wavfile.write(audio_path, sample_rate, audio_data)
-            print(f"音频已保存到: {audio_path}")
+                log.add_timing('generate', time.time() - generate_start)
             
-            return jsonify({
-                'success': True,
-                'audio_url': f'/audio/qwen_tts_output_{hash(text)}.wav'
-            })
+                # 处理生成的音频（所有分支都需要执行这里）
+                audio_data = wavs[0]  # 取第一个生成的音频
+            
+                # 更新token预算统计，检查是否触顶
+                hit_cap = token_budget.record(text, language, model_name, speaker_key,
+                                              len(audio_data), sample_rate, max_tokens)
+                if hit_cap:
+                    log_event(logger, logging.WARNING, "生成达到token预算上限，音频可能被截断",
+                              model=model_name, max_tokens=max_tokens)
+            
+                # 发布到缓存（临时文件写完后原子替换）；截断或未固定种子的结果单独保存，下次重新生成
+                wav_bytes = encode_wav(audio_data, sample_rate)
+                if hit_cap or not entry.enabled:
+                    filename = f"qwen_tts_output_{digest[:16]}_{int(time.time())}.wav"
+                    write_atomic(os.path.join(OUTPUT_DIR, filename), wav_bytes)
+                else:
+                    filename = f"{digest}.wav"
+                    entry.publish(wav_bytes)
+                log.finish('ok', cached=False, hit_cap=hit_cap, sample_rate=sample_rate,
+                           audio_seconds=round(len(audio_data) / sample_rate, 2), file=filename)
+            
+                return jsonify({
+                    'success': True,
+                    'audio_url': f'/audio/{filename}',
+                    'seed': seed
+                })
             
         except Exception as e:
-            print(f"模型生成失败: {e}")
-            import traceback
-            traceback.print_exc()
+            log.note(error=str(e))
+            log_event(logger, logging.ERROR, "模型生成失败，使用模拟音频", exc_info=True, error=str(e))
             # 如果模型生成失败，使用模拟音频作为后备
             sample_rate = 22050
             duration = 2  # 2秒
@@ -1684,17 +1453,17 @@ def text_to_speech():
             audio_data = 0.5 * np.sin(2 * np.pi * frequency * t)
             audio_data = (audio_data * 32767).astype(np.int16)
             
-            audio_path = os.path.join(OUTPUT_DIR, f"tts_output_{hash(text)}.wav")
-            scipy.io.wavfile.write(audio_path, sample_rate, audio_data)
-            print(f"音频已保存到: {audio_path}")
+            audio_path = os.path.join(OUTPUT_DIR, f"tts_output_{digest[:16]}.wav")
+            write_atomic(audio_path, encode_wav(audio_data, sample_rate))
+            log.finish('fallback', level=logging.WARNING, file=os.path.basename(audio_path))
             
             return jsonify({
                 'success': True,
-                'audio_url': f'/audio/tts_output_{hash(text)}.wav'
+                'audio_url': f'/audio/tts_output_{digest[:16]}.wav'
             })
 
     except Exception as e:
-        print(f"生成语音时出错: {e}")
+        log.finish('error', level=logging.ERROR, exc_info=True, error=str(e))
         return jsonify({'success': False, 'error': str(e)})
 
 @app.route('/upload', methods=['POST'])
@@ -1708,12 +1477,14 @@ def upload_file():
         if file.filename == '':
             return jsonify({'success': False, 'error': '文件名为空'}), 400
         
-        # 保存文件到output目录
-        filename = f"ref_audio_{hash(file.filename)}_{file.filename}"
+        # 按内容命名并原子写入output目录：同名的不同文件不会互相覆盖
+        data = file.read()
+        filename = f"ref_audio_{content_key(data)[:16]}_{os.path.basename(file.filename)}"
         filepath = os.path.join(OUTPUT_DIR, filename)
-        file.save(filepath)
+        if not os.path.exists(filepath):
+            write_atomic(filepath, data)
         
-        print(f"参考音频已上传到: {filepath}")
+        log_event(logger, logging.INFO, "参考音频已上传", file=filename, bytes=len(data))
         
         return jsonify({
             'success': True,
@@ -1721,14 +1492,19 @@ def upload_file():
             'filepath': filepath
         })
     except Exception as e:
-        print(f"文件上传失败: {e}")
+        log_event(logger, logging.ERROR, "文件上传失败", exc_info=True, error=str(e))
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/stats/token-budget')
+def token_budget_stats():
+    """token预算统计：各语言/模型/说话人的帧/字符比与触顶比例"""
+    return jsonify(token_budget.summary())
+
 @app.route('/audio/<filename>')
 def serve_audio(filename):
     try:
-        # 首先在output目录查找
-        audio_path = os.path.join(OUTPUT_DIR, filename)
+        # 首先在结果缓存与output目录查找
+        audio_path = result_cache.locate(filename) or os.path.join(OUTPUT_DIR, filename)
         if not os.path.exists(audio_path):
             # 如果不在output目录，尝试在临时目录查找（兼容旧文件）
             audio_path = os.path.join(tempfile.gettempdir(), filename)
@@ -1741,4 +1517,4 @@ if __name__ == '__main__':
     print("Qwen-TTS 服务启动成功！")
     print("请在浏览器中访问: http://localhost:5000")
     print("="*50 + "\n")
-    app.run(host='0.0.0.0', port=5000, debug=False)
+    app.run(host='0.0.0.0', port=int(os.environ.get('QWEN_TTS_PORT', 5000)), debug=False)
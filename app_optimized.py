@@ -7,15 +7,48 @@ Qwen-TTS 高性能优化版本
 4. 缓存机制
 5. 优化的生成参数
 """
-from flask import Flask, request, jsonify, send_file, render_template
+from flask import Flask, Response, request, jsonify, send_file, render_template, g
 import tempfile
 import os
-import scipy
 import numpy as np
 import torch
-import warnings
 import time
-from functools import lru_cache
+import hashlib
+import json
+import uuid
+import math
+import logging
+import queue
+import threading
+from token_budget import TokenBudgetEstimator
+from seeding import resolve_seed, seeded, derive_seed
+from singleflight import SingleFlight
+from scheduler import SynthesisScheduler, resolve_priority
+from text_segmenter import split_segments, SentenceBuffer, SEGMENT_MAX_CHARS
+from cancellation import CancellationRegistry, DuplicateRequestId, GenerationCancelled, stopping_criteria_for
+from slo import ModelSpeedTracker, choose_tier, model_size
+from rate_limit import ClientRateLimiter, client_identity, estimate_cost
+import request_log
+from request_log import RequestLog, log_event
+from token_budget import CODEC_FRAME_RATE, SAVE_INTERVAL
+from document_jobs import DocumentJobManager
+from segment_store import SegmentStore, segment_key, to_pcm16
+from disk_cache import DiskCache, content_key, write_atomic
+from voice_profiles import VoiceProfileLibrary
+from clone_preflight import ClonePreflight
+from progress import ProgressHub, DecodeProgress, TERMINAL_EVENTS, format_sse
+from functools import partial
+import audio_postprocess
+import openai_compat
+from audio_output import AsyncAudioWriter, encode_wav, multipart_body, resolve_response_mode
+from tts_engine import SynthesisRequest, create_engine, parse_model_keys, sampling_config, LOAD_MODELS
+
+# WebSocket流式接口为可选功能（pip install flask-sock）
+try:
+    from flask_sock import Sock
+    from simple_websocket import ConnectionClosed
+except ImportError:
+    Sock = None
 
 # 设置PyTorch性能优化
 # 启用TF32加速（在支持的GPU上）
@@ -24,335 +57,1089 @@ torch.backends.cudnn.allow_tf32 = True
 # 启用cudnn基准测试，自动寻找最快的卷积算法
 torch.backends.cudnn.benchmark = True
 
+# 请求路径上的日志经队列由后台线程写出（JSON），每个请求一条汇总记录
+logger = request_log.get_logger('app')
+
 app = Flask(__name__, template_folder='templates')
+sock = Sock(app) if Sock is not None else None
 
 # 创建输出目录
 OUTPUT_DIR = os.path.join(os.path.dirname(__file__), 'output')
 os.makedirs(OUTPUT_DIR, exist_ok=True)
-print(f"音频输出目录: {OUTPUT_DIR}")
+log_event(logger, logging.INFO, '音频输出目录', path=OUTPUT_DIR)
+
+# max_new_tokens预算估计器（统计持久化到输出目录）
+token_budget = TokenBudgetEstimator(os.path.join(OUTPUT_DIR, 'token_budget_stats.json'), save_interval=SAVE_INTERVAL)
+
+# 在途请求去重：相同请求只生成一次
+inflight_requests = SingleFlight()
+
+# 合成调度器：按模型分配槽位，按优先级类别加权调度
+synthesis_scheduler = SynthesisScheduler()
+
+# 按客户端的请求数与计算量限流（调度器内再按客户端公平排队）
+rate_limiter = ClientRateLimiter()
+
+# 取消登记：客户端断线或调用 /cancel 时在下一个解码步停止生成
+cancellations = CancellationRegistry()
+
+# 各模型/采样档的历史解码速度，用于截止时间估算
+speed_tracker = ModelSpeedTracker()
+
+# 片段音频存储：修改长文本后只重新生成变化的片段
+segment_store = SegmentStore(os.path.join(OUTPUT_DIR, 'segments'))
+
+# 音色档案库：设计一次的音色以Base模型克隆提示的形式复用
+voice_profiles = VoiceProfileLibrary(os.path.join(OUTPUT_DIR, 'voice_profiles'))
+voice_profiles.preload_configured()
+
+# 生成进度（SSE）：排队、开始、每N个token、片段完成与结束事件
+progress_hub = ProgressHub()
+
+# 声音克隆预检：按参考音频缓存ICL/x-vector判断与克隆提示
+clone_preflight = ClonePreflight()
+
+# 生成的音频在后台线程落盘，不阻塞请求
+audio_writer = AsyncAudioWriter(OUTPUT_DIR)
+
+# 完整请求结果的共享磁盘缓存：同机的所有工作进程共用，相同请求只生成一次
+result_cache = DiskCache(os.path.join(OUTPUT_DIR, 'cache'))
+
+# 多片段拼接时片段之间插入的停顿（秒）
+SEGMENT_PAUSE_SECONDS = 0.1
 
 print("=" * 60)
 print("🚀 Qwen-TTS 高性能优化版本正在启动...")
 print("=" * 60)
 
-# 初始化模型变量
-model_base = None
-model_voice_design = None
-model_custom_voice = None
-model_base_0_6b = None
-model_voice_design_0_6b = None
-model_custom_voice_0_6b = None
+# 合成引擎：模型加载、选择与生成调用（QWEN_TTS_ENGINE 可切换为 eager / stub 后端）
+engine = create_engine(default='optimized')
+print(f"\n📦 正在加载模型（{engine.name} 后端）...")
+if not engine.load(parse_model_keys(LOAD_MODELS)):
+    print("❌ 没有可用的模型，合成请求将返回错误")
 
-# 模型编译缓存
-compiled_models = {}
+print("\n" + "=" * 60)
+print("✅ 模型加载和优化完成！")
+print("=" * 60)
+
+def select_model(mode, use_0_6b):
+    """按模式与模型尺寸选择已加载的模型，0.6B未加载时回退到1.7B"""
+    return engine.select_model(mode, '0.6b' if use_0_6b else '1.7b')
+
+def get_speaker_key(mode, speaker, voice_description, reference_audio, voice_profile=''):
+    """token预算统计使用的说话人标识"""
+    if voice_profile:
+        return f"profile:{voice_profile}"
+    if mode == 'tts-custom':
+        return speaker
+    if mode == 'voice-clone':
+        return f"clone:{reference_audio}"
+    digest = hashlib.md5(voice_description.encode('utf-8')).hexdigest()[:8]
+    return f"design:{digest}"
 
-def compile_model(model, name):
-    """使用torch.compile编译模型以加速推理"""
-    if model is None:
+@app.route('/')
+def index():
+    return render_template('index.html')
+
+LANGUAGE_MAP = {
+    'zh': 'chinese', 'en': 'english', 'ja': 'japanese',
+    'ko': 'korean', 'fr': 'french', 'de': 'german',
+    'es': 'spanish', 'it': 'italian', 'pt': 'portuguese', 'ru': 'russian'
+}
+
+def parse_tts_request(data):
+    """从请求JSON中提取合成参数"""
+    language = data.get('language', 'auto')
+    text = data.get('text', '')
+    voice_profile = data.get('voice_profile', '')
+    return {
+        'text': text,
+        # 引用音色档案时走Base模型克隆路径
+        'mode': 'voice-clone' if voice_profile else data.get('mode', 'voice-design'),
+        'voice_profile': voice_profile,
+        'language': LANGUAGE_MAP.get(language, language),
+        'voice_description': data.get('voice_description', ''),
+        'reference_text': data.get('reference_text', ''),
+        'reference_audio': data.get('reference_audio', ''),
+        'speaker': data.get('speaker', 'Vivian'),
+        'style': data.get('style', ''),
+        'model_version': data.get('model_version', '1.7b'),
+        # 采样参数档，默认与模型版本一致
+        'sampling_profile': data.get('sampling_profile') or data.get('model_version', '1.7b'),
+        # 获取前端传来的模型参数
+        'temperature': float(data.get('temperature', 0.6)),
+        'top_p': float(data.get('top_p', 0.85)),
+        # 可选随机种子：固定后相同请求生成相同音频
+        'seed': resolve_seed(data.get('seed')),
+        # 优先级类别：未指定时短文本为interactive，需要分段的长文本为batch
+        'priority': resolve_priority(
+            data.get('priority'),
+            'interactive' if len(text) <= SEGMENT_MAX_CHARS else 'batch'
+        ),
+        # 可选截止时间（毫秒，相对请求到达时刻），预计超时时自动降级
+        'deadline_ms': float(data['deadline_ms']) if data.get('deadline_ms') else None,
+        # 可选服务端后处理：响度归一化、静音裁剪、淡入淡出、int16转换
+        'postprocess': audio_postprocess.parse_config(data.get('postprocess')),
+    }
+
+def request_digest(params):
+    """
+    请求摘要：文本、模式、模型、音色参数与种子完全相同的请求摘要相同
+
+    截止时间可能把请求降级到其他模型或采样参数，应在 apply_deadline 之后对实际使用的档位计算摘要，
+    否则没有截止时间的请求会合并到降级的在途生成上。
+    """
+    # 优先级、截止时间与客户端只影响调度，不影响生成结果
+    content = {k: v for k, v in params.items() if k not in ('priority', 'deadline_ms', 'client')}
+    payload = json.dumps(content, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def build_clone_prompt(model_name, ref_audio, ref_text, x_vector_only_mode=False):
+    """用Base模型为参考音频（路径或 (音频, 采样率)）计算克隆提示"""
+    with synthesis_scheduler.slot(model_name, 'interactive'), torch.no_grad():
+        return engine.create_clone_prompt(model_name, ref_audio, ref_text, x_vector_only_mode)
+
+def resolve_reference_path(reference_audio):
+    """上传的参考音频位于输出目录（旧版本位于临时目录）"""
+    if not reference_audio:
+        raise Exception("请上传参考音频文件")
+    ref_audio_path = os.path.join(OUTPUT_DIR, reference_audio)
+    if not os.path.isfile(ref_audio_path):
+        ref_audio_path = os.path.join(tempfile.gettempdir(), reference_audio)
+    if not os.path.isfile(ref_audio_path):
+        raise Exception(f"参考音频不存在: {reference_audio}")
+    return ref_audio_path
+
+def attach_decode_hooks(generation_config, cancel_token, progress, expected_frames):
+    """在解码循环的停止条件上挂取消检查与进度钩子，返回解码步数记录器（都不需要时为None）"""
+    if cancel_token is None and progress is None:
         return None
+    on_step = DecodeProgress(progress, expected_frames, generation_config['max_new_tokens']) if progress else None
+    generation_config['stopping_criteria'], decode_progress = stopping_criteria_for(cancel_token, on_step)
+    return decode_progress
+
+def decode_started(progress, model_name, generation_config, start_time):
+    """取得模型槽位、开始解码：记录时间并推送开始事件"""
+    decode_start = time.time()
+    if progress is not None:
+        progress('started', model_name=model_name, queue_seconds=round(decode_start - start_time, 3),
+                 max_new_tokens=generation_config['max_new_tokens'])
+    return decode_start
+
+def synthesize(params, cancel_token=None, progress=None, on_audio=None):
+    """
+    执行一次语音合成，返回 (音频数据, 采样率, 生成信息)
     
-    try:
-        # 检查PyTorch版本是否支持torch.compile
-        if hasattr(torch, 'compile') and torch.__version__ >= "2.0":
-            print(f"⚡ 正在编译 {name} 模型以加速推理...")
-            # 使用默认模式编译，平衡性能和编译时间
-            compiled_model = torch.compile(model, mode="reduce-overhead")
-            print(f"✅ {name} 模型编译完成！")
-            return compiled_model
+    progress 为可选的进度回调 (事件名, **数据)，由解码循环每N个token调用一次；
+    on_audio 为可选的音频回调 (音频片段, 采样率)，启用解码流水线时在生成过程中逐窗口调用，
+    生成信息中的 streamed_samples 为已通过回调输出的采样点数
+    """
+    text = params['text']
+    mode = params['mode']
+    language = params['language']
+    voice_description = params['voice_description']
+    reference_text = params['reference_text']
+    reference_audio = params['reference_audio']
+    speaker = params['speaker']
+    style = params['style']
+    model_version = params['model_version']
+    seed = params['seed']
+    priority = params['priority']
+    
+    # 根据采样参数档生成基础参数（截止时间降级时可能与模型版本不同）
+    sampling_profile = params.get('sampling_profile') or model_version
+    
+    # 使用前端传来的参数覆盖默认值
+    generation_config = sampling_config(sampling_profile)
+    generation_config['temperature'] = params['temperature']
+    generation_config['top_p'] = params['top_p']
+    
+    voice_profile = params.get('voice_profile', '')
+    speaker_key = get_speaker_key(mode, speaker, voice_description, reference_audio, voice_profile)
+    
+    # 开始计时
+    start_time = time.time()
+    
+    _, model_name = select_model(mode, model_version == '0.6b')
+    req = SynthesisRequest(
+        text=text, mode=mode, language=language, model_version=model_version,
+        speaker=speaker, style=style, voice_description=voice_description,
+        generation_config=generation_config, on_audio=on_audio,
+    )
+    
+    if mode == 'voice-clone':
+        if voice_profile:
+            # 音色档案：使用缓存的克隆提示，不需要参考音频
+            req.clone_prompt = voice_profiles.prompt_for(
+                voice_profile, model_name,
+                lambda audio, sr, ref_text: build_clone_prompt(model_name, (audio, sr), ref_text)
+            )
         else:
-            print(f"⚠️ PyTorch版本 {torch.__version__} 不支持torch.compile，跳过编译")
-            return model
-    except Exception as e:
-        print(f"⚠️ {name} 模型编译失败: {e}，使用原始模型")
-        return model
+            # 预检决定ICL或x-vector模式并缓存克隆提示，生成只运行一次
+            req.clone_prompt, _ = clone_preflight.prompt_for(
+                model_name, resolve_reference_path(reference_audio), reference_text,
+                lambda ref_audio, ref_text, x_vector_only: build_clone_prompt(model_name, ref_audio, ref_text, x_vector_only)
+            )
+    
+    generation_config['max_new_tokens'] = token_budget.budget(text, language, model_name, speaker_key)
+    request_log.verbose(generation_config=dict(generation_config))
+    decode_progress = attach_decode_hooks(
+        generation_config, cancel_token, progress,
+        token_budget.expected_frames(text, language, model_name, speaker_key)
+    )
+    request_log.note(model=model_name)
+    
+    # 同一优先级类别内按客户端公平排队，占用的份额按估算计算量计
+    cost = estimate_cost(len(text), model_size(model_name).lower())
+    with synthesis_scheduler.slot(model_name, priority, params.get('client'), cost), seeded(seed):
+        decode_start = decode_started(progress, model_name, generation_config, start_time)
+        result = engine.generate(req)
+    wavs, sample_rate = result.wavs, result.sample_rate
+    
+    # 计算生成时间
+    generation_time = time.time() - start_time
+    request_log.add_timing('queue', decode_start - start_time)
+    request_log.add_timing('generate', time.time() - decode_start)
+    
+    if cancel_token is not None and cancel_token.cancelled:
+        # 按预计帧数估算被省下的解码时间
+        expected = token_budget.expected_frames(text, language, model_name, speaker_key)
+        remaining_steps = max(0.0, expected - decode_progress.steps)
+        cancellations.record_saved(remaining_steps * decode_progress.seconds_per_step)
+        cancel_token.check()
+    
+    audio_data = wavs[0]
+    decode_time = time.time() - decode_start
+    speed_tracker.record(model_name, sampling_profile, decode_time, len(audio_data) / float(sample_rate) * CODEC_FRAME_RATE)
+    hit_cap = token_budget.record(
+        text, language, model_name, speaker_key,
+        len(audio_data), sample_rate, generation_config['max_new_tokens']
+    )
+    if hit_cap:
+        log_event(logger, logging.WARNING, '生成达到token预算上限，音频可能被截断',
+                  model=model_name, max_new_tokens=generation_config['max_new_tokens'], chars=len(text))
+    
+    return audio_data, sample_rate, {
+        'model_name': model_name,
+        'generation_time': generation_time,
+        'queue_time': decode_start - start_time,
+        'max_new_tokens': generation_config['max_new_tokens'],
+        'hit_token_cap': hit_cap,
+        'streamed_samples': result.streamed_samples,
+    }
 
-def quantize_model(model, name):
-    """对模型进行动态量化以加速CPU推理"""
-    if model is None:
-        return None
+def synthesize_cached(params, cancel_token=None, progress=None, on_audio=None):
+    """合成单个片段，相同文本与参数的片段直接复用已存储的音频（其他工作进程正在生成时等待其结果）"""
+    key = segment_key(params, params['text'])
+    with segment_store.claim(key, cancel_token) as cached:
+        if cached is not None:
+            audio_data, sample_rate = cached
+            return audio_data, sample_rate, {
+                'model_name': None, 'generation_time': 0.0, 'queue_time': 0.0,
+                'max_new_tokens': 0, 'hit_token_cap': False, 'reused': True, 'streamed_samples': 0,
+            }
+        audio_data, sample_rate, info = synthesize(params, cancel_token, progress, on_audio)
+        # 截断的片段不入库，下次重新生成
+        if not info['hit_token_cap']:
+            segment_store.put(key, audio_data, sample_rate)
+    return audio_data, sample_rate, dict(info, reused=False)
+
+def iter_segments(params, cancel_token=None, progress=None, on_audio=None):
+    """
+    逐个合成长文本的片段并依次产出 (片段文本, 音频, 采样率, 信息)：
+    每个片段单独申请模型槽位，高优先级请求到达时长任务在片段之间让出模型；
+    未修改的片段从片段存储复用，只重新生成变化的句子
+    """
+    segments = split_segments(params['text'])
+    if len(segments) <= 1:
+        audio_data, sample_rate, info = synthesize(params, cancel_token, progress, on_audio)
+        yield params['text'], audio_data, sample_rate, dict(info, reused=False, index=0, total=1)
+        return
     
-    try:
-        print(f"🔧 正在量化 {name} 模型...")
-        # 动态量化线性层，使用INT8精度
-        quantized_model = torch.quantization.quantize_dynamic(
-            model,
-            {torch.nn.Linear},
-            dtype=torch.qint8
-        )
-        print(f"✅ {name} 模型量化完成！")
-        return quantized_model
-    except Exception as e:
-        print(f"⚠️ {name} 模型量化失败: {e}，使用原始模型")
-        return model
+    request_log.note(segments=len(segments))
+    model_name = None
+    generated = 0
+    generation_time = 0.0
+    for index, segment in enumerate(segments):
+        if cancel_token is not None and cancel_token.cancelled:
+            # 剩余片段不再生成：按已生成片段的平均耗时估算节省的时间
+            cancellations.record_saved(generation_time / max(1, generated) * (len(segments) - index))
+            cancel_token.check()
+        if model_name and synthesis_scheduler.has_higher_priority_waiting(model_name, params['priority']):
+            synthesis_scheduler.note_yield()
+            log_event(logger, logging.DEBUG, '让出模型给更高优先级请求', segment=index, segments=len(segments))
+        # 片段种子由片段内容派生：结果与调度顺序和前后文修改无关
+        segment_params = dict(params, text=segment, seed=derive_seed(params['seed'], segment))
+        audio_data, sample_rate, info = synthesize_cached(segment_params, cancel_token, progress, on_audio)
+        if not info['reused']:
+            generated += 1
+            model_name = info['model_name']
+        generation_time += info['generation_time']
+        if progress is not None:
+            # 剩余片段按已生成片段的平均耗时估算（复用的片段不计耗时）
+            remaining = len(segments) - index - 1
+            progress('segment', index=index, total=len(segments), reused=info['reused'],
+                     eta_seconds=round(generation_time / max(1, generated) * remaining, 2))
+        yield segment, audio_data, sample_rate, dict(info, index=index, total=len(segments))
 
-# 尝试导入Qwen-TTS模型
-print("\n📦 正在加载模型...")
-try:
-    warnings.filterwarnings("ignore")
-    from qwen_tts import Qwen3TTSModel
+def iter_audio_pieces(params, cancel_token=None, windows=True):
+    """
+    逐段产出 (音频, 采样率, 片段序号, 是否片段开头)：启用解码流水线时一个片段内
+    按解码窗口陆续产出，否则（或 windows=False、片段已缓存）每个片段整段产出
+    """
+    pieces = queue.Queue()
+    current = {'index': 0, 'pieces': 0}
+    # 合成在后台线程中进行，耗时仍记到调用方的请求日志上
+    log = request_log.current()
     
-    print("✅ Qwen-TTS模型类导入成功！")
+    def put(audio_data, sample_rate):
+        pieces.put((audio_data, sample_rate, current['index'], current['pieces'] == 0))
+        current['pieces'] += 1
     
-    # 加载模型函数
-    def load_and_optimize_model(model_path, name, use_quantization=False, use_compile=False):
-        """加载并优化模型"""
+    def run():
         try:
-            print(f"\n📁 加载 {name} 模型...")
-            
-            # 加载模型（Qwen3TTSModel使用原始参数）
-            model = Qwen3TTSModel.from_pretrained(
-                model_path,
-                trust_remote_code=True,
-                device_map="cpu"
-            )
-            
-            # 注意：Qwen3TTSModel不支持eval()和quantize_dynamic
-            # 我们只使用生成参数优化
-            
-            print(f"✅ {name} 模型加载成功！")
-            return model
-            
+            with request_log.bind(log):
+                for _, audio_data, sample_rate, info in iter_segments(params, cancel_token, on_audio=put if windows else None):
+                    # 补发流水线没有输出的部分（未启用流水线时为整段）
+                    remainder = audio_data[info['streamed_samples']:]
+                    if len(remainder) or not current['pieces']:
+                        put(remainder, sample_rate)
+                    current.update(index=info['index'] + 1, pieces=0)
+            pieces.put(None)
         except Exception as e:
-            print(f"❌ {name} 模型加载失败: {e}")
-            return None
+            pieces.put(e)
     
-    # 加载所有模型（应用优化）
-    model_base = load_and_optimize_model("./Qwen3-TTS-12Hz-1.7B-Base", "Base")
-    model_voice_design = load_and_optimize_model("./Qwen3-TTS-12Hz-1.7B-VoiceDesign-Full", "VoiceDesign")
-    model_custom_voice = load_and_optimize_model("./Qwen3-TTS-12Hz-1.7B-CustomVoice-Full", "CustomVoice")
-    model_base_0_6b = load_and_optimize_model("./Qwen3-TTS-12Hz-0.6B-Base", "0.6B Base")
-    model_voice_design_0_6b = load_and_optimize_model("./Qwen3-TTS-12Hz-0.6B-VoiceDesign", "0.6B VoiceDesign")
-    model_custom_voice_0_6b = load_and_optimize_model("./Qwen3-TTS-12Hz-0.6B-CustomVoice", "0.6B CustomVoice")
+    threading.Thread(target=run, name='tts-pieces', daemon=True).start()
+    finished = False
+    try:
+        while True:
+            item = pieces.get()
+            if item is None or isinstance(item, Exception):
+                finished = True
+                if item is None:
+                    return
+                raise item
+            yield item
+    finally:
+        if not finished and cancel_token is not None:
+            # 调用方提前停止读取（如客户端断开）
+            cancel_token.cancel('disconnect')
+
+def synthesize_segments(params, cancel_token=None, progress=None):
+    """分段合成长文本并拼接，片段之间插入短暂停顿"""
+    pieces = []
+    sample_rate = None
+    total = {'generation_time': 0.0, 'max_new_tokens': 0, 'hit_token_cap': False}
+    model_name = None
+    reused = 0
+    segments = 0
+    for _, audio_data, sample_rate, info in iter_segments(params, cancel_token, progress):
+        segments = info['total']
+        if info['reused']:
+            reused += 1
+        else:
+            model_name = info['model_name']
+        audio_data = audio_data.astype(np.float32, copy=False) if segments > 1 else audio_data
+        if pieces:
+            pieces.append(np.zeros(int(sample_rate * SEGMENT_PAUSE_SECONDS), dtype=np.float32))
+        pieces.append(audio_data)
+        total['generation_time'] += info['generation_time']
+        total['max_new_tokens'] += info['max_new_tokens']
+        total['hit_token_cap'] = total['hit_token_cap'] or info['hit_token_cap']
     
-except Exception as e:
-    print(f"❌ 模型类导入失败: {e}")
-    print("📝 将使用模拟音频生成功能。")
+    if reused:
+        request_log.note(segments_reused=reused)
+    audio_data = pieces[0] if len(pieces) == 1 else np.concatenate(pieces)
+    return audio_data, sample_rate, dict(
+        total, model_name=model_name, segments=segments, segments_reused=reused
+    )
 
-print("\n" + "=" * 60)
-print("✅ 模型加载和优化完成！")
-print("=" * 60)
+def apply_deadline(params, received_at):
+    """
+    按截止时间选择档位：根据队列深度与历史速度估算完成时间，
+    赶不上时降级到0.6B模型和/或极速采样参数
+    """
+    requested = {'model_version': params['model_version'], 'sampling_profile': params['sampling_profile']}
+    if params['deadline_ms'] is None:
+        return params, dict(requested, downgraded=False, estimated_seconds=None)
+    
+    remaining = params['deadline_ms'] / 1000.0 - (time.time() - received_at)
+    speaker_key = get_speaker_key(
+        params['mode'], params['speaker'], params['voice_description'],
+        params['reference_audio'], params['voice_profile']
+    )
+    
+    def estimate_tier(version, profile):
+        try:
+            _, model_name = select_model(params['mode'], version == '0.6b')
+        except Exception:
+            return None
+        if version == '0.6b' and not model_name.startswith('0.6B'):
+            return None
+        frames = token_budget.expected_frames(params['text'], params['language'], model_name, speaker_key)
+        return speed_tracker.estimate(
+            model_name, profile, frames,
+            synthesis_scheduler.queue_depth(model_name),
+            synthesis_scheduler.slots_per_model
+        )
+    
+    version, profile, estimated, downgraded = choose_tier(params['model_version'], remaining, estimate_tier)
+    tier = {
+        'model_version': version,
+        'sampling_profile': profile,
+        'downgraded': downgraded,
+        'estimated_seconds': round(estimated, 2) if estimated is not None else None,
+        'deadline_seconds': round(remaining, 2),
+    }
+    if downgraded:
+        log_event(logger, logging.INFO, '预计无法在截止时间内完成，降级', model_version=version, sampling_profile=profile,
+                  estimated_seconds=round(estimated, 2), remaining_seconds=round(remaining, 2))
+    return dict(params, model_version=version, sampling_profile=profile), tier
 
-# 缓存机制 - 缓存最近使用的生成配置
-@lru_cache(maxsize=128)
-def get_cached_generation_params(text_hash, mode, model_version, text_length):
-    """缓存生成参数，避免重复计算"""
-    # 根据模型版本和文本长度优化参数
-    if model_version == '0.6b':
-        # 0.6B模型：更快的生成速度
-        max_tokens = min(1024, max(256, text_length * 5))
-        temperature = 0.5
-        top_p = 0.75
-        top_k = 25
-        num_beams = 1
-    elif model_version == 'fast':
-        # 极速模式：最快但质量稍低
-        max_tokens = min(512, max(128, text_length * 4))
-        temperature = 0.4
-        top_p = 0.7
-        top_k = 20
-        num_beams = 1
-    else:
-        # 1.7B完整版：最高质量
-        max_tokens = min(2048, max(512, text_length * 8))
-        temperature = 0.6
-        top_p = 0.85
-        top_k = 40
-        num_beams = 1
+def run_tts_request(params, digest, tier, cancel_token=None):
+    """按已选定的档位（apply_deadline）合成并编码音频，返回可共享给所有相同请求的 (WAV字节, 元数据)"""
+    tier = dict(tier)
+    audio_data, sample_rate, info = synthesize_segments(params, cancel_token, partial(progress_hub.publish, digest))
+    tier['model_name'] = info['model_name']
     
-    return {
-        'do_sample': True,
-        'temperature': temperature,
-        'top_p': top_p,
-        'top_k': top_k,
-        'max_new_tokens': max_tokens,
-        'num_beams': num_beams,
-        'early_stopping': True,
-        'use_cache': True,  # 启用KV缓存加速
+    postprocess_timings = None
+    if params['postprocess']:
+        begin = time.time()
+        audio_data, postprocess_timings = audio_postprocess.process(audio_data, sample_rate, params['postprocess'])
+        request_log.add_timing('postprocess', time.time() - begin)
+    
+    # 在内存中编码，由调用方决定直接返回还是落盘（文件名带请求摘要，避免同一秒内的请求互相覆盖）
+    filename = f"qwen_tts_output_{int(time.time())}_{digest[:8]}.wav"
+    begin = time.time()
+    wav_bytes = encode_wav(audio_data, sample_rate)
+    request_log.add_timing('encode', time.time() - begin)
+    
+    return wav_bytes, {
+        'audio_url': f'/audio/{filename}',
+        'generation_time': round(info['generation_time'], 2),
+        'sample_rate': sample_rate,
+        'seed': params['seed'],
+        'max_new_tokens': info['max_new_tokens'],
+        'hit_token_cap': info['hit_token_cap'],
+        'segments': info['segments'],
+        'segments_reused': info['segments_reused'],
+        'tier': tier,
+        'postprocess_timings': postprocess_timings,
     }
 
-@app.route('/')
-def index():
-    return render_template('index.html')
+def check_rate_limit(chars, model_version, requests=1):
+    """按客户端检查并扣除限流额度；结果记在 g 中，由 add_rate_limit_headers 写入响应头"""
+    client = client_identity(request.headers, request.remote_addr)
+    decision = rate_limiter.check(client, estimate_cost(chars, model_version), requests)
+    g.rate_limit = decision
+    if not decision.allowed:
+        log_event(logger, logging.WARNING, '超出限流', client=client, retry_after=round(decision.retry_after, 2),
+                  path=request.path)
+    return decision
+
+def rate_limit_message(decision):
+    return f"请求过于频繁（客户端 {decision.client}），请在 {int(math.ceil(decision.retry_after))} 秒后重试"
+
+@app.after_request
+def add_rate_limit_headers(response):
+    """限流状态写入响应头 X-RateLimit-*（被拒绝时带 Retry-After）"""
+    decision = g.get('rate_limit')
+    if decision is not None:
+        for name, value in decision.headers().items():
+            response.headers[name] = value
+    return response
+
+def cached_tts_request(params, digest, tier, cancel_token=None):
+    """
+    先查多进程共享的结果缓存，未命中时合成并发布
+
+    同机的其他工作进程正在生成相同请求时等待其发布后直接读取，不重复生成。
+    摘要按实际使用的档位计算，降级的结果与直接请求该档位的结果相同，可以共享；截断的结果不入缓存。
+    未固定种子的请求每次生成的结果不同，不读也不写缓存。
+
+    Returns:
+        (WAV字节, 元数据)
+    """
+    abort = cancel_token.check if cancel_token is not None else None
+    with result_cache.claim(digest, abort, bypass=params['seed'] is None) as entry:
+        if entry.hit and entry.meta is not None:
+            request_log.note(cached=True, waited_for_other_worker=entry.waited)
+            return entry.data, dict(entry.meta, cached=True)
+        wav_bytes, result = run_tts_request(params, digest, tier, cancel_token)
+        if entry.enabled and not result['hit_token_cap']:
+            # 内容寻址的文件名：相同请求总是同一个文件，/audio 直接从缓存读取
+            result = dict(result, audio_url=f"/audio/{digest}.wav")
+            entry.publish(wav_bytes, result)
+    return wav_bytes, dict(result, cached=False)
 
 @app.route('/tts', methods=['POST'])
 def text_to_speech():
-    try:
-        data = request.json
-        text = data.get('text', '')
-        mode = data.get('mode', 'voice-design')
+    # 整个请求只输出一条汇总日志，合成各阶段的耗时记在绑定到本线程的请求日志上
+    log = RequestLog('tts')
+    with request_log.bind(log):
+        return handle_tts_request(log)
 
-        if not text:
+def handle_tts_request(log):
+    request_id = None
+    try:
+        received_at = time.time()
+        params = parse_tts_request(request.json)
+        if not params['text']:
+            log.finish('invalid', error='empty text')
             return jsonify({'success': False, 'error': '请输入要合成的文本'})
-
-        print(f"\n{'='*60}")
-        print(f"🎯 语音生成请求 - {time.strftime('%H:%M:%S')}")
-        print(f"{'='*60}")
-        print(f"模式: {mode}")
-        print(f"文本长度: {len(text)} 字符")
-        
-        # 参数提取
-        language = data.get('language', 'auto')
-        language_map = {
-            'zh': 'chinese', 'en': 'english', 'ja': 'japanese',
-            'ko': 'korean', 'fr': 'french', 'de': 'german',
-            'es': 'spanish', 'it': 'italian', 'pt': 'portuguese', 'ru': 'russian'
-        }
-        if language in language_map:
-            language = language_map[language]
-        
-        voice_description = data.get('voice_description', '')
-        reference_text = data.get('reference_text', '')
-        speaker = data.get('speaker', 'Vivian')
-        style = data.get('style', '')
-        model_version = data.get('model_version', '1.7b')
-        
-        # 获取前端传来的模型参数
-        temperature = data.get('temperature', 0.6)
-        top_p = data.get('top_p', 0.85)
-        
-        print(f"模型版本: {model_version}")
-        print(f"语言: {language}")
-        print(f"Temperature: {temperature}")
-        print(f"Top P: {top_p}")
+        log.note(mode=params['mode'], chars=len(params['text']), model_version=params['model_version'],
+                 language=params['language'], priority=params['priority'], seed=params['seed'])
+        log.verbose(temperature=params['temperature'], top_p=params['top_p'], speaker=params['speaker'],
+                    voice_profile=params['voice_profile'], postprocess=params['postprocess'])
+        decision = check_rate_limit(len(params['text']), params['model_version'])
+        if not decision.allowed:
+            log.finish('rate_limited', level=logging.WARNING, client=decision.client)
+            return jsonify(dict(decision.to_dict(), success=False, rate_limited=True, error=rate_limit_message(decision))), 429
+        params['client'] = decision.client
         
-        # 根据模型版本和文本长度生成基础参数
-        text_hash = hash(text[:100])
-        base_config = get_cached_generation_params(text_hash, mode, model_version, len(text))
+        # 客户端可自带request_id以便调用 /cancel/<request_id>
+        client_request_id = request.json.get('request_id')
+        if client_request_id and cancellations.active(str(client_request_id)):
+            # 已在使用中的ID直接拒绝，不能接管对方的进度频道与取消登记
+            raise DuplicateRequestId(f"request_id 已在使用中: {client_request_id}")
+        request_id = str(client_request_id or uuid.uuid4().hex)
+        log.request_id = request_id
+        log.note(client=decision.client)
+        # 响应方式：url（默认）/ audio / multipart；直接返回音频时可选择不落盘
+        response_mode = resolve_response_mode(request.json.get('response'), request.headers.get('Accept'))
+        persist = response_mode == 'url' or bool(request.json.get('persist', True))
+        # 先按截止时间选定档位再计算摘要：只有实际使用相同模型与采样参数的请求才合并
+        params, tier = apply_deadline(params, received_at)
+        digest = request_digest(params)
+        progress_hub.join(digest, request_id)
+        progress_hub.publish(digest, 'queued', request_id=request_id, priority=params['priority'],
+                             chars=len(params['text']), segments=len(split_segments(params['text'])))
         
-        # 使用前端传来的参数覆盖默认值
-        generation_config = base_config.copy()
-        generation_config['temperature'] = float(temperature)
-        generation_config['top_p'] = float(top_p)
+        # 相同的在途请求合并为一次生成，后到的请求等待并共享结果
+        while True:
+            cancel_token = cancellations.join(digest, request_id)
+            cancellations.watch(request_id, request.environ.get('werkzeug.socket') or request.environ.get('gunicorn.socket'))
+            try:
+                (wav_bytes, result), shared = inflight_requests.do(digest, lambda: cached_tts_request(params, digest, tier, cancel_token))
+                break
+            except GenerationCancelled:
+                # 加入的是一个已被取消的共享生成，而本请求仍然有效：重新发起
+                if not cancel_token.cancelled:
+                    continue
+                raise
+            finally:
+                cancellations.leave(request_id)
         
-        print(f"⚙️ 生成参数: {generation_config}")
+        # 共享的结果中档位信息（是否降级、预计耗时）按本请求替换
+        result = dict(result, tier=dict(tier, model_name=result['tier']['model_name']))
+        filename = os.path.basename(result['audio_url'])
+        if persist and result_cache.locate(filename) is None:
+            audio_writer.save(filename, wav_bytes)
+        metadata = dict(result, success=True, deduplicated=shared, request_id=request_id)
+        if not persist:
+            metadata['audio_url'] = None
+        progress_hub.publish_request(request_id, 'done', **metadata)
+        log.finish('ok', deduplicated=shared, response=response_mode, segments=result['segments'],
+                   hit_token_cap=result['hit_token_cap'], tier=f"{result['tier']['model_version']}/{result['tier']['sampling_profile']}")
         
-        # 选择模型
-        use_0_6b = (model_version == '0.6b')
+        if response_mode == 'audio':
+            # 元数据放在响应头中（ASCII转义的JSON）
+            return Response(wav_bytes, mimetype='audio/wav', headers={
+                'X-Request-Id': request_id,
+                'X-TTS-Metadata': json.dumps(metadata, ensure_ascii=True),
+            })
+        if response_mode == 'multipart':
+            body, content_type = multipart_body(metadata, wav_bytes)
+            return Response(body, content_type=content_type)
+        return jsonify(metadata)
         
-        # 开始计时
-        start_time = time.time()
-        
-        # 根据模式选择模型和生成方法
-        if mode == 'voice-design':
-            if use_0_6b and model_voice_design_0_6b is not None:
-                selected_model = model_voice_design_0_6b
-                model_name = "0.6B VoiceDesign"
-            elif model_voice_design is not None:
-                selected_model = model_voice_design
-                model_name = "1.7B VoiceDesign"
-            else:
-                raise Exception("VoiceDesign模型未加载")
-            
-            print(f"🚀 使用 {model_name} 生成语音...")
-            
-            # 使用torch.no_grad()加速推理
-            with torch.no_grad():
-                wavs, sample_rate = selected_model.generate_voice_design(
-                    text=text,
-                    language=language,
-                    voice_description=voice_description,
-                    instruct=voice_description,
-                    **generation_config
-                )
-                
-        elif mode == 'voice-clone':
-            if use_0_6b and model_base_0_6b is not None:
-                selected_model = model_base_0_6b
-                model_name = "0.6B Base"
-            elif model_base is not None:
-                selected_model = model_base
-                model_name = "1.7B Base"
-            else:
-                raise Exception("Base模型未加载")
-            
-            reference_audio = data.get('reference_audio', '')
-            if not reference_audio:
-                raise Exception("请上传参考音频文件")
-            
-            ref_audio_path = os.path.join(OUTPUT_DIR, reference_audio)
-            if not os.path.exists(ref_audio_path):
-                ref_audio_path = os.path.join(tempfile.gettempdir(), reference_audio)
-            
-            print(f"🚀 使用 {model_name} 进行声音克隆...")
-            
-            with torch.no_grad():
-                try:
-                    wavs, sample_rate = selected_model.generate_voice_clone(
-                        text=text,
-                        language=language,
-                        ref_audio=ref_audio_path,
-                        ref_text=reference_text if reference_text else None,
-                        x_vector_only_mode=False,
-                        **generation_config
-                    )
-                except Exception as e:
-                    print(f"⚠️ ICL模式失败，切换到x_vector模式: {e}")
-                    wavs, sample_rate = selected_model.generate_voice_clone(
-                        text=text,
-                        language=language,
-                        ref_audio=ref_audio_path,
-                        x_vector_only_mode=True,
-                        **generation_config
-                    )
-                    
-        elif mode == 'tts-custom':
-            if use_0_6b and model_custom_voice_0_6b is not None:
-                selected_model = model_custom_voice_0_6b
-                model_name = "0.6B CustomVoice"
-            elif model_custom_voice is not None:
-                selected_model = model_custom_voice
-                model_name = "1.7B CustomVoice"
+    except DuplicateRequestId as e:
+        log.finish('conflict', level=logging.WARNING, error=str(e))
+        return jsonify({'success': False, 'error': str(e)}), 409
+    except GenerationCancelled as e:
+        log.finish('cancelled', error=str(e))
+        progress_hub.publish_request(request_id, 'cancelled', error=str(e))
+        return jsonify({'success': False, 'cancelled': True, 'error': str(e)}), 499
+    except Exception as e:
+        log.finish('error', level=logging.ERROR, exc_info=True, error=str(e))
+        progress_hub.publish_request(request_id, 'error', error=str(e))
+        return jsonify({'success': False, 'error': str(e)})
+    finally:
+        progress_hub.leave(request_id)
+
+def last_event_id():
+    """断线重连时浏览器带上的 Last-Event-ID"""
+    try:
+        return int(request.headers.get('Last-Event-ID', -1))
+    except ValueError:
+        return -1
+
+@app.route('/progress/<request_id>')
+def progress_events(request_id):
+    """
+    SSE进度流：queued → started → progress（每N个token）/ segment → done | error | cancelled
+    可以在发起 /tts 之前订阅（带上相同的request_id），断线重连时从 Last-Event-ID 之后继续
+    """
+    return Response(
+        progress_hub.subscribe(request_id, last_event_id()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+@app.route('/v1/audio/speech', methods=['POST'])
+def openai_speech():
+    """
+    OpenAI兼容的语音合成接口：音频直接放在响应体中返回，
+    WAV/PCM格式按片段边合成边分块输出，无需再请求 /audio 也不写磁盘
+    """
+    received_at = time.time()
+    log = RequestLog('openai')
+    try:
+        data, fmt, speed = openai_compat.to_tts_request(request.get_json(force=True, silent=True) or {})
+        params = parse_tts_request(data)
+    except openai_compat.OpenAIRequestError as e:
+        log.finish('invalid', error=str(e))
+        return jsonify(e.to_dict()), 400
+    except ValueError as e:
+        log.finish('invalid', error=str(e))
+        return jsonify(openai_compat.OpenAIRequestError(str(e)).to_dict()), 400
+    log.note(mode=params['mode'], voice=params['voice_profile'] or params['speaker'], chars=len(params['text']),
+             model_version=params['model_version'], format=fmt, speed=speed)
+    decision = check_rate_limit(len(params['text']), params['model_version'])
+    if not decision.allowed:
+        log.finish('rate_limited', level=logging.WARNING, client=decision.client)
+        return jsonify({'error': {'message': rate_limit_message(decision), 'type': 'rate_limit_error',
+                                  'code': 'rate_limit_exceeded'}}), 429
+    params['client'] = decision.client
+    
+    params, tier = apply_deadline(params, received_at)
+    request_id = request.headers.get('X-Request-Id') or uuid.uuid4().hex
+    log.request_id = request_id
+    log.note(client=decision.client, tier=f"{tier['model_version']}/{tier['sampling_profile']}")
+    try:
+        cancel_token = cancellations.join(f"openai:{request_id}", request_id)
+    except DuplicateRequestId as e:
+        log.finish('conflict', level=logging.WARNING, error=str(e))
+        return jsonify({'error': {'message': str(e), 'type': 'invalid_request_error', 'param': 'X-Request-Id', 'code': None}}), 409
+    cancellations.watch(request_id, request.environ.get('werkzeug.socket') or request.environ.get('gunicorn.socket'))
+    
+    def pcm_chunks():
+        """逐片段（启用解码流水线时逐解码窗口）产出 (采样率, int16音频)"""
+        postprocessor = None
+        sample_rate = None
+        # 变速需要整段音频，只有原速时才按窗口输出
+        for audio_data, sample_rate, index, starts in iter_audio_pieces(params, cancel_token, windows=speed == 1.0):
+            audio_data = openai_compat.change_speed(audio_data.astype(np.float32, copy=False), sample_rate, speed)
+            if index and starts:
+                audio_data = np.concatenate((np.zeros(int(sample_rate * SEGMENT_PAUSE_SECONDS), dtype=np.float32), audio_data))
+            if params['postprocess']:
+                if postprocessor is None:
+                    postprocessor = audio_postprocess.StreamingPostProcessor(sample_rate, dict(params['postprocess'], format='int16'))
+                yield sample_rate, postprocessor.feed(audio_data)
             else:
-                raise Exception("CustomVoice模型未加载")
-            
-            print(f"🚀 使用 {model_name} 生成语音...")
-            
-            instruct_text = style if style else None
-            
-            with torch.no_grad():
-                if instruct_text:
-                    wavs, sample_rate = selected_model.generate_custom_voice(
-                        text=text,
-                        language=language,
-                        speaker=speaker,
-                        instruct=instruct_text,
-                        **generation_config
-                    )
-                else:
-                    wavs, sample_rate = selected_model.generate_custom_voice(
-                        text=text,
-                        language=language,
-                        speaker=speaker,
-                        **generation_config
-                    )
+                yield sample_rate, to_pcm16(audio_data)
+        if postprocessor is not None:
+            yield sample_rate, postprocessor.flush()
+    
+    chunks = pcm_chunks()
+    try:
+        # 先合成第一个片段再发送响应头，生成失败时仍能返回错误状态码
+        with request_log.bind(log):
+            sample_rate, first = next(chunks)
+        log.add_timing('first_audio', time.time() - received_at)
+    except GenerationCancelled as e:
+        cancellations.leave(request_id)
+        log.finish('cancelled', error=str(e))
+        return jsonify({'error': {'message': str(e), 'type': 'cancelled'}}), 499
+    except Exception as e:
+        cancellations.leave(request_id)
+        log.finish('error', level=logging.ERROR, exc_info=True, error=str(e))
+        return jsonify({'error': {'message': str(e), 'type': 'server_error'}}), 500
+    headers = {'X-Request-Id': request_id, 'X-Seed': str(params['seed']), 'X-Tier': f"{tier['model_version']}/{tier['sampling_profile']}"}
+    
+    if fmt not in openai_compat.STREAMING_FORMATS:
+        # 压缩格式需要完整音频才能编码
+        try:
+            pcm16 = np.concatenate([first] + [chunk for _, chunk in chunks])
+        except GenerationCancelled as e:
+            log.finish('cancelled', error=str(e))
+            return jsonify({'error': {'message': str(e), 'type': 'cancelled'}}), 499
+        finally:
+            cancellations.leave(request_id)
+        try:
+            with log.timed('encode'):
+                body = openai_compat.encode_audio(pcm16, sample_rate, fmt)
+        except Exception as e:
+            log.finish('error', level=logging.ERROR, exc_info=True, error=f"{fmt} 编码失败: {e}")
+            return jsonify({'error': {'message': f"{fmt} 编码失败: {e}", 'type': 'server_error'}}), 500
+        log.finish('ok', audio_seconds=round(len(pcm16) / sample_rate, 2))
+        return Response(body, mimetype=openai_compat.CONTENT_TYPES[fmt], headers=headers)
+    
+    def stream():
+        samples = len(first)
+        try:
+            if fmt == 'wav':
+                yield openai_compat.wav_stream_header(sample_rate)
+            yield first.astype('<i2', copy=False).tobytes()
+            for _, chunk in chunks:
+                samples += len(chunk)
+                yield chunk.astype('<i2', copy=False).tobytes()
+            log.finish('ok', streamed=True, audio_seconds=round(samples / sample_rate, 2))
+        except GenerationCancelled as e:
+            log.finish('cancelled', streamed=True, error=str(e))
+        except Exception as e:
+            # 响应头已发送，只能中断输出
+            log.finish('error', level=logging.ERROR, exc_info=True, streamed=True, error=f"流式输出中断: {e}")
+        finally:
+            cancellations.leave(request_id)
+            # 客户端断开时生成器被关闭，上面的分支都不会执行
+            log.finish('disconnected', streamed=True, audio_seconds=round(samples / sample_rate, 2))
+    
+    # 不设置Content-Length，HTTP/1.1下按分块传输
+    headers['X-Sample-Rate'] = str(sample_rate)
+    return Response(stream(), mimetype=openai_compat.CONTENT_TYPES[fmt], headers=headers)
+
+# 长文档合成任务：片段检查点保存在 output/jobs，启动时自动恢复未完成的任务
+def publish_job_event(job_id, event, status):
+    """文档任务事件转发到进度频道 job:<任务ID>"""
+    key = f"job:{job_id}"
+    if event == 'started':
+        progress_hub.join(key, key)
+    progress_hub.publish(key, event, **status)
+    if event in TERMINAL_EVENTS:
+        progress_hub.leave(key)
+
+document_jobs = DocumentJobManager(os.path.join(OUTPUT_DIR, 'jobs'), synthesize_cached, on_event=publish_job_event)
+document_jobs.resume_incomplete()
+
+@app.route('/jobs/document', methods=['POST'])
+def create_document_job():
+    """创建长文档合成任务：上传 .txt/.md 文件（表单字段为合成参数）或提交JSON"""
+    try:
+        if 'file' in request.files:
+            file = request.files['file']
+            fields = request.form.to_dict()
+            text = file.read().decode('utf-8-sig')
+            source_name = file.filename
         else:
-            raise Exception(f"未知模式: {mode}")
-        
-        # 计算生成时间
-        generation_time = time.time() - start_time
-        
-        # 保存音频
-        audio_data = wavs[0]
-        audio_path = os.path.join(OUTPUT_DIR, f"qwen_tts_output_{int(time.time())}.wav")
-        scipy.io.wavfile.write(audio_path, sample_rate, audio_data)
+            fields = dict(request.json or {})
+            text = fields.get('text', '')
+            source_name = fields.get('source_name', '')
+        fmt = fields.get('format') or ('markdown' if source_name.lower().endswith(('.md', '.markdown')) else 'text')
         
-        print(f"✅ 语音生成完成！")
-        print(f"⏱️ 生成耗时: {generation_time:.2f} 秒")
-        print(f"💾 音频已保存: {audio_path}")
-        print(f"{'='*60}\n")
+        if isinstance(fields.get('postprocess'), str):
+            # 表单字段中的后处理配置为JSON字符串
+            fields['postprocess'] = json.loads(fields['postprocess'] or 'null')
+        # 文档任务默认以background优先级运行，不影响交互请求
+        fields.setdefault('priority', 'background')
+        fields['text'] = ''
+        params = parse_tts_request(fields)
+        params.pop('text')
+        decision = check_rate_limit(len(text), params['model_version'])
+        if not decision.allowed:
+            return jsonify(dict(decision.to_dict(), success=False, rate_limited=True, error=rate_limit_message(decision))), 429
+        params['client'] = decision.client
         
-        return jsonify({
-            'success': True,
-            'audio_url': f'/audio/{os.path.basename(audio_path)}',
-            'generation_time': round(generation_time, 2),
-            'sample_rate': sample_rate
-        })
+        job_id = document_jobs.create(text, params, fmt=fmt, source_name=source_name)
+        return jsonify(dict(document_jobs.status(job_id), success=True))
+    except Exception as e:
+        log_event(logger, logging.ERROR, '文档任务创建失败', exc_info=True, error=str(e))
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+@app.route('/jobs/<job_id>')
+def document_job_status(job_id):
+    try:
+        return jsonify(document_jobs.status(job_id))
+    except KeyError:
+        return jsonify({'error': '任务不存在'}), 404
+
+@app.route('/jobs/<job_id>/events')
+def document_job_events(job_id):
+    """文档任务的SSE进度流：每个片段完成时推送一次状态（含预计剩余时间）"""
+    try:
+        status = document_jobs.status(job_id)
+    except KeyError:
+        return jsonify({'error': '任务不存在'}), 404
+    if status['status'] != 'running':
+        # 任务已结束：只发送一条最终状态
+        event = {'completed': 'done', 'failed': 'error'}.get(status['status'], status['status'])
+        stream = iter([format_sse(0, event, status)])
+    else:
+        stream = progress_hub.subscribe(f"job:{job_id}", last_event_id())
+    return Response(stream, mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/jobs/<job_id>/audio')
+def document_job_audio(job_id):
+    """完整音频（支持Range请求，可边下边播）"""
+    try:
+        path = document_jobs.output_path(job_id)
+    except KeyError:
+        return jsonify({'error': '任务不存在'}), 404
+    if not os.path.exists(path):
+        return jsonify({'error': '任务尚未完成'}), 404
+    return send_file(path, mimetype='audio/wav', conditional=True)
+
+@app.route('/jobs/<job_id>/index')
+def document_job_index(job_id):
+    """片段索引：章节、文本与在完整音频中的起止时间"""
+    try:
+        path = document_jobs.index_path(job_id)
+    except KeyError:
+        return jsonify({'error': '任务不存在'}), 404
+    if not os.path.exists(path):
+        return jsonify({'error': '任务尚未完成'}), 404
+    return send_file(path, mimetype='application/json')
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_document_job(job_id):
+    return jsonify({'success': document_jobs.cancel(job_id), 'job_id': job_id})
+
+@app.route('/jobs/<job_id>/retry', methods=['POST'])
+def retry_document_job(job_id):
+    """重新运行失败/取消的任务，已完成的片段直接复用"""
+    try:
+        document_jobs.retry(job_id)
+        return jsonify(dict(document_jobs.status(job_id), success=True))
+    except (KeyError, FileNotFoundError):
+        return jsonify({'error': '任务不存在'}), 404
+
+@app.route('/voice-profiles', methods=['GET'])
+def list_voice_profiles():
+    return jsonify({'profiles': voice_profiles.list()})
+
+@app.route('/voice-profiles', methods=['POST'])
+def create_voice_profile():
+    """
+    设计并保存音色档案：用VoiceDesign按描述生成样本，
+    再为所有已加载的Base模型预先计算克隆提示
+    """
+    try:
+        data = dict(request.json or {})
+        sample_text = data.get('sample_text') or data.get('text', '')
+        if not sample_text or not data.get('voice_description'):
+            return jsonify({'success': False, 'error': '需要提供 voice_description 和 sample_text'}), 400
+        data.update(text=sample_text, mode='voice-design', voice_profile='')
+        params = parse_tts_request(data)
         
+        audio_data, sample_rate, info = synthesize(params)
+        meta = voice_profiles.create(
+            data.get('name', ''), params['voice_description'], sample_text,
+            params['language'], audio_data, sample_rate
+        )
+        for use_0_6b in (False, True):
+            try:
+                _, model_name = select_model('voice-clone', use_0_6b)
+            except Exception:
+                continue
+            voice_profiles.prompt_for(
+                meta['profile_id'], model_name,
+                lambda audio, sr, ref_text: build_clone_prompt(model_name, (audio, sr), ref_text)
+            )
+        return jsonify(dict(meta, success=True, generation_time=round(info['generation_time'], 2),
+                            sample_url=f"/voice-profiles/{meta['profile_id']}/sample"))
     except Exception as e:
-        print(f"❌ 生成失败: {e}")
-        import traceback
-        traceback.print_exc()
-        return jsonify({'success': False, 'error': str(e)})
+        log_event(logger, logging.ERROR, '音色档案创建失败', exc_info=True, error=str(e))
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/voice-profiles/<profile_id>/sample')
+def voice_profile_sample(profile_id):
+    try:
+        return send_file(voice_profiles.sample_path(profile_id), mimetype='audio/wav')
+    except (KeyError, FileNotFoundError):
+        return jsonify({'error': '音色档案不存在'}), 404
+
+@app.route('/voice-profiles/<profile_id>/preload', methods=['POST'])
+def preload_voice_profile(profile_id):
+    try:
+        return jsonify({'success': True, 'loaded': voice_profiles.preload([profile_id])})
+    except (KeyError, FileNotFoundError):
+        return jsonify({'error': '音色档案不存在'}), 404
+
+@app.route('/voice-profiles/<profile_id>/evict', methods=['POST'])
+def evict_voice_profile(profile_id):
+    """从内存中移除克隆提示，磁盘上的档案保留"""
+    return jsonify({'success': voice_profiles.evict(profile_id)})
+
+@app.route('/voice-profiles/<profile_id>', methods=['DELETE'])
+def delete_voice_profile(profile_id):
+    try:
+        return jsonify({'success': voice_profiles.delete(profile_id)})
+    except KeyError:
+        return jsonify({'error': '音色档案不存在'}), 404
+
+def stream_tts(ws):
+    """
+    WebSocket增量合成：客户端陆续推送文本片段（如LLM流式输出），
+    服务端凑满一句立即合成，并在同一连接上推送该句音频
+
+    协议（文本帧均为JSON）：
+        客户端 → {"type": "start", ...与 /tts 相同的合成参数（不含text）}
+                 {"type": "text", "text": "文本片段"}      可发送多次
+                 {"type": "end"}                           文本结束，合成剩余内容
+                 {"type": "cancel"}                        放弃尚未合成的内容
+        服务端 → {"type": "ready", "request_id": ...}
+                 {"type": "audio", "index", "chunk", "text", "sample_rate", "format", "samples", "latency_ms"}
+                 紧跟一个二进制帧：小端PCM（format为int16或float32）；
+                 启用解码流水线时同一句（index）分多个 chunk 陆续推送
+                 {"type": "done", ...统计} 或 {"type": "error", "error": ...}
+    """
+    send_lock = threading.Lock()
+    
+    def send(message):
+        with send_lock:
+            ws.send(message if isinstance(message, bytes) else json.dumps(message, ensure_ascii=False))
+    
+    try:
+        start = json.loads(ws.receive())
+        if start.get('type') != 'start':
+            send({'type': 'error', 'error': '第一条消息必须是 start'})
+            return
+        start['text'] = ''
+        start.setdefault('priority', 'interactive')
+        params = parse_tts_request(start)
+        # 会话按一个请求计数，每句的计算量在合成前单独扣除
+        decision = check_rate_limit(0, params['model_version'])
+        if not decision.allowed:
+            send({'type': 'error', 'rate_limited': True, 'retry_after': round(decision.retry_after, 2),
+                  'error': rate_limit_message(decision)})
+            return
+        params['client'] = decision.client
+        request_id = str(start.get('request_id') or uuid.uuid4().hex)
+        # 与 /tts 共用取消登记，可通过 /cancel/<request_id> 取消
+        cancel_token = cancellations.join(f"ws:{request_id}", request_id)
+    except (ValueError, TypeError, AttributeError, DuplicateRequestId) as e:
+        # 非JSON、非对象或参数无效的 start 消息
+        send({'type': 'error', 'error': f"无效的 start 消息: {e}"})
+        return
+    buffer = SentenceBuffer()
+    sentences = queue.Queue()
+    stats = {'sentences': 0, 'audio_seconds': 0.0, 'generation_time': 0.0, 'first_audio_ms': None}
+    first_text_at = None
+    
+    def worker():
+        """按到达顺序合成句子并推送音频；与接收循环并行，合成期间继续收文本"""
+        postprocessor = None
+        sample_rate = None
+        try:
+            while True:
+                item = sentences.get()
+                if item is None or cancel_token.cancelled:
+                    break
+                sentence, ready_at = item
+                chunks = [0]
+                
+                def emit(audio_data, sample_rate):
+                    """输出一段音频：启用解码流水线时一句话分多次输出"""
+                    nonlocal postprocessor
+                    audio_data = audio_data.astype(np.float32, copy=False)
+                    if stats['sentences'] and not chunks[0]:
+                        audio_data = np.concatenate((np.zeros(int(sample_rate * SEGMENT_PAUSE_SECONDS), dtype=np.float32), audio_data))
+                    if params['postprocess']:
+                        if postprocessor is None:
+                            postprocessor = audio_postprocess.StreamingPostProcessor(sample_rate, params['postprocess'])
+                        out = postprocessor.feed(audio_data)
+                    else:
+                        out = to_pcm16(audio_data)
+                    send_audio(stats['sentences'], sentence, out, sample_rate, ready_at, chunks[0])
+                    chunks[0] += 1
+                    stats['audio_seconds'] += len(audio_data) / float(sample_rate)
+                
+                # 计算量额度不足时等待补充（流式输出变慢，不中断会话）
+                cost = estimate_cost(len(sentence), params['model_version'])
+                while True:
+                    decision = rate_limiter.check(params['client'], cost, requests=0)
+                    if decision.allowed:
+                        break
+                    cancel_token.check()
+                    time.sleep(min(1.0, decision.retry_after))
+                sentence_params = dict(params, text=sentence, seed=derive_seed(params['seed'], sentence))
+                audio_data, sample_rate, info = synthesize_cached(sentence_params, cancel_token, on_audio=emit)
+                remainder = audio_data[info['streamed_samples']:]
+                if len(remainder) or not chunks[0]:
+                    emit(remainder, sample_rate)
+                stats['sentences'] += 1
+                stats['generation_time'] += info['generation_time']
+            if postprocessor is not None and not cancel_token.cancelled:
+                # 输出后处理保留的尾部（淡出与尾部静音裁剪）
+                send_audio(stats['sentences'], '', postprocessor.flush(), sample_rate, time.time())
+            send({'type': 'done', 'request_id': request_id, 'cancelled': cancel_token.cancelled, **stats,
+                  'postprocess_timings': postprocessor.timings if postprocessor else None})
+        except GenerationCancelled:
+            try:
+                send({'type': 'done', 'request_id': request_id, 'cancelled': True, **stats})
+            except ConnectionClosed:
+                pass
+        except ConnectionClosed:
+            cancel_token.cancel('disconnect')
+        except Exception as e:
+            log.note(error=str(e))
+            log_event(logger, logging.ERROR, '流式合成失败', exc_info=True, request_id=request_id, error=str(e))
+            cancel_token.cancel('error')
+            try:
+                send({'type': 'error', 'error': str(e)})
+            except ConnectionClosed:
+                pass
+    
+    def send_audio(index, sentence, out, sample_rate, ready_at, chunk=0):
+        now = time.time()
+        if stats['first_audio_ms'] is None and first_text_at is not None:
+            stats['first_audio_ms'] = round((now - first_text_at) * 1000, 1)
+        send({
+            'type': 'audio', 'index': index, 'chunk': chunk, 'text': sentence,
+            'sample_rate': sample_rate, 'format': 'int16' if out.dtype == np.int16 else 'float32',
+            'samples': len(out), 'latency_ms': round((now - ready_at) * 1000, 1),
+        })
+        send(out.astype(out.dtype.newbyteorder('<'), copy=False).tobytes())
+    
+    log = RequestLog('ws', request_id)
+    log.note(mode=params['mode'], model_version=params['model_version'], client=decision.client)
+    send({'type': 'ready', 'request_id': request_id})
+    thread = threading.Thread(target=request_log.bound(log, worker), name=f'ws-tts-{request_id[:8]}', daemon=True)
+    thread.start()
+    reason = 'error'
+    try:
+        while True:
+            try:
+                message = json.loads(ws.receive())
+                kind = message.get('type')
+            except (ValueError, TypeError, AttributeError) as e:
+                # 无效的消息只报告错误，会话继续
+                send({'type': 'error', 'error': f"无效的消息: {e}"})
+                continue
+            if kind == 'text':
+                if first_text_at is None:
+                    first_text_at = time.time()
+                for sentence in buffer.push(message.get('text', '')):
+                    sentences.put((sentence, time.time()))
+            elif kind == 'end':
+                for sentence in buffer.flush():
+                    sentences.put((sentence, time.time()))
+                break
+            elif kind == 'cancel':
+                cancel_token.cancel('client')
+                break
+        sentences.put(None)
+        thread.join()
+        reason = None
+    except ConnectionClosed:
+        # 客户端断开：在下一个解码步停止当前句子，剩余句子不再合成
+        reason = 'disconnect'
+    finally:
+        # 任何原因提前退出（包括未预期的异常）都要停止合成线程，不让它阻塞在队列上
+        if reason is not None:
+            cancel_token.cancel(reason)
+        sentences.put(None)
+        cancellations.leave(request_id)
+        # 会话一条汇总记录：句数、首段音频延迟与生成耗时
+        status = 'ok' if not cancel_token.cancelled else ('error' if cancel_token.reason == 'error' else 'cancelled')
+        log.finish(status, cancel_reason=cancel_token.reason, sentences=stats['sentences'],
+                   first_audio_ms=stats['first_audio_ms'], audio_seconds=round(stats['audio_seconds'], 2))
+
+if sock is not None:
+    sock.route('/ws/tts')(stream_tts)
+else:
+    print("⚠️ 未安装 flask-sock，WebSocket流式合成接口 /ws/tts 不可用")
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
@@ -365,11 +1152,14 @@ def upload_file():
         if file.filename == '':
             return jsonify({'success': False, 'error': '文件名为空'}), 400
         
-        filename = f"ref_audio_{int(time.time())}_{file.filename}"
+        # 按内容命名并原子写入：多个工作进程同时上传同名文件不会互相覆盖
+        data = file.read()
+        filename = f"ref_audio_{content_key(data)[:16]}_{os.path.basename(file.filename)}"
         filepath = os.path.join(OUTPUT_DIR, filename)
-        file.save(filepath)
+        if not os.path.exists(filepath):
+            write_atomic(filepath, data)
         
-        print(f"📤 参考音频已上传: {filepath}")
+        log_event(logger, logging.INFO, '参考音频已上传', filename=filename, bytes=len(data))
         
         return jsonify({
             'success': True,
@@ -377,13 +1167,58 @@ def upload_file():
             'filepath': filepath
         })
     except Exception as e:
-        print(f"❌ 文件上传失败: {e}")
+        log_event(logger, logging.ERROR, '文件上传失败', exc_info=True, error=str(e))
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/clone/preflight', methods=['POST'])
+def clone_preflight_check():
+    """上传参考音频后提前预检并编码克隆提示，首个克隆请求不再承担这部分耗时"""
+    try:
+        data = request.json or {}
+        _, model_name = select_model('voice-clone', data.get('model_version') == '0.6b')
+        _, decision = clone_preflight.prompt_for(
+            model_name, resolve_reference_path(data.get('reference_audio', '')), data.get('reference_text', ''),
+            lambda ref_audio, ref_text, x_vector_only: build_clone_prompt(model_name, ref_audio, ref_text, x_vector_only)
+        )
+        return jsonify(dict(decision, success=True, model_name=model_name))
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+@app.route('/cancel/<request_id>', methods=['POST'])
+def cancel_request(request_id):
+    """显式取消一个进行中的生成请求"""
+    cancelled = cancellations.cancel(request_id, reason='api')
+    return jsonify({'success': cancelled, 'request_id': request_id})
+
+@app.route('/stats')
+def service_stats():
+    """服务运行统计"""
+    return jsonify({
+        'token_budget': token_budget.summary(),
+        'inflight': inflight_requests.stats(),
+        'scheduler': synthesis_scheduler.stats(),
+        'logging': request_log.stats(),
+        'rate_limit': rate_limiter.stats(),
+        'cancellation': cancellations.stats(),
+        'model_speed': speed_tracker.stats(),
+        'segment_store': segment_store.stats(),
+        'result_cache': result_cache.stats(),
+        'audio_writer': audio_writer.stats(),
+        'clone_preflight': clone_preflight.stats(),
+        'engine': engine.stats(),
+    })
+
+@app.route('/stats/token-budget')
+def token_budget_stats():
+    """token预算统计：各语言/模型/说话人的帧/字符比与触顶比例"""
+    return jsonify(token_budget.summary())
+
 @app.route('/audio/<filename>')
 def serve_audio(filename):
     try:
-        audio_path = os.path.join(OUTPUT_DIR, filename)
+        # 刚生成的音频可能还在后台写入
+        audio_writer.wait(filename)
+        audio_path = result_cache.locate(filename) or os.path.join(OUTPUT_DIR, filename)
         if not os.path.exists(audio_path):
             audio_path = os.path.join(tempfile.gettempdir(), filename)
         return send_file(audio_path, mimetype='audio/wav')
@@ -401,4 +1236,4 @@ if __name__ == '__main__':
     print("   • torch.no_grad() 推理优化")
     print("   • 优化的生成参数")
     print("="*60 + "\n")
-    app.run(host='0.0.0.0', port=5000, debug=False)
+    app.run(host='0.0.0.0', port=int(os.environ.get('QWEN_TTS_PORT', 5000)), debug=False)
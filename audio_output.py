@@ -0,0 +1,124 @@
+"""
+合成结果的输出
+在内存中把音频编码为WAV，可直接放在 /tts 的响应体中返回（二进制或 multipart），
+落盘保存交给后台线程异步完成，不再阻塞请求。
+"""
+import io
+import json
+import logging
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import scipy.io.wavfile
+
+from disk_cache import write_atomic
+from request_log import get_logger, log_event
+
+logger = get_logger('audio_output')
+
+# /tts 的响应方式：url（JSON + /audio 地址）、audio（响应体即音频）、multipart（JSON与音频两部分）
+RESPONSE_MODES = ('url', 'audio', 'multipart')
+
+
+def encode_wav(audio_data, sample_rate):
+    """在内存中编码WAV，保持音频原有的采样格式（float32 / int16）"""
+    buffer = io.BytesIO()
+    scipy.io.wavfile.write(buffer, sample_rate, audio_data)
+    return buffer.getvalue()
+
+
+def resolve_response_mode(value, accept=''):
+    """
+    解析响应方式：请求参数优先，其次按 Accept 头
+
+    Args:
+        value: 请求中的 response 参数
+        accept: HTTP Accept 头
+
+    Returns:
+        str: RESPONSE_MODES 之一
+    """
+    if value:
+        if value not in RESPONSE_MODES:
+            raise ValueError(f"未知的响应方式: {value}，可选: {', '.join(RESPONSE_MODES)}")
+        return value
+    accept = (accept or '').lower()
+    if 'multipart/mixed' in accept:
+        return 'multipart'
+    if 'audio/' in accept and 'application/json' not in accept:
+        return 'audio'
+    return 'url'
+
+
+def multipart_body(metadata, audio_bytes, mimetype='audio/wav'):
+    """
+    构造 multipart/mixed 响应：第一部分为JSON元数据，第二部分为音频
+
+    Returns:
+        (响应体bytes, Content-Type)
+    """
+    boundary = uuid.uuid4().hex
+    head = (
+        f"--{boundary}\r\n"
+        "Content-Type: application/json; charset=utf-8\r\n\r\n"
+        f"{json.dumps(metadata, ensure_ascii=False)}\r\n"
+        f"--{boundary}\r\n"
+        f"Content-Type: {mimetype}\r\n"
+        f"Content-Length: {len(audio_bytes)}\r\n\r\n"
+    ).encode('utf-8')
+    tail = f"\r\n--{boundary}--\r\n".encode('utf-8')
+    return head + audio_bytes + tail, f"multipart/mixed; boundary={boundary}"
+
+
+class AsyncAudioWriter:
+    """后台线程落盘：先写临时文件再原子替换，/audio 读取时等待尚未写完的文件"""
+
+    def __init__(self, output_dir, workers=1):
+        self.output_dir = output_dir
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='audio-writer')
+        self._lock = threading.Lock()
+        self._pending = {}
+        self.written = 0
+        self.bytes_written = 0
+        self.failed = 0
+
+    def save(self, filename, data):
+        """提交写入任务；同名文件已写入或正在写入时直接返回"""
+        path = os.path.join(self.output_dir, filename)
+        with self._lock:
+            if filename in self._pending or os.path.exists(path):
+                return
+            self._pending[filename] = self._executor.submit(self._write, filename, path, data)
+
+    def _write(self, filename, path, data):
+        try:
+            # 临时文件名带进程与线程标识，多个工作进程写同一目录时互不干扰
+            write_atomic(path, data)
+            with self._lock:
+                self.written += 1
+                self.bytes_written += len(data)
+        except OSError as e:
+            log_event(logger, logging.ERROR, '音频保存失败', file=filename, error=str(e))
+            with self._lock:
+                self.failed += 1
+        finally:
+            with self._lock:
+                self._pending.pop(filename, None)
+
+    def wait(self, filename, timeout=10.0):
+        """等待指定文件写完（未在写入队列中时立即返回）"""
+        with self._lock:
+            future = self._pending.get(filename)
+        if future is not None:
+            future.result(timeout=timeout)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': len(self._pending),
+                'written': self.written,
+                'bytes_written': self.bytes_written,
+                'failed': self.failed,
+            }
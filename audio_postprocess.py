@@ -0,0 +1,363 @@
+"""
+音频后处理
+对生成的波形做可选的服务端后处理，全部使用向量化的 NumPy 运算：
+1. 响度归一化：峰值归一化或 LUFS（ITU-R BS.1770 K加权 + 门限）
+2. 首尾静音裁剪
+3. 淡入淡出
+4. float → int16 转换（TPDF 抖动）
+
+既可以处理完整音频（process），也可以对流式分块增量处理（StreamingPostProcessor），
+每个阶段的耗时都会返回给调用方。
+"""
+import time
+
+import numpy as np
+from scipy.signal import lfilter
+
+DEFAULTS = {
+    'normalize': None,        # None / 'peak' / 'lufs'
+    'target_db': -1.0,        # 峰值归一化目标（dBFS）
+    'target_lufs': -16.0,     # LUFS 归一化目标
+    'max_peak_db': -1.0,      # LUFS 归一化后的峰值上限（dBFS）
+    'trim': False,            # 裁剪首尾静音
+    'silence_db': -45.0,      # 静音判定阈值（dBFS，按10ms帧RMS）
+    'pad_ms': 60,             # 裁剪后保留的静音（毫秒）
+    'fade_in_ms': 0,
+    'fade_out_ms': 0,
+    'format': 'float32',      # 'float32' / 'int16'
+    'dither': True,           # int16 转换时加 TPDF 抖动
+}
+
+_FRAME_MS = 10
+
+
+def parse_config(value):
+    """
+    解析请求中的 postprocess 参数
+
+    Args:
+        value: None / dict；为 True 时使用推荐配置
+
+    Returns:
+        dict | None: 完整配置，None 表示不做后处理
+    """
+    if not value:
+        return None
+    if value is True:
+        value = {'normalize': 'lufs', 'trim': True, 'fade_in_ms': 10, 'fade_out_ms': 30, 'format': 'int16'}
+    if not isinstance(value, dict):
+        raise ValueError("postprocess 参数必须是对象")
+    unknown = set(value) - set(DEFAULTS)
+    if unknown:
+        raise ValueError(f"未知的后处理参数: {', '.join(sorted(unknown))}")
+    config = dict(DEFAULTS, **value)
+    if config['normalize'] not in (None, 'peak', 'lufs'):
+        raise ValueError(f"未知的归一化方式: {config['normalize']}")
+    if config['format'] not in ('float32', 'int16'):
+        raise ValueError(f"未知的输出格式: {config['format']}")
+    return config
+
+
+def _db_to_gain(db):
+    return 10.0 ** (db / 20.0)
+
+
+def _as_float(audio):
+    audio = np.asarray(audio)
+    if audio.dtype == np.int16:
+        return audio.astype(np.float32) / 32768.0
+    return audio.astype(np.float32, copy=False)
+
+
+# ---- 响度 ----
+
+def _k_weighting(sample_rate):
+    """BS.1770 K加权滤波器系数（高架 + 高通两级二阶节），按采样率计算"""
+    # 第一级：高架滤波，模拟头部声学效应
+    gain_db, q, fc = 4.0, 1 / np.sqrt(2), 1500.0
+    a = 10 ** (gain_db / 40.0)
+    w0 = 2 * np.pi * fc / sample_rate
+    alpha = np.sin(w0) / (2 * q)
+    cos_w0 = np.cos(w0)
+    shelf_b = np.array([
+        a * ((a + 1) + (a - 1) * cos_w0 + 2 * np.sqrt(a) * alpha),
+        -2 * a * ((a - 1) + (a + 1) * cos_w0),
+        a * ((a + 1) + (a - 1) * cos_w0 - 2 * np.sqrt(a) * alpha),
+    ])
+    shelf_a = np.array([
+        (a + 1) - (a - 1) * cos_w0 + 2 * np.sqrt(a) * alpha,
+        2 * ((a - 1) - (a + 1) * cos_w0),
+        (a + 1) - (a - 1) * cos_w0 - 2 * np.sqrt(a) * alpha,
+    ])
+    # 第二级：RLB 高通
+    q, fc = 0.5, 38.0
+    w0 = 2 * np.pi * fc / sample_rate
+    alpha = np.sin(w0) / (2 * q)
+    cos_w0 = np.cos(w0)
+    hp_b = np.array([(1 + cos_w0) / 2, -(1 + cos_w0), (1 + cos_w0) / 2])
+    hp_a = np.array([1 + alpha, -2 * cos_w0, 1 - alpha])
+    return (shelf_b / shelf_a[0], shelf_a / shelf_a[0]), (hp_b / hp_a[0], hp_a / hp_a[0])
+
+
+def integrated_loudness(audio, sample_rate):
+    """
+    计算积分响度（LUFS）
+
+    400ms 块、75% 重叠；绝对门限 -70 LUFS，相对门限 -10 LU。
+    块能量由平方信号的累积和一次性求出。
+    """
+    audio = _as_float(audio)
+    (b1, a1), (b2, a2) = _k_weighting(sample_rate)
+    weighted = lfilter(b2, a2, lfilter(b1, a1, audio))
+
+    block = int(0.4 * sample_rate)
+    step = block // 4
+    if len(weighted) < block:
+        block = step = len(weighted)
+    if block == 0:
+        return -np.inf
+    cumulative = np.concatenate(([0.0], np.cumsum(weighted.astype(np.float64) ** 2)))
+    starts = np.arange(0, len(weighted) - block + 1, step)
+    energies = (cumulative[starts + block] - cumulative[starts]) / block
+    with np.errstate(divide='ignore'):
+        loudness = -0.691 + 10 * np.log10(energies)
+
+    gated = energies[loudness > -70.0]
+    if gated.size == 0:
+        return -np.inf
+    relative_gate = -0.691 + 10 * np.log10(gated.mean()) - 10.0
+    gated = energies[(loudness > -70.0) & (loudness > relative_gate)]
+    if gated.size == 0:
+        return -np.inf
+    return float(-0.691 + 10 * np.log10(gated.mean()))
+
+
+def peak_gain(audio, target_db):
+    peak = float(np.max(np.abs(audio))) if len(audio) else 0.0
+    return _db_to_gain(target_db) / peak if peak > 0 else 1.0
+
+
+def loudness_gain(audio, sample_rate, target_lufs, max_peak_db):
+    """LUFS 归一化增益，受峰值上限约束"""
+    loudness = integrated_loudness(audio, sample_rate)
+    if not np.isfinite(loudness):
+        return 1.0
+    gain = _db_to_gain(target_lufs - loudness)
+    return min(gain, peak_gain(audio, max_peak_db))
+
+
+# ---- 裁剪与淡入淡出 ----
+
+def _frame_levels_db(audio, sample_rate):
+    """按 10ms 帧计算 RMS 电平（dBFS）"""
+    frame = max(1, sample_rate * _FRAME_MS // 1000)
+    count = len(audio) // frame
+    if count == 0:
+        return np.array([]), frame
+    frames = audio[:count * frame].reshape(count, frame)
+    rms = np.sqrt(np.mean(frames.astype(np.float64) ** 2, axis=1))
+    with np.errstate(divide='ignore'):
+        return 20 * np.log10(np.maximum(rms, 1e-10)), frame
+
+
+def trim_silence(audio, sample_rate, silence_db, pad_ms):
+    levels, frame = _frame_levels_db(audio, sample_rate)
+    voiced = np.flatnonzero(levels > silence_db)
+    if voiced.size == 0:
+        return audio
+    pad = sample_rate * pad_ms // 1000
+    start = max(0, voiced[0] * frame - pad)
+    end = min(len(audio), (voiced[-1] + 1) * frame + pad)
+    return audio[start:end]
+
+
+def apply_fades(audio, sample_rate, fade_in_ms, fade_out_ms):
+    audio = audio.copy()
+    fade_in = min(len(audio), sample_rate * int(fade_in_ms) // 1000)
+    fade_out = min(len(audio), sample_rate * int(fade_out_ms) // 1000)
+    if fade_in:
+        audio[:fade_in] *= np.linspace(0.0, 1.0, fade_in, dtype=np.float32)
+    if fade_out:
+        audio[-fade_out:] *= np.linspace(1.0, 0.0, fade_out, dtype=np.float32)
+    return audio
+
+
+# ---- 格式转换 ----
+
+def to_int16(audio, dither=True, rng=None):
+    """float → int16，TPDF 抖动（两个均匀分布之差，幅度 ±1 LSB）"""
+    scaled = _as_float(audio) * 32767.0
+    if dither:
+        rng = rng or np.random.default_rng()
+        scaled = scaled + (rng.random(len(scaled), dtype=np.float32) - rng.random(len(scaled), dtype=np.float32))
+    return np.clip(np.round(scaled), -32768, 32767).astype(np.int16)
+
+
+def _finish_format(audio, config, rng=None):
+    if config['format'] == 'int16':
+        return to_int16(audio, config['dither'], rng)
+    return np.clip(audio, -1.0, 1.0).astype(np.float32, copy=False)
+
+
+def process(audio, sample_rate, config):
+    """
+    对完整音频执行后处理链
+
+    Args:
+        audio: 生成的波形
+        sample_rate: 采样率
+        config: parse_config 返回的配置
+
+    Returns:
+        tuple: (处理后的音频, 各阶段耗时毫秒 dict)
+    """
+    timings = {}
+
+    def timed(stage, fn, *args):
+        started = time.perf_counter()
+        result = fn(*args)
+        timings[stage] = round((time.perf_counter() - started) * 1000, 3)
+        return result
+
+    audio = _as_float(audio)
+    if config['trim']:
+        audio = timed('trim', trim_silence, audio, sample_rate, config['silence_db'], config['pad_ms'])
+    if config['normalize'] == 'peak':
+        audio = timed('normalize', lambda a: a * np.float32(peak_gain(a, config['target_db'])), audio)
+    elif config['normalize'] == 'lufs':
+        audio = timed('normalize', lambda a: a * np.float32(
+            loudness_gain(a, sample_rate, config['target_lufs'], config['max_peak_db'])), audio)
+    if config['fade_in_ms'] or config['fade_out_ms']:
+        audio = timed('fade', apply_fades, audio, sample_rate, config['fade_in_ms'], config['fade_out_ms'])
+    audio = timed('format', _finish_format, audio, config)
+    return audio, timings
+
+
+class StreamingPostProcessor:
+    """
+    流式分块增量后处理，输出与 process() 处理完整音频一致（归一化增益除外）
+
+    - 静音按从流开头起的 10ms 帧网格判定，与 trim_silence 相同；
+    - 首部静音在检测到第一帧有声内容前缓存，之后只保留 pad_ms 余量；
+    - 最后一帧有声内容之后的静音（超出 pad_ms 的部分）缓存到后续出现有声内容时输出，flush 时丢弃；
+    - 归一化增益在累积约 1 秒音频后锁定，之后的块使用同一增益并限制峰值；
+    - 保留最后 fade_out 的样本，flush 时在裁剪后的结尾处淡出。
+    """
+
+    WARMUP_SECONDS = 1.0
+
+    def __init__(self, sample_rate, config):
+        self.sample_rate = sample_rate
+        self.config = config
+        self.timings = {}
+        self._rng = np.random.default_rng()
+        self._gain = None if config['normalize'] else 1.0
+        self._pending = np.zeros(0, dtype=np.float32)
+        # 裁剪：未输出的原始样本及其在流中的起始位置、未满一帧的样本、最后一帧有声内容的结束位置
+        self._pad = sample_rate * int(config['pad_ms']) // 1000
+        self._raw = np.zeros(0, dtype=np.float32)
+        self._raw_start = 0
+        self._analysis = np.zeros(0, dtype=np.float32)
+        self._classified = 0
+        self._voiced_end = None
+        # 淡入淡出
+        self._fade_in = np.linspace(0.0, 1.0, sample_rate * int(config['fade_in_ms']) // 1000, dtype=np.float32)
+        self._fade_out = sample_rate * int(config['fade_out_ms']) // 1000
+        self._faded = 0
+        self._held = np.zeros(0, dtype=np.float32)
+
+    def _time(self, stage, started):
+        self.timings[stage] = round(self.timings.get(stage, 0.0) + (time.perf_counter() - started) * 1000, 3)
+
+    def _lock_gain(self, audio):
+        if self.config['normalize'] == 'peak':
+            return peak_gain(audio, self.config['target_db'])
+        return loudness_gain(audio, self.sample_rate, self.config['target_lufs'], self.config['max_peak_db'])
+
+    def feed(self, chunk):
+        """输入一个分块，返回可以立即输出的音频（可能为空）"""
+        return self._run(_as_float(chunk), final=False)
+
+    def flush(self):
+        """输入结束：输出剩余音频（尾部静音裁剪与淡出在此完成）"""
+        return self._run(np.zeros(0, dtype=np.float32), final=True)
+
+    def _run(self, audio, final):
+        audio = self._trim(audio, final)
+        audio = self._normalize(audio, final)
+        audio = self._fade(audio, final)
+        started = time.perf_counter()
+        audio = _finish_format(audio, self.config, self._rng)
+        self._time('format', started)
+        return audio
+
+    def _trim(self, audio, final):
+        """返回确定保留的原始样本，其余缓存到能判定为止"""
+        if not self.config['trim']:
+            return audio
+        started = time.perf_counter()
+        self._raw = np.concatenate((self._raw, audio))
+        self._analysis = np.concatenate((self._analysis, audio))
+        levels, frame = _frame_levels_db(self._analysis, self.sample_rate)
+        voiced = np.flatnonzero(levels > self.config['silence_db'])
+        if voiced.size:
+            if self._voiced_end is None:
+                # 第一帧有声内容：丢弃超出余量的首部静音
+                begin = max(0, self._classified + voiced[0] * frame - self._pad)
+                self._raw = self._raw[begin - self._raw_start:]
+                self._raw_start = begin
+            self._voiced_end = self._classified + (voiced[-1] + 1) * frame
+        self._analysis = self._analysis[len(levels) * frame:]
+        self._classified += len(levels) * frame
+
+        if self._voiced_end is None:
+            # 尚未出现有声内容；整段都是静音时与 trim_silence 一样原样输出
+            release = len(self._raw) if final else 0
+        else:
+            # 有声内容及其后 pad_ms 内的样本无论后面是否还有有声内容都会保留
+            release = max(0, min(len(self._raw), self._voiced_end + self._pad - self._raw_start))
+        out, self._raw = self._raw[:release], self._raw[release:]
+        self._raw_start += release
+        if final:
+            self._raw = np.zeros(0, dtype=np.float32)
+        self._time('trim', started)
+        return out
+
+    def _normalize(self, audio, final):
+        if self._gain is None:
+            # 增益尚未锁定：积累音频
+            self._pending = np.concatenate((self._pending, audio))
+            if not final and len(self._pending) < self.WARMUP_SECONDS * self.sample_rate:
+                return np.zeros(0, dtype=np.float32)
+            started = time.perf_counter()
+            self._gain = self._lock_gain(self._pending) if len(self._pending) else 1.0
+            self._time('normalize', started)
+            audio, self._pending = self._pending, np.zeros(0, dtype=np.float32)
+        if not self.config['normalize']:
+            return audio
+        started = time.perf_counter()
+        audio = audio * np.float32(self._gain)
+        # 锁定增益后限制峰值，避免后续块削波
+        np.clip(audio, -1.0, 1.0, out=audio)
+        self._time('normalize', started)
+        return audio
+
+    def _fade(self, audio, final):
+        if not len(self._fade_in) and not self._fade_out:
+            return audio
+        started = time.perf_counter()
+        if self._faded < len(self._fade_in) and len(audio):
+            n = min(len(self._fade_in) - self._faded, len(audio))
+            audio = audio.copy()
+            audio[:n] *= self._fade_in[self._faded:self._faded + n]
+            self._faded += n
+        if self._fade_out:
+            audio = np.concatenate((self._held, audio))
+            if final:
+                self._held = np.zeros(0, dtype=np.float32)
+                audio = apply_fades(audio, self.sample_rate, 0, self.config['fade_out_ms'])
+            else:
+                split = max(0, len(audio) - self._fade_out)
+                audio, self._held = audio[:split], audio[split:]
+        self._time('fade', started)
+        return audio
@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+"""
+AIMAX395TTS - 命令行批量合成
+不启动Web服务，直接读取JSONL请求文件批量合成，适合夜间大批量生产任务。
+
+使用方法:
+    python batch_tts.py requests.jsonl [-o output/batch] [--batch-size 8] [--force]
+
+请求文件每行一个JSON，字段与 /tts 相同，另加输出文件名 name：
+    {"name": "ch01_001", "text": "...", "mode": "tts-custom", "speaker": "Vivian", "language": "zh"}
+    {"name": "intro", "text": "...", "mode": "voice-design", "voice_description": "温柔的女声"}
+    {"name": "clone_01", "text": "...", "mode": "voice-clone", "reference_audio": "ref.wav", "reference_text": "..."}
+
+特性:
+    - 只加载请求文件中用到的模型
+    - 相同模型与采样参数的请求按文本长度排序后以列表形式批量生成
+    - 生成与写盘流水线并行：后台线程写音频和清单，主线程继续下一批
+    - 清单 manifest.jsonl 逐条追加；再次运行时跳过已完成的请求（断点续跑）
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import hashlib
+import argparse
+import threading
+
+from seeding import resolve_seed, seeded
+from token_budget import TokenBudgetEstimator
+from segment_store import write_wav_atomic
+from clone_preflight import ClonePreflight
+from tts_engine import MODEL_SPECS, ENGINES, SynthesisRequest, create_engine, sampling_config
+
+LANGUAGE_MAP = {
+    'zh': 'chinese', 'en': 'english', 'ja': 'japanese',
+    'ko': 'korean', 'fr': 'french', 'de': 'german',
+    'es': 'spanish', 'it': 'italian', 'pt': 'portuguese', 'ru': 'russian'
+}
+
+
+def load_requests(path):
+    """
+    读取并规范化JSONL请求文件
+
+    Args:
+        path: 请求文件路径
+
+    Returns:
+        list[dict]: 规范化后的请求，含 name 与 digest（请求内容摘要，用于续跑判断）
+    """
+    requests = []
+    names = set()
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            data = json.loads(line)
+            mode = data.get('mode', 'tts-custom')
+            version = data.get('model_version', '1.7b')
+            if (mode, version) not in MODEL_SPECS:
+                raise ValueError(f"第 {line_no} 行: 未知的模式/模型版本 {mode}/{version}")
+            if not data.get('text', '').strip():
+                raise ValueError(f"第 {line_no} 行: text 为空")
+            if mode == 'voice-clone' and not data.get('reference_audio'):
+                raise ValueError(f"第 {line_no} 行: 声音克隆需要 reference_audio")
+            language = data.get('language', 'auto')
+            req = {
+                'name': str(data.get('name') or f"line_{line_no:05d}"),
+                'text': data['text'],
+                'mode': mode,
+                'model_version': version,
+                'language': LANGUAGE_MAP.get(language, language),
+                'speaker': data.get('speaker', 'Vivian'),
+                'style': data.get('style', ''),
+                'voice_description': data.get('voice_description', ''),
+                'reference_audio': data.get('reference_audio', ''),
+                'reference_text': data.get('reference_text', ''),
+                'temperature': float(data.get('temperature', sampling_config(version)['temperature'])),
+                'top_p': float(data.get('top_p', sampling_config(version)['top_p'])),
+                'seed': resolve_seed(data.get('seed')),
+            }
+            if any(c in req['name'] for c in '/\\') or req['name'].startswith('.'):
+                raise ValueError(f"第 {line_no} 行: 非法的输出名称 {req['name']}")
+            if req['name'] in names:
+                raise ValueError(f"第 {line_no} 行: 输出名称重复 {req['name']}")
+            names.add(req['name'])
+            payload = json.dumps(req, sort_keys=True, ensure_ascii=False)
+            req['digest'] = hashlib.sha256(payload.encode('utf-8')).hexdigest()
+            requests.append(req)
+    return requests
+
+
+def load_manifest(manifest_path, output_dir):
+    """读取已有清单，返回已成功完成的请求 {名称: 摘要}（音频文件必须存在）"""
+    done = {}
+    if not os.path.exists(manifest_path):
+        return done
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # 上次运行中断时可能留下半行
+                continue
+            if entry.get('status') == 'ok' and os.path.exists(os.path.join(output_dir, entry['file'])):
+                done[entry['name']] = entry['digest']
+            else:
+                done.pop(entry.get('name'), None)
+    return done
+
+
+def voice_key(req):
+    """同一批次内必须相同的音色参数"""
+    if req['mode'] == 'voice-clone':
+        return (req['reference_audio'], req['reference_text'])
+    return ()
+
+
+def speaker_key(req):
+    """token预算统计使用的说话人标识（与Web服务一致，共用统计数据）"""
+    if req['mode'] == 'tts-custom':
+        return req['speaker']
+    if req['mode'] == 'voice-clone':
+        return f"clone:{req['reference_audio']}"
+    digest = hashlib.md5(req['voice_description'].encode('utf-8')).hexdigest()[:8]
+    return f"design:{digest}"
+
+
+def plan_batches(requests, batch_size):
+    """
+    将请求分组为批次
+
+    相同模型、采样参数与参考音频的请求放在同一组，组内按文本长度排序，
+    使同一批次的生成长度接近、减少填充浪费。指定了种子的请求单独生成，
+    保证结果与单条请求一致。
+
+    Args:
+        requests: 待合成的请求
+        batch_size: 每批最大请求数
+
+    Returns:
+        list[list[dict]]
+    """
+    groups = {}
+    singles = []
+    for req in requests:
+        if req['seed'] is not None or batch_size <= 1:
+            singles.append([req])
+            continue
+        key = (req['mode'], req['model_version'], req['temperature'], req['top_p'], voice_key(req))
+        groups.setdefault(key, []).append(req)
+
+    batches = []
+    for group in groups.values():
+        group.sort(key=lambda r: len(r['text']))
+        for i in range(0, len(group), batch_size):
+            batches.append(group[i:i + batch_size])
+    return batches + singles
+
+
+class BatchRunner:
+    """按批次调用模型生成，音频写入与清单记录交给后台线程"""
+
+    def __init__(self, engine, output_dir, manifest_path, token_budget):
+        self.engine = engine
+        self.output_dir = output_dir
+        self.token_budget = token_budget
+        self.clone_preflight = ClonePreflight()
+        self._writes = queue.Queue(maxsize=4)
+        self._manifest = open(manifest_path, 'a', encoding='utf-8')
+        # 统计数由主线程与写盘线程共同更新
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.failed = 0
+        self.audio_seconds = 0.0
+        self._writer = threading.Thread(target=self._write_loop, name='batch-writer', daemon=True)
+        self._writer.start()
+
+    def _write_loop(self):
+        """
+        写音频与清单的后台线程
+
+        单条写入失败只把该条记为 error，线程只在收到 None 时退出：
+        提前退出会让主线程的 put（队列已满）和 close 永远阻塞。
+        """
+        while True:
+            item = self._writes.get()
+            if item is None:
+                return
+            req, audio_data, sample_rate, entry = item
+            if audio_data is not None:
+                try:
+                    write_start = time.time()
+                    write_wav_atomic(os.path.join(self.output_dir, entry['file']), sample_rate, audio_data)
+                    entry['write_seconds'] = round(time.time() - write_start, 3)
+                except Exception as e:
+                    print(f"❌ {req['name']}: 写入音频失败: {e}")
+                    with self._lock:
+                        self.completed -= 1
+                        self.failed += 1
+                        self.audio_seconds -= entry.get('audio_seconds', 0.0)
+                    entry.update(status='error', error=f"写入音频失败: {e}")
+            try:
+                self._manifest.write(json.dumps(entry, ensure_ascii=False) + '\n')
+                self._manifest.flush()
+                os.fsync(self._manifest.fileno())
+            except Exception as e:
+                # 没有记录的请求下次运行时会重新合成
+                print(f"❌ {req['name']}: 写入清单失败: {e}")
+
+    def _clone_prompt(self, model_name, req):
+        """同一参考音频只预检、编码一次克隆提示"""
+        prompt, _ = self.clone_preflight.prompt_for(
+            model_name, req['reference_audio'], req['reference_text'],
+            lambda ref_audio, ref_text, x_vector_only: self.engine.create_clone_prompt(
+                model_name, ref_audio, ref_text, x_vector_only
+            )
+        )
+        return prompt
+
+    def _generate(self, model_name, batch, generation_config):
+        """以列表形式一次生成整批请求"""
+        first = batch[0]
+        req = SynthesisRequest(
+            text=[r['text'] for r in batch],
+            mode=first['mode'],
+            language=[r['language'] for r in batch],
+            model_version=first['model_version'],
+            speaker=[r['speaker'] for r in batch],
+            style=[r['style'] for r in batch],
+            voice_description=[r['voice_description'] for r in batch],
+            generation_config=generation_config,
+        )
+        if first['mode'] == 'voice-clone':
+            req.clone_prompt = self._clone_prompt(model_name, first)
+        result = self.engine.generate(req)
+        return result.wavs, result.sample_rate
+
+    def run_batch(self, batch_id, batch):
+        first = batch[0]
+        _, model_name = self.engine.select_model(first['mode'], first['model_version'])
+        budgets = [self.token_budget.budget(r['text'], r['language'], model_name, speaker_key(r)) for r in batch]
+        generation_config = dict(
+            sampling_config(first['model_version']),
+            temperature=first['temperature'], top_p=first['top_p'],
+            max_new_tokens=max(budgets),
+        )
+
+        start = time.time()
+        try:
+            with seeded(first['seed']):
+                wavs, sample_rate = self._generate(model_name, batch, generation_config)
+            error = None
+        except Exception as e:
+            wavs, sample_rate, error = None, None, str(e)
+        elapsed = time.time() - start
+
+        if error is not None and len(batch) > 1:
+            # 整批失败（如内存不足）时拆开逐条重试，避免一条坏请求拖垮整批
+            print(f"⚠️ 批次 {batch_id} 失败，逐条重试: {error}")
+            for req in batch:
+                self.run_batch(batch_id, [req])
+            return
+
+        for index, req in enumerate(batch):
+            entry = {
+                'name': req['name'],
+                'digest': req['digest'],
+                'file': f"{req['name']}.wav",
+                'model': model_name,
+                'batch_id': batch_id,
+                'batch_size': len(batch),
+                'batch_seconds': round(elapsed, 3),
+                'max_new_tokens': generation_config['max_new_tokens'],
+                'finished_at': time.time(),
+            }
+            if error is not None:
+                with self._lock:
+                    self.failed += 1
+                entry.update(status='error', error=error)
+                print(f"❌ {req['name']}: {error}")
+                self._writes.put((req, None, None, entry))
+                continue
+            audio_data = wavs[index]
+            duration = len(audio_data) / float(sample_rate)
+            hit_cap = self.token_budget.record(
+                req['text'], req['language'], model_name, speaker_key(req),
+                len(audio_data), sample_rate, budgets[index]
+            )
+            with self._lock:
+                self.completed += 1
+                self.audio_seconds += duration
+            entry.update(
+                status='ok', audio_seconds=round(duration, 3), sample_rate=sample_rate,
+                # 批次耗时按请求数均摊
+                rtf=round(elapsed / len(batch) / duration, 3) if duration else None,
+                hit_token_cap=hit_cap,
+            )
+            self._writes.put((req, audio_data, sample_rate, entry))
+
+    def close(self):
+        self._writes.put(None)
+        self._writer.join()
+        self._manifest.close()
+        self.token_budget.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="AIMAX395TTS - 命令行批量合成",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+示例:
+  python batch_tts.py jobs.jsonl                      # 输出到 output/batch
+  python batch_tts.py jobs.jsonl -o out --batch-size 4
+  python batch_tts.py jobs.jsonl --force              # 忽略清单，全部重新生成
+        """
+    )
+    parser.add_argument('requests', help='JSONL请求文件')
+    parser.add_argument('-o', '--output', default=os.path.join('output', 'batch'), help='输出目录（默认 output/batch）')
+    parser.add_argument('--batch-size', type=int, default=8, help='每批最大请求数（默认 8，设为1禁用批量）')
+    parser.add_argument('--force', action='store_true', help='忽略已有清单，重新生成全部请求')
+    parser.add_argument('--engine', default=None, choices=sorted(ENGINES), help='合成后端（默认 optimized，stub 用于测试）')
+    args = parser.parse_args()
+
+    requests = load_requests(args.requests)
+    os.makedirs(args.output, exist_ok=True)
+    manifest_path = os.path.join(args.output, 'manifest.jsonl')
+    if args.force and os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    done = load_manifest(manifest_path, args.output)
+    pending = [r for r in requests if done.get(r['name']) != r['digest']]
+    print(f"📋 共 {len(requests)} 条请求，已完成 {len(requests) - len(pending)} 条，待合成 {len(pending)} 条")
+    if not pending:
+        return 0
+
+    batches = plan_batches(pending, args.batch_size)
+    needed = {(r['mode'], r['model_version']) for r in pending}
+    engine = create_engine(args.engine)
+    engine.load(needed)
+    missing = needed - set(engine.models)
+    if missing:
+        print(f"❌ 模型加载失败: {', '.join(MODEL_SPECS[key][1] for key in sorted(missing))}")
+        return 1
+    token_budget = TokenBudgetEstimator(os.path.join('output', 'token_budget_stats.json'), save_every=50)
+    runner = BatchRunner(engine, args.output, manifest_path, token_budget)
+
+    start = time.time()
+    try:
+        for batch_id, batch in enumerate(batches):
+            print(f"🚀 批次 {batch_id + 1}/{len(batches)}: {len(batch)} 条 ({batch[0]['mode']}/{batch[0]['model_version']})")
+            runner.run_batch(batch_id, batch)
+    except KeyboardInterrupt:
+        print("\n⏹️ 已中断，已完成的请求记录在清单中，重新运行即可续跑")
+    finally:
+        runner.close()
+
+    elapsed = time.time() - start
+    print("\n" + "=" * 60)
+    print(f"✅ 完成 {runner.completed} 条，失败 {runner.failed} 条")
+    print(f"⏱️ 总耗时 {elapsed:.1f} 秒，生成音频 {runner.audio_seconds:.1f} 秒"
+          + (f"，RTF {elapsed / runner.audio_seconds:.3f}" if runner.audio_seconds else ""))
+    print(f"📄 清单: {manifest_path}")
+    print("=" * 60)
+    return 1 if runner.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
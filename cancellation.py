@@ -0,0 +1,209 @@
+"""
+生成取消
+客户端断开连接或显式调用取消接口时，在下一个解码步通过 StoppingCriteria
+停止 talker 的解码循环，立即释放模型，并统计节省的 CPU 时间。
+
+相同的在途请求会合并为一次生成（见 singleflight），因此取消令牌按生成共享：
+只有所有挂在该生成上的请求都取消后，生成才会真正停止。
+"""
+import logging
+import os
+import select
+import socket
+import threading
+import time
+
+import torch
+
+try:
+    from transformers import StoppingCriteria, StoppingCriteriaList
+except ImportError:  # transformers 缺失时退化为普通对象，生成方法不会调用它
+    StoppingCriteria = object
+    StoppingCriteriaList = list
+
+from request_log import get_logger, log_event
+
+logger = get_logger('cancellation')
+
+# 断线检测轮询间隔（秒）
+DISCONNECT_POLL_INTERVAL = float(os.environ.get('QWEN_TTS_DISCONNECT_POLL', 0.5))
+
+
+class GenerationCancelled(Exception):
+    """生成已被取消"""
+
+
+class DuplicateRequestId(Exception):
+    """请求ID已被另一个在途请求使用"""
+
+
+class CancelToken:
+    """一次生成的取消令牌，可被多个请求共享"""
+
+    def __init__(self, key):
+        self.key = key
+        self.active = 0
+        self.reason = None
+        self._event = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self, reason):
+        self.reason = reason
+        self._event.set()
+
+    def check(self):
+        """已取消时抛出 GenerationCancelled（用于片段之间的检查点）"""
+        if self._event.is_set():
+            raise GenerationCancelled(f"生成已取消: {self.reason}")
+
+
+class CancelStoppingCriteria(StoppingCriteria):
+    """解码循环中的取消检查，同时记录解码步数与耗时，并可在每步调用进度钩子"""
+
+    def __init__(self, token, on_step=None):
+        self.token = token
+        self.on_step = on_step
+        self.steps = 0
+        self.first_step_at = None
+        self.last_step_at = None
+
+    def __call__(self, input_ids, scores, **kwargs):
+        now = time.time()
+        if self.first_step_at is None:
+            self.first_step_at = now
+        self.last_step_at = now
+        self.steps += 1
+        if self.on_step is not None:
+            try:
+                self.on_step(self.steps, self.seconds_per_step)
+            except Exception as e:
+                # 进度钩子出错不影响生成
+                log_event(logger, logging.WARNING, '进度钩子异常', error=str(e))
+                self.on_step = None
+        cancelled = self.token is not None and self.token.cancelled
+        return torch.full((input_ids.shape[0],), cancelled, dtype=torch.bool)
+
+    @property
+    def seconds_per_step(self):
+        if self.steps < 2:
+            return 0.0
+        return (self.last_step_at - self.first_step_at) / (self.steps - 1)
+
+
+def stopping_criteria_for(token, on_step=None):
+    """为生成调用构造停止条件，返回 (StoppingCriteriaList, 记录器)"""
+    criteria = CancelStoppingCriteria(token, on_step)
+    return StoppingCriteriaList([criteria]), criteria
+
+
+def _peer_closed(sock):
+    """对端是否已关闭连接：可读且 MSG_PEEK 读到 0 字节"""
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        if not readable:
+            return False
+        return sock.recv(1, socket.MSG_PEEK) == b''
+    except (OSError, ValueError):
+        return True
+
+
+class CancellationRegistry:
+    """请求ID → 取消令牌的登记表，并在后台检测客户端断线"""
+
+    def __init__(self, poll_interval=DISCONNECT_POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._tokens = {}
+        self._requests = {}
+        self._sockets = {}
+        self._watcher = None
+        self.cancelled = 0
+        self.wall_seconds_saved = 0.0
+        self.cpu_seconds_saved = 0.0
+
+    def join(self, key, request_id):
+        """
+        请求加入某个生成（按请求摘要），返回共享的取消令牌
+
+        客户端自带的 request_id 若已被在途请求使用则抛出 DuplicateRequestId，
+        避免覆盖对方的登记（之后对方无法取消、完成时也会误删本请求的登记）。
+        """
+        with self._lock:
+            if request_id in self._requests:
+                raise DuplicateRequestId(f"request_id 已在使用中: {request_id}")
+            token = self._tokens.get(key)
+            if token is None or token.cancelled:
+                token = self._tokens[key] = CancelToken(key)
+            token.active += 1
+            self._requests[request_id] = token
+            return token
+
+    def active(self, request_id):
+        """请求ID是否属于在途请求"""
+        with self._lock:
+            return request_id in self._requests
+
+    def leave(self, request_id):
+        """请求结束（正常完成或失败），不再关注其连接"""
+        with self._lock:
+            self._sockets.pop(request_id, None)
+            token = self._requests.pop(request_id, None)
+            if token is None:
+                return
+            token.active -= 1
+            if token.active <= 0 and self._tokens.get(token.key) is token:
+                del self._tokens[token.key]
+
+    def cancel(self, request_id, reason='client'):
+        """取消一个请求；共享生成的所有请求都取消后才停止解码"""
+        with self._lock:
+            self._sockets.pop(request_id, None)
+            token = self._requests.pop(request_id, None)
+            if token is None:
+                return False
+            token.active -= 1
+            if token.active <= 0:
+                token.cancel(reason)
+                self.cancelled += 1
+                if self._tokens.get(token.key) is token:
+                    del self._tokens[token.key]
+        log_event(logger, logging.INFO, '请求已取消', request_id=request_id, reason=reason)
+        return True
+
+    def watch(self, request_id, sock):
+        """登记请求的客户端连接，断线时自动取消"""
+        if sock is None:
+            return
+        with self._lock:
+            self._sockets[request_id] = sock
+            if self._watcher is None:
+                self._watcher = threading.Thread(target=self._watch_loop, name='disconnect-watcher', daemon=True)
+                self._watcher.start()
+
+    def _watch_loop(self):
+        while True:
+            time.sleep(self.poll_interval)
+            with self._lock:
+                watched = list(self._sockets.items())
+            for request_id, sock in watched:
+                if _peer_closed(sock):
+                    self.cancel(request_id, reason='disconnect')
+
+    def record_saved(self, wall_seconds):
+        """记录一次取消节省的解码时间（墙钟秒 × 推理线程数 ≈ CPU秒）"""
+        wall_seconds = max(0.0, wall_seconds)
+        with self._lock:
+            self.wall_seconds_saved += wall_seconds
+            self.cpu_seconds_saved += wall_seconds * torch.get_num_threads()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'active_requests': len(self._requests),
+                'cancelled': self.cancelled,
+                'wall_seconds_saved': round(self.wall_seconds_saved, 2),
+                'cpu_seconds_saved': round(self.cpu_seconds_saved, 2),
+            }
@@ -0,0 +1,149 @@
+"""
+声音克隆预检
+生成前先低成本地判断参考音频能否使用ICL模式（参考音频 + 参考文本），
+并预先计算对应模式的克隆提示：
+1. 没有参考文本 → x-vector 模式
+2. 参考音频过短/过长、或参考文本长度与音频时长明显不匹配 → x-vector 模式
+3. ICL 克隆提示编码失败 → x-vector 模式
+
+判断结果与克隆提示按「模型 + 参考音频内容 + 参考文本」缓存，
+生成只需用缓存的提示运行一次，不再在ICL失败后整段重新生成。
+"""
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import request_log
+from request_log import get_logger, log_event
+from token_budget import count_chars
+
+logger = get_logger('clone_preflight')
+
+# ICL模式可用的参考音频时长范围（秒）
+MIN_ICL_SECONDS = float(os.environ.get('QWEN_TTS_MIN_ICL_SECONDS', 1.5))
+MAX_ICL_SECONDS = float(os.environ.get('QWEN_TTS_MAX_ICL_SECONDS', 30))
+
+# 参考文本语速的合理范围（有效字符/秒），超出视为文本与音频不对应
+CHARS_PER_SECOND_RANGE = (0.5, 25.0)
+
+# 内存中最多缓存的克隆提示数量
+MAX_CACHED_PROMPTS = int(os.environ.get('QWEN_TTS_CLONE_PROMPT_CACHE', 64))
+
+
+def audio_duration(path):
+    """读取音频时长（秒），无法读取时返回 None"""
+    try:
+        import soundfile
+        return soundfile.info(path).duration
+    except Exception:
+        return None
+
+
+def icl_rejection(ref_text, duration):
+    """
+    根据参考文本与时长判断ICL模式是否可行
+
+    Returns:
+        str | None: 不可行的原因，None 表示可以尝试ICL
+    """
+    if not ref_text or not ref_text.strip():
+        return '缺少参考文本'
+    if duration is None:
+        return None
+    if duration < MIN_ICL_SECONDS:
+        return f"参考音频过短（{duration:.1f}s）"
+    if duration > MAX_ICL_SECONDS:
+        return f"参考音频过长（{duration:.1f}s）"
+    rate = count_chars(ref_text) / duration
+    if not CHARS_PER_SECOND_RANGE[0] <= rate <= CHARS_PER_SECOND_RANGE[1]:
+        return f"参考文本与音频时长不匹配（{rate:.1f} 字/秒）"
+    return None
+
+
+class ClonePreflight:
+    """按参考音频缓存克隆模式判断与克隆提示"""
+
+    def __init__(self, max_prompts=MAX_CACHED_PROMPTS):
+        self.max_prompts = max_prompts
+        self._lock = threading.Lock()
+        self._prompts = OrderedDict()
+        # 文件摘要缓存：{路径: (mtime, size, sha256)}
+        self._digests = {}
+        # 按键加锁，相同参考音频的并发请求只编码一次
+        self._building = {}
+        self.decisions = {'icl': 0, 'x_vector': 0}
+        self.hits = 0
+
+    def _file_digest(self, path):
+        st = os.stat(path)
+        with self._lock:
+            cached = self._digests.get(path)
+        if cached and cached[:2] == (st.st_mtime, st.st_size):
+            return cached[2]
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        digest = h.hexdigest()
+        with self._lock:
+            self._digests[path] = (st.st_mtime, st.st_size, digest)
+        return digest
+
+    def prompt_for(self, model_name, ref_audio_path, ref_text, build_prompt):
+        """
+        取得参考音频的克隆提示，首次使用时完成预检与编码
+
+        Args:
+            model_name: Base模型名称
+            ref_audio_path: 参考音频路径
+            ref_text: 参考文本（可为空）
+            build_prompt: 回调 (参考音频路径, 参考文本, x_vector_only_mode) → 克隆提示
+
+        Returns:
+            (克隆提示, 判断结果dict：mode 为 'icl' 或 'x_vector'，reason 为降级原因)
+        """
+        key = (model_name, self._file_digest(ref_audio_path), (ref_text or '').strip())
+        with self._lock:
+            if key in self._prompts:
+                self._prompts.move_to_end(key)
+                self.hits += 1
+                return self._prompts[key]
+            building = self._building.setdefault(key, threading.Lock())
+
+        with building:
+            with self._lock:
+                if key in self._prompts:
+                    self.hits += 1
+                    return self._prompts[key]
+            try:
+                entry = self._preflight(ref_audio_path, key[2], build_prompt)
+                with self._lock:
+                    self._prompts[key] = entry
+                    self.decisions[entry[1]['mode']] += 1
+                    while len(self._prompts) > self.max_prompts:
+                        self._prompts.popitem(last=False)
+            finally:
+                with self._lock:
+                    self._building.pop(key, None)
+        return entry
+
+    def _preflight(self, ref_audio_path, ref_text, build_prompt):
+        duration = audio_duration(ref_audio_path)
+        reason = icl_rejection(ref_text, duration)
+        if reason is None:
+            try:
+                prompt = build_prompt(ref_audio_path, ref_text, False)
+                request_log.note(clone_mode='icl', reference_seconds=round(duration, 1) if duration else None)
+                return prompt, {'mode': 'icl', 'reason': None, 'duration': duration}
+            except Exception as e:
+                reason = f"ICL提示编码失败: {e}"
+        request_log.note(clone_mode='x_vector', clone_reason=reason)
+        log_event(logger, logging.DEBUG, '克隆预检: 使用x-vector模式', reason=reason)
+        prompt = build_prompt(ref_audio_path, None, True)
+        return prompt, {'mode': 'x_vector', 'reason': reason, 'duration': duration}
+
+    def stats(self):
+        with self._lock:
+            return dict(self.decisions, cached=len(self._prompts), hits=self.hits)
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""
+语音编解码器解码端的 ONNX Runtime 后端
+12Hz 编解码器把codec token还原为波形的解码器是固定结构的卷积网络，
+导出为ONNX后用 onnxruntime 的CPU执行器运行，线程数由我们控制。
+
+导出时先用随机codec token对比 torch 与 onnxruntime 的输出，误差超出阈值则不启用；
+运行时任何异常（形状不支持、onnxruntime 未安装等）都自动退回 eager torch。
+
+使用方法:
+    python codec_onnx.py export ./Qwen3-TTS-12Hz-1.7B-CustomVoice-Full     # 导出并验证
+    python codec_onnx.py validate ./Qwen3-TTS-12Hz-1.7B-CustomVoice-Full   # 重新验证并测速
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+import threading
+
+import numpy as np
+
+from weight_sharing import module_digest
+from request_log import get_logger, log_event
+
+logger = get_logger('codec_onnx')
+
+# ONNX文件目录：<目录>/<模型目录名>-codec-decoder.onnx，验证结果写在同名 .json 中
+ONNX_DIR = os.environ.get('QWEN_TTS_ONNX_DIR', os.path.join('output', 'onnx'))
+
+# onnxruntime 线程数：算子内并行（默认为CPU核数的一半）与算子间并行
+INTRA_OP_THREADS = int(os.environ.get('QWEN_TTS_ONNX_THREADS', max(1, (os.cpu_count() or 2) // 2)))
+INTER_OP_THREADS = int(os.environ.get('QWEN_TTS_ONNX_INTER_THREADS', 1))
+
+# 验证阈值：最大绝对误差（波形幅度范围约为 [-1, 1]）
+MAX_ABS_ERROR = float(os.environ.get('QWEN_TTS_ONNX_TOLERANCE', 1e-3))
+
+# 解码器在 Qwen3TTSModel 中可能的位置（按顺序查找）
+DECODER_PATHS = (
+    'model.speech_tokenizer.model.decoder',
+    'model.speech_tokenizer.decoder',
+    'speech_tokenizer.model.decoder',
+    'speech_tokenizer.decoder',
+)
+
+# 导出与验证使用的码本大小与帧数
+DEFAULT_CODEBOOK_SIZE = 2048
+DEFAULT_NUM_QUANTIZERS = 16
+EXPORT_FRAMES = 48
+VALIDATE_FRAMES = (12, 48, 120)
+
+OPSET_VERSION = 17
+
+
+def find_decoder(model):
+    """在模型中查找编解码器的解码器，返回 (路径, 模块)，找不到时返回 (None, None)"""
+    for path in DECODER_PATHS:
+        obj = model
+        for attr in path.split('.'):
+            obj = getattr(obj, attr, None)
+            if obj is None:
+                break
+        if obj is not None and hasattr(obj, 'forward'):
+            return path, obj
+    return None, None
+
+
+def onnx_path_for(model_path):
+    return os.path.join(ONNX_DIR, f"{os.path.basename(os.path.normpath(model_path))}-codec-decoder.onnx")
+
+
+def decoder_signature(decoder):
+    """
+    解码器结构与权重内容的摘要，模型权重变化后旧的ONNX文件不再使用
+
+    哈希与子模块共享使用同一算法（weight_sharing.module_digest）：覆盖参数与缓冲区的名称、
+    形状、精度与内容，形状相同、权重不同的微调模型也不会误用旧文件
+    """
+    params = [(name, tuple(p.shape)) for name, p in decoder.named_parameters()]
+    return {
+        'parameters': len(params),
+        'elements': int(sum(int(np.prod(s)) for _, s in params)),
+        'sha256': module_digest(decoder, {})[0],
+    }
+
+
+def _codes_shape(decoder, frames):
+    config = getattr(decoder, 'config', None)
+    num_quantizers = getattr(config, 'num_quantizers', None) or DEFAULT_NUM_QUANTIZERS
+    codebook_size = getattr(config, 'codebook_size', None) or DEFAULT_CODEBOOK_SIZE
+    return (1, num_quantizers, frames), codebook_size
+
+
+def num_quantizers(decoder):
+    """每帧的码本数"""
+    return _codes_shape(decoder, 1)[0][1]
+
+
+def _random_codes(decoder, frames, layout, seed=0):
+    import torch
+    shape, codebook_size = _codes_shape(decoder, frames)
+    generator = torch.Generator().manual_seed(seed)
+    codes = torch.randint(0, codebook_size, shape, generator=generator, dtype=torch.long)
+    return codes.transpose(1, 2).contiguous() if layout == 'btq' else codes
+
+
+def as_waveform(output):
+    # 解码器可能返回元组或带 audio_values 等字段的输出对象
+    if isinstance(output, (tuple, list)):
+        output = output[0]
+    for attr in ('audio_values', 'waveform', 'audio'):
+        if hasattr(output, attr):
+            output = getattr(output, attr)
+    return output
+
+
+def detect_layout(decoder):
+    """codec token 的排列：(batch, 量化器, 帧) 或 (batch, 帧, 量化器)，以能在torch上运行的为准"""
+    import torch
+    errors = []
+    for layout in ('bqt', 'btq'):
+        try:
+            with torch.no_grad():
+                as_waveform(decoder(_random_codes(decoder, EXPORT_FRAMES, layout)))
+            return layout
+        except Exception as e:
+            errors.append(f"{layout}: {e}")
+    raise RuntimeError(f"无法确定解码器输入格式 ({'; '.join(errors)})")
+
+
+def _export_module(decoder):
+    """导出时只保留波形输出"""
+    import torch
+
+    class DecoderExport(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.decoder = decoder
+
+        def forward(self, codes):
+            return as_waveform(self.decoder(codes)).float()
+
+    return DecoderExport()
+
+
+def create_session(onnx_path, intra_threads=INTRA_OP_THREADS, inter_threads=INTER_OP_THREADS):
+    """创建CPU执行器的 onnxruntime 会话"""
+    import onnxruntime as ort
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = intra_threads
+    options.inter_op_num_threads = inter_threads
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return ort.InferenceSession(onnx_path, sess_options=options, providers=['CPUExecutionProvider'])
+
+
+def validate(decoder, session, layout, frames=VALIDATE_FRAMES, runs=3):
+    """
+    用随机codec token对比 torch 与 onnxruntime 的输出与耗时
+
+    Returns:
+        dict: max_abs_error、snr_db、torch/onnx 平均耗时（秒）与是否通过
+    """
+    import torch
+    input_name = session.get_inputs()[0].name
+    max_error = 0.0
+    snr = float('inf')
+    torch_seconds = onnx_seconds = 0.0
+    for index, n in enumerate(frames):
+        codes = _random_codes(decoder, n, layout, seed=index + 1)
+        for _ in range(runs):
+            start = time.perf_counter()
+            with torch.no_grad():
+                expected = as_waveform(decoder(codes)).float().numpy()
+            torch_seconds += time.perf_counter() - start
+            start = time.perf_counter()
+            actual = session.run(None, {input_name: codes.numpy()})[0]
+            onnx_seconds += time.perf_counter() - start
+        if actual.shape != expected.shape:
+            return {'passed': False, 'error': f"输出形状不一致: onnx {actual.shape} / torch {expected.shape}"}
+        diff = np.abs(actual - expected)
+        max_error = max(max_error, float(diff.max()))
+        noise = float(np.mean(diff ** 2))
+        if noise > 0:
+            snr = min(snr, 10 * np.log10(float(np.mean(expected ** 2)) / noise + 1e-12))
+    calls = len(frames) * runs
+    return {
+        'passed': max_error <= MAX_ABS_ERROR,
+        'max_abs_error': max_error,
+        'snr_db': None if snr == float('inf') else round(snr, 1),
+        'torch_seconds': round(torch_seconds / calls, 4),
+        'onnx_seconds': round(onnx_seconds / calls, 4),
+        'tolerance': MAX_ABS_ERROR,
+    }
+
+
+def export_decoder(model, onnx_path):
+    """
+    把模型的编解码器解码器导出为ONNX并验证数值
+
+    Args:
+        model: 已加载的 Qwen3TTSModel
+        onnx_path: 输出的ONNX文件路径
+
+    Returns:
+        dict: 验证结果（同时写入 <onnx_path>.json）
+    """
+    import torch
+    path, decoder = find_decoder(model)
+    if decoder is None:
+        raise RuntimeError("模型中未找到编解码器的解码器")
+    decoder.eval()
+    layout = detect_layout(decoder)
+    print(f"🔎 解码器: {path}，输入格式: {layout}")
+
+    os.makedirs(os.path.dirname(onnx_path) or '.', exist_ok=True)
+    tmp_path = f"{onnx_path}.tmp"
+    time_axis = 2 if layout == 'bqt' else 1
+    module = _export_module(decoder)
+    codes = _random_codes(decoder, EXPORT_FRAMES, layout)
+    with torch.no_grad():
+        sample_axis = module(codes).dim() - 1
+        torch.onnx.export(
+            module, (codes,), tmp_path,
+            input_names=['codes'], output_names=['waveform'],
+            dynamic_axes={'codes': {0: 'batch', time_axis: 'frames'}, 'waveform': {0: 'batch', sample_axis: 'samples'}},
+            opset_version=OPSET_VERSION,
+        )
+    os.replace(tmp_path, onnx_path)
+    print(f"📦 已导出: {onnx_path}")
+
+    result = validate(decoder, create_session(onnx_path), layout)
+    result.update(layout=layout, decoder_path=path, signature=decoder_signature(decoder))
+    with open(f"{onnx_path}.json", 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    return result
+
+
+class OnnxDecoder:
+    """以 onnxruntime 运行的解码器，调用方式与原解码器相同，失败时退回torch"""
+
+    def __init__(self, decoder, onnx_path, layout, name):
+        self.decoder = decoder
+        self.torch_forward = decoder.forward
+        self.session = create_session(onnx_path)
+        self.input_name = self.session.get_inputs()[0].name
+        self.layout = layout
+        self.name = name
+        self.enabled = True
+        self._lock = threading.Lock()
+        self.onnx_calls = 0
+        self.torch_calls = 0
+
+    def __call__(self, *args, **kwargs):
+        import torch
+        # 只接管单个codec token张量的调用，其余形式交给torch
+        if self.enabled and len(args) == 1 and not kwargs and torch.is_tensor(args[0]) and args[0].dim() == 3:
+            try:
+                codes = args[0].detach().to('cpu', torch.long).numpy()
+                waveform = self.session.run(None, {self.input_name: codes})[0]
+                with self._lock:
+                    self.onnx_calls += 1
+                param = next(self.decoder.parameters(), None)
+                dtype = param.dtype if param is not None else torch.float32
+                return torch.from_numpy(waveform).to(device=args[0].device, dtype=dtype)
+            except Exception as e:
+                self.enabled = False
+                log_event(logger, logging.WARNING, 'ONNX解码失败，退回torch', exc_info=True, model=self.name, error=str(e))
+        with self._lock:
+            self.torch_calls += 1
+        return self.torch_forward(*args, **kwargs)
+
+    def stats(self):
+        with self._lock:
+            return {'enabled': self.enabled, 'onnx_calls': self.onnx_calls, 'torch_calls': self.torch_calls}
+
+
+def install(model, model_path, name):
+    """
+    为已加载的模型启用ONNX解码：需要已导出且验证通过、与当前解码器匹配的ONNX文件
+
+    Returns:
+        OnnxDecoder | None: 未启用时返回 None（继续使用torch解码）
+    """
+    onnx_path = onnx_path_for(model_path)
+    path, decoder = find_decoder(model)
+    if decoder is None:
+        print(f"⚠️ {name} 未找到编解码器的解码器，使用torch解码")
+        return None
+    if getattr(decoder, 'onnx_decoder', None) is not None:
+        # 与其他模型共享的解码器已经启用
+        return decoder.onnx_decoder
+    try:
+        with open(f"{onnx_path}.json", 'r', encoding='utf-8') as f:
+            report = json.load(f)
+    except (OSError, ValueError):
+        print(f"⚠️ {name} 没有已验证的ONNX解码器（python codec_onnx.py export {model_path}），使用torch解码")
+        return None
+    if not report.get('passed') or report.get('signature') != decoder_signature(decoder):
+        print(f"⚠️ {name} 的ONNX解码器未通过验证或与模型不匹配，使用torch解码")
+        return None
+    try:
+        onnx_decoder = OnnxDecoder(decoder, onnx_path, report['layout'], name)
+    except Exception as e:
+        print(f"⚠️ {name} onnxruntime 初始化失败: {e}，使用torch解码")
+        return None
+    decoder.forward = onnx_decoder
+    decoder.onnx_decoder = onnx_decoder
+    print(f"✅ {name} 使用 onnxruntime 解码（{INTRA_OP_THREADS} 线程，"
+          f"验证时 {report['torch_seconds']:.3f}s → {report['onnx_seconds']:.3f}s）")
+    return onnx_decoder
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="AIMAX395TTS - 编解码器解码器ONNX导出与验证",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+示例:
+  python codec_onnx.py export ./Qwen3-TTS-12Hz-1.7B-CustomVoice-Full
+  QWEN_TTS_ONNX_THREADS=8 python codec_onnx.py validate ./Qwen3-TTS-12Hz-1.7B-CustomVoice-Full
+        """
+    )
+    parser.add_argument('command', choices=['export', 'validate'], help='export: 导出并验证；validate: 验证已导出的文件')
+    parser.add_argument('model', help='模型目录')
+    args = parser.parse_args()
+
+    from qwen_tts import Qwen3TTSModel
+    model = Qwen3TTSModel.from_pretrained(args.model, trust_remote_code=True, device_map="cpu")
+    onnx_path = onnx_path_for(args.model)
+    if args.command == 'export':
+        result = export_decoder(model, onnx_path)
+    else:
+        _, decoder = find_decoder(model)
+        layout = detect_layout(decoder)
+        result = validate(decoder, create_session(onnx_path), layout)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if result.get('passed'):
+        print(f"✅ 验证通过：torch {result['torch_seconds']:.4f}s / onnxruntime {result['onnx_seconds']:.4f}s 每次")
+        return 0
+    print(f"❌ 验证未通过，服务将继续使用torch解码")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,251 @@
+"""
+talker 与编解码器解码的流水线
+原流程是 talker 生成全部codec帧后才开始解码波形，两个阶段串行。
+流水线中 talker 每生成一帧就放入队列，解码线程按窗口解码已生成的帧：
+1. 每个窗口带上前文帧（context）与少量后续帧（lookahead），只输出窗口本身对应的音频，减少拼接处的失真
+2. 生成结束时只剩最后一个窗口需要解码；模型自己的整段解码直接返回流水线拼好的波形，不再重复计算
+3. 每个窗口解码完成即通过回调输出，流式接口可以在一句话内逐段发送音频
+
+解码线程可以绑定到单独的CPU核（QWEN_TTS_DECODE_CORES），不与 talker 争抢。
+任何一步失败（找不到talker输出的帧、帧数与最终解码不一致等）都退回模型原有的整段解码。
+"""
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+import codec_onnx
+from request_log import get_logger, log_event
+from token_budget import CODEC_FRAME_RATE
+
+# 设为 1 启用流水线（optimized 后端）
+PIPELINE = os.environ.get('QWEN_TTS_PIPELINE', '0') == '1'
+
+# 窗口帧数（12帧约1秒音频）、前文帧数与后续帧数
+WINDOW_FRAMES = int(os.environ.get('QWEN_TTS_PIPELINE_WINDOW', 12))
+CONTEXT_FRAMES = int(os.environ.get('QWEN_TTS_PIPELINE_CONTEXT', 12))
+LOOKAHEAD_FRAMES = int(os.environ.get('QWEN_TTS_PIPELINE_LOOKAHEAD', 2))
+
+# 解码线程使用的CPU核，如 "24-31" 或 "0,2,4"；为空时不绑定
+DECODE_CORES = os.environ.get('QWEN_TTS_DECODE_CORES', '')
+
+# talker 在 Qwen3TTSModel 中可能的位置（按顺序查找）
+TALKER_PATHS = (
+    'model.talker',
+    'talker',
+)
+
+_active = threading.local()
+
+logger = get_logger('codec_pipeline')
+
+
+def parse_cores(value):
+    """解析CPU核列表："0-3,8" → {0, 1, 2, 3, 8}，为空返回 None"""
+    cores = set()
+    for part in (value or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        first, _, last = part.partition('-')
+        cores.update(range(int(first), int(last or first) + 1))
+    return cores or None
+
+
+class CodecPipeline:
+    """
+    codec帧的生产者-消费者流水线：生产者（talker所在线程）逐帧 push，
+    解码线程按窗口解码，close() 等待剩余帧解码完毕
+
+    Args:
+        decode: 回调 (帧列表) → 一维float32波形
+        on_audio: 可选回调 (音频片段, 采样率)，每个窗口解码完成时调用
+    """
+
+    def __init__(self, decode, on_audio=None, window=WINDOW_FRAMES, context=CONTEXT_FRAMES,
+                 lookahead=LOOKAHEAD_FRAMES, cores=None):
+        self.decode = decode
+        self.on_audio = on_audio
+        self.window = max(1, window)
+        self.context = max(0, context)
+        self.lookahead = max(0, lookahead)
+        self.cores = cores
+        self.frames = []
+        self.pieces = []
+        self.emitted_frames = 0
+        self.samples = 0
+        self.decode_seconds = 0.0
+        self.error = None
+        self._done = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='codec-decode', daemon=True)
+        self._thread.start()
+
+    def push(self, frame):
+        with self._cond:
+            if self._done:
+                return
+            self.frames.append(frame)
+            self._cond.notify()
+
+    def close(self):
+        """标记生成结束并等待剩余帧解码完毕"""
+        with self._cond:
+            self._done = True
+            self._cond.notify()
+        self._thread.join()
+
+    def waveform(self):
+        """close() 之后取得完整波形；解码失败时返回 None"""
+        if self.error is not None or not self.pieces:
+            return None
+        return np.concatenate(self.pieces)
+
+    def _next_window(self):
+        with self._cond:
+            while not self._done and len(self.frames) - self.emitted_frames < self.window + self.lookahead:
+                self._cond.wait()
+            total = len(self.frames)
+            if self.emitted_frames >= total:
+                return None
+            end = total if self._done else total - self.lookahead
+            start = max(0, self.emitted_frames - self.context)
+            return start, end, self.frames[start:total]
+
+    def _run(self):
+        if self.cores:
+            try:
+                os.sched_setaffinity(0, self.cores)
+            except (AttributeError, OSError) as e:
+                log_event(logger, logging.WARNING, '解码线程绑定CPU核失败', cores=sorted(self.cores), error=str(e))
+        while True:
+            window = self._next_window()
+            if window is None:
+                return
+            start, end, frames = window
+            try:
+                begin = time.time()
+                audio = self.decode(frames)
+                self.decode_seconds += time.time() - begin
+            except Exception as e:
+                self.error = e
+                log_event(logger, logging.WARNING, '流水线解码失败，退回整段解码', exc_info=True, error=str(e))
+                return
+            # 解码器输出按帧等长，去掉前文与后续帧对应的音频
+            per_frame = len(audio) / float(len(frames))
+            piece = audio[int(round((self.emitted_frames - start) * per_frame)):int(round((end - start) * per_frame))]
+            self.pieces.append(piece)
+            self.emitted_frames = end
+            self.samples += len(piece)
+            if self.on_audio is not None and len(piece):
+                try:
+                    self.on_audio(piece, int(round(per_frame * CODEC_FRAME_RATE)))
+                except Exception as e:
+                    # 输出端出错（如连接断开）不影响生成
+                    log_event(logger, logging.WARNING, '流式音频回调失败', error=str(e))
+                    self.on_audio = None
+
+
+def frame_codes(output, num_quantizers):
+    """从talker单步前向的输出中取出本步生成的整帧codec（batch, 码本数），找不到时返回 None"""
+    import torch
+    hidden = getattr(output, 'hidden_states', None)
+    if not isinstance(hidden, (tuple, list)):
+        return None
+    for value in reversed(hidden):
+        if torch.is_tensor(value) and not value.is_floating_point() and value.dim() == 2 \
+                and value.shape[-1] == num_quantizers:
+            return value
+    return None
+
+
+class PipelineHooks:
+    """
+    在模型上安装流水线钩子：talker 前向钩子收集帧，解码器在流水线已完成解码时直接返回结果。
+    钩子只对当前线程启用的流水线生效，同一模型上的其他请求不受影响。
+    """
+
+    def __init__(self, model, name):
+        import torch
+        _, self.decoder = codec_onnx.find_decoder(model)
+        self.talker = None
+        for path in TALKER_PATHS:
+            obj = model
+            for attr in path.split('.'):
+                obj = getattr(obj, attr, None)
+                if obj is None:
+                    break
+            if isinstance(obj, torch.nn.Module):
+                self.talker = obj
+                break
+        if self.decoder is None or self.talker is None:
+            raise RuntimeError("未找到talker或编解码器的解码器")
+        self.name = name
+        self.layout = codec_onnx.detect_layout(self.decoder)
+        self.num_quantizers = codec_onnx.num_quantizers(self.decoder)
+        # 解码器当前的前向（可能已替换为onnxruntime）
+        self.inner_forward = self.decoder.forward
+        self.output_shape = None
+        self.pipelined = 0
+        self.fallbacks = 0
+        self.talker.register_forward_hook(self._on_talker_step)
+        self.decoder.forward = self._decode
+
+    def _current(self):
+        pipeline = getattr(_active, 'pipeline', None)
+        return pipeline if pipeline is not None and getattr(_active, 'hooks', None) is self else None
+
+    def _on_talker_step(self, module, args, output):
+        pipeline = self._current()
+        if pipeline is None:
+            return
+        codes = frame_codes(output, self.num_quantizers)
+        if codes is not None and codes.shape[0] == 1:
+            pipeline.push(codes[0].detach().to('cpu'))
+
+    def decode_frames(self, frames):
+        """解码线程调用：把若干帧解码为一维波形"""
+        import torch
+        codes = torch.stack(frames, dim=-1).unsqueeze(0).long()
+        if self.layout == 'btq':
+            codes = codes.transpose(1, 2)
+        with torch.no_grad():
+            output = self.inner_forward(codes)
+        waveform = codec_onnx.as_waveform(output)
+        if not torch.is_tensor(output):
+            raise RuntimeError(f"解码器输出类型不支持: {type(output).__name__}")
+        self.output_shape = (tuple(waveform.shape[:-1]), waveform.dtype)
+        return waveform.detach().float().reshape(-1).cpu().numpy()
+
+    def _decode(self, *args, **kwargs):
+        import torch
+        pipeline = self._current()
+        if pipeline is not None and len(args) == 1 and not kwargs and torch.is_tensor(args[0]):
+            codes = args[0]
+            frames = codes.shape[2 if self.layout == 'bqt' else 1]
+            pipeline.close()
+            waveform = pipeline.waveform()
+            if codes.shape[0] == 1 and frames == len(pipeline.frames) and waveform is not None \
+                    and self.output_shape is not None:
+                self.pipelined += 1
+                prefix, dtype = self.output_shape
+                return torch.from_numpy(waveform).reshape(*prefix, -1).to(device=codes.device, dtype=dtype)
+        if pipeline is not None:
+            self.fallbacks += 1
+        return self.inner_forward(*args, **kwargs)
+
+    @contextmanager
+    def active(self, pipeline):
+        """在当前线程上启用流水线"""
+        _active.pipeline, _active.hooks = pipeline, self
+        try:
+            yield pipeline
+        finally:
+            _active.pipeline = _active.hooks = None
+            pipeline.close()
+
+    def stats(self):
+        return {'pipelined': self.pipelined, 'fallbacks': self.fallbacks}
@@ -0,0 +1,448 @@
+"""
+多进程共享的磁盘缓存
+同一台机器上的多个工作进程、多个服务实例共用一个缓存目录：
+1. 内容寻址：条目路径只由键（请求参数的sha256）决定，<根目录>/<键前两位>/<键><后缀>
+2. 原子发布：先写同目录下的唯一临时文件，fsync 后 os.replace 到最终路径，读者只会看到完整文件或看不到文件
+3. 咨询锁：生成前对键加排他锁（POSIX flock / Windows msvcrt.locking），
+   其他进程正在生成同一个键时等待其发布后直接读取，不重复生成；持有锁的进程退出时锁由系统释放
+4. 紧凑索引：index.bin 由定长记录（键、大小、时间）追加写入，容量统计与淘汰不必遍历目录；
+   记录数远多于条目数时重写为每个条目一条
+
+条目可以带一个JSON元数据（<键>.json），在数据文件之前发布，数据文件存在即表示条目完整。
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import struct
+import threading
+import time
+from contextlib import contextmanager
+
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
+
+from request_log import get_logger, log_event
+
+logger = get_logger('disk_cache')
+
+# 设为 0 关闭共享缓存
+SHARED_CACHE = os.environ.get('QWEN_TTS_SHARED_CACHE', '1') == '1'
+
+# 缓存容量上限（MB），超过后按最近使用时间淘汰
+SHARED_CACHE_MB = int(os.environ.get('QWEN_TTS_SHARED_CACHE_MB', 4096))
+
+# 等待其他进程生成同一条目的最长时间（秒），超时后自行生成
+LOCK_TIMEOUT = float(os.environ.get('QWEN_TTS_CACHE_LOCK_TIMEOUT', 600))
+
+# 等待锁时的轮询间隔（秒）
+LOCK_POLL_INTERVAL = 0.05
+
+# 命中时距上次记录超过该时间（秒）才追加访问记录，避免索引增长过快
+TOUCH_INTERVAL = 60.0
+
+# 索引记录：sha256键（32字节）、条目字节数（0表示已删除）、最近使用时间
+_RECORD = struct.Struct('<32sQd')
+
+_KEY_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+
+def content_key(*parts):
+    """由若干字符串/字节计算内容键（sha256十六进制）"""
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part if isinstance(part, bytes) else str(part).encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+def write_atomic(path, data):
+    """写入文件：先写同目录下的唯一临时文件并 fsync，再原子替换"""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _try_lock(fd):
+    try:
+        if os.name == 'nt':
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        else:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+def _unlock(fd):
+    if os.name == 'nt':
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+    else:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+class FileLock:
+    """
+    基于锁文件的跨进程排他锁（同一进程的不同线程之间同样互斥）
+
+    Args:
+        path: 锁文件路径
+        timeout: 最长等待时间（秒），超时抛出 TimeoutError
+        abort: 可选回调，等待期间周期调用，抛出异常即放弃等待（如请求已取消）
+        remove: 释放时删除锁文件（POSIX），避免锁文件堆积
+    """
+
+    def __init__(self, path, timeout=LOCK_TIMEOUT, abort=None, remove=True):
+        self.path = path
+        self.timeout = timeout
+        self.abort = abort
+        self.remove = remove and os.name != 'nt'
+        self.fd = None
+        self.waited = False
+
+    def acquire(self):
+        deadline = time.time() + self.timeout
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                while not _try_lock(fd):
+                    self.waited = True
+                    if self.abort is not None:
+                        self.abort()
+                    if time.time() > deadline:
+                        raise TimeoutError(f"等待锁超时: {self.path}")
+                    time.sleep(LOCK_POLL_INTERVAL)
+                # 上一个持有者释放前删除了锁文件时，锁住的是已删除的文件，需要重新打开
+                if self._same_file(fd):
+                    self.fd = fd
+                    return self
+                _unlock(fd)
+            except BaseException:
+                os.close(fd)
+                raise
+            os.close(fd)
+
+    def _same_file(self, fd):
+        if not self.remove:
+            return True
+        try:
+            return os.fstat(fd).st_ino == os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return False
+
+    def release(self):
+        if self.fd is None:
+            return
+        if self.remove:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+        _unlock(self.fd)
+        os.close(self.fd)
+        self.fd = None
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class CacheEntry:
+    """claim() 得到的条目：命中时带数据与元数据，未命中时由调用方生成后 publish"""
+
+    def __init__(self, cache, key, enabled=True):
+        self.cache = cache
+        self.key = key
+        # 缓存关闭或本次调用绕过缓存时，条目不命中且 publish 不写入
+        self.enabled = enabled and cache.enabled
+        self.hit = False
+        self.waited = False
+        self.data = None
+        self.meta = None
+        self.published = False
+
+    @property
+    def path(self):
+        return self.cache.path(self.key)
+
+    def publish(self, data, meta=None):
+        if self.enabled:
+            self.cache.put(self.key, data, meta)
+        self.published = self.enabled
+
+
+class DiskCache:
+    """
+    多进程共享的内容寻址磁盘缓存
+
+    Args:
+        root_dir: 缓存目录（同一机器上的所有工作进程使用同一目录）
+        max_mb: 容量上限（MB），0 表示关闭缓存
+        suffix: 数据文件后缀
+    """
+
+    def __init__(self, root_dir, max_mb=SHARED_CACHE_MB, suffix='.wav', enabled=SHARED_CACHE):
+        self.root_dir = root_dir
+        self.max_bytes = max_mb * 1024 * 1024
+        self.suffix = suffix
+        self.enabled = enabled and self.max_bytes > 0
+        self.index_path = os.path.join(root_dir, 'index.bin')
+        os.makedirs(os.path.join(root_dir, 'locks'), exist_ok=True)
+        self._lock = threading.Lock()
+        # 索引在内存中的视图 {键: [字节数, 最近使用时间]}，从 index.bin 增量读取
+        self._entries = {}
+        self._index_offset = 0
+        self._index_inode = None
+        self._index_records = 0
+        self.hits = 0
+        self.waits = 0
+        self.misses = 0
+        self.published = 0
+        self.evicted = 0
+        if self.enabled:
+            with self._index_lock():
+                if not os.path.exists(self.index_path):
+                    self._rebuild_index()
+                self._refresh()
+
+    # ---- 路径 ----
+
+    def path(self, key, suffix=None):
+        return os.path.join(self.root_dir, key[:2], f"{key}{suffix or self.suffix}")
+
+    def locate(self, filename):
+        """把 /audio 等接口中的文件名（<键><后缀>）映射到缓存中的路径，不是缓存条目时返回 None"""
+        key, suffix = os.path.splitext(os.path.basename(filename))
+        if suffix != self.suffix or not _KEY_PATTERN.match(key):
+            return None
+        path = self.path(key)
+        return path if os.path.exists(path) else None
+
+    # ---- 读写 ----
+
+    def get(self, key):
+        """返回 (数据bytes, 元数据dict或None)，不存在时返回 None"""
+        if not self.enabled:
+            return None
+        try:
+            with open(self.path(key), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        meta = None
+        try:
+            with open(self.path(key, '.json'), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (FileNotFoundError, ValueError):
+            pass
+        self._touch(key)
+        return data, meta
+
+    def put(self, key, data, meta=None):
+        """原子发布条目：元数据先于数据文件发布"""
+        if not self.enabled:
+            return
+        os.makedirs(os.path.dirname(self.path(key)), exist_ok=True)
+        if meta is not None:
+            write_atomic(self.path(key, '.json'), json.dumps(meta, ensure_ascii=False).encode('utf-8'))
+        write_atomic(self.path(key), data)
+        with self._lock:
+            self.published += 1
+        self._append([(key, len(data), time.time())])
+        if self._total_bytes() > self.max_bytes:
+            self._evict()
+
+    @contextmanager
+    def claim(self, key, abort=None, bypass=False):
+        """
+        取得条目或生成它的权利
+
+        已发布的条目直接命中；否则对键加锁，其他进程正在生成时等待其发布后命中，
+        拿到锁后仍未发布则由调用方生成并调用 entry.publish()，离开上下文时释放锁。
+
+        Args:
+            key: 条目键
+            abort: 可选回调，等待其他进程期间周期调用，抛出异常即放弃（如请求已取消）
+            bypass: 为 True 时不读也不写缓存、不加锁（如未固定种子、每次结果都不同的生成）
+        """
+        entry = CacheEntry(self, key, not bypass)
+        if not entry.enabled:
+            yield entry
+            return
+        if self._fill(entry):
+            yield entry
+            return
+        os.makedirs(os.path.join(self.root_dir, 'locks', key[:2]), exist_ok=True)
+        lock = FileLock(os.path.join(self.root_dir, 'locks', key[:2], f"{key}.lock"), abort=abort)
+        try:
+            lock.acquire()
+        except TimeoutError as e:
+            # 持有者长时间未完成（可能已挂起）：不再等待，自行生成，发布同样是原子的
+            log_event(logger, logging.WARNING, '等待其他进程生成超时，自行生成', key=key[:12], error=str(e))
+            lock = None
+        try:
+            entry.waited = lock is not None and lock.waited
+            if not self._fill(entry):
+                with self._lock:
+                    self.misses += 1
+            elif entry.waited:
+                with self._lock:
+                    self.waits += 1
+            yield entry
+        finally:
+            if lock is not None:
+                lock.release()
+
+    def _fill(self, entry):
+        cached = self.get(entry.key)
+        if cached is None:
+            return False
+        entry.hit = True
+        entry.data, entry.meta = cached
+        with self._lock:
+            self.hits += 1
+        return True
+
+    # ---- 索引 ----
+
+    @contextmanager
+    def _index_lock(self):
+        with FileLock(os.path.join(self.root_dir, 'index.lock'), remove=False):
+            yield
+
+    def _refresh(self):
+        """读取其他进程追加的索引记录；索引被重写过时从头读取"""
+        try:
+            st = os.stat(self.index_path)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            if st.st_ino != self._index_inode or st.st_size < self._index_offset:
+                self._entries, self._index_offset, self._index_records = {}, 0, 0
+                self._index_inode = st.st_ino
+            if st.st_size == self._index_offset:
+                return
+            with open(self.index_path, 'rb') as f:
+                f.seek(self._index_offset)
+                data = f.read()
+            usable = len(data) - len(data) % _RECORD.size
+            for raw_key, size, stamp in _RECORD.iter_unpack(data[:usable]):
+                key = raw_key.hex()
+                if size:
+                    self._entries[key] = [size, stamp]
+                else:
+                    self._entries.pop(key, None)
+            self._index_offset += usable
+            self._index_records += usable // _RECORD.size
+
+    def _append(self, records):
+        data = b''.join(_RECORD.pack(bytes.fromhex(key), size, stamp) for key, size, stamp in records)
+        with self._index_lock():
+            with open(self.index_path, 'ab') as f:
+                f.write(data)
+            self._refresh()
+            with self._lock:
+                compact = self._index_records > 2 * len(self._entries) + 1024
+            if compact:
+                self._compact()
+
+    def _compact(self):
+        """重写索引：每个现存条目一条记录（调用方持有索引锁）"""
+        with self._lock:
+            entries = sorted(self._entries.items(), key=lambda item: item[1][1])
+        write_atomic(self.index_path, b''.join(
+            _RECORD.pack(bytes.fromhex(key), size, stamp) for key, (size, stamp) in entries
+        ))
+        self._refresh()
+
+    def _rebuild_index(self):
+        """没有索引时（首次使用或旧版本留下的目录）扫描已有条目（调用方持有索引锁）"""
+        records = []
+        for dirpath, _, filenames in os.walk(self.root_dir):
+            for name in filenames:
+                key, suffix = os.path.splitext(name)
+                if suffix == self.suffix and _KEY_PATTERN.match(key):
+                    try:
+                        st = os.stat(os.path.join(dirpath, name))
+                    except FileNotFoundError:
+                        continue
+                    records.append(_RECORD.pack(bytes.fromhex(key), st.st_size, st.st_mtime))
+        write_atomic(self.index_path, b''.join(records))
+        if records:
+            log_event(logger, logging.INFO, '已为缓存目录建立索引', root=self.root_dir, entries=len(records))
+
+    def _touch(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or now - entry[1] < TOUCH_INTERVAL:
+                return
+            entry[1] = now
+            size = entry[0]
+        self._append([(key, size, now)])
+
+    def _total_bytes(self):
+        self._refresh()
+        with self._lock:
+            return sum(size for size, _ in self._entries.values())
+
+    def _evict(self):
+        """按最近使用时间淘汰，直到容量降到上限的90%"""
+        with self._index_lock():
+            self._refresh()
+            with self._lock:
+                entries = sorted(self._entries.items(), key=lambda item: item[1][1])
+            total = sum(size for _, (size, _) in entries)
+            target = int(self.max_bytes * 0.9)
+            removed = []
+            for key, (size, _) in entries:
+                if total <= target:
+                    break
+                for path in (self.path(key), self.path(key, '.json')):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                total -= size
+                removed.append((key, 0, time.time()))
+            if removed:
+                with open(self.index_path, 'ab') as f:
+                    f.write(b''.join(_RECORD.pack(bytes.fromhex(k), s, t) for k, s, t in removed))
+                self._refresh()
+        if removed:
+            with self._lock:
+                self.evicted += len(removed)
+            log_event(logger, logging.INFO, '缓存淘汰', root=self.root_dir, entries=len(removed))
+
+    def stats(self):
+        if self.enabled:
+            self._refresh()
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'entries': len(self._entries),
+                'bytes': sum(size for size, _ in self._entries.values()),
+                'index_records': self._index_records,
+                'hits': self.hits,
+                'waited_for_other_worker': self.waits,
+                'misses': self.misses,
+                'published': self.published,
+                'evicted': self.evicted,
+            }
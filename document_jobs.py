@@ -0,0 +1,377 @@
+"""
+长文档（有声书）合成任务
+将纯文本或Markdown文档拆分为章节与片段，通过工作线程池逐段合成。
+每个完成的片段立即以 WAV 文件检查点形式写入任务目录，服务崩溃或重启后
+只需补齐缺失的片段即可继续；全部完成后流式拼接为一个音频文件并生成片段索引。
+
+任务目录结构：
+    jobs/<job_id>/job.json          任务参数与章节/片段划分
+    jobs/<job_id>/segments/*.wav    片段检查点（16位PCM）
+    jobs/<job_id>/output.wav        拼接后的完整音频
+    jobs/<job_id>/index.json        片段索引（章节、文本、起止时间）
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+import wave
+from concurrent.futures import ThreadPoolExecutor
+
+import audio_postprocess
+from cancellation import CancelToken, GenerationCancelled
+from disk_cache import write_atomic
+from request_log import get_logger, log_event
+from seeding import derive_seed
+from segment_store import write_wav_atomic
+from text_segmenter import split_segments
+
+# 文档合成工作线程数
+DOCUMENT_WORKERS = int(os.environ.get('QWEN_TTS_DOCUMENT_WORKERS', 2))
+# 章节之间插入的停顿（秒）
+CHAPTER_PAUSE_SECONDS = 1.0
+# 片段之间插入的停顿（秒）
+SEGMENT_PAUSE_SECONDS = 0.3
+
+logger = get_logger('document_jobs')
+
+_MD_HEADING = re.compile(r'^(#{1,6})\s+(.+?)\s*#*\s*$')
+_TEXT_HEADING = re.compile(r'^\s*(第[0-9零一二三四五六七八九十百千]+[章节回卷部].*|chapter\s+\w+.*)$', re.IGNORECASE)
+
+
+def _strip_markdown(line):
+    """去掉Markdown行内标记，只保留朗读文本"""
+    line = re.sub(r'!\[[^\]]*\]\([^)]*\)', '', line)          # 图片
+    line = re.sub(r'\[([^\]]*)\]\([^)]*\)', r'\1', line)      # 链接
+    line = re.sub(r'`{1,3}([^`]*)`{1,3}', r'\1', line)         # 行内代码
+    line = re.sub(r'(\*\*|__|\*|_|~~)(.+?)\1', r'\2', line)   # 强调
+    line = re.sub(r'^\s*(>+|[-*+]|\d+[.)])\s+', '', line)     # 引用/列表
+    return line.strip()
+
+
+def split_document(text, fmt='text'):
+    """
+    将文档拆分为章节
+
+    Args:
+        text: 文档内容
+        fmt: 'markdown' 或 'text'
+
+    Returns:
+        list[dict]: [{'title': 章节标题, 'segments': [片段文本, ...]}, ...]
+    """
+    chapters = []
+    title = ''
+    lines = []
+    in_code_block = False
+
+    def flush():
+        body = '\n'.join(lines).strip()
+        if body or title:
+            chapters.append({'title': title, 'segments': split_segments(body) if body else []})
+
+    for raw in text.splitlines():
+        if fmt == 'markdown':
+            if raw.strip().startswith('```'):
+                in_code_block = not in_code_block
+                continue
+            if in_code_block:
+                continue
+            match = _MD_HEADING.match(raw)
+            heading = _strip_markdown(match.group(2)) if match else None
+            line = _strip_markdown(raw)
+        else:
+            match = _TEXT_HEADING.match(raw)
+            heading = match.group(1).strip() if match else None
+            line = raw.strip()
+        if heading:
+            flush()
+            title = heading
+            # 标题本身也朗读
+            lines = [heading if heading[-1] in '。.!?！？' else heading + '。']
+        else:
+            lines.append(line)
+    flush()
+    return [c for c in chapters if c['segments']]
+
+
+def _write_json_atomic(path, payload):
+    """原子写入并落盘：崩溃后 job.json 要么是旧版本要么是新版本"""
+    write_atomic(path, json.dumps(payload, ensure_ascii=False, indent=2).encode('utf-8'))
+
+
+class DocumentJobManager:
+    """文档合成任务：创建、检查点、断点续跑与拼接"""
+
+    def __init__(self, root_dir, synthesize_fn, workers=DOCUMENT_WORKERS, on_event=None):
+        """
+        Args:
+            root_dir: 任务根目录
+            synthesize_fn: 合成回调 (参数dict, 取消令牌) → (音频, 采样率, 信息)
+            workers: 工作线程数
+            on_event: 可选的进度回调 (任务ID, 事件名, 任务状态)，
+                      事件为 started / segment / done / error / cancelled
+        """
+        self.root_dir = root_dir
+        self.synthesize_fn = synthesize_fn
+        self.on_event = on_event
+        os.makedirs(root_dir, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='document-job')
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    # ---- 路径 ----
+
+    def job_dir(self, job_id):
+        if not re.fullmatch(r'[0-9a-f]{32}', job_id or ''):
+            raise KeyError(job_id)
+        return os.path.join(self.root_dir, job_id)
+
+    def _segment_path(self, job_id, chapter_index, segment_index):
+        return os.path.join(self.job_dir(job_id), 'segments', f"{chapter_index:03d}_{segment_index:05d}.wav")
+
+    def output_path(self, job_id):
+        return os.path.join(self.job_dir(job_id), 'output.wav')
+
+    def index_path(self, job_id):
+        return os.path.join(self.job_dir(job_id), 'index.json')
+
+    # ---- 任务生命周期 ----
+
+    def create(self, text, params, fmt='text', source_name=''):
+        """创建文档任务并开始合成，返回任务ID"""
+        chapters = split_document(text, fmt)
+        if not chapters:
+            raise ValueError("文档中没有可合成的文本")
+        job_id = uuid.uuid4().hex
+        job_dir = self.job_dir(job_id)
+        os.makedirs(os.path.join(job_dir, 'segments'), exist_ok=True)
+        job = {
+            'job_id': job_id,
+            'source_name': source_name,
+            'format': fmt,
+            'created_at': time.time(),
+            'status': 'running',
+            'params': params,
+            'chapters': chapters,
+        }
+        _write_json_atomic(os.path.join(job_dir, 'job.json'), job)
+        total = sum(len(c['segments']) for c in chapters)
+        log_event(logger, logging.INFO, '文档任务已创建', job_id=job_id, chapters=len(chapters), segments=total)
+        self._start(job)
+        return job_id
+
+    def resume_incomplete(self):
+        """启动时恢复未完成的任务，只补齐缺失的片段"""
+        resumed = 0
+        for job_id in sorted(os.listdir(self.root_dir)):
+            job_file = os.path.join(self.root_dir, job_id, 'job.json')
+            if not os.path.exists(job_file):
+                continue
+            try:
+                with open(job_file, 'r', encoding='utf-8') as f:
+                    job = json.load(f)
+            except Exception as e:
+                log_event(logger, logging.WARNING, '文档任务读取失败', job_id=job_id, error=str(e))
+                continue
+            if job.get('status') == 'running':
+                self._start(job)
+                resumed += 1
+        if resumed:
+            log_event(logger, logging.INFO, '已恢复未完成的文档任务', jobs=resumed)
+        return resumed
+
+    def _start(self, job):
+        job_id = job['job_id']
+        pending = []
+        done = 0
+        for ci, chapter in enumerate(job['chapters']):
+            for si, _ in enumerate(chapter['segments']):
+                if os.path.exists(self._segment_path(job_id, ci, si)):
+                    done += 1
+                else:
+                    pending.append((ci, si))
+        state = {
+            'job': job,
+            'token': CancelToken(job_id),
+            'total': done + len(pending),
+            'done': done,
+            'resumed_from': done,
+            'failed': [],
+            'started_at': time.time(),
+            'remaining': len(pending),
+        }
+        with self._lock:
+            self._jobs[job_id] = state
+        self._emit(job_id, 'started')
+        if not pending:
+            self._finish(job_id)
+            return
+        for ci, si in pending:
+            self._executor.submit(self._run_segment, job_id, ci, si)
+
+    def _run_segment(self, job_id, chapter_index, segment_index):
+        state = self._jobs[job_id]
+        job = state['job']
+        text = job['chapters'][chapter_index]['segments'][segment_index]
+        params = dict(job['params'], text=text,
+                      seed=derive_seed(job['params'].get('seed'), text))
+        try:
+            state['token'].check()
+            audio_data, sample_rate, _ = self.synthesize_fn(params, state['token'])
+            if params.get('postprocess'):
+                # 逐片段后处理：片段之间的停顿由拼接插入，裁剪与淡入淡出不影响停顿
+                audio_data, _ = audio_postprocess.process(audio_data, sample_rate, params['postprocess'])
+            write_wav_atomic(self._segment_path(job_id, chapter_index, segment_index), sample_rate, audio_data)
+            with self._lock:
+                state['done'] += 1
+            self._emit(job_id, 'segment')
+        except GenerationCancelled:
+            pass
+        except Exception as e:
+            log_event(logger, logging.ERROR, '文档任务片段失败', exc_info=True, job_id=job_id,
+                      chapter=chapter_index, segment=segment_index, error=str(e))
+            with self._lock:
+                state['failed'].append({'chapter': chapter_index, 'segment': segment_index, 'error': str(e)})
+        finally:
+            with self._lock:
+                state['remaining'] -= 1
+                last = state['remaining'] == 0
+            if last:
+                self._finish(job_id)
+
+    def _finish(self, job_id):
+        state = self._jobs[job_id]
+        job = state['job']
+        if state['token'].cancelled:
+            job['status'] = 'cancelled'
+        elif state['failed']:
+            # 保持检查点，重启或重试时只补齐失败的片段
+            job['status'] = 'failed'
+        else:
+            self._concatenate(job)
+            job['status'] = 'completed'
+            job['completed_at'] = time.time()
+            log_event(logger, logging.INFO, '文档任务完成', job_id=job_id, segments=state['total'],
+                      seconds=round(time.time() - state['started_at'], 1))
+        _write_json_atomic(os.path.join(self.job_dir(job_id), 'job.json'), job)
+        self._emit(job_id, {'completed': 'done', 'failed': 'error'}.get(job['status'], job['status']))
+
+    def _emit(self, job_id, event):
+        if self.on_event is None:
+            return
+        try:
+            self.on_event(job_id, event, self.status(job_id))
+        except Exception as e:
+            log_event(logger, logging.WARNING, '文档任务事件回调失败', job_id=job_id, error=str(e))
+
+    def _concatenate(self, job):
+        """按顺序流式拼接片段检查点，写出完整音频与片段索引"""
+        job_id = job['job_id']
+        index = []
+        position = 0
+        tmp_path = self.output_path(job_id) + '.tmp'
+        out = None
+        try:
+            for ci, chapter in enumerate(job['chapters']):
+                for si, text in enumerate(chapter['segments']):
+                    with wave.open(self._segment_path(job_id, ci, si), 'rb') as seg:
+                        sample_rate = seg.getframerate()
+                        frames = seg.readframes(seg.getnframes())
+                    if out is None:
+                        out = wave.open(tmp_path, 'wb')
+                        out.setnchannels(1)
+                        out.setsampwidth(2)
+                        out.setframerate(sample_rate)
+                    elif si == 0:
+                        pause = int(sample_rate * CHAPTER_PAUSE_SECONDS)
+                        out.writeframes(b'\x00\x00' * pause)
+                        position += pause
+                    else:
+                        pause = int(sample_rate * SEGMENT_PAUSE_SECONDS)
+                        out.writeframes(b'\x00\x00' * pause)
+                        position += pause
+                    count = len(frames) // 2
+                    out.writeframes(frames)
+                    index.append({
+                        'chapter': ci,
+                        'chapter_title': chapter['title'],
+                        'segment': si,
+                        'text': text,
+                        'start': round(position / sample_rate, 3),
+                        'end': round((position + count) / sample_rate, 3),
+                    })
+                    position += count
+        finally:
+            if out is not None:
+                out.close()
+        os.replace(tmp_path, self.output_path(job_id))
+        _write_json_atomic(self.index_path(job_id), {
+            'job_id': job_id,
+            'sample_rate': sample_rate,
+            'duration': round(position / sample_rate, 3),
+            'segments': index,
+        })
+
+    def retry(self, job_id):
+        """重新运行失败或已取消的任务（已完成的片段直接复用）"""
+        with self._lock:
+            state = self._jobs.get(job_id)
+            if state is not None and state['remaining'] > 0:
+                return
+        job_file = os.path.join(self.job_dir(job_id), 'job.json')
+        with open(job_file, 'r', encoding='utf-8') as f:
+            job = json.load(f)
+        job['status'] = 'running'
+        _write_json_atomic(job_file, job)
+        self._start(job)
+
+    def cancel(self, job_id):
+        with self._lock:
+            state = self._jobs.get(job_id)
+        if state is None:
+            return False
+        state['token'].cancel('api')
+        return True
+
+    def status(self, job_id):
+        """任务进度：已完成/总片段数、失败列表与预计剩余时间"""
+        with self._lock:
+            state = self._jobs.get(job_id)
+            if state is not None:
+                job = state['job']
+                done, total = state['done'], state['total']
+                finished_here = done - state['resumed_from']
+                elapsed = time.time() - state['started_at']
+                failed = list(state['failed'])
+            else:
+                job = None
+        if job is None:
+            job_file = os.path.join(self.job_dir(job_id), 'job.json')
+            if not os.path.exists(job_file):
+                raise KeyError(job_id)
+            with open(job_file, 'r', encoding='utf-8') as f:
+                job = json.load(f)
+            total = sum(len(c['segments']) for c in job['chapters'])
+            done = sum(
+                os.path.exists(self._segment_path(job_id, ci, si))
+                for ci, c in enumerate(job['chapters']) for si in range(len(c['segments']))
+            )
+            elapsed, failed, finished_here = 0.0, [], 0
+        remaining = None
+        if job['status'] == 'running' and finished_here > 0:
+            # 按本次运行完成的片段速度估算（不计入断点恢复前的片段）
+            remaining = round(elapsed / finished_here * (total - done), 1)
+        return {
+            'job_id': job_id,
+            'status': job['status'],
+            'chapters': len(job['chapters']),
+            'segments_total': total,
+            'segments_done': done,
+            'failed': failed,
+            'estimated_remaining_seconds': remaining,
+            'audio_url': f'/jobs/{job_id}/audio' if job['status'] == 'completed' else None,
+            'index_url': f'/jobs/{job_id}/index' if job['status'] == 'completed' else None,
+        }
@@ -0,0 +1,195 @@
+"""
+模型推理精度
+按模型选择 fp32 / bf16 / fp16：解码受内存带宽限制，半精度权重使内存占用与每个token读取的数据量约减半。
+
+数值敏感的部分保持 fp32：
+1. 编解码器（speech tokenizer）与说话人编码器：整个子模块保持 fp32
+2. 归一化层（LayerNorm / RMSNorm）：输入转为 fp32 计算，输出转回模型精度
+3. 输出头（lm_head / codec_head）：logits 保持 fp32，采样不受舍入影响
+
+权重先按 fp32 加载，再把非敏感部分转换为目标精度，敏感部分不会经过半精度舍入。
+
+配置:
+    QWEN_TTS_DTYPE=bf16                                  # 所有模型的默认精度（默认 fp32）
+    QWEN_TTS_DTYPES="voice-clone=fp32,tts-custom:0.6b=fp16"   # 按模式或 模式:版本 覆盖
+"""
+import os
+import re
+
+DTYPE_NAMES = ('fp32', 'bf16', 'fp16')
+
+_ALIASES = {
+    'float32': 'fp32', 'float': 'fp32',
+    'bfloat16': 'bf16',
+    'float16': 'fp16', 'half': 'fp16',
+}
+
+DEFAULT_DTYPE = os.environ.get('QWEN_TTS_DTYPE', 'fp32')
+MODEL_DTYPES = os.environ.get('QWEN_TTS_DTYPES', '')
+
+# 整体保持fp32的子模块（按模块名中的片段匹配），及其输出是否转回模型精度
+FP32_SUBMODULES = (
+    ('speech_tokenizer', False),  # 输出波形保持fp32
+    ('speaker_encoder', True),    # x-vector 输入talker，需与talker精度一致
+)
+
+# 权重保持fp32、logits不转回的输出头
+FP32_HEADS = re.compile(r'(^|\.)(lm_head|codec_head)$')
+
+
+def normalize_dtype(value):
+    value = _ALIASES.get((value or 'fp32').strip().lower(), (value or 'fp32').strip().lower())
+    if value not in DTYPE_NAMES:
+        raise ValueError(f"未知精度: {value}，可选: {', '.join(DTYPE_NAMES)}")
+    return value
+
+
+def parse_model_dtypes(value=MODEL_DTYPES):
+    """解析 QWEN_TTS_DTYPES：返回 {(模式, 版本或None): 精度}"""
+    overrides = {}
+    for item in (value or '').split(','):
+        if not item.strip():
+            continue
+        target, _, dtype = item.partition('=')
+        mode, _, version = target.strip().partition(':')
+        overrides[(mode, version or None)] = normalize_dtype(dtype)
+    return overrides
+
+
+def dtype_for(mode, version, overrides=None, default=DEFAULT_DTYPE):
+    """模型使用的精度：模式:版本 的设置优先，其次模式，最后默认值"""
+    overrides = parse_model_dtypes() if overrides is None else overrides
+    return overrides.get((mode, version)) or overrides.get((mode, None)) or normalize_dtype(default)
+
+
+def torch_dtype(name):
+    import torch
+    return {'fp32': torch.float32, 'bf16': torch.bfloat16, 'fp16': torch.float16}[name]
+
+
+def cpu_supports(name):
+    """检查CPU上该精度的矩阵乘法是否可用"""
+    if name == 'fp32':
+        return True
+    import torch
+    try:
+        x = torch.ones(4, 4, dtype=torch_dtype(name))
+        return bool(((x @ x).float() == 4).all())
+    except Exception:
+        return False
+
+
+def named_roots(model):
+    """Qwen3TTSModel 本身不是 nn.Module，返回其中的顶层 (属性名, nn.Module)"""
+    import torch
+    if isinstance(model, torch.nn.Module):
+        return [('', model)]
+    return [(attr, m) for attr, m in vars(model).items() if isinstance(m, torch.nn.Module)]
+
+
+def torch_modules(model):
+    return [m for _, m in named_roots(model)]
+
+
+def _cast_floats(value, dtype):
+    import torch
+    if torch.is_tensor(value):
+        return value.to(dtype) if value.is_floating_point() and value.dtype != dtype else value
+    if isinstance(value, (tuple, list)):
+        return type(value)(_cast_floats(v, dtype) for v in value)
+    if isinstance(value, dict):
+        return {k: _cast_floats(v, dtype) for k, v in value.items()}
+    return value
+
+
+def _keep_fp32(module, compute_dtype, cast_output):
+    """模块在fp32下计算：输入转为fp32，需要时输出转回模型精度"""
+    import torch
+    module.register_forward_pre_hook(
+        lambda m, args, kwargs: (_cast_floats(args, torch.float32), _cast_floats(kwargs, torch.float32)),
+        with_kwargs=True,
+    )
+    if cast_output:
+        module.register_forward_hook(lambda m, args, output: _cast_floats(output, compute_dtype))
+
+
+def _fp32_submodule(name):
+    for fragment, cast_output in FP32_SUBMODULES:
+        if fragment in name.split('.'):
+            return cast_output
+    return None
+
+
+def apply_precision(model, dtype_name):
+    """
+    把模型的非敏感部分转换为目标精度
+
+    Args:
+        model: 以fp32加载的模型
+        dtype_name: 'fp32' / 'bf16' / 'fp16'
+
+    Returns:
+        dict: 转换为半精度与保持fp32的参数数量
+    """
+    report = {'dtype': dtype_name, 'converted': 0, 'fp32': 0}
+    if dtype_name == 'fp32':
+        return report
+    import torch
+    compute_dtype = torch_dtype(dtype_name)
+    for attr, root in named_roots(model):
+        keep = set()
+        for name, module in root.named_modules():
+            if any(name == k or name.startswith(k + '.') for k in keep):
+                continue
+            full_name = f"{attr}.{name}" if attr and name else (attr or name)
+            cast_output = _fp32_submodule(full_name)
+            if cast_output is not None:
+                keep.add(name)
+                _keep_fp32(module, compute_dtype, cast_output)
+            elif FP32_HEADS.search(full_name):
+                keep.add(name)
+                _keep_fp32(module, compute_dtype, False)
+            elif type(module).__name__.endswith('Norm'):
+                keep.add(name)
+                _keep_fp32(module, compute_dtype, True)
+
+        def kept(tensor_name):
+            owner = tensor_name.rpartition('.')[0]
+            return any(owner == k or owner.startswith(k + '.') for k in keep)
+
+        # 共享权重（如与输出头绑定的词嵌入）只要有一处需要fp32就保持fp32
+        params = {}
+        for name, param in root.named_parameters(remove_duplicate=False):
+            entry = params.setdefault(id(param), [param, False])
+            entry[1] = entry[1] or kept(name)
+        for param, keep_fp32 in params.values():
+            if not param.is_floating_point() or keep_fp32:
+                report['fp32'] += param.numel()
+                continue
+            param.data = param.data.to(compute_dtype)
+            report['converted'] += param.numel()
+    # 缓冲区（如旋转位置编码的频率表）很小，保持原精度
+    return report
+
+
+def model_memory_bytes(model):
+    """模型参数与缓冲区占用的内存（共享的张量只计一次）"""
+    seen = set()
+    total = 0
+    for root in torch_modules(model):
+        for tensor in list(root.parameters()) + list(root.buffers()):
+            ptr = tensor.data_ptr()
+            if ptr in seen:
+                continue
+            seen.add(ptr)
+            total += tensor.numel() * tensor.element_size()
+    return total
+
+
+def process_rss_bytes():
+    """当前进程的常驻内存（无法读取时返回 None）"""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
@@ -0,0 +1,162 @@
+"""
+OpenAI 兼容接口的参数映射与音频编码
+把 /v1/audio/speech 的 model / voice / input / response_format / speed
+映射到本服务的合成模式与说话人，并把合成结果编码为对应的音频格式。
+"""
+import io
+import re
+import struct
+
+import numpy as np
+
+# model → 模型版本
+MODEL_VERSIONS = {
+    'tts-1': '0.6b',
+    'tts-1-hd': '1.7b',
+    'gpt-4o-mini-tts': '1.7b',
+    'qwen3-tts-0.6b': '0.6b',
+    'qwen3-tts-1.7b': '1.7b',
+}
+
+# OpenAI 预置音色 → TTS预设说话人
+VOICE_SPEAKERS = {
+    'alloy': 'Vivian',
+    'nova': 'Emma',
+    'shimmer': 'Lisa',
+    'coral': 'Vivian',
+    'echo': 'Mike',
+    'onyx': 'David',
+    'fable': 'John',
+    'ash': 'Mike',
+    'sage': 'David',
+    'ballad': 'John',
+    'verse': 'John',
+}
+
+# 本服务的预设说话人（voice 也可以直接写说话人名称）
+SPEAKERS = ('Vivian', 'Mike', 'Lisa', 'David', 'Emma', 'John')
+
+CONTENT_TYPES = {
+    'wav': 'audio/wav',
+    'pcm': 'audio/pcm',
+    'flac': 'audio/flac',
+    'mp3': 'audio/mpeg',
+    'opus': 'audio/ogg',
+}
+
+# 可以边合成边输出的格式：WAV（长度未知的头）与裸PCM
+STREAMING_FORMATS = ('wav', 'pcm')
+
+SPEED_RANGE = (0.25, 4.0)
+
+
+class OpenAIRequestError(ValueError):
+    """请求参数不合法（返回 OpenAI 风格的 400 错误）"""
+
+    def __init__(self, message, param=None):
+        super().__init__(message)
+        self.param = param
+
+    def to_dict(self):
+        return {'error': {'message': str(self), 'type': 'invalid_request_error', 'param': self.param, 'code': None}}
+
+
+def to_tts_request(body):
+    """
+    将 OpenAI speech 请求体转换为 /tts 的请求参数
+
+    Args:
+        body: 请求JSON，字段 model / voice / input / response_format / speed / instructions；
+              另外接受本服务的扩展字段（language、seed、priority、deadline_ms、postprocess 等）
+
+    Returns:
+        (tts请求dict, 输出格式, 语速)
+    """
+    text = body.get('input')
+    if not isinstance(text, str) or not text.strip():
+        raise OpenAIRequestError("input 不能为空", 'input')
+
+    model = body.get('model', 'tts-1')
+    if model not in MODEL_VERSIONS:
+        raise OpenAIRequestError(f"未知模型: {model}，可选: {', '.join(MODEL_VERSIONS)}", 'model')
+
+    fmt = body.get('response_format', 'mp3')
+    if fmt not in CONTENT_TYPES:
+        raise OpenAIRequestError(f"不支持的格式: {fmt}，可选: {', '.join(CONTENT_TYPES)}", 'response_format')
+
+    try:
+        speed = float(body.get('speed', 1.0))
+    except (TypeError, ValueError):
+        raise OpenAIRequestError("speed 必须是数字", 'speed')
+    if not SPEED_RANGE[0] <= speed <= SPEED_RANGE[1]:
+        raise OpenAIRequestError(f"speed 取值范围为 {SPEED_RANGE[0]}-{SPEED_RANGE[1]}", 'speed')
+
+    data = {k: v for k, v in body.items() if k not in ('model', 'voice', 'input', 'response_format', 'speed', 'instructions')}
+    data.update(text=text, model_version=MODEL_VERSIONS[model])
+
+    voice = str(body.get('voice', 'alloy'))
+    speakers = {s.lower(): s for s in SPEAKERS}
+    if voice.lower() in VOICE_SPEAKERS:
+        data.update(mode='tts-custom', speaker=VOICE_SPEAKERS[voice.lower()])
+    elif voice.lower() in speakers:
+        data.update(mode='tts-custom', speaker=speakers[voice.lower()])
+    elif re.fullmatch(r'(profile:)?[0-9a-f]{12}', voice):
+        # 音色档案ID：走Base模型克隆路径
+        data['voice_profile'] = voice.split(':')[-1]
+    else:
+        raise OpenAIRequestError(f"未知音色: {voice}", 'voice')
+
+    if body.get('instructions'):
+        data['style'] = body['instructions']
+    return data, fmt, speed
+
+
+def wav_stream_header(sample_rate):
+    """16位单声道WAV头，数据长度未知（0xFFFFFFFF），供流式输出使用"""
+    unknown = 0xFFFFFFFF
+    return b''.join((
+        b'RIFF', struct.pack('<I', unknown), b'WAVE',
+        b'fmt ', struct.pack('<IHHIIHH', 16, 1, 1, sample_rate, sample_rate * 2, 2, 16),
+        b'data', struct.pack('<I', unknown),
+    ))
+
+
+def change_speed(audio_data, sample_rate, speed):
+    """保持音高的变速（相位声码器）"""
+    if speed == 1.0 or len(audio_data) == 0:
+        return audio_data
+    import librosa
+    return librosa.effects.time_stretch(np.asarray(audio_data, dtype=np.float32), rate=speed)
+
+
+def encode_audio(pcm16, sample_rate, fmt):
+    """
+    将完整的16位PCM编码为指定格式
+
+    Args:
+        pcm16: int16 音频
+        sample_rate: 采样率
+        fmt: CONTENT_TYPES 中的格式
+
+    Returns:
+        bytes
+    """
+    if fmt == 'pcm':
+        return pcm16.astype('<i2', copy=False).tobytes()
+    if fmt == 'wav':
+        header = bytearray(wav_stream_header(sample_rate))
+        size = len(pcm16) * 2
+        header[4:8] = struct.pack('<I', 36 + size)
+        header[40:44] = struct.pack('<I', size)
+        return bytes(header) + pcm16.astype('<i2', copy=False).tobytes()
+
+    import soundfile
+    buffer = io.BytesIO()
+    if fmt == 'flac':
+        soundfile.write(buffer, pcm16, sample_rate, format='FLAC', subtype='PCM_16')
+    elif fmt == 'opus':
+        soundfile.write(buffer, pcm16, sample_rate, format='OGG', subtype='OPUS')
+    else:
+        # MP3 编码需要 libsndfile >= 1.1.0
+        soundfile.write(buffer, pcm16, sample_rate, format='MP3')
+    return buffer.getvalue()
@@ -0,0 +1,177 @@
+"""
+生成进度推送（Server-Sent Events）
+合成过程中的事件（排队、开始、每N个token、片段完成、结束）按频道记录，
+客户端通过 SSE 订阅，无需轮询即可显示实时进度与剩余时间。
+
+去重合并的请求共享同一个频道：请求ID映射到频道，任一请求ID都能订阅到同一份进度。
+"""
+import json
+import os
+import threading
+import time
+
+# 每生成多少个token推送一次进度（12Hz编解码器，12个token约1秒音频）
+PROGRESS_EVERY_TOKENS = int(os.environ.get('QWEN_TTS_PROGRESS_EVERY', 12))
+
+# 请求结束后频道保留的时间（秒），供晚到的订阅者读取最终结果
+RETAIN_SECONDS = 120
+
+# 订阅者等待频道出现的时间（秒）：客户端可以先订阅再发起请求
+SUBSCRIBE_WAIT_SECONDS = 30
+
+# 每个频道保留的事件数上限，超过后丢弃最早的事件（长时间运行的频道不会无限增长）
+MAX_CHANNEL_EVENTS = int(os.environ.get('QWEN_TTS_PROGRESS_EVENTS', 256))
+
+# 结束事件
+TERMINAL_EVENTS = ('done', 'error', 'cancelled')
+
+
+def format_sse(event_id, event, data):
+    """编码一条SSE消息"""
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class _Channel:
+    def __init__(self, key):
+        self.key = key
+        self.events = []
+        # events[0] 的事件ID（之前的事件已被丢弃）
+        self.first_id = 0
+        self.closed_at = None
+        self.active = 0
+
+
+class ProgressHub:
+    """进度频道登记：发布事件、按请求ID订阅"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._channels = {}
+        self._requests = {}
+
+    def _gc_locked(self):
+        now = time.time()
+        expired = [rid for rid, ch in self._requests.items()
+                   if ch.closed_at is not None and now - ch.closed_at > RETAIN_SECONDS]
+        for request_id in expired:
+            del self._requests[request_id]
+
+    def join(self, key, request_id):
+        """请求加入频道（按请求摘要），返回频道键"""
+        with self._cond:
+            self._gc_locked()
+            channel = self._channels.get(key)
+            if channel is None or channel.closed_at is not None:
+                channel = self._channels[key] = _Channel(key)
+            channel.active += 1
+            self._requests[request_id] = channel
+            self._cond.notify_all()
+            return key
+
+    def leave(self, request_id):
+        """请求结束：频道在所有请求离开后关闭，保留一段时间供订阅者读取"""
+        with self._cond:
+            channel = self._requests.get(request_id)
+            if channel is None:
+                return
+            channel.active -= 1
+            if channel.active <= 0:
+                channel.closed_at = time.time()
+                if self._channels.get(channel.key) is channel:
+                    del self._channels[channel.key]
+            self._cond.notify_all()
+
+    def publish(self, key, event, **data):
+        """向频道发布事件（频道不存在时忽略）"""
+        with self._cond:
+            channel = self._channels.get(key)
+            if channel is None:
+                return
+            data['time'] = round(time.time(), 3)
+            channel.events.append((event, data))
+            excess = len(channel.events) - MAX_CHANNEL_EVENTS
+            if excess > 0:
+                del channel.events[:excess]
+                channel.first_id += excess
+            self._cond.notify_all()
+
+    def publish_request(self, request_id, event, **data):
+        """向请求所在的频道发布事件"""
+        with self._cond:
+            channel = self._requests.get(request_id)
+            key = channel.key if channel is not None and channel.closed_at is None else None
+        if key is not None:
+            self.publish(key, event, **data)
+
+    def subscribe(self, request_id, last_event_id=-1, heartbeat=15.0):
+        """
+        订阅请求的进度事件（生成器），先补发历史事件再实时推送
+
+        只在锁内取出待发送的事件，yield 时不持有锁：慢速或停滞的客户端不会阻塞 publish（解码循环）。
+        频道只保留最近 MAX_CHANNEL_EVENTS 个事件，更早的事件补发时跳过。
+
+        Args:
+            request_id: 请求ID
+            last_event_id: 断线重连时浏览器带上的 Last-Event-ID
+            heartbeat: 无事件时发送注释行保持连接的间隔（秒）
+
+        Yields:
+            str: SSE格式的消息
+        """
+        deadline = time.time() + SUBSCRIBE_WAIT_SECONDS
+        with self._cond:
+            while request_id not in self._requests:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            channel = self._requests.get(request_id)
+        if channel is None:
+            yield format_sse(0, 'error', {'error': '请求不存在或已过期'})
+            return
+
+        sent = last_event_id + 1
+        while True:
+            with self._cond:
+                if sent >= channel.first_id + len(channel.events) and channel.closed_at is None:
+                    self._cond.wait(heartbeat)
+                sent = max(sent, channel.first_id)
+                pending = channel.events[sent - channel.first_id:]
+                closed = channel.closed_at is not None
+            if not pending:
+                if closed:
+                    return
+                yield ': keep-alive\n\n'
+                continue
+            for event, data in pending:
+                yield format_sse(sent, event, data)
+                sent += 1
+                if event in TERMINAL_EVENTS:
+                    return
+
+
+class DecodeProgress:
+    """
+    解码循环进度钩子：由停止条件每步调用，每N个token发布一次进度，
+    剩余时间按实测的每步耗时与预计总帧数估算
+    """
+
+    def __init__(self, publish, expected_frames, max_new_tokens, every=PROGRESS_EVERY_TOKENS):
+        self.publish = publish
+        self.expected_frames = max(1.0, float(expected_frames))
+        self.max_new_tokens = max_new_tokens
+        self.every = max(1, every)
+
+    def __call__(self, steps, seconds_per_step):
+        if steps % self.every:
+            return
+        # 实际长度超过预计时按上限估算
+        expected = min(self.max_new_tokens, max(self.expected_frames, steps * 1.05))
+        self.publish(
+            'progress',
+            tokens=steps,
+            expected_tokens=int(expected),
+            max_new_tokens=self.max_new_tokens,
+            fraction=round(min(1.0, steps / expected), 3),
+            eta_seconds=round(max(0.0, expected - steps) * seconds_per_step, 2),
+        )
@@ -0,0 +1,301 @@
+"""
+按客户端的限流
+每个客户端两个令牌桶：
+1. 请求数：每分钟补充 QWEN_TTS_RATE_REQUESTS 个，桶容量（突发）QWEN_TTS_RATE_REQUESTS_BURST
+2. 计算量：按「文本字符数 × 模型参数量（十亿）」估算，每分钟补充 QWEN_TTS_RATE_COST 个单位
+
+任一桶不足时请求被拒绝（HTTP 429，Retry-After 为补足所需秒数），两个桶都足够时才同时扣除。
+单个请求的计算量超过桶容量时按容量扣除：长文档在桶满时仍可提交，提交后把桶耗尽。
+限流只决定是否接受请求；被接受的请求在调度器中按客户端加权公平排队（见 scheduler）。
+
+客户端标识默认取连接的对端地址。请求头由调用方任意填写，不能直接作为标识（每次换一个值就能得到新的令牌桶）：
+X-Client-Id 头或 Authorization 头（Bearer）中的密钥只有在 QWEN_TTS_CLIENT_KEYS 允许列表中时才使用，映射为配置的客户端名。
+QWEN_TTS_TRUST_PROXY=1 时，来自可信代理（QWEN_TTS_TRUSTED_PROXIES）的连接取 X-Forwarded-For 中
+从右往左第一个不可信的地址（代理把对端地址追加在末尾，左边的内容可由客户端伪造）。
+"""
+import hmac
+import ipaddress
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from request_log import get_logger, log_event
+
+logger = get_logger('rate_limit')
+
+# 设为 0 关闭限流
+RATE_LIMIT = os.environ.get('QWEN_TTS_RATE_LIMIT', '1') == '1'
+
+# 每个客户端每分钟的请求数与突发上限
+REQUESTS_PER_MINUTE = float(os.environ.get('QWEN_TTS_RATE_REQUESTS', 120))
+REQUESTS_BURST = float(os.environ.get('QWEN_TTS_RATE_REQUESTS_BURST', 30))
+
+# 每个客户端每分钟的计算量（字符 × 十亿参数）与突发上限
+COST_PER_MINUTE = float(os.environ.get('QWEN_TTS_RATE_COST', 12000))
+COST_BURST = float(os.environ.get('QWEN_TTS_RATE_COST_BURST', 30000))
+
+# 是否信任反向代理传来的 X-Forwarded-For
+TRUST_PROXY = os.environ.get('QWEN_TTS_TRUST_PROXY', '0') == '1'
+
+# 可信代理的地址或网段（逗号分隔），默认本机（router.py --spawn）
+TRUSTED_PROXIES = os.environ.get('QWEN_TTS_TRUSTED_PROXIES', '127.0.0.1,::1')
+
+# 客户端密钥允许列表，格式 "名称=密钥,名称=密钥"；不在列表中的 X-Client-Id / Authorization 被忽略
+CLIENT_KEYS = os.environ.get('QWEN_TTS_CLIENT_KEYS', '')
+
+# 同时记录的客户端数上限，超过后淘汰最久未出现的客户端
+MAX_CLIENTS = 4096
+
+# 模型版本对应的参数量（十亿），用于估算计算量
+MODEL_BILLIONS = {
+    '1.7b': 1.7,
+    '0.6b': 0.6,
+}
+
+
+def estimate_cost(chars, model_version):
+    """估算计算量：字符数 × 模型参数量（十亿）"""
+    return max(1, chars) * MODEL_BILLIONS.get(model_version, MODEL_BILLIONS['1.7b'])
+
+
+def parse_client_keys(spec):
+    """解析 "名称=密钥,名称=密钥"，返回 {密钥: 名称}"""
+    keys = {}
+    for item in spec.split(','):
+        name, sep, key = item.partition('=')
+        if sep and name.strip() and key.strip():
+            keys[key.strip()] = name.strip()
+    return keys
+
+
+def parse_networks(spec):
+    """解析逗号分隔的地址或网段"""
+    networks = []
+    for item in spec.split(','):
+        item = item.strip()
+        if item:
+            try:
+                networks.append(ipaddress.ip_network(item, strict=False))
+            except ValueError:
+                log_event(logger, logging.WARNING, '忽略无效的代理地址', address=item)
+    return networks
+
+
+_client_keys = parse_client_keys(CLIENT_KEYS)
+_trusted_proxies = parse_networks(TRUSTED_PROXIES)
+
+
+def _is_trusted_proxy(address):
+    try:
+        ip = ipaddress.ip_address(address.strip())
+    except ValueError:
+        return False
+    return any(ip in network for network in _trusted_proxies)
+
+
+def _allowed_client(credential):
+    """凭据在允许列表中时返回客户端名（逐个常量时间比较）"""
+    if not credential:
+        return None
+    name = None
+    for key, client in _client_keys.items():
+        if hmac.compare_digest(key.encode('utf-8'), credential.encode('utf-8')):
+            name = client
+    return name
+
+
+def client_address(headers, remote_addr):
+    """
+    客户端地址：对端是可信代理时沿 X-Forwarded-For 从右往左跳过可信代理，取第一个不可信的地址
+
+    Args:
+        headers: 请求头
+        remote_addr: 连接的对端地址
+    """
+    address = remote_addr or 'unknown'
+    if not TRUST_PROXY or not _is_trusted_proxy(address):
+        return address
+    hops = [hop.strip() for hop in (headers.get('X-Forwarded-For') or '').split(',') if hop.strip()]
+    for hop in reversed(hops):
+        address = hop
+        if not _is_trusted_proxy(hop):
+            break
+    return address
+
+
+def client_identity(headers, remote_addr):
+    """
+    请求的客户端标识
+
+    Args:
+        headers: 请求头
+        remote_addr: 连接的对端地址
+
+    Returns:
+        str: 带类型前缀的标识，允许列表中的密钥为 "id:alice"，其余为 "ip:10.0.0.5"
+    """
+    auth = (headers.get('Authorization') or '').strip()
+    if auth.lower().startswith('bearer '):
+        auth = auth[7:].strip()
+    client = _allowed_client((headers.get('X-Client-Id') or '').strip()) or _allowed_client(auth)
+    if client:
+        return f"id:{client}"
+    return f"ip:{client_address(headers, remote_addr)}"
+
+
+class TokenBucket:
+    """令牌桶：按速率连续补充，容量为突发上限"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, per_minute, capacity, now=None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.time() if now is None else now
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def shortfall_seconds(self, amount):
+        """补足 amount 个令牌还需的秒数"""
+        missing = amount - self.tokens
+        if missing <= 0:
+            return 0.0
+        return missing / self.rate if self.rate > 0 else float('inf')
+
+    def reset_seconds(self):
+        """补满所需的秒数"""
+        return self.shortfall_seconds(self.capacity)
+
+
+class RateLimitDecision:
+    """一次限流检查的结果，headers() 给出响应头"""
+
+    def __init__(self, client, allowed, cost, requests_bucket, cost_bucket, retry_after=0.0):
+        self.client = client
+        self.allowed = allowed
+        self.cost = cost
+        self.retry_after = retry_after
+        self.requests_limit = requests_bucket.capacity
+        self.requests_remaining = requests_bucket.tokens
+        self.cost_limit = cost_bucket.capacity
+        self.cost_remaining = cost_bucket.tokens
+        self.reset = max(requests_bucket.reset_seconds(), cost_bucket.reset_seconds())
+
+    def headers(self):
+        headers = {
+            'X-RateLimit-Limit': str(int(self.requests_limit)),
+            'X-RateLimit-Remaining': str(int(math.floor(self.requests_remaining))),
+            'X-RateLimit-Reset': str(int(math.ceil(self.reset))),
+            'X-RateLimit-Cost-Limit': str(int(self.cost_limit)),
+            'X-RateLimit-Cost-Remaining': str(int(math.floor(self.cost_remaining))),
+            'X-RateLimit-Cost': str(int(math.ceil(self.cost))),
+        }
+        if not self.allowed:
+            headers['Retry-After'] = str(int(math.ceil(self.retry_after)))
+        return headers
+
+    def to_dict(self):
+        return {
+            'client': self.client,
+            'allowed': self.allowed,
+            'cost': round(self.cost, 1),
+            'retry_after': round(self.retry_after, 2),
+            'requests_remaining': int(self.requests_remaining),
+            'cost_remaining': int(self.cost_remaining),
+        }
+
+
+class ClientRateLimiter:
+    """每个客户端的请求数与计算量令牌桶"""
+
+    def __init__(self, requests_per_minute=REQUESTS_PER_MINUTE, requests_burst=REQUESTS_BURST,
+                 cost_per_minute=COST_PER_MINUTE, cost_burst=COST_BURST, enabled=RATE_LIMIT):
+        self.requests_per_minute = requests_per_minute
+        self.requests_burst = requests_burst
+        self.cost_per_minute = cost_per_minute
+        self.cost_burst = cost_burst
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        # {客户端: [请求桶, 计算量桶, 接受数, 拒绝数, 累计计算量]}
+        self._clients = OrderedDict()
+        self.allowed = 0
+        self.limited = 0
+
+    def _client(self, client, now):
+        entry = self._clients.get(client)
+        if entry is None:
+            entry = self._clients[client] = [
+                TokenBucket(self.requests_per_minute, self.requests_burst, now),
+                TokenBucket(self.cost_per_minute, self.cost_burst, now),
+                0, 0, 0.0,
+            ]
+            while len(self._clients) > MAX_CLIENTS:
+                self._clients.popitem(last=False)
+        self._clients.move_to_end(client)
+        return entry
+
+    def check(self, client, cost, requests=1):
+        """
+        检查并扣除请求数与计算量
+
+        Args:
+            client: 客户端标识
+            cost: 估算的计算量（estimate_cost）
+            requests: 扣除的请求数（流式会话的后续句子只扣计算量，传 0）
+
+        Returns:
+            RateLimitDecision
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._client(client, now)
+            requests_bucket, cost_bucket = entry[0], entry[1]
+            requests_bucket.refill(now)
+            cost_bucket.refill(now)
+            charge = min(cost, cost_bucket.capacity)
+            wait = max(requests_bucket.shortfall_seconds(requests), cost_bucket.shortfall_seconds(charge))
+            allowed = not self.enabled or wait <= 0
+            if allowed:
+                requests_bucket.tokens = max(0.0, requests_bucket.tokens - requests)
+                cost_bucket.tokens = max(0.0, cost_bucket.tokens - charge)
+                entry[2] += requests
+                entry[4] += cost
+                self.allowed += requests
+            else:
+                entry[3] += 1
+                self.limited += 1
+            return RateLimitDecision(client, allowed, cost, requests_bucket, cost_bucket, wait)
+
+    def stats(self, top=20):
+        now = time.time()
+        with self._lock:
+            clients = []
+            for client, (requests_bucket, cost_bucket, allowed, limited, cost) in self._clients.items():
+                requests_bucket.refill(now)
+                cost_bucket.refill(now)
+                clients.append({
+                    'client': client,
+                    'allowed': allowed,
+                    'limited': limited,
+                    'cost': round(cost, 1),
+                    'requests_remaining': int(requests_bucket.tokens),
+                    'cost_remaining': int(cost_bucket.tokens),
+                })
+            clients.sort(key=lambda c: c['cost'], reverse=True)
+            return {
+                'enabled': self.enabled,
+                'requests_per_minute': self.requests_per_minute,
+                'requests_burst': self.requests_burst,
+                'cost_per_minute': self.cost_per_minute,
+                'cost_burst': self.cost_burst,
+                'allowed': self.allowed,
+                'limited': self.limited,
+                'clients': clients[:top],
+                'tracked_clients': len(self._clients),
+            }
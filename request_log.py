@@ -0,0 +1,237 @@
+"""
+结构化请求日志
+请求路径上不再逐行 print：日志记录放入有界队列立即返回，由后台线程格式化为JSON（或单行文本）写出，
+控制台或磁盘变慢时不会拖慢请求；队列满时丢弃记录并计数，不阻塞请求线程。
+
+每个请求只输出一条汇总记录：模式、模型、文本长度、结果与各阶段耗时（timings_ms）。
+生成参数等冗长字段只在抽样的请求（QWEN_TTS_LOG_SAMPLE）或 DEBUG 级别下附带。
+同一线程中深层函数（合成、后处理）通过 add_timing / note / verbose 把数据记到当前请求上，不需要逐层传参。
+
+配置:
+    QWEN_TTS_LOG_LEVEL=INFO         # DEBUG / INFO / WARNING / ERROR
+    QWEN_TTS_LOG_FORMAT=json        # json / text
+    QWEN_TTS_LOG_FILE=              # 为空时写到标准输出
+    QWEN_TTS_LOG_SAMPLE=0.05        # 附带冗长字段的请求比例
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+LOG_LEVEL = os.environ.get('QWEN_TTS_LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('QWEN_TTS_LOG_FORMAT', 'json')
+LOG_FILE = os.environ.get('QWEN_TTS_LOG_FILE', '')
+LOG_SAMPLE_RATE = float(os.environ.get('QWEN_TTS_LOG_SAMPLE', 0.05))
+
+# 日志队列容量，写出跟不上时超出的记录被丢弃
+LOG_QUEUE_SIZE = int(os.environ.get('QWEN_TTS_LOG_QUEUE', 10000))
+
+LOGGER_NAME = 'qwen_tts'
+
+_setup_lock = threading.Lock()
+_listener = None
+_handler = None
+_local = threading.local()
+
+
+class JsonFormatter(logging.Formatter):
+    """每条记录一行JSON：时间、级别、来源、消息与结构化字段"""
+
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """单行文本：时间 级别 消息 key=value ..."""
+
+    def format(self, record):
+        fields = getattr(record, 'fields', None) or {}
+        line = f"{time.strftime('%H:%M:%S', time.localtime(record.created))} {record.levelname} {record.getMessage()}"
+        if fields:
+            line += ' ' + ' '.join(
+                f"{k}={json.dumps(v, ensure_ascii=False, default=str) if isinstance(v, (dict, list)) else v}"
+                for k, v in fields.items()
+            )
+        if record.exc_info:
+            line += '\n' + self.formatException(record.exc_info)
+        return line
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """放入有界队列后立即返回；格式化（包括traceback）留给后台线程"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # 只合并消息参数，不在请求线程中格式化
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(level=LOG_LEVEL, fmt=LOG_FORMAT, log_file=LOG_FILE):
+    """配置 qwen_tts 日志：队列处理器 + 后台写出线程（重复调用无副作用）"""
+    global _listener, _handler
+    logger = logging.getLogger(LOGGER_NAME)
+    with _setup_lock:
+        if _listener is not None:
+            return logger
+        target = logging.FileHandler(log_file, encoding='utf-8') if log_file else logging.StreamHandler(sys.stdout)
+        target.setFormatter(TextFormatter() if fmt == 'text' else JsonFormatter())
+        _handler = NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+        logger.addHandler(_handler)
+        logger.setLevel(level)
+        logger.propagate = False
+        _listener = logging.handlers.QueueListener(_handler.queue, target)
+        _listener.start()
+        # 退出前写完队列中剩余的记录
+        atexit.register(_listener.stop)
+    return logger
+
+
+def get_logger(name):
+    setup_logging()
+    return logging.getLogger(f"{LOGGER_NAME}.{name}")
+
+
+def log_event(logger, level, message, exc_info=None, **fields):
+    """输出一条带结构化字段的记录（级别未启用时不构造记录）"""
+    if logger.isEnabledFor(level):
+        logger.log(level, message, exc_info=exc_info, extra={'fields': fields})
+
+
+class RequestLog:
+    """
+    一次请求的汇总日志：累积字段与各阶段耗时，finish() 时输出一条记录
+
+    Args:
+        kind: 请求类型（如 tts、openai、ws）
+        request_id: 请求ID
+        logger: 输出使用的logger
+        sample_rate: 附带冗长字段的抽样比例
+    """
+
+    def __init__(self, kind, request_id=None, logger=None, sample_rate=LOG_SAMPLE_RATE):
+        self.kind = kind
+        self.request_id = request_id
+        self.logger = logger or get_logger('request')
+        self.started = time.time()
+        self.fields = {}
+        self.timings = {}
+        self.verbose_fields = {}
+        self.sampled = self.logger.isEnabledFor(logging.DEBUG) or random.random() < sample_rate
+        self.finished = False
+        self._lock = threading.Lock()
+
+    def note(self, **fields):
+        with self._lock:
+            self.fields.update(fields)
+
+    def verbose(self, **fields):
+        """冗长字段：只在抽样的请求中输出"""
+        if self.sampled:
+            with self._lock:
+                self.verbose_fields.update(fields)
+
+    def add_timing(self, name, seconds):
+        """累加某阶段的耗时（多片段请求各片段的同名阶段合计）"""
+        with self._lock:
+            self.timings[name] = self.timings.get(name, 0.0) + seconds * 1000
+
+    @contextmanager
+    def timed(self, name):
+        begin = time.time()
+        try:
+            yield
+        finally:
+            self.add_timing(name, time.time() - begin)
+
+    def finish(self, status='ok', level=logging.INFO, exc_info=None, **fields):
+        """输出汇总记录（只输出一次）"""
+        with self._lock:
+            if self.finished:
+                return
+            self.finished = True
+            self.timings['total'] = (time.time() - self.started) * 1000
+            record = {'kind': self.kind, 'request_id': self.request_id, 'status': status}
+            record.update(self.fields)
+            record.update(fields)
+            record['timings_ms'] = {k: round(v, 1) for k, v in self.timings.items()}
+            if self.verbose_fields:
+                record['verbose'] = dict(self.verbose_fields)
+        log_event(self.logger, level, f"{self.kind} {status}", exc_info=exc_info, **record)
+
+
+@contextmanager
+def bind(log):
+    """把请求日志绑定到当前线程，深层函数用 add_timing / note / verbose 记录到该请求"""
+    previous = getattr(_local, 'log', None)
+    _local.log = log
+    try:
+        yield log
+    finally:
+        _local.log = previous
+
+
+def bound(log, fn):
+    """包装 fn：在执行它的线程（如后台线程）上绑定请求日志"""
+    def run(*args, **kwargs):
+        with bind(log):
+            return fn(*args, **kwargs)
+    return run
+
+
+def current():
+    """当前线程绑定的请求日志（没有时返回 None）"""
+    return getattr(_local, 'log', None)
+
+
+def add_timing(name, seconds):
+    log = current()
+    if log is not None:
+        log.add_timing(name, seconds)
+
+
+def note(**fields):
+    log = current()
+    if log is not None:
+        log.note(**fields)
+
+
+def verbose(**fields):
+    log = current()
+    if log is not None:
+        log.verbose(**fields)
+
+
+def stats():
+    return {
+        'queued': _handler.queue.qsize() if _handler else 0,
+        'dropped': _handler.dropped if _handler else 0,
+        'level': logging.getLevelName(logging.getLogger(LOGGER_NAME).level),
+        'sample_rate': LOG_SAMPLE_RATE,
+    }
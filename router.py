@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+"""
+AIMAX395TTS - 多实例请求路由
+在多个服务实例（不同端口或不同机器）之前运行的轻量路由进程：
+1. 按 (模型, 音色/参考音频) 一致性哈希选择实例，同一音色总落在同一实例上，缓存与模型保持热
+2. 后台定期检查各实例的 /stats，连续失败的实例从哈希环上跳过，请求转到环上的下一个实例
+3. 首选实例排队过深时溢出到环上下一个负载较低的实例
+4. 生成的音频、上传的参考音频、文档任务与请求ID记住所在实例，后续的 /audio、/progress、/cancel 等请求转到同一实例
+
+使用方法:
+    python router.py --backend http://127.0.0.1:5001 --backend http://127.0.0.1:5002
+    python router.py --spawn 2                       # 在本机 5001、5002 端口各启动一个 app_optimized.py
+    QWEN_TTS_BACKENDS=http://a:5000,http://b:5000 python router.py
+
+WebSocket接口 /ws/tts 不经过路由，客户端直接连接实例。
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import uuid
+import bisect
+import atexit
+import hashlib
+import argparse
+import threading
+import subprocess
+from collections import OrderedDict
+
+import requests
+from flask import Flask, Response, request, jsonify
+
+import openai_compat
+from request_log import get_logger, log_event
+
+logger = get_logger('router')
+
+# 每个实例在哈希环上的虚拟节点数
+VIRTUAL_NODES = 160
+
+# 健康检查间隔（秒）与判定不可用的连续失败次数
+HEALTH_INTERVAL = float(os.environ.get('QWEN_TTS_ROUTER_HEALTH_INTERVAL', 2.0))
+HEALTH_FAILURES = 2
+
+# 首选实例排队（运行中 + 等待）达到该深度时溢出到负载更低的实例
+SPILL_QUEUE_DEPTH = int(os.environ.get('QWEN_TTS_ROUTER_SPILL_DEPTH', 4))
+
+# 转发超时（秒）：连接超时短，生成可能较慢
+CONNECT_TIMEOUT = 3.0
+READ_TIMEOUT = 600.0
+
+# 记住的 音频文件/请求ID/任务ID → 实例 映射数量上限
+AFFINITY_LIMIT = 20000
+
+# /progress 在请求到达前订阅时，等待请求ID出现的时间（秒）
+AFFINITY_WAIT_SECONDS = 10.0
+
+# 不转发的逐跳头部
+HOP_HEADERS = {'connection', 'keep-alive', 'transfer-encoding', 'content-length', 'content-encoding', 'host', 'upgrade'}
+
+
+def _hash(value):
+    return int(hashlib.md5(value.encode('utf-8')).hexdigest()[:16], 16)
+
+
+class HashRing:
+    """带虚拟节点的一致性哈希环"""
+
+    def __init__(self, backends, virtual_nodes=VIRTUAL_NODES):
+        self._ring = sorted(
+            (_hash(f"{backend}#{i}"), backend)
+            for backend in backends for i in range(virtual_nodes)
+        )
+        self._keys = [h for h, _ in self._ring]
+        self.backends = list(backends)
+
+    def preference(self, key):
+        """按环上顺序返回所有实例（首个为首选实例）"""
+        order = []
+        index = bisect.bisect(self._keys, _hash(key))
+        for offset in range(len(self._ring)):
+            backend = self._ring[(index + offset) % len(self._ring)][1]
+            if backend not in order:
+                order.append(backend)
+                if len(order) == len(self.backends):
+                    break
+        return order
+
+
+class Backend:
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        self.healthy = True
+        self.failures = 0
+        self.queue_depth = 0
+        self.inflight = 0
+        self.routed = 0
+        self.errors = 0
+        self.checked_at = None
+
+    @property
+    def load(self):
+        # 实例上报的深度有延迟，与本路由转发中的请求数取较大者
+        return max(self.queue_depth, self.inflight)
+
+    def to_dict(self):
+        return {
+            'url': self.url, 'healthy': self.healthy, 'queue_depth': self.queue_depth,
+            'inflight': self.inflight, 'routed': self.routed, 'errors': self.errors,
+            'checked_at': self.checked_at,
+        }
+
+
+def routing_key(path, data):
+    """
+    一致性哈希的键：(模型, 音色)
+
+    Args:
+        path: 请求路径
+        data: 请求JSON
+
+    Returns:
+        str: 模式|模型版本|音色标识
+    """
+    if path == 'v1/audio/speech':
+        try:
+            data, _, _ = openai_compat.to_tts_request(data)
+        except ValueError:
+            pass
+    mode = 'voice-clone' if data.get('voice_profile') else data.get('mode', 'voice-design')
+    version = data.get('model_version', '1.7b')
+    if data.get('voice_profile'):
+        voice = f"profile:{data['voice_profile']}"
+    elif mode == 'tts-custom':
+        voice = f"speaker:{data.get('speaker', 'Vivian')}"
+    elif mode == 'voice-clone':
+        reference = f"{data.get('reference_audio', '')}|{(data.get('reference_text') or '').strip()}"
+        voice = f"clone:{hashlib.sha256(reference.encode('utf-8')).hexdigest()[:16]}"
+    else:
+        voice = f"design:{hashlib.sha256(data.get('voice_description', '').encode('utf-8')).hexdigest()[:16]}"
+    return f"{mode}|{version}|{voice}"
+
+
+class Router:
+    """实例选择、健康检查与亲和记录"""
+
+    def __init__(self, urls):
+        self.backends = {url.rstrip('/'): Backend(url) for url in urls}
+        self.ring = HashRing(list(self.backends))
+        self._lock = threading.Condition()
+        self._affinity = OrderedDict()
+        self.spills = 0
+        self.failovers = 0
+        threading.Thread(target=self._health_loop, name='router-health', daemon=True).start()
+
+    # ---- 健康检查 ----
+
+    def _health_loop(self):
+        while True:
+            for backend in list(self.backends.values()):
+                self.check(backend)
+            time.sleep(HEALTH_INTERVAL)
+
+    def check(self, backend):
+        try:
+            stats = requests.get(f"{backend.url}/stats", timeout=CONNECT_TIMEOUT).json()
+            models = stats.get('scheduler', {}).get('models', {})
+            depth = sum(sum(m['running'].values()) + sum(m['waiting'].values()) for m in models.values())
+            with self._lock:
+                if not backend.healthy:
+                    log_event(logger, logging.INFO, '实例恢复', backend=backend.url)
+                backend.healthy, backend.failures, backend.queue_depth = True, 0, depth
+                backend.checked_at = round(time.time(), 3)
+        except (requests.RequestException, ValueError, KeyError, AttributeError, TypeError):
+            self.mark_failed(backend)
+
+    def mark_failed(self, backend):
+        with self._lock:
+            backend.failures += 1
+            if backend.healthy and backend.failures >= HEALTH_FAILURES:
+                backend.healthy = False
+                log_event(logger, logging.WARNING, '实例不可用，已从路由中跳过', backend=backend.url)
+
+    # ---- 选择 ----
+
+    def candidates(self, key, pinned=None):
+        """
+        按优先顺序返回候选实例：亲和实例 → 哈希首选（排队过深时溢出）→ 环上其余实例
+
+        Args:
+            key: 路由键
+            pinned: 需要固定到的实例URL（音频文件、请求ID等所在实例）
+        """
+        with self._lock:
+            order = self.ring.preference(key)
+            healthy = [self.backends[url] for url in order if self.backends[url].healthy]
+            # 全部不可用时仍按环顺序尝试
+            healthy = healthy or [self.backends[url] for url in order]
+            if pinned in self.backends and self.backends[pinned].healthy:
+                return [self.backends[pinned]] + [b for b in healthy if b.url != pinned]
+            primary = healthy[0]
+            if primary.load >= SPILL_QUEUE_DEPTH and len(healthy) > 1:
+                spill = min(healthy[1:], key=lambda b: b.load)
+                if spill.load < primary.load:
+                    self.spills += 1
+                    return [spill] + [b for b in healthy if b is not spill]
+            return healthy
+
+    # ---- 亲和记录 ----
+
+    def remember(self, value, backend_url):
+        if not value:
+            return
+        with self._lock:
+            self._affinity[value] = backend_url
+            self._affinity.move_to_end(value)
+            while len(self._affinity) > AFFINITY_LIMIT:
+                self._affinity.popitem(last=False)
+            self._lock.notify_all()
+
+    def pinned(self, value, wait=0.0):
+        deadline = time.time() + wait
+        with self._lock:
+            while value not in self._affinity and time.time() < deadline:
+                self._lock.wait(deadline - time.time())
+            return self._affinity.get(value)
+
+    def remember_response(self, backend_url, payload, headers):
+        """记录响应中出现的音频文件、上传文件、任务、音色档案与请求ID"""
+        if isinstance(payload, dict):
+            audio_url = payload.get('audio_url') or ''
+            self.remember(audio_url.rsplit('/', 1)[-1], backend_url)
+            for field in ('filename', 'job_id', 'profile_id', 'request_id'):
+                self.remember(payload.get(field), backend_url)
+        self.remember(headers.get('X-Request-Id'), backend_url)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'backends': [b.to_dict() for b in self.backends.values()],
+                'spills': self.spills,
+                'failovers': self.failovers,
+                'affinity_entries': len(self._affinity),
+                'spill_queue_depth': SPILL_QUEUE_DEPTH,
+            }
+
+
+app = Flask(__name__)
+router = None
+
+
+def route_request(path, data):
+    """
+    为请求确定路由键与固定实例
+
+    Returns:
+        (路由键, 固定实例URL或None)
+    """
+    parts = path.split('/')
+    if path == 'jobs/document':
+        # 文档以表单上传，任务较长，按新键分散到各实例（负载过高时同样溢出）
+        return f"document|{uuid.uuid4().hex}", None
+    if path in ('tts', 'v1/audio/speech'):
+        key = routing_key(path, data)
+        # 参考音频或音色档案所在的实例优先
+        anchor = data.get('reference_audio') or data.get('voice_profile')
+        return key, router.pinned(anchor) if anchor else None
+    if parts[0] == 'upload':
+        # 上传的文件名由实例生成，返回后才能记录所在实例；上传本身分散到各实例
+        return f"upload|{uuid.uuid4().hex}", None
+    if parts[0] in ('audio', 'cancel', 'progress') and len(parts) > 1:
+        wait = AFFINITY_WAIT_SECONDS if parts[0] == 'progress' else 0.0
+        return path, router.pinned(parts[1], wait)
+    if parts[0] in ('jobs', 'voice-profiles') and len(parts) > 1:
+        return '/'.join(parts[:2]), router.pinned(parts[1])
+    return path, None
+
+
+@app.route('/router/stats')
+def router_stats():
+    return jsonify(router.stats())
+
+
+@app.route('/', defaults={'path': ''}, methods=['GET', 'POST', 'DELETE', 'PUT'])
+@app.route('/<path:path>', methods=['GET', 'POST', 'DELETE', 'PUT'])
+def proxy(path):
+    body = request.get_data()
+    headers = {k: v for k, v in request.headers.items() if k.lower() not in HOP_HEADERS}
+    # 实例按客户端限流与公平排队，转发时带上原始客户端地址
+    forwarded = request.headers.get('X-Forwarded-For')
+    headers['X-Forwarded-For'] = f"{forwarded}, {request.remote_addr}" if forwarded else request.remote_addr
+    data = {}
+    if request.is_json:
+        try:
+            data = json.loads(body or b'{}')
+        except ValueError:
+            data = {}
+    # 生成请求分配请求ID，/progress 与 /cancel 才能找到所在实例
+    if path == 'tts' and isinstance(data, dict):
+        data.setdefault('request_id', uuid.uuid4().hex)
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+    elif path == 'v1/audio/speech':
+        headers.setdefault('X-Request-Id', uuid.uuid4().hex)
+    key, pinned = route_request(path, data if isinstance(data, dict) else {})
+
+    last_error = None
+    for attempt, backend in enumerate(router.candidates(key, pinned)):
+        request_id = data.get('request_id') if path == 'tts' and isinstance(data, dict) else headers.get('X-Request-Id')
+        if request_id:
+            router.remember(request_id, backend.url)
+        with router._lock:
+            backend.inflight += 1
+            backend.routed += 1
+        try:
+            upstream = requests.request(
+                request.method, f"{backend.url}/{path}", params=request.args, data=body, headers=headers,
+                stream=True, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), allow_redirects=False,
+            )
+        except requests.RequestException as e:
+            # 连接失败：换环上的下一个实例（请求尚未被处理，可以安全重试）
+            with router._lock:
+                backend.inflight -= 1
+                backend.errors += 1
+                router.failovers += 1
+            router.mark_failed(backend)
+            last_error = e
+            log_event(logger, logging.WARNING, '转发失败，尝试下一个实例', backend=backend.url, error=str(e))
+            continue
+        return relay(backend, upstream)
+
+    return jsonify({'success': False, 'error': f"没有可用的实例: {last_error}"}), 503
+
+
+def relay(backend, upstream):
+    """把实例的响应转发给客户端：JSON读取后记录亲和信息，其余（音频、SSE）边收边发"""
+    headers = [(k, v) for k, v in upstream.headers.items() if k.lower() not in HOP_HEADERS]
+    headers.append(('X-Backend', backend.url))
+    content_type = upstream.headers.get('Content-Type', '')
+
+    def done():
+        with router._lock:
+            backend.inflight -= 1
+
+    if content_type.startswith('application/json'):
+        try:
+            content = upstream.content
+        finally:
+            upstream.close()
+            done()
+        try:
+            router.remember_response(backend.url, json.loads(content), upstream.headers)
+        except ValueError:
+            pass
+        return Response(content, status=upstream.status_code, headers=headers)
+
+    metadata = upstream.headers.get('X-TTS-Metadata')
+    if metadata:
+        try:
+            router.remember_response(backend.url, json.loads(metadata), upstream.headers)
+        except ValueError:
+            pass
+    else:
+        router.remember_response(backend.url, None, upstream.headers)
+
+    def stream():
+        try:
+            for chunk in upstream.iter_content(chunk_size=None):
+                yield chunk
+        finally:
+            upstream.close()
+            done()
+
+    return Response(stream(), status=upstream.status_code, headers=headers, direct_passthrough=True)
+
+
+def spawn_backends(count, base_port, script):
+    """在本机启动多个服务实例，返回其URL"""
+    processes = []
+    urls = []
+    for i in range(count):
+        port = base_port + i
+        env = dict(os.environ, QWEN_TTS_PORT=str(port))
+        # 实例只收到路由转发的请求，按 X-Forwarded-For 中路由追加的地址区分客户端
+        env.setdefault('QWEN_TTS_TRUST_PROXY', '1')
+        processes.append(subprocess.Popen([sys.executable, script], env=env))
+        urls.append(f"http://127.0.0.1:{port}")
+        print(f"🚀 启动实例 {script} → 端口 {port}")
+    atexit.register(lambda: [p.terminate() for p in processes])
+    return urls
+
+
+def main():
+    global router
+    parser = argparse.ArgumentParser(
+        description="AIMAX395TTS - 多实例请求路由",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+示例:
+  python router.py --backend http://127.0.0.1:5001 --backend http://127.0.0.1:5002
+  python router.py --spawn 3 --backend-port 5001 --port 5000
+        """
+    )
+    parser.add_argument('--backend', action='append', default=[], help='实例地址（可重复）')
+    parser.add_argument('--spawn', type=int, default=0, help='在本机启动的实例数')
+    parser.add_argument('--backend-port', type=int, default=5001, help='本机实例的起始端口（默认 5001）')
+    parser.add_argument('--script', default='app_optimized.py', help='本机实例运行的服务程序')
+    parser.add_argument('--port', type=int, default=int(os.environ.get('QWEN_TTS_ROUTER_PORT', 5000)), help='路由监听端口（默认 5000）')
+    args = parser.parse_args()
+
+    urls = args.backend + [u for u in os.environ.get('QWEN_TTS_BACKENDS', '').split(',') if u.strip()]
+    if args.spawn:
+        urls += spawn_backends(args.spawn, args.backend_port, args.script)
+    if not urls:
+        parser.error("至少需要一个实例（--backend、--spawn 或 QWEN_TTS_BACKENDS）")
+
+    router = Router(urls)
+    print("=" * 60)
+    print(f"🔀 路由已启动: http://localhost:{args.port}，实例 {len(urls)} 个")
+    for url in urls:
+        print(f"   • {url}")
+    print("=" * 60)
+    app.run(host='0.0.0.0', port=args.port, debug=False, threaded=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,282 @@
+"""
+合成调度器
+按模型分配生成槽位，等待中的请求按优先级类别加权调度：
+- interactive：Web界面的单句请求
+- batch：批量与长文本任务
+- background：文档/离线任务
+
+类别之间使用步长调度（stride scheduling），权重越高获得槽位越频繁，
+低优先级类别也不会被完全饿死。多片段任务每个片段单独申请槽位，
+因此高优先级请求到达后，长任务会在片段之间让出模型。
+
+同一类别内按客户端加权公平排队（WFQ）：每个片段按估算计算量与客户端权重计算虚拟完成时间，
+完成时间最小的先获得槽位。一个客户端一次提交大量请求时，只会排在自己的请求之后，
+其他客户端的请求仍按各自的份额穿插执行。
+"""
+import contextlib
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+PRIORITY_CLASSES = ('interactive', 'batch', 'background')
+PRIORITY_WEIGHTS = {
+    'interactive': 8,
+    'batch': 2,
+    'background': 1,
+}
+
+# 每个模型同时运行的生成数（CPU推理默认串行，避免线程争用）
+SLOTS_PER_MODEL = int(os.environ.get('QWEN_TTS_SLOTS_PER_MODEL', 1))
+
+# 客户端权重，如 "id:alice=2,ip:10.0.0.5=0.5"，未列出的客户端权重为1
+CLIENT_WEIGHTS = os.environ.get('QWEN_TTS_CLIENT_WEIGHTS', '')
+
+# 未标识客户端的请求（命令行、内部任务）使用的客户端名
+DEFAULT_CLIENT = 'local'
+
+# 统计中保留的客户端数
+CLIENT_STATS_LIMIT = 256
+
+
+def parse_client_weights(value=CLIENT_WEIGHTS):
+    """解析 QWEN_TTS_CLIENT_WEIGHTS：返回 {客户端: 权重}"""
+    weights = {}
+    for item in (value or '').split(','):
+        client, _, weight = item.strip().rpartition('=')
+        if client:
+            weights[client] = max(0.01, float(weight))
+    return weights
+
+
+def resolve_priority(value, default='interactive'):
+    """解析请求中的优先级类别"""
+    if not value:
+        return default
+    if value not in PRIORITY_CLASSES:
+        raise ValueError(f"未知优先级: {value}，可选: {', '.join(PRIORITY_CLASSES)}")
+    return value
+
+
+class _Waiter:
+    __slots__ = ('seq', 'priority', 'client', 'start', 'finish', 'granted', 'enqueued_at')
+
+    def __init__(self, seq, priority, client, start, finish):
+        self.seq = seq
+        self.priority = priority
+        self.client = client
+        # WFQ的虚拟开始/完成时间
+        self.start = start
+        self.finish = finish
+        self.granted = False
+        self.enqueued_at = time.time()
+
+
+class _ModelQueue:
+    """单个模型的槽位与分类别等待队列"""
+
+    def __init__(self, slots):
+        self.slots = slots
+        self.running = {p: 0 for p in PRIORITY_CLASSES}
+        self.queues = {p: [] for p in PRIORITY_CLASSES}
+        # 步长调度的各类别pass值
+        self.passes = {p: 0.0 for p in PRIORITY_CLASSES}
+        self.virtual_time = 0.0
+        # 类别内WFQ：各类别的虚拟时间与各客户端最后一个请求的虚拟完成时间
+        self.class_vtime = {p: 0.0 for p in PRIORITY_CLASSES}
+        self.client_finish = {p: {} for p in PRIORITY_CLASSES}
+
+    def enqueue(self, waiter_factory, priority, client, cost, weight):
+        """按客户端上一个请求的完成时间计算虚拟开始/完成时间并入队"""
+        start = max(self.class_vtime[priority], self.client_finish[priority].get(client, 0.0))
+        finish = start + cost / weight
+        self.client_finish[priority][client] = finish
+        waiter = waiter_factory(start, finish)
+        self.queues[priority].append(waiter)
+        return waiter
+
+    def pop(self, priority):
+        """取出类别中虚拟完成时间最小的等待者（同值时先到先得）"""
+        queue = self.queues[priority]
+        waiter = min(queue, key=lambda w: (w.finish, w.seq))
+        queue.remove(waiter)
+        vtime = self.class_vtime[priority] = max(self.class_vtime[priority], waiter.start)
+        # 完成时间已落后于虚拟时间的客户端不再需要记录
+        finishes = self.client_finish[priority]
+        for client in [c for c, f in finishes.items() if f <= vtime]:
+            del finishes[client]
+        return waiter
+
+    @property
+    def busy(self):
+        return sum(self.running.values())
+
+    def waiting(self, priority=None):
+        if priority is not None:
+            return len(self.queues[priority])
+        return sum(len(q) for q in self.queues.values())
+
+
+class SynthesisScheduler:
+    """按模型的加权优先级调度器"""
+
+    def __init__(self, slots_per_model=SLOTS_PER_MODEL, weights=None, history=512, client_weights=None):
+        self.slots_per_model = max(1, slots_per_model)
+        self.weights = dict(weights or PRIORITY_WEIGHTS)
+        self.client_weights = parse_client_weights() if client_weights is None else dict(client_weights)
+        self._cond = threading.Condition()
+        self._models = {}
+        self._seq = itertools.count()
+        self._waits = {p: deque(maxlen=history) for p in PRIORITY_CLASSES}
+        self._yields = 0
+        # 各客户端的等待/运行数、完成数、累计计算量与等待时间 {客户端: dict}
+        self._clients = OrderedDict()
+
+    def _client_stats(self, client):
+        entry = self._clients.get(client)
+        if entry is None:
+            entry = self._clients[client] = {'waiting': 0, 'running': 0, 'served': 0, 'cost': 0.0, 'wait_seconds': 0.0}
+        self._clients.move_to_end(client)
+        while len(self._clients) > CLIENT_STATS_LIMIT:
+            idle = next((c for c, e in self._clients.items() if not e['waiting'] and not e['running']), None)
+            if idle is None:
+                break
+            del self._clients[idle]
+        return entry
+
+    def _queue(self, model_name):
+        queue = self._models.get(model_name)
+        if queue is None:
+            queue = self._models[model_name] = _ModelQueue(self.slots_per_model)
+        return queue
+
+    def _dispatch_locked(self, queue):
+        """槽位空闲时按步长调度选出下一个等待者"""
+        granted = False
+        while queue.busy < queue.slots and queue.waiting():
+            candidates = [p for p in PRIORITY_CLASSES if queue.queues[p]]
+            # pass最小的类别获得槽位；同值时按类别顺序（高优先级优先）
+            priority = min(candidates, key=lambda p: (queue.passes[p], PRIORITY_CLASSES.index(p)))
+            queue.virtual_time = queue.passes[priority]
+            queue.passes[priority] += 1.0 / self.weights.get(priority, 1)
+            waiter = queue.pop(priority)
+            waiter.granted = True
+            queue.running[priority] += 1
+            waited = time.time() - waiter.enqueued_at
+            self._waits[priority].append(waited)
+            client = self._client_stats(waiter.client)
+            client['waiting'] -= 1
+            client['running'] += 1
+            client['wait_seconds'] += waited
+            granted = True
+        if granted:
+            self._cond.notify_all()
+
+    def acquire(self, model_name, priority='interactive', client=None, cost=1.0):
+        """
+        等待模型槽位
+
+        Args:
+            model_name: 模型名称
+            priority: 优先级类别
+            client: 客户端标识，类别内按客户端公平排队
+            cost: 估算计算量，决定该请求占用客户端份额的多少
+        """
+        client = client or DEFAULT_CLIENT
+        with self._cond:
+            queue = self._queue(model_name)
+            if not queue.queues[priority]:
+                # 重新变为活跃的类别不能累积历史“欠账”，从当前虚拟时间开始
+                queue.passes[priority] = max(queue.passes[priority], queue.virtual_time)
+            weight = self.client_weights.get(client, 1.0)
+            waiter = queue.enqueue(
+                lambda start, finish: _Waiter(next(self._seq), priority, client, start, finish),
+                priority, client, max(cost, 1e-6), weight,
+            )
+            stats = self._client_stats(client)
+            stats['waiting'] += 1
+            stats['cost'] += cost
+            self._dispatch_locked(queue)
+            try:
+                while not waiter.granted:
+                    self._cond.wait()
+            except BaseException:
+                if not waiter.granted:
+                    queue.queues[priority].remove(waiter)
+                    self._client_stats(client)['waiting'] -= 1
+                else:
+                    self._release_locked(queue, priority, client)
+                raise
+
+    def _release_locked(self, queue, priority, client):
+        queue.running[priority] -= 1
+        stats = self._client_stats(client)
+        stats['running'] -= 1
+        stats['served'] += 1
+        self._dispatch_locked(queue)
+
+    def release(self, model_name, priority='interactive', client=None):
+        with self._cond:
+            self._release_locked(self._queue(model_name), priority, client or DEFAULT_CLIENT)
+
+    @contextlib.contextmanager
+    def slot(self, model_name, priority='interactive', client=None, cost=1.0):
+        """在模型槽位中执行一次生成（一个片段）"""
+        self.acquire(model_name, priority, client, cost)
+        try:
+            yield
+        finally:
+            self.release(model_name, priority, client)
+
+    def has_higher_priority_waiting(self, model_name, priority):
+        """是否有更高优先级的请求在等待该模型（长任务据此在片段间让出）"""
+        with self._cond:
+            queue = self._models.get(model_name)
+            if queue is None:
+                return False
+            rank = PRIORITY_CLASSES.index(priority)
+            return any(queue.queues[p] for p in PRIORITY_CLASSES[:rank])
+
+    def note_yield(self):
+        with self._cond:
+            self._yields += 1
+
+    def queue_depth(self, model_name=None):
+        """等待+运行中的请求数"""
+        with self._cond:
+            if model_name is not None:
+                queue = self._models.get(model_name)
+                return (queue.waiting() + queue.busy) if queue else 0
+            return sum(q.waiting() + q.busy for q in self._models.values())
+
+    def stats(self):
+        with self._cond:
+            models = {
+                name: {
+                    'running': dict(queue.running),
+                    'waiting': {p: len(queue.queues[p]) for p in PRIORITY_CLASSES},
+                }
+                for name, queue in self._models.items()
+            }
+            waits = {}
+            for priority, samples in self._waits.items():
+                ordered = sorted(samples)
+                waits[priority] = {
+                    'count': len(ordered),
+                    'p50': round(ordered[len(ordered) // 2], 3) if ordered else 0.0,
+                    'p95': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3) if ordered else 0.0,
+                }
+            clients = {
+                client: dict(entry, cost=round(entry['cost'], 1), wait_seconds=round(entry['wait_seconds'], 3))
+                for client, entry in self._clients.items()
+            }
+            return {
+                'slots_per_model': self.slots_per_model,
+                'weights': dict(self.weights),
+                'client_weights': dict(self.client_weights),
+                'models': models,
+                'wait_seconds': waits,
+                'segment_yields': self._yields,
+                'clients': clients,
+            }
@@ -0,0 +1,137 @@
+"""
+确定性生成（随机种子控制）
+为请求提供可选的随机种子，使相同请求生成相同的音频，便于结果缓存与性能A/B对比。
+
+PyTorch 的默认随机数生成器是进程全局的，并发请求会互相消耗随机数；而模型的 generate 接口
+（transformers 采样、code predictor 采样）不接受 generator 参数。
+带种子的生成在当前线程进入一个 TorchFunctionMode：线程内所有未指定 generator 的随机操作
+（torch.multinomial / Tensor.multinomial、torch.rand* / randint / randperm / normal / bernoulli
+及 Tensor 的原地随机填充）都改用本次请求按设备创建的 torch.Generator。
+TorchFunctionMode 只对进入它的线程生效，不需要加锁，也不修改 torch 的全局函数，
+带种子的请求与其他请求并发执行时结果仍然确定。
+
+限制：Python random / numpy 的全局随机状态不受请求种子控制（模型生成不使用它们）。
+"""
+import contextlib
+import hashlib
+import logging
+import os
+
+import torch
+from torch.overrides import TorchFunctionMode
+
+from request_log import get_logger, log_event
+
+logger = get_logger('seeding')
+
+
+def _env_seed():
+    value = os.environ.get('QWEN_TTS_SEED', '').strip()
+    if not value:
+        return None
+    try:
+        return int(value) & 0x7FFFFFFF
+    except ValueError:
+        log_event(logger, logging.WARNING, '无效的 QWEN_TTS_SEED，忽略默认种子', value=value)
+        return None
+
+
+# 服务端默认种子（未设置时为非确定性生成）
+DEFAULT_SEED = _env_seed()
+
+
+def resolve_seed(value, default=DEFAULT_SEED):
+    """
+    解析请求中的 seed 参数
+
+    Args:
+        value: 请求传入的种子（int/str/None）
+        default: 未传入时使用的默认种子
+
+    Returns:
+        int | None: 31位非负整数种子，None表示不固定种子
+    """
+    if value is None or value == '':
+        return default
+    try:
+        return int(value) & 0x7FFFFFFF
+    except (TypeError, ValueError):
+        raise ValueError(f"无效的seed参数: {value}")
+
+
+def derive_seed(seed, *parts):
+    """由基础种子派生子种子（分段/批内条目），保证每个子任务结果与调度顺序无关"""
+    if seed is None:
+        return None
+    payload = '|'.join([str(seed)] + [str(p) for p in parts]).encode('utf-8')
+    return int.from_bytes(hashlib.sha256(payload).digest()[:4], 'big') & 0x7FFFFFFF
+
+
+# 需要注入 generator 的随机操作（都接受 generator 关键字参数）
+_RANDOM_FUNCTIONS = frozenset([
+    torch.multinomial,
+    torch.Tensor.multinomial,
+    torch.rand,
+    torch.randn,
+    torch.randint,
+    torch.randperm,
+    torch.normal,
+    torch.bernoulli,
+    torch.poisson,
+    torch.Tensor.bernoulli,
+    torch.Tensor.bernoulli_,
+    torch.Tensor.normal_,
+    torch.Tensor.uniform_,
+    torch.Tensor.random_,
+    torch.Tensor.exponential_,
+])
+
+
+def _target_device(args, kwargs):
+    """随机数所在设备：优先取输入张量，其次是 device 参数，最后是默认设备"""
+    for value in args:
+        if isinstance(value, torch.Tensor):
+            return value.device
+    device = kwargs.get('device')
+    if device is not None:
+        return torch.device(device)
+    return torch.empty(0).device
+
+
+class _SeededMode(TorchFunctionMode):
+    """当前线程内的随机操作使用本次请求的生成器（每个设备一个）"""
+
+    def __init__(self, seed):
+        super().__init__()
+        self.seed = seed
+        self.generators = {}
+
+    def generator(self, device):
+        generator = self.generators.get(device)
+        if generator is None:
+            generator = torch.Generator(device=device)
+            generator.manual_seed(self.seed)
+            self.generators[device] = generator
+        return generator
+
+    def __torch_function__(self, func, types, args=(), kwargs=None):
+        kwargs = kwargs or {}
+        if func in _RANDOM_FUNCTIONS and kwargs.get('generator') is None:
+            kwargs = dict(kwargs, generator=self.generator(_target_device(args, kwargs)))
+        return func(*args, **kwargs)
+
+
+@contextlib.contextmanager
+def seeded(seed):
+    """
+    在固定随机种子下执行生成
+
+    seed为None时不做任何处理；否则当前线程的随机操作使用以 seed 初始化的独立生成器，
+    不影响也不受其他线程（包括并发的带种子请求）影响。
+    """
+    if seed is None:
+        yield
+        return
+
+    with _SeededMode(seed):
+        yield
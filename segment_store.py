@@ -0,0 +1,125 @@
+"""
+片段音频存储
+按「片段文本 + 音色与生成参数」的哈希保存已合成的片段音频。
+分段合成时先查存储，只有新增或修改过的句子才重新生成，
+编辑后重新生成长文本时其余片段直接复用并重新拼接。
+存储目录由同机的所有工作进程共享（见 disk_cache）。
+"""
+import hashlib
+import io
+import json
+import os
+import threading
+import wave
+from contextlib import contextmanager
+
+import numpy as np
+
+from disk_cache import DiskCache, write_atomic
+
+# 存储容量上限（MB），超过后按最近使用时间淘汰
+SEGMENT_STORE_MB = int(os.environ.get('QWEN_TTS_SEGMENT_STORE_MB', 2048))
+
+# 不影响单个片段生成结果的参数（调度参数、客户端与拼接后的后处理）
+_SCHEDULING_KEYS = ('text', 'priority', 'deadline_ms', 'client', 'postprocess')
+
+
+def to_pcm16(audio_data):
+    """浮点音频转换为16位PCM"""
+    audio = np.asarray(audio_data)
+    if audio.dtype == np.int16:
+        return audio
+    return (np.clip(audio.astype(np.float32), -1.0, 1.0) * 32767).astype(np.int16)
+
+
+def encode_wav_pcm16(audio_data, sample_rate):
+    """在内存中编码16位单声道WAV"""
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(to_pcm16(audio_data).tobytes())
+    return buffer.getvalue()
+
+
+def write_wav_atomic(path, sample_rate, audio_data):
+    """写入16位单声道WAV：先写临时文件再原子替换，读者不会看到半个文件"""
+    write_atomic(path, encode_wav_pcm16(audio_data, sample_rate))
+
+
+def read_wav(path):
+    """读取16位单声道WAV（路径或文件对象），返回 (float32音频, 采样率)"""
+    with wave.open(path, 'rb') as f:
+        sample_rate = f.getframerate()
+        frames = f.readframes(f.getnframes())
+    return np.frombuffer(frames, dtype=np.int16).astype(np.float32) / 32767.0, sample_rate
+
+
+def segment_key(params, text):
+    """片段键：文本与全部影响生成结果的参数"""
+    content = {k: v for k, v in params.items() if k not in _SCHEDULING_KEYS}
+    payload = json.dumps(content, sort_keys=True, ensure_ascii=False) + '\n' + text
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class SegmentStore:
+    """片段音频的内容寻址存储，建立在多进程共享的磁盘缓存之上，同机的所有工作进程共用"""
+
+    def __init__(self, root_dir, max_mb=SEGMENT_STORE_MB):
+        self.root_dir = root_dir
+        self.cache = DiskCache(root_dir, max_mb=max_mb, suffix='.wav', enabled=True)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """返回 (音频, 采样率)，不存在时返回 None"""
+        cached = self.cache.get(key)
+        try:
+            audio = read_wav(io.BytesIO(cached[0])) if cached is not None else None
+        except (wave.Error, EOFError):
+            audio = None
+        with self._lock:
+            if audio is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return audio
+
+    def put(self, key, audio_data, sample_rate):
+        self.cache.put(key, encode_wav_pcm16(audio_data, sample_rate))
+
+    @contextmanager
+    def claim(self, key, cancel_token=None):
+        """
+        取得片段或生成它的权利：其他工作进程正在生成同一片段时等待其结果
+
+        Yields:
+            (音频, 采样率) 或 None（由调用方生成后调用 put）
+        """
+        with self.cache.claim(key, abort=cancel_token.check if cancel_token is not None else None) as entry:
+            audio = None
+            if entry.hit:
+                try:
+                    audio = read_wav(io.BytesIO(entry.data))
+                except (wave.Error, EOFError):
+                    audio = None
+            with self._lock:
+                if audio is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+            yield audio
+
+    def stats(self):
+        cache = self.cache.stats()
+        with self._lock:
+            return {
+                'bytes': cache['bytes'],
+                'entries': cache['entries'],
+                'hits': self.hits,
+                'misses': self.misses,
+                'waited_for_other_worker': cache['waited_for_other_worker'],
+                'evicted': cache['evicted'],
+            }
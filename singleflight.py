@@ -0,0 +1,79 @@
+"""
+在途请求去重（single-flight）
+相同摘要的请求在第一个请求生成期间到达时，不再重复生成，
+而是等待第一个请求完成并共享其结果（或异常）。
+"""
+import threading
+
+
+class _Call:
+    """一次在途生成：完成事件 + 结果/异常 + 共享者计数"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """按键合并并发调用，同一时刻每个键只执行一次"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        """
+        执行或加入一次在途调用
+
+        Args:
+            key: 请求摘要
+            fn: 无参可调用对象，仅由第一个请求执行
+
+        Returns:
+            tuple: (结果, 是否为共享结果)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.coalesced += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self.executed += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            # 先移除再通知：之后到达的相同请求将重新生成
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.result, False
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'executed': self.executed,
+                'coalesced': self.coalesced,
+            }
@@ -0,0 +1,133 @@
+"""
+延迟SLO与自动降级
+请求可携带截止时间（deadline_ms）。调度前根据模型队列深度与历史解码速度
+估算完成时间，预计超时时依次降级到更快的档位：
+
+    1.7B + 标准采样 → 1.7B + 极速采样 → 0.6B + 标准采样 → 0.6B + 极速采样
+
+并在响应中报告实际使用的档位。
+"""
+import threading
+
+# 降级档位：(模型版本, 采样参数档)，按质量从高到低排列
+TIERS = (
+    ('1.7b', '1.7b'),
+    ('1.7b', 'fast'),
+    ('0.6b', '0.6b'),
+    ('0.6b', 'fast'),
+)
+
+# 请求的 model_version 对应的起始档位
+START_TIER = {
+    '1.7b': 0,
+    'fast': 1,
+    '0.6b': 2,
+}
+
+# 没有历史数据时的先验速度（秒/帧），参考README中的实测数据
+DEFAULT_SECONDS_PER_FRAME = {
+    '1.7B': 0.085,
+    '0.6B': 0.035,
+}
+
+# 指数滑动平均系数
+EWMA_ALPHA = 0.2
+
+
+def model_size(model_name):
+    """从模型名称中取出尺寸前缀，如 "1.7B VoiceDesign" → "1.7B" """
+    return model_name.split(' ', 1)[0] if model_name else ''
+
+
+class ModelSpeedTracker:
+    """按 (模型, 采样参数档) 记录解码速度与单次任务耗时的滑动平均"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._seconds_per_frame = {}
+        self._job_seconds = {}
+        self._samples = {}
+
+    def record(self, model_name, profile, decode_seconds, frames):
+        if frames <= 0 or decode_seconds <= 0:
+            return
+        key = (model_name, profile)
+        rate = decode_seconds / frames
+        with self._lock:
+            previous = self._seconds_per_frame.get(key)
+            self._seconds_per_frame[key] = rate if previous is None else previous + EWMA_ALPHA * (rate - previous)
+            previous = self._job_seconds.get(model_name)
+            self._job_seconds[model_name] = decode_seconds if previous is None else previous + EWMA_ALPHA * (decode_seconds - previous)
+            self._samples[key] = self._samples.get(key, 0) + 1
+
+    def seconds_per_frame(self, model_name, profile):
+        with self._lock:
+            rate = self._seconds_per_frame.get((model_name, profile))
+            if rate is None:
+                # 同一模型其他采样档的数据也比先验更可靠
+                rates = [v for (name, _), v in self._seconds_per_frame.items() if name == model_name]
+                rate = min(rates) if rates else None
+        if rate is None:
+            rate = DEFAULT_SECONDS_PER_FRAME.get(model_size(model_name), 0.085)
+        return rate
+
+    def job_seconds(self, model_name, default):
+        with self._lock:
+            return self._job_seconds.get(model_name, default)
+
+    def estimate(self, model_name, profile, frames, queue_depth, slots=1):
+        """
+        估算从现在起到生成完成的时间
+
+        Args:
+            model_name: 模型名称
+            profile: 采样参数档
+            frames: 预计生成帧数
+            queue_depth: 该模型上等待+运行中的任务数
+            slots: 该模型并发槽位数
+
+        Returns:
+            float: 预计完成秒数（排队 + 解码）
+        """
+        decode = frames * self.seconds_per_frame(model_name, profile)
+        queue_wait = queue_depth * self.job_seconds(model_name, decode) / max(1, slots)
+        return queue_wait + decode
+
+    def stats(self):
+        with self._lock:
+            return {
+                f"{name}|{profile}": {
+                    'seconds_per_frame': round(rate, 4),
+                    'samples': self._samples.get((name, profile), 0),
+                }
+                for (name, profile), rate in sorted(self._seconds_per_frame.items())
+            }
+
+
+def choose_tier(model_version, deadline_seconds, estimate_tier):
+    """
+    选择能在截止时间内完成的最高质量档位
+
+    Args:
+        model_version: 请求的模型版本（'1.7b' / 'fast' / '0.6b'）
+        deadline_seconds: 剩余可用秒数；None表示不限
+        estimate_tier: 回调 (模型版本, 采样档) → 预计完成秒数，模型不可用时返回None
+
+    Returns:
+        tuple: (模型版本, 采样档, 预计秒数, 是否降级)
+    """
+    start = START_TIER.get(model_version, 0)
+    fallback = None
+    for index, (version, profile) in enumerate(TIERS[start:]):
+        estimated = estimate_tier(version, profile)
+        if estimated is None:
+            continue
+        if deadline_seconds is None or estimated <= deadline_seconds:
+            return version, profile, estimated, index > 0
+        # 都赶不上时使用最快的可用档位
+        if fallback is None or estimated < fallback[2]:
+            fallback = (version, profile, estimated, index > 0)
+    if fallback is None:
+        version, profile = TIERS[start]
+        return version, profile, None, False
+    return fallback
@@ -0,0 +1,5 @@
+"""测试配置：把仓库根目录加入 sys.path，以便直接导入根目录下的模块"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
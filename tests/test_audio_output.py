@@ -0,0 +1,74 @@
+"""合成结果输出：内存WAV编码、响应方式解析、multipart 与异步落盘"""
+import io
+import json
+import os
+import threading
+
+import numpy as np
+import pytest
+import scipy.io.wavfile
+
+from audio_output import AsyncAudioWriter, encode_wav, multipart_body, resolve_response_mode
+
+
+def test_encode_wav_keeps_sample_format():
+    for audio in (np.linspace(-1, 1, 50, dtype=np.float32), np.arange(50, dtype=np.int16)):
+        sample_rate, decoded = scipy.io.wavfile.read(io.BytesIO(encode_wav(audio, 24000)))
+        assert sample_rate == 24000
+        assert decoded.dtype == audio.dtype
+        assert np.array_equal(decoded, audio)
+
+
+@pytest.mark.parametrize('value, accept, expected', [
+    (None, '', 'url'),
+    (None, 'audio/wav', 'audio'),
+    (None, 'audio/wav, application/json', 'url'),
+    (None, 'multipart/mixed', 'multipart'),
+    ('audio', 'application/json', 'audio'),
+])
+def test_resolve_response_mode(value, accept, expected):
+    assert resolve_response_mode(value, accept) == expected
+
+
+def test_resolve_response_mode_rejects_unknown():
+    with pytest.raises(ValueError):
+        resolve_response_mode('zip')
+
+
+def test_multipart_body_contains_metadata_and_audio():
+    body, content_type = multipart_body({'seed': 1, 'text': '你好'}, b'RIFFDATA')
+    boundary = content_type.split('boundary=')[1]
+    parts = body.split(f'--{boundary}'.encode())
+    assert json.loads(parts[1].split(b'\r\n\r\n', 1)[1].strip().decode('utf-8')) == {'seed': 1, 'text': '你好'}
+    assert parts[2].split(b'\r\n\r\n', 1)[1] == b'RIFFDATA\r\n'
+    assert parts[3] == b'--\r\n'
+
+
+def test_async_writer_writes_once_and_waits(tmp_path):
+    writer = AsyncAudioWriter(str(tmp_path))
+    release = threading.Event()
+    original = writer._write
+
+    def slow_write(*args):
+        release.wait(5)
+        original(*args)
+
+    writer._write = slow_write
+    writer.save('a.wav', b'first')
+    writer.save('a.wav', b'second')
+    assert writer.stats()['pending'] == 1
+    release.set()
+    writer.wait('a.wav')
+    assert (tmp_path / 'a.wav').read_bytes() == b'first'
+    writer.save('a.wav', b'third')
+    writer.wait('a.wav')
+    assert (tmp_path / 'a.wav').read_bytes() == b'first'
+    assert writer.stats() == {'pending': 0, 'written': 1, 'bytes_written': 5, 'failed': 0}
+    assert os.listdir(tmp_path) == ['a.wav']
+
+
+def test_async_writer_counts_failures(tmp_path):
+    writer = AsyncAudioWriter(str(tmp_path / 'missing'))
+    writer.save('a.wav', b'data')
+    writer._executor.shutdown(wait=True)
+    assert writer.stats()['failed'] == 1
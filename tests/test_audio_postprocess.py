@@ -0,0 +1,58 @@
+"""流式后处理与完整音频后处理的一致性"""
+import numpy as np
+import pytest
+
+import audio_postprocess
+
+SAMPLE_RATE = 24000
+
+
+def _silence(seconds):
+    return np.zeros(int(seconds * SAMPLE_RATE), dtype=np.float32)
+
+
+def _tone(seconds, frequency=220.0):
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    return (0.5 * np.sin(2 * np.pi * frequency * t)).astype(np.float32)
+
+
+def _stream(audio, config, chunk):
+    processor = audio_postprocess.StreamingPostProcessor(SAMPLE_RATE, config)
+    pieces = [processor.feed(audio[i:i + chunk]) for i in range(0, len(audio), chunk)]
+    pieces.append(processor.flush())
+    return np.concatenate(pieces)
+
+
+CLIPS = {
+    'trailing_silence': np.concatenate((_silence(0.5), _tone(2.0), _silence(2.0))),
+    'inner_pause': np.concatenate((_silence(0.3), _tone(0.8), _silence(1.2), _tone(0.7, 330.0), _silence(0.9))),
+    'no_silence': _tone(1.5),
+    'all_silence': _silence(1.0),
+}
+
+CONFIGS = [
+    {'trim': True, 'fade_out_ms': 30},
+    {'trim': True, 'fade_in_ms': 10, 'fade_out_ms': 30, 'pad_ms': 100},
+    {'trim': False, 'fade_in_ms': 20, 'fade_out_ms': 50},
+]
+
+
+@pytest.mark.parametrize('clip', sorted(CLIPS))
+@pytest.mark.parametrize('config', CONFIGS)
+@pytest.mark.parametrize('chunk', [240, 1234, 24000, 10 ** 6])
+def test_streaming_matches_process(clip, config, chunk):
+    config = audio_postprocess.parse_config(config)
+    audio = CLIPS[clip]
+    expected, _ = audio_postprocess.process(audio, SAMPLE_RATE, config)
+    streamed = _stream(audio, config, chunk)
+    assert len(streamed) == len(expected)
+    np.testing.assert_allclose(streamed, expected, atol=1e-6)
+
+
+def test_trailing_silence_trimmed_and_faded_at_speech_end():
+    config = audio_postprocess.parse_config({'trim': True, 'fade_out_ms': 30})
+    streamed = _stream(CLIPS['trailing_silence'], config, 1234)
+    # 2秒语音 + 首尾各 60ms 余量
+    assert len(streamed) == int(2.12 * SAMPLE_RATE)
+    assert streamed[-1] == 0.0
+    assert np.abs(streamed[-int(0.09 * SAMPLE_RATE):-int(0.03 * SAMPLE_RATE)]).max() > 0.1
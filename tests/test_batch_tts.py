@@ -0,0 +1,107 @@
+"""命令行批量合成：请求解析、批次规划、清单续跑与写盘失败处理"""
+import json
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip('torch')
+
+import batch_tts
+from batch_tts import BatchRunner, load_manifest, load_requests, plan_batches
+from token_budget import TokenBudgetEstimator
+from tts_engine import EagerTorchEngine
+
+SAMPLE_RATE = 24000
+
+
+def _write_requests(tmp_path, rows):
+    path = tmp_path / 'requests.jsonl'
+    path.write_text('\n'.join(json.dumps(r, ensure_ascii=False) for r in rows) + '\n', encoding='utf-8')
+    return str(path)
+
+
+class FakeModel:
+    """按文本长度返回音频的模型"""
+
+    def __init__(self):
+        self.calls = []
+
+    def generate_custom_voice(self, text, language, speaker, **kwargs):
+        self.calls.append(list(text))
+        return [np.full(len(t) * 100, 0.1, dtype=np.float32) for t in text], SAMPLE_RATE
+
+
+def test_load_requests_normalizes_and_validates(tmp_path):
+    path = _write_requests(tmp_path, [
+        {'name': 'a', 'text': '你好', 'language': 'zh'},
+        {'text': 'hello', 'seed': '5'},
+    ])
+    requests = load_requests(path)
+    assert [r['name'] for r in requests] == ['a', 'line_00002']
+    assert requests[0]['language'] == 'chinese'
+    assert requests[1]['seed'] == 5
+    assert requests[0]['digest'] != requests[1]['digest']
+
+    for bad in ({'name': 'x', 'text': ''}, {'name': '../x', 'text': 'a'}, {'text': 'a', 'mode': 'sing'}):
+        with pytest.raises(ValueError):
+            load_requests(_write_requests(tmp_path, [bad]))
+    with pytest.raises(ValueError):
+        load_requests(_write_requests(tmp_path, [{'name': 'x', 'text': 'a'}, {'name': 'x', 'text': 'b'}]))
+
+
+def test_plan_batches_groups_and_keeps_seeded_single(tmp_path):
+    rows = [{'name': f'n{i}', 'text': 'x' * (10 - i)} for i in range(5)]
+    rows.append({'name': 'seeded', 'text': 'abc', 'seed': 1})
+    rows.append({'name': 'small', 'text': 'abc', 'model_version': '0.6b'})
+    batches = plan_batches(load_requests(_write_requests(tmp_path, rows)), batch_size=2)
+    names = [[r['name'] for r in b] for b in batches]
+    assert ['seeded'] in names and ['small'] in names
+    # 组内按文本长度排序
+    assert names[0] == ['n4', 'n3']
+    assert all(len(b) <= 2 for b in batches)
+
+
+def _runner(tmp_path, model):
+    output = tmp_path / 'out'
+    output.mkdir(exist_ok=True)
+    manifest = str(output / 'manifest.jsonl')
+    engine = EagerTorchEngine()
+    engine.models[('tts-custom', '1.7b')] = model
+    return BatchRunner(engine, str(output), manifest, TokenBudgetEstimator()), str(output), manifest
+
+
+def test_runner_writes_audio_and_manifest(tmp_path):
+    model = FakeModel()
+    requests = load_requests(_write_requests(tmp_path, [{'name': 'a', 'text': '你好'}, {'name': 'b', 'text': '世界你好'}]))
+    runner, output, manifest = _runner(tmp_path, model)
+    for batch_id, batch in enumerate(plan_batches(requests, 8)):
+        runner.run_batch(batch_id, batch)
+    runner.close()
+    assert model.calls == [['你好', '世界你好']]
+    assert runner.completed == 2 and runner.failed == 0
+    assert load_manifest(manifest, output) == {r['name']: r['digest'] for r in requests}
+
+
+def test_write_failure_is_recorded_and_runner_keeps_going(tmp_path, monkeypatch):
+    requests = load_requests(_write_requests(tmp_path, [{'name': f'n{i}', 'text': '你好'} for i in range(8)]))
+    real_write = batch_tts.write_wav_atomic
+
+    def flaky_write(path, sample_rate, audio_data):
+        if os.path.basename(path) == 'n3.wav':
+            raise OSError('磁盘已满')
+        real_write(path, sample_rate, audio_data)
+
+    monkeypatch.setattr(batch_tts, 'write_wav_atomic', flaky_write)
+    runner, output, manifest = _runner(tmp_path, FakeModel())
+    # 逐条提交超过队列容量：写盘线程若因异常退出，这里会阻塞
+    for batch_id, batch in enumerate(plan_batches(requests, 1)):
+        runner.run_batch(batch_id, batch)
+    runner.close()
+    assert runner.completed == 7 and runner.failed == 1
+    with open(manifest, encoding='utf-8') as f:
+        entries = {e['name']: e for e in map(json.loads, f)}
+    assert entries['n3']['status'] == 'error'
+    assert '磁盘已满' in entries['n3']['error']
+    assert 'n3' not in load_manifest(manifest, output)
+    assert len(load_manifest(manifest, output)) == 7
@@ -0,0 +1,85 @@
+"""生成取消：共享令牌、请求ID登记与停止条件"""
+import socket
+
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from cancellation import (CancellationRegistry, DuplicateRequestId, GenerationCancelled,
+                          _peer_closed, stopping_criteria_for)
+
+
+def test_shared_token_cancels_after_all_requests_cancel():
+    registry = CancellationRegistry()
+    first = registry.join('digest', 'r1')
+    second = registry.join('digest', 'r2')
+    assert first is second
+    assert registry.cancel('r1')
+    assert not first.cancelled
+    assert registry.cancel('r2', reason='api')
+    assert first.cancelled and first.reason == 'api'
+    with pytest.raises(GenerationCancelled):
+        first.check()
+    assert registry.stats()['cancelled'] == 1
+
+
+def test_cancelled_token_is_not_reused():
+    registry = CancellationRegistry()
+    token = registry.join('digest', 'r1')
+    registry.cancel('r1')
+    assert registry.join('digest', 'r2') is not token
+
+
+def test_leave_releases_request():
+    registry = CancellationRegistry()
+    registry.join('digest', 'r1')
+    registry.leave('r1')
+    assert not registry.cancel('r1')
+    assert registry.stats()['active_requests'] == 0
+
+
+def test_duplicate_request_id_is_rejected():
+    registry = CancellationRegistry()
+    token = registry.join('a', 'same')
+    with pytest.raises(DuplicateRequestId):
+        registry.join('b', 'same')
+    # 原请求的登记不受影响，仍可取消
+    assert registry.cancel('same')
+    assert token.cancelled
+    # 结束后该ID可以再次使用
+    registry.join('b', 'same')
+
+
+def test_stopping_criteria_follows_token():
+    registry = CancellationRegistry()
+    token = registry.join('digest', 'r1')
+    criteria, progress = stopping_criteria_for(token)
+    input_ids = torch.zeros((2, 3), dtype=torch.long)
+    assert not criteria[0](input_ids, None).any()
+    registry.cancel('r1')
+    assert criteria[0](input_ids, None).all()
+    assert progress.steps == 2
+
+
+def test_peer_closed_detects_disconnect():
+    left, right = socket.socketpair()
+    try:
+        assert not _peer_closed(left)
+        right.close()
+        assert _peer_closed(left)
+    finally:
+        left.close()
+
+
+def test_active_and_progress_hook():
+    registry = CancellationRegistry()
+    token = registry.join('digest', 'r1')
+    assert registry.active('r1') and not registry.active('r2')
+    steps = []
+    criteria, _ = stopping_criteria_for(token, on_step=lambda n, s: steps.append(n))
+    input_ids = torch.zeros((1, 1), dtype=torch.long)
+    criteria[0](input_ids, None)
+    criteria[0](input_ids, None)
+    assert steps == [1, 2]
+    registry.leave('r1')
+    assert not registry.active('r1')
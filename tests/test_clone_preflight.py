@@ -0,0 +1,97 @@
+"""声音克隆预检：ICL可行性判断、降级与克隆提示缓存"""
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import clone_preflight
+from clone_preflight import ClonePreflight, icl_rejection
+
+
+def test_icl_rejection_reasons():
+    assert icl_rejection('', 5.0) == '缺少参考文本'
+    assert icl_rejection('你好', None) is None
+    assert '过短' in icl_rejection('你好', 0.5)
+    assert '过长' in icl_rejection('你好', 60.0)
+    assert '不匹配' in icl_rejection('字' * 200, 3.0)
+    assert icl_rejection('今天天气很好，我们去公园吧。', 4.0) is None
+
+
+@pytest.fixture
+def ref_audio(tmp_path, monkeypatch):
+    path = tmp_path / 'ref.wav'
+    path.write_bytes(b'fake audio')
+    monkeypatch.setattr(clone_preflight, 'audio_duration', lambda p: 4.0)
+    return str(path)
+
+
+def test_icl_prompt_is_cached(ref_audio):
+    calls = []
+
+    def build(path, text, x_vector_only):
+        calls.append((text, x_vector_only))
+        return ['prompt']
+
+    preflight = ClonePreflight()
+    prompt, decision = preflight.prompt_for('1.7B Base', ref_audio, '今天天气很好，我们去公园吧。', build)
+    assert decision['mode'] == 'icl' and prompt == ['prompt']
+    preflight.prompt_for('1.7B Base', ref_audio, '今天天气很好，我们去公园吧。 ', build)
+    assert calls == [('今天天气很好，我们去公园吧。', False)]
+    assert preflight.stats() == {'icl': 1, 'x_vector': 0, 'cached': 1, 'hits': 1}
+    # 不同模型分别编码
+    preflight.prompt_for('0.6B Base', ref_audio, '今天天气很好，我们去公园吧。', build)
+    assert len(calls) == 2
+
+
+def test_falls_back_to_x_vector_when_icl_encoding_fails(ref_audio):
+    def build(path, text, x_vector_only):
+        if not x_vector_only:
+            raise RuntimeError('编码失败')
+        return ['xvec']
+
+    prompt, decision = ClonePreflight().prompt_for('1.7B Base', ref_audio, '今天天气很好，我们去公园吧。', build)
+    assert prompt == ['xvec']
+    assert decision['mode'] == 'x_vector' and '编码失败' in decision['reason']
+
+
+def test_missing_text_uses_x_vector_without_trying_icl(ref_audio):
+    calls = []
+    _, decision = ClonePreflight().prompt_for('1.7B Base', ref_audio, '', lambda *a: calls.append(a) or ['x'])
+    assert decision['mode'] == 'x_vector'
+    assert [c[2] for c in calls] == [True]
+
+
+def test_concurrent_requests_encode_once(ref_audio):
+    calls = []
+
+    def build(path, text, x_vector_only):
+        calls.append(1)
+        time.sleep(0.1)
+        return ['prompt']
+
+    preflight = ClonePreflight()
+    threads = [threading.Thread(target=preflight.prompt_for, args=('1.7B Base', ref_audio, '你好啊朋友们', build))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+
+
+def test_cache_is_bounded_and_tracks_file_changes(tmp_path, monkeypatch):
+    monkeypatch.setattr(clone_preflight, 'audio_duration', lambda p: None)
+    preflight = ClonePreflight(max_prompts=2)
+    paths = []
+    for i in range(3):
+        path = tmp_path / f'{i}.wav'
+        path.write_bytes(np.full(10, i, dtype=np.int16).tobytes())
+        paths.append(str(path))
+        preflight.prompt_for('m', str(path), '你好', lambda *a: ['p'])
+    assert preflight.stats()['cached'] == 2
+    # 文件内容变化后重新编码
+    calls = []
+    (tmp_path / '2.wav').write_bytes(b'changed content')
+    preflight.prompt_for('m', paths[2], '你好', lambda *a: calls.append(1) or ['p'])
+    assert calls == [1]
@@ -0,0 +1,85 @@
+"""ONNX解码器：解码器查找、输入格式识别、权重签名与运行时回退"""
+import json
+import threading
+import types
+
+import pytest
+
+torch = pytest.importorskip('torch')
+
+import codec_onnx
+from codec_onnx import OnnxDecoder, decoder_signature, find_decoder
+
+
+class Decoder(torch.nn.Module):
+    """(batch, 量化器, 帧) 输入、每帧输出4个采样点的解码器"""
+
+    def __init__(self, num_quantizers=16):
+        super().__init__()
+        self.config = types.SimpleNamespace(num_quantizers=num_quantizers, codebook_size=32)
+        self.embed = torch.nn.Embedding(32, 4)
+
+    def forward(self, codes):
+        if codes.shape[1] != self.config.num_quantizers:
+            raise ValueError('量化器维度不匹配')
+        return self.embed(codes).sum(dim=1).reshape(codes.shape[0], 1, -1)
+
+
+def _model(decoder):
+    inner = types.SimpleNamespace(speech_tokenizer=types.SimpleNamespace(model=types.SimpleNamespace(decoder=decoder)))
+    return types.SimpleNamespace(model=inner)
+
+
+def test_find_decoder():
+    decoder = Decoder()
+    assert find_decoder(_model(decoder)) == ('model.speech_tokenizer.model.decoder', decoder)
+    assert find_decoder(types.SimpleNamespace()) == (None, None)
+
+
+def test_detect_layout():
+    assert codec_onnx.detect_layout(Decoder()) == 'bqt'
+
+
+def test_signature_tracks_weight_content():
+    torch.manual_seed(0)
+    decoder = Decoder()
+    signature = decoder_signature(decoder)
+    assert signature == decoder_signature(decoder)
+    # 形状相同、权重不同（微调模型）
+    with torch.no_grad():
+        decoder.embed.weight[0, 0] += 1
+    changed = decoder_signature(decoder)
+    assert changed['elements'] == signature['elements']
+    assert changed['sha256'] != signature['sha256']
+
+
+def test_install_rejects_report_for_other_weights(tmp_path, monkeypatch):
+    monkeypatch.setattr(codec_onnx, 'ONNX_DIR', str(tmp_path))
+    decoder = Decoder()
+    onnx_path = codec_onnx.onnx_path_for('./model')
+    report = {'passed': True, 'layout': 'bqt', 'signature': decoder_signature(decoder)}
+    with torch.no_grad():
+        decoder.embed.weight.mul_(2)
+    with open(f"{onnx_path}.json", 'w', encoding='utf-8') as f:
+        json.dump(report, f)
+    assert codec_onnx.install(_model(decoder), './model', 'test') is None
+    assert 'forward' not in decoder.__dict__
+
+
+def test_onnx_failure_falls_back_to_torch():
+    class BrokenSession:
+        def run(self, *args):
+            raise RuntimeError('不支持的形状')
+
+    decoder = Decoder()
+    onnx_decoder = object.__new__(OnnxDecoder)
+    onnx_decoder.__dict__.update(
+        decoder=decoder, torch_forward=decoder.forward, session=BrokenSession(), input_name='codes',
+        layout='bqt', name='test', enabled=True, _lock=threading.Lock(), onnx_calls=0, torch_calls=0,
+    )
+    codes = torch.zeros(1, 16, 5, dtype=torch.long)
+    assert torch.equal(onnx_decoder(codes), decoder(codes))
+    assert onnx_decoder.stats() == {'enabled': False, 'onnx_calls': 0, 'torch_calls': 1}
+    # 关闭后不再尝试ONNX
+    onnx_decoder(codes)
+    assert onnx_decoder.stats()['torch_calls'] == 2
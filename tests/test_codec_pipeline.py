@@ -0,0 +1,90 @@
+"""解码流水线：按窗口解码、去掉前文/后续帧对应的音频与失败回退"""
+import threading
+import types
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from codec_pipeline import CodecPipeline, frame_codes, parse_cores
+
+SAMPLES_PER_FRAME = 2000  # 24kHz / 12Hz
+
+
+def _decode(frames):
+    """逐帧独立的解码器：每帧输出等长、取值为帧号的波形"""
+    return np.repeat(np.asarray(frames, dtype=np.float32), SAMPLES_PER_FRAME)
+
+
+def test_parse_cores():
+    assert parse_cores('') is None
+    assert parse_cores('0-3, 8') == {0, 1, 2, 3, 8}
+
+
+@pytest.mark.parametrize('frames', [1, 5, 12, 13, 40])
+def test_windows_join_to_full_decode(frames):
+    chunks = []
+    pipeline = CodecPipeline(_decode, on_audio=lambda audio, sr: chunks.append((len(audio), sr)),
+                             window=4, context=3, lookahead=2)
+    for frame in range(frames):
+        pipeline.push(frame)
+    pipeline.close()
+    np.testing.assert_array_equal(pipeline.waveform(), _decode(list(range(frames))))
+    assert pipeline.samples == frames * SAMPLES_PER_FRAME
+    assert sum(n for n, _ in chunks) == pipeline.samples
+    assert {sr for _, sr in chunks} == {24000}
+
+
+def test_decode_windows_include_context():
+    windows = []
+    decoded = threading.Event()
+
+    def decode(frames):
+        windows.append(list(frames))
+        decoded.set()
+        return _decode(frames)
+
+    pipeline = CodecPipeline(decode, window=4, context=2, lookahead=1)
+    for frame in range(5):
+        pipeline.push(frame)
+    # 凑够 window + lookahead 帧后解码第一个窗口，只输出前4帧
+    assert decoded.wait(5)
+    for frame in range(5, 8):
+        pipeline.push(frame)
+    pipeline.close()
+    # 最后一个窗口带上2帧前文
+    assert windows == [[0, 1, 2, 3, 4], [2, 3, 4, 5, 6, 7]]
+    np.testing.assert_array_equal(pipeline.waveform(), _decode(list(range(8))))
+
+
+def test_decode_error_falls_back():
+    def decode(frames):
+        raise RuntimeError('解码失败')
+
+    pipeline = CodecPipeline(decode, window=2)
+    for frame in range(4):
+        pipeline.push(frame)
+    pipeline.close()
+    assert pipeline.waveform() is None
+    assert isinstance(pipeline.error, RuntimeError)
+
+
+def test_audio_callback_error_does_not_stop_decoding():
+    def on_audio(audio, sample_rate):
+        raise ConnectionError('连接已断开')
+
+    pipeline = CodecPipeline(_decode, on_audio=on_audio, window=2, context=0, lookahead=0)
+    for frame in range(6):
+        pipeline.push(frame)
+    pipeline.close()
+    assert pipeline.on_audio is None
+    assert len(pipeline.waveform()) == 6 * SAMPLES_PER_FRAME
+
+
+def test_frame_codes():
+    codes = torch.ones(1, 16, dtype=torch.long)
+    output = types.SimpleNamespace(hidden_states=(torch.zeros(1, 4, 8), codes))
+    assert frame_codes(output, 16) is codes
+    assert frame_codes(output, 8) is None
+    assert frame_codes(types.SimpleNamespace(), 16) is None
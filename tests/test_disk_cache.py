@@ -0,0 +1,114 @@
+"""多进程共享磁盘缓存：原子发布、键锁等待、绕过缓存与按索引淘汰"""
+import os
+import threading
+import time
+
+import pytest
+
+from disk_cache import DiskCache, content_key, write_atomic
+
+KEY = content_key('你好', 'voice-design', 1)
+
+
+def test_write_atomic_leaves_no_temp_files(tmp_path):
+    path = str(tmp_path / 'a.bin')
+    write_atomic(path, b'one')
+    write_atomic(path, b'two')
+    assert open(path, 'rb').read() == b'two'
+    assert os.listdir(tmp_path) == ['a.bin']
+
+
+def test_put_get_and_locate(tmp_path):
+    cache = DiskCache(str(tmp_path))
+    assert cache.get(KEY) is None
+    cache.put(KEY, b'RIFF', {'seed': 1})
+    assert cache.get(KEY) == (b'RIFF', {'seed': 1})
+    assert cache.locate(f"{KEY}.wav") == cache.path(KEY)
+    assert cache.locate('qwen_tts_output_1.wav') is None
+    # 新进程从索引恢复容量统计
+    assert DiskCache(str(tmp_path)).stats()['bytes'] == 4
+
+
+def test_claim_waits_for_other_writer(tmp_path):
+    cache = DiskCache(str(tmp_path))
+    claimed = threading.Event()
+
+    def writer():
+        with cache.claim(KEY) as entry:
+            assert not entry.hit
+            claimed.set()
+            time.sleep(0.2)
+            entry.publish(b'audio', {'seed': 1})
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    assert claimed.wait(5)
+    # 另一个实例（相当于另一个工作进程）等待发布后直接命中
+    with DiskCache(str(tmp_path)).claim(KEY) as entry:
+        assert entry.hit and entry.waited
+        assert entry.data == b'audio'
+    thread.join()
+
+
+def test_claim_abort_stops_waiting(tmp_path):
+    cache = DiskCache(str(tmp_path))
+    claimed, done = threading.Event(), threading.Event()
+
+    def holder():
+        with cache.claim(KEY):
+            claimed.set()
+            done.wait(5)
+
+    thread = threading.Thread(target=holder)
+    thread.start()
+    assert claimed.wait(5)
+
+    def abort():
+        raise RuntimeError('已取消')
+
+    with pytest.raises(RuntimeError):
+        with DiskCache(str(tmp_path)).claim(KEY, abort=abort):
+            pass
+    done.set()
+    thread.join()
+
+
+def test_bypass_neither_reads_nor_writes(tmp_path):
+    cache = DiskCache(str(tmp_path))
+    cache.put(KEY, b'seeded')
+    # 未固定种子的请求：不命中已有条目，生成结果也不发布
+    with cache.claim(KEY, bypass=True) as entry:
+        assert not entry.enabled and not entry.hit
+        entry.publish(b'random')
+        assert not entry.published
+    assert cache.get(KEY) == (b'seeded', None)
+
+    other = content_key('其他')
+    with cache.claim(other, bypass=True) as entry:
+        entry.publish(b'random')
+    assert cache.get(other) is None
+    assert not os.path.exists(os.path.join(str(tmp_path), 'locks', other[:2], f"{other}.lock"))
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = DiskCache(str(tmp_path), max_mb=1)
+    keys = [content_key(i) for i in range(4)]
+    for key in keys:
+        cache.put(key, b'\0' * (400 * 1024))
+    assert cache.stats()['bytes'] <= cache.max_bytes
+    assert cache.get(keys[0]) is None
+    assert cache.get(keys[-1]) is not None
+
+
+def test_index_rebuilt_from_existing_entries(tmp_path):
+    cache = DiskCache(str(tmp_path))
+    cache.put(KEY, b'12345')
+    os.remove(cache.index_path)
+    assert DiskCache(str(tmp_path)).stats()['bytes'] == 5
+
+
+def test_disabled_cache(tmp_path):
+    cache = DiskCache(str(tmp_path), enabled=False)
+    with cache.claim(KEY) as entry:
+        entry.publish(b'x')
+    assert cache.get(KEY) is None
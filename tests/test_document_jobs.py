@@ -0,0 +1,148 @@
+"""文档合成任务：章节拆分、检查点、断点续跑与拼接"""
+import json
+import os
+import threading
+import time
+import wave
+
+import numpy as np
+import pytest
+
+pytest.importorskip('torch')
+
+from document_jobs import DocumentJobManager, split_document
+
+SAMPLE_RATE = 16000
+
+DOCUMENT = """# 第一章
+
+今天天气很好。我们去公园散步。
+
+## 第二章
+
+晚上下起了雨。
+"""
+
+
+def _fake_synthesize(calls=None, fail_on=None):
+    def synthesize(params, token):
+        if calls is not None:
+            calls.append(params['text'])
+        if fail_on and fail_on in params['text']:
+            raise RuntimeError('合成失败')
+        return np.full(SAMPLE_RATE // 10, 0.25, dtype=np.float32), SAMPLE_RATE, {}
+    return synthesize
+
+
+def _wait(manager, job_id, timeout=10):
+    deadline = time.time() + timeout
+    while True:
+        status = manager.status(job_id)
+        if status['status'] != 'running':
+            return status
+        if time.time() > deadline:
+            raise AssertionError('任务超时')
+        time.sleep(0.02)
+
+
+def test_split_document_markdown():
+    chapters = split_document(DOCUMENT, 'markdown')
+    assert [c['title'] for c in chapters] == ['第一章', '第二章']
+    assert chapters[0]['segments'][0].startswith('第一章。')
+    assert '晚上下起了雨。' in chapters[1]['segments'][0]
+
+
+def test_split_document_text_headings_and_markup():
+    text = "第一章 开始\n**你好**，[世界](http://x)。\n```\ncode\n```\n"
+    chapters = split_document(text, 'markdown')
+    assert 'code' not in ''.join(chapters[0]['segments'])
+    assert '你好，世界。' in chapters[0]['segments'][0]
+    chapters = split_document("第一章 开始\n正文。\n第二章 结束\n尾声。", 'text')
+    assert [c['title'] for c in chapters] == ['第一章 开始', '第二章 结束']
+
+
+def test_job_completes_with_index(tmp_path):
+    manager = DocumentJobManager(str(tmp_path), _fake_synthesize(), workers=2)
+    job_id = manager.create(DOCUMENT, {'seed': 1}, fmt='markdown')
+    status = _wait(manager, job_id)
+    assert status['status'] == 'completed'
+    assert status['segments_done'] == status['segments_total'] == 2
+    with wave.open(manager.output_path(job_id), 'rb') as f:
+        assert f.getframerate() == SAMPLE_RATE
+        # 两个片段 + 一个章节停顿
+        assert f.getnframes() == 2 * SAMPLE_RATE // 10 + SAMPLE_RATE
+    with open(manager.index_path(job_id), encoding='utf-8') as f:
+        index = json.load(f)
+    assert [s['chapter'] for s in index['segments']] == [0, 1]
+    assert index['segments'][1]['start'] == pytest.approx(1.1)
+    assert not any(name.endswith('.tmp') for name in os.listdir(manager.job_dir(job_id)))
+
+
+def test_failed_segments_are_retried_from_checkpoints(tmp_path):
+    calls = []
+    fail = {'text': '晚上'}
+    manager = DocumentJobManager(str(tmp_path), lambda p, t: _fake_synthesize(calls, fail['text'])(p, t), workers=1)
+    job_id = manager.create(DOCUMENT, {}, fmt='markdown')
+    status = _wait(manager, job_id)
+    assert status['status'] == 'failed'
+    assert status['failed'][0]['chapter'] == 1
+    fail['text'] = None
+    calls.clear()
+    manager.retry(job_id)
+    assert _wait(manager, job_id)['status'] == 'completed'
+    # 已完成的片段不会重新合成
+    assert len(calls) == 1 and '晚上' in calls[0]
+
+
+def test_resume_incomplete_after_restart(tmp_path):
+    release = threading.Event()
+
+    def blocking(params, token):
+        release.wait(5)
+        token.check()
+        return np.zeros(10, dtype=np.float32), SAMPLE_RATE, {}
+
+    manager = DocumentJobManager(str(tmp_path), blocking, workers=1)
+    job_id = manager.create(DOCUMENT, {}, fmt='markdown')
+    # 模拟进程退出：取消正在运行的任务，job.json 仍为 running
+    manager.cancel(job_id)
+    release.set()
+    _wait(manager, job_id)
+    with open(os.path.join(manager.job_dir(job_id), 'job.json'), encoding='utf-8') as f:
+        job = json.load(f)
+    job['status'] = 'running'
+    with open(os.path.join(manager.job_dir(job_id), 'job.json'), 'w', encoding='utf-8') as f:
+        json.dump(job, f)
+
+    restarted = DocumentJobManager(str(tmp_path), _fake_synthesize(), workers=1)
+    assert restarted.resume_incomplete() == 1
+    assert _wait(restarted, job_id)['status'] == 'completed'
+
+
+def test_invalid_job_id(tmp_path):
+    manager = DocumentJobManager(str(tmp_path), _fake_synthesize())
+    with pytest.raises(KeyError):
+        manager.status('../etc')
+    with pytest.raises(ValueError):
+        manager.create('   ', {})
+
+
+def test_postprocess_is_applied_per_segment(tmp_path):
+    audio_postprocess = pytest.importorskip('audio_postprocess')
+    config = audio_postprocess.parse_config({'normalize': 'peak', 'target_db': -6.0})
+    manager = DocumentJobManager(str(tmp_path), _fake_synthesize(), workers=1)
+    job_id = manager.create(DOCUMENT, {'postprocess': config}, fmt='markdown')
+    assert _wait(manager, job_id)['status'] == 'completed'
+    with wave.open(manager.output_path(job_id), 'rb') as f:
+        samples = np.frombuffer(f.readframes(f.getnframes()), dtype=np.int16)
+    # 0.25 的片段被归一化到 -6dBFS（约 0.5）
+    assert abs(samples.max() / 32767.0 - 10 ** (-6.0 / 20)) < 0.01
+
+
+def test_progress_events(tmp_path):
+    events = []
+    manager = DocumentJobManager(str(tmp_path), _fake_synthesize(), workers=1,
+                                 on_event=lambda job_id, event, status: events.append((event, status['segments_done'])))
+    job_id = manager.create(DOCUMENT, {}, fmt='markdown')
+    _wait(manager, job_id)
+    assert events == [('started', 0), ('segment', 1), ('segment', 2), ('done', 2)]
@@ -0,0 +1,78 @@
+"""推理精度：精度配置解析与敏感层保持fp32"""
+import pytest
+
+torch = pytest.importorskip('torch')
+
+import model_precision
+from model_precision import apply_precision, dtype_for, model_memory_bytes, normalize_dtype, parse_model_dtypes
+
+
+class LayerNorm(torch.nn.LayerNorm):
+    pass
+
+
+class Talker(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.embed = torch.nn.Embedding(16, 8)
+        self.proj = torch.nn.Linear(8, 8)
+        self.norm = LayerNorm(8)
+        self.lm_head = torch.nn.Linear(8, 16, bias=False)
+
+    def forward(self, ids):
+        return self.lm_head(self.norm(self.proj(self.embed(ids))))
+
+
+class Wrapper:
+    """与 Qwen3TTSModel 一样本身不是 nn.Module"""
+
+    def __init__(self):
+        self.model = Talker()
+        self.speech_tokenizer = torch.nn.Linear(4, 4)
+
+
+def test_dtype_config():
+    assert normalize_dtype('bfloat16') == 'bf16'
+    assert normalize_dtype(None) == 'fp32'
+    with pytest.raises(ValueError):
+        normalize_dtype('int4')
+    overrides = parse_model_dtypes('voice-clone=fp32, tts-custom:0.6b=half')
+    assert overrides == {('voice-clone', None): 'fp32', ('tts-custom', '0.6b'): 'fp16'}
+    assert dtype_for('tts-custom', '0.6b', overrides, default='bf16') == 'fp16'
+    assert dtype_for('tts-custom', '1.7b', overrides, default='bf16') == 'bf16'
+    assert dtype_for('voice-clone', '0.6b', overrides, default='bf16') == 'fp32'
+
+
+def test_fp32_is_untouched():
+    model = Wrapper()
+    assert apply_precision(model, 'fp32') == {'dtype': 'fp32', 'converted': 0, 'fp32': 0}
+    assert model.model.proj.weight.dtype == torch.float32
+
+
+@pytest.mark.skipif(not model_precision.cpu_supports('bf16'), reason='CPU不支持bf16')
+def test_bf16_keeps_sensitive_layers_fp32():
+    model = Wrapper()
+    before = model_memory_bytes(model)
+    report = apply_precision(model, 'bf16')
+    talker = model.model
+    assert talker.proj.weight.dtype == torch.bfloat16
+    assert talker.embed.weight.dtype == torch.bfloat16
+    assert talker.norm.weight.dtype == torch.float32
+    assert talker.lm_head.weight.dtype == torch.float32
+    assert model.speech_tokenizer.weight.dtype == torch.float32
+    assert report['converted'] == talker.proj.weight.numel() + talker.proj.bias.numel() + talker.embed.weight.numel()
+    assert model_memory_bytes(model) < before
+
+    logits = talker(torch.tensor([[1, 2, 3]]))
+    # 输出头在fp32下计算，logits不经过半精度舍入
+    assert logits.dtype == torch.float32
+    assert model.speech_tokenizer(torch.ones(1, 4, dtype=torch.bfloat16)).dtype == torch.float32
+
+
+@pytest.mark.skipif(not model_precision.cpu_supports('bf16'), reason='CPU不支持bf16')
+def test_tied_weights_stay_fp32():
+    model = Wrapper()
+    model.model.lm_head = torch.nn.Linear(8, 16, bias=False)
+    model.model.lm_head.weight = model.model.embed.weight
+    apply_precision(model, 'bf16')
+    assert model.model.embed.weight.dtype == torch.float32
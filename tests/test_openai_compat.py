@@ -0,0 +1,68 @@
+"""OpenAI 兼容接口：参数映射与音频编码"""
+import io
+import struct
+import wave
+
+import numpy as np
+import pytest
+
+import openai_compat
+from openai_compat import OpenAIRequestError, encode_audio, to_tts_request, wav_stream_header
+
+
+def test_maps_model_voice_and_extensions():
+    data, fmt, speed = to_tts_request({
+        'model': 'tts-1-hd', 'voice': 'nova', 'input': '你好', 'response_format': 'wav',
+        'speed': 1.5, 'instructions': '开心地', 'seed': 7,
+    })
+    assert data == {'text': '你好', 'model_version': '1.7b', 'mode': 'tts-custom', 'speaker': 'Emma',
+                    'style': '开心地', 'seed': 7}
+    assert (fmt, speed) == ('wav', 1.5)
+
+
+def test_defaults_and_direct_speaker_names():
+    data, fmt, speed = to_tts_request({'input': 'hi', 'voice': 'david'})
+    assert data['speaker'] == 'David' and data['model_version'] == '0.6b'
+    assert (fmt, speed) == ('mp3', 1.0)
+
+
+def test_voice_profile_ids():
+    data, _, _ = to_tts_request({'input': 'hi', 'voice': 'profile:0123456789ab'})
+    assert data['voice_profile'] == '0123456789ab'
+    assert 'mode' not in data
+
+
+@pytest.mark.parametrize('body, param', [
+    ({'input': ' '}, 'input'),
+    ({'input': 'hi', 'model': 'tts-2'}, 'model'),
+    ({'input': 'hi', 'response_format': 'aac'}, 'response_format'),
+    ({'input': 'hi', 'speed': 'fast'}, 'speed'),
+    ({'input': 'hi', 'speed': 5}, 'speed'),
+    ({'input': 'hi', 'voice': 'nobody'}, 'voice'),
+])
+def test_invalid_requests(body, param):
+    with pytest.raises(OpenAIRequestError) as info:
+        to_tts_request(body)
+    assert info.value.param == param
+    assert info.value.to_dict()['error']['type'] == 'invalid_request_error'
+
+
+def test_wav_encoding_has_exact_sizes():
+    pcm16 = (np.arange(100) - 50).astype(np.int16)
+    data = encode_audio(pcm16, 24000, 'wav')
+    with wave.open(io.BytesIO(data), 'rb') as f:
+        assert f.getframerate() == 24000
+        assert np.array_equal(np.frombuffer(f.readframes(f.getnframes()), dtype='<i2'), pcm16)
+    assert encode_audio(pcm16, 24000, 'pcm') == pcm16.astype('<i2').tobytes()
+
+
+def test_streaming_header_has_unknown_length():
+    header = wav_stream_header(16000)
+    assert len(header) == 44
+    assert struct.unpack('<I', header[4:8])[0] == 0xFFFFFFFF
+    assert struct.unpack('<I', header[24:28])[0] == 16000
+
+
+def test_change_speed_identity():
+    audio = np.ones(10, dtype=np.float32)
+    assert openai_compat.change_speed(audio, 16000, 1.0) is audio
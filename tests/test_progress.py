@@ -0,0 +1,93 @@
+"""生成进度推送：频道登记、事件补发、容量上限与解码进度钩子"""
+import threading
+
+import pytest
+
+import progress
+from progress import DecodeProgress, ProgressHub, format_sse
+
+
+def _events(messages):
+    return [m.split('\n')[1][len('event: '):] for m in messages if m.startswith('id:')]
+
+
+def test_format_sse():
+    assert format_sse(3, 'done', {'a': '你好'}) == 'id: 3\nevent: done\ndata: {"a": "你好"}\n\n'
+
+
+def test_subscribe_replays_history_until_terminal_event():
+    hub = ProgressHub()
+    hub.join('digest', 'r1')
+    hub.join('digest', 'r2')
+    hub.publish('digest', 'queued')
+    hub.publish('digest', 'progress', tokens=12)
+    hub.publish_request('r2', 'done')
+    assert _events(hub.subscribe('r1')) == ['queued', 'progress', 'done']
+    # Last-Event-ID 之后的事件
+    assert _events(hub.subscribe('r2', last_event_id=1)) == ['done']
+
+
+def test_channel_closes_after_all_requests_leave():
+    hub = ProgressHub()
+    hub.join('digest', 'r1')
+    hub.publish('digest', 'queued')
+    hub.leave('r1')
+    # 关闭后的频道不再接收事件，订阅者读完历史后结束
+    hub.publish('digest', 'late')
+    hub.publish_request('r1', 'late')
+    assert _events(hub.subscribe('r1')) == ['queued']
+
+
+def test_unknown_request_reports_error(monkeypatch):
+    monkeypatch.setattr(progress, 'SUBSCRIBE_WAIT_SECONDS', 0.05)
+    messages = list(ProgressHub().subscribe('missing'))
+    assert _events(messages) == ['error']
+
+
+def test_subscriber_can_subscribe_before_request_starts():
+    hub = ProgressHub()
+    received = []
+    thread = threading.Thread(target=lambda: received.extend(hub.subscribe('r1', heartbeat=0.05)))
+    thread.start()
+    hub.join('digest', 'r1')
+    hub.publish('digest', 'started')
+    hub.publish('digest', 'done')
+    thread.join(5)
+    assert _events(received) == ['started', 'done']
+
+
+def test_history_is_capped_and_ids_stay_stable(monkeypatch):
+    monkeypatch.setattr(progress, 'MAX_CHANNEL_EVENTS', 5)
+    hub = ProgressHub()
+    hub.join('digest', 'r1')
+    for i in range(10):
+        hub.publish('digest', 'progress', tokens=i)
+    hub.publish('digest', 'done')
+    messages = [m for m in hub.subscribe('r1') if m.startswith('id:')]
+    assert [int(m.split('\n')[0][4:]) for m in messages] == [6, 7, 8, 9, 10]
+    # 落后于上限的重连从最早保留的事件开始
+    assert len([m for m in hub.subscribe('r1', last_event_id=0) if m.startswith('id:')]) == 5
+
+
+def test_stalled_subscriber_does_not_block_publish():
+    hub = ProgressHub()
+    hub.join('digest', 'r1')
+    hub.publish('digest', 'queued')
+    stream = hub.subscribe('r1')
+    next(stream)  # 订阅者停在 yield 处
+    done = threading.Event()
+    threading.Thread(target=lambda: (hub.publish('digest', 'progress'), done.set())).start()
+    assert done.wait(2)
+
+
+def test_decode_progress_publishes_every_n_steps():
+    published = []
+    hook = DecodeProgress(lambda event, **data: published.append(data), expected_frames=48, max_new_tokens=100, every=12)
+    for step in range(1, 61):
+        hook(step, 0.1)
+    assert [p['tokens'] for p in published] == [12, 24, 36, 48, 60]
+    assert published[0]['fraction'] == pytest.approx(0.25)
+    assert published[0]['eta_seconds'] == pytest.approx(3.6)
+    # 超过预计帧数后按实际步数放大估计，不超过上限
+    assert published[-1]['expected_tokens'] == 63
+    assert published[-1]['fraction'] < 1.0
@@ -0,0 +1,75 @@
+"""客户端限流：令牌桶、计算量估算与客户端识别"""
+import ipaddress
+
+import pytest
+
+import rate_limit
+from rate_limit import ClientRateLimiter, client_address, client_identity, estimate_cost, parse_client_keys
+
+
+@pytest.fixture
+def proxy_config(monkeypatch):
+    monkeypatch.setattr(rate_limit, 'TRUST_PROXY', True)
+    monkeypatch.setattr(rate_limit, '_trusted_proxies', [ipaddress.ip_network('127.0.0.1/32'),
+                                                          ipaddress.ip_network('10.0.0.0/8')])
+    monkeypatch.setattr(rate_limit, '_client_keys', parse_client_keys('alice=sk-alice'))
+
+
+def test_estimate_cost_scales_with_model():
+    assert estimate_cost(100, '1.7b') > estimate_cost(100, '0.6b')
+    assert estimate_cost(0, '1.7b') == estimate_cost(1, '1.7b')
+
+
+def test_request_bucket_limits_and_refills(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(rate_limit.time, 'time', lambda: now[0])
+    limiter = ClientRateLimiter(requests_per_minute=60, requests_burst=2, cost_per_minute=1e6, cost_burst=1e6)
+    assert limiter.check('ip:a', 1).allowed
+    assert limiter.check('ip:a', 1).allowed
+    decision = limiter.check('ip:a', 1)
+    assert not decision.allowed
+    assert decision.retry_after == pytest.approx(1.0)
+    assert decision.headers()['Retry-After'] == '1'
+    # 其他客户端有各自的额度
+    assert limiter.check('ip:b', 1).allowed
+    now[0] += 1.0
+    assert limiter.check('ip:a', 1).allowed
+
+
+def test_cost_is_capped_at_capacity(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(rate_limit.time, 'time', lambda: now[0])
+    limiter = ClientRateLimiter(requests_per_minute=600, requests_burst=10, cost_per_minute=600, cost_burst=100)
+    # 超过容量的长文档在桶满时仍可提交，提交后桶被耗尽
+    assert limiter.check('ip:a', 500).allowed
+    decision = limiter.check('ip:a', 50)
+    assert not decision.allowed and decision.retry_after == pytest.approx(5.0)
+    # 只扣计算量的检查（流式会话的后续句子）
+    now[0] += 5.0
+    assert limiter.check('ip:a', 50, requests=0).allowed
+
+
+def test_disabled_limiter_allows_everything():
+    limiter = ClientRateLimiter(requests_burst=1, enabled=False)
+    assert all(limiter.check('ip:a', 1e9).allowed for _ in range(5))
+
+
+def test_identity_ignores_unknown_credentials(proxy_config):
+    # 调用方任意填写的请求头不能换来新的额度
+    assert client_identity({'X-Client-Id': 'random'}, '203.0.113.5') == 'ip:203.0.113.5'
+    assert client_identity({'Authorization': 'Bearer other'}, '203.0.113.5') == 'ip:203.0.113.5'
+    assert client_identity({'X-Client-Id': 'sk-alice'}, '203.0.113.5') == 'id:alice'
+    assert client_identity({'Authorization': 'Bearer sk-alice'}, '203.0.113.5') == 'id:alice'
+
+
+def test_forwarded_for_only_from_trusted_proxy(proxy_config):
+    headers = {'X-Forwarded-For': '1.1.1.1, 198.51.100.7, 10.0.0.2'}
+    # 从右往左跳过可信代理，左边可由客户端伪造的地址不采用
+    assert client_address(headers, '127.0.0.1') == '198.51.100.7'
+    assert client_address(headers, '203.0.113.5') == '203.0.113.5'
+    assert client_address({}, '127.0.0.1') == '127.0.0.1'
+
+
+def test_forwarded_for_ignored_without_trust(monkeypatch):
+    monkeypatch.setattr(rate_limit, 'TRUST_PROXY', False)
+    assert client_address({'X-Forwarded-For': '198.51.100.7'}, '127.0.0.1') == '127.0.0.1'
@@ -0,0 +1,106 @@
+"""异步结构化请求日志：汇总记录、线程绑定、格式化与有界队列"""
+import json
+import logging
+import queue
+import threading
+
+import pytest
+
+import request_log
+from request_log import JsonFormatter, NonBlockingQueueHandler, RequestLog, TextFormatter, log_event
+
+
+class _Capture(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+@pytest.fixture
+def captured():
+    logger = logging.getLogger('test_request_log')
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    handler = _Capture()
+    logger.addHandler(handler)
+    yield logger, handler.records
+    logger.removeHandler(handler)
+
+
+def test_finish_emits_one_summary(captured):
+    logger, records = captured
+    log = RequestLog('tts', request_id='r1', logger=logger, sample_rate=0)
+    log.note(chars=12)
+    log.add_timing('generate', 0.5)
+    log.add_timing('generate', 0.25)
+    log.verbose(text='不会输出')
+    log.finish('ok', model='m')
+    log.finish('error')
+    assert len(records) == 1
+    fields = records[0].fields
+    assert records[0].getMessage() == 'tts ok'
+    assert fields['request_id'] == 'r1' and fields['chars'] == 12 and fields['model'] == 'm'
+    assert fields['timings_ms']['generate'] == 750.0
+    assert 'total' in fields['timings_ms'] and 'verbose' not in fields
+
+
+def test_verbose_fields_only_when_sampled(captured):
+    logger, records = captured
+    log = RequestLog('tts', logger=logger, sample_rate=1.0)
+    log.verbose(text='你好')
+    log.finish()
+    assert records[0].fields['verbose'] == {'text': '你好'}
+
+
+def test_bound_records_from_worker_thread(captured):
+    logger, records = captured
+    log = RequestLog('ws', logger=logger, sample_rate=0)
+
+    def work():
+        request_log.add_timing('encode', 0.1)
+        request_log.note(sentences=3)
+
+    thread = threading.Thread(target=request_log.bound(log, work))
+    thread.start()
+    thread.join()
+    # 未绑定的线程上调用不报错，也不会记录到任何请求
+    request_log.note(ignored=True)
+    log.finish()
+    fields = records[0].fields
+    assert fields['sentences'] == 3 and fields['timings_ms']['encode'] == 100.0
+    assert 'ignored' not in fields
+    assert request_log.current() is None
+
+
+def test_log_event_skips_disabled_levels(captured):
+    logger, records = captured
+    log_event(logger, logging.DEBUG, '不输出', value=1)
+    log_event(logger, logging.WARNING, '输出', value=2)
+    assert [r.fields for r in records] == [{'value': 2}]
+
+
+def test_formatters_render_fields():
+    record = logging.LogRecord('qwen_tts.app', logging.INFO, __file__, 1, '音频输出目录', None, None)
+    record.fields = {'path': '/tmp/out', 'timings_ms': {'total': 1.5}}
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry['msg'] == '音频输出目录' and entry['path'] == '/tmp/out' and entry['level'] == 'INFO'
+    line = TextFormatter().format(record)
+    assert 'INFO 音频输出目录 path=/tmp/out timings_ms={"total": 1.5}' in line
+
+
+def test_full_queue_drops_instead_of_blocking():
+    handler = NonBlockingQueueHandler(queue.Queue(2))
+    logger = logging.getLogger('test_request_log.queue')
+    logger.propagate = False
+    logger.addHandler(handler)
+    try:
+        for i in range(5):
+            logger.warning('记录 %d', i)
+    finally:
+        logger.removeHandler(handler)
+    assert handler.queue.qsize() == 2 and handler.dropped == 3
+    # 消息参数在请求线程中合并，格式化留给后台线程
+    assert handler.queue.get_nowait().msg == '记录 0'
@@ -0,0 +1,83 @@
+"""多实例路由：一致性哈希、路由键、健康跳过与排队溢出"""
+import pytest
+
+import router as router_module
+from router import HashRing, Router, routing_key
+
+BACKENDS = [f"http://127.0.0.1:{5001 + i}" for i in range(4)]
+
+
+@pytest.fixture
+def router(monkeypatch):
+    # 不启动后台健康检查
+    monkeypatch.setattr(Router, '_health_loop', lambda self: None)
+    instance = Router(BACKENDS)
+    monkeypatch.setattr(router_module, 'router', instance)
+    return instance
+
+
+def test_ring_preference_lists_every_backend_once():
+    ring = HashRing(BACKENDS)
+    order = ring.preference('tts-custom|1.7b|speaker:Vivian')
+    assert sorted(order) == sorted(BACKENDS)
+    assert ring.preference('tts-custom|1.7b|speaker:Vivian') == order
+
+
+def test_removing_backend_only_moves_its_keys():
+    keys = [f"voice-design|1.7b|design:{i}" for i in range(500)]
+    full = HashRing(BACKENDS)
+    reduced = HashRing(BACKENDS[:-1])
+    moved = 0
+    for key in keys:
+        before = full.preference(key)[0]
+        after = reduced.preference(key)[0]
+        if before != BACKENDS[-1]:
+            assert after == before
+        else:
+            moved += 1
+            # 被移除实例的键转到环上的下一个实例
+            assert after == full.preference(key)[1]
+    # 虚拟节点使各实例分到的键大致均匀
+    assert 500 / 4 * 0.5 < moved < 500 / 4 * 1.5
+
+
+def test_routing_key_groups_by_model_and_voice():
+    assert routing_key('tts', {'mode': 'tts-custom', 'speaker': 'Ryan'}) == 'tts-custom|1.7b|speaker:Ryan'
+    clone = {'mode': 'voice-clone', 'reference_audio': 'a.wav', 'reference_text': '你好'}
+    assert routing_key('tts', clone) == routing_key('tts', dict(clone, text='其他文本'))
+    assert routing_key('tts', clone) != routing_key('tts', dict(clone, reference_audio='b.wav'))
+    assert routing_key('tts', {'voice_profile': 'abc'}) == 'voice-clone|1.7b|profile:abc'
+    assert routing_key('v1/audio/speech', {'input': 'hi', 'voice': 'david', 'model': 'tts-1-hd'}) == \
+        routing_key('tts', {'mode': 'tts-custom', 'speaker': 'David', 'model_version': '1.7b'})
+
+
+def test_unhealthy_backend_is_skipped(router):
+    key = 'tts-custom|1.7b|speaker:Vivian'
+    primary = router.ring.preference(key)[0]
+    for _ in range(router_module.HEALTH_FAILURES):
+        router.mark_failed(router.backends[primary])
+    order = [b.url for b in router.candidates(key)]
+    assert primary not in order
+    assert order == [url for url in router.ring.preference(key) if url != primary]
+
+
+def test_deep_queue_spills_to_least_loaded(router):
+    key = 'tts-custom|1.7b|speaker:Vivian'
+    order = router.ring.preference(key)
+    for backend in router.backends.values():
+        backend.queue_depth = router_module.SPILL_QUEUE_DEPTH
+    router.backends[order[0]].queue_depth = router_module.SPILL_QUEUE_DEPTH + 2
+    router.backends[order[2]].queue_depth = 1
+    assert router.candidates(key)[0].url == order[2]
+    assert router.spills == 1
+    # 固定实例（音频、请求ID所在实例）优先于溢出
+    assert router.candidates(key, pinned=order[0])[0].url == order[0]
+
+
+def test_affinity_from_responses(router):
+    router.remember_response(BACKENDS[1], {'audio_url': '/audio/tts_1.wav', 'job_id': 'job1'}, {'X-Request-Id': 'req1'})
+    assert router.pinned('tts_1.wav') == BACKENDS[1]
+    assert router.pinned('job1') == BACKENDS[1]
+    assert router_module.route_request('progress/req1', {}) == ('progress/req1', BACKENDS[1])
+    assert router_module.route_request('jobs/job1/audio', {}) == ('jobs/job1', BACKENDS[1])
+    assert router_module.route_request('audio/unknown.wav', {}) == ('audio/unknown.wav', None)
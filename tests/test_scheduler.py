@@ -0,0 +1,152 @@
+"""合成调度器：优先级解析、槽位限制与加权调度"""
+import threading
+import time
+
+import pytest
+
+from scheduler import SynthesisScheduler, resolve_priority
+
+
+def _wait_until(predicate, timeout=5):
+    deadline = time.time() + timeout
+    while not predicate():
+        if time.time() > deadline:
+            raise AssertionError('等待超时')
+        time.sleep(0.005)
+
+
+def _queue_waiters(scheduler, model, priorities, order):
+    """在模型槽位被占用时依次排队，记录获得槽位的顺序"""
+    threads = []
+    for index, priority in enumerate(priorities):
+        def worker(priority=priority, index=index):
+            with scheduler.slot(model, priority):
+                order.append((priority, index))
+        thread = threading.Thread(target=worker)
+        thread.start()
+        threads.append(thread)
+        _wait_until(lambda n=index + 1: scheduler.stats()['models'][model]['waiting'] and
+                    sum(scheduler.stats()['models'][model]['waiting'].values()) == n)
+    return threads
+
+
+def test_resolve_priority():
+    assert resolve_priority(None) == 'interactive'
+    assert resolve_priority('', default='batch') == 'batch'
+    assert resolve_priority('background') == 'background'
+    with pytest.raises(ValueError):
+        resolve_priority('urgent')
+
+
+def test_slots_limit_concurrency():
+    scheduler = SynthesisScheduler(slots_per_model=2)
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def worker():
+        with scheduler.slot('m'):
+            with lock:
+                running.append(1)
+                peak.append(len(running))
+            time.sleep(0.05)
+            with lock:
+                running.pop()
+
+    threads = [threading.Thread(target=worker) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max(peak) == 2
+    assert scheduler.queue_depth('m') == 0
+
+
+def test_interactive_jumps_ahead_of_background():
+    scheduler = SynthesisScheduler(slots_per_model=1)
+    order = []
+    scheduler.acquire('m', 'background')
+    threads = _queue_waiters(scheduler, 'm', ['background', 'background', 'interactive'], order)
+    assert scheduler.has_higher_priority_waiting('m', 'background')
+    assert not scheduler.has_higher_priority_waiting('m', 'interactive')
+    scheduler.release('m', 'background')
+    for thread in threads:
+        thread.join()
+    assert order[0][0] == 'interactive'
+
+
+def test_weighted_share_between_classes():
+    scheduler = SynthesisScheduler(slots_per_model=1, weights={'interactive': 4, 'batch': 1, 'background': 1})
+    order = []
+    scheduler.acquire('m', 'batch')
+    priorities = ['batch'] * 5 + ['interactive'] * 10
+    threads = _queue_waiters(scheduler, 'm', priorities, order)
+    scheduler.release('m', 'batch')
+    for thread in threads:
+        thread.join()
+    first = [priority for priority, _ in order[:10]]
+    # 权重 4:1，前 10 次调度中 batch 约占 2 次，但不会被完全饿死
+    assert 1 <= first.count('batch') <= 3
+
+
+def test_cancelled_waiter_is_removed():
+    scheduler = SynthesisScheduler(slots_per_model=1)
+    scheduler.acquire('m')
+
+    class Stop(Exception):
+        pass
+
+    # 等待中的请求抛出异常后不会残留在队列中
+    original_wait = scheduler._cond.wait
+
+    def failing_wait(*args, **kwargs):
+        raise Stop()
+
+    scheduler._cond.wait = failing_wait
+    with pytest.raises(Stop):
+        scheduler.acquire('m', 'batch')
+    scheduler._cond.wait = original_wait
+    assert scheduler.stats()['models']['m']['waiting']['batch'] == 0
+    scheduler.release('m')
+    assert scheduler.queue_depth() == 0
+
+
+def test_fair_queuing_between_clients():
+    scheduler = SynthesisScheduler(slots_per_model=1)
+    order = []
+    scheduler.acquire('m', 'batch', 'holder')
+    threads = []
+    # 客户端 a 先提交6个请求，b 随后提交2个：b 不必排在 a 的全部请求之后
+    for index, client in enumerate(['a'] * 6 + ['b'] * 2):
+        def worker(client=client):
+            with scheduler.slot('m', 'batch', client, cost=10):
+                order.append(client)
+        thread = threading.Thread(target=worker)
+        thread.start()
+        threads.append(thread)
+        _wait_until(lambda n=index + 1: scheduler.stats()['models']['m']['waiting']['batch'] == n)
+    scheduler.release('m', 'batch', 'holder')
+    for thread in threads:
+        thread.join()
+    assert order[:4].count('b') == 2
+    assert scheduler.stats()['clients']['a']['served'] == 6
+
+
+def test_client_weight_sets_share():
+    scheduler = SynthesisScheduler(slots_per_model=1, client_weights={'heavy': 3})
+    order = []
+    scheduler.acquire('m', 'batch', 'holder')
+    threads = []
+    for index, client in enumerate(['light'] * 6 + ['heavy'] * 6):
+        def worker(client=client):
+            with scheduler.slot('m', 'batch', client, cost=10):
+                order.append(client)
+        thread = threading.Thread(target=worker)
+        thread.start()
+        threads.append(thread)
+        _wait_until(lambda n=index + 1: scheduler.stats()['models']['m']['waiting']['batch'] == n)
+    scheduler.release('m', 'batch', 'holder')
+    for thread in threads:
+        thread.join()
+    # 权重 3:1，前 8 次调度中 heavy 约占 6 次
+    assert order[:8].count('heavy') >= 5
@@ -0,0 +1,64 @@
+"""片段存储与增量重新生成：内容寻址、容量淘汰与分段边界稳定性"""
+import os
+
+import numpy as np
+
+from segment_store import SegmentStore, read_wav, segment_key, to_pcm16, write_wav_atomic
+from text_segmenter import split_segments
+
+PARAMS = {'mode': 'voice-design', 'model_version': '1.7b', 'seed': 1, 'priority': 'interactive'}
+
+
+def test_segment_key_ignores_scheduling_params():
+    key = segment_key(PARAMS, '你好。')
+    assert key == segment_key(dict(PARAMS, priority='background', deadline_ms=100, text='整段'), '你好。')
+    assert key != segment_key(dict(PARAMS, seed=2), '你好。')
+    assert key != segment_key(PARAMS, '你好！')
+
+
+def test_wav_roundtrip(tmp_path):
+    path = str(tmp_path / 'a.wav')
+    audio = np.linspace(-1.0, 1.0, 100, dtype=np.float32)
+    write_wav_atomic(path, 24000, audio)
+    restored, sample_rate = read_wav(path)
+    assert sample_rate == 24000
+    np.testing.assert_allclose(restored, audio, atol=1e-4)
+    assert to_pcm16(np.array([2.0, -2.0]))[0] == 32767
+    assert os.listdir(tmp_path) == ['a.wav']
+
+
+def test_store_get_put_and_stats(tmp_path):
+    store = SegmentStore(str(tmp_path))
+    key = segment_key(PARAMS, '你好。')
+    assert store.get(key) is None
+    store.put(key, np.zeros(1000, dtype=np.float32), 16000)
+    audio, sample_rate = store.get(key)
+    assert sample_rate == 16000 and len(audio) == 1000
+    stats = store.stats()
+    assert stats['hits'] == 1 and stats['misses'] == 1
+    assert stats['bytes'] > 2000
+    # 重启后按磁盘内容恢复容量统计
+    assert SegmentStore(str(tmp_path)).stats()['bytes'] == stats['bytes']
+
+
+def test_store_evicts_least_recently_used(tmp_path):
+    store = SegmentStore(str(tmp_path), max_mb=1)
+    audio = np.zeros(200 * 1024, dtype=np.float32)  # 约 400KB
+    keys = [segment_key(PARAMS, str(i)) for i in range(4)]
+    for key in keys:
+        store.put(key, audio, 16000)
+    assert store.stats()['bytes'] <= store.cache.max_bytes
+    assert store.get(keys[-1]) is not None
+    assert store.get(keys[0]) is None
+
+
+def test_local_edit_keeps_most_segments():
+    sentences = [f"这是第{i}句话，内容各不相同。" for i in range(60)]
+    original = split_segments(''.join(sentences), max_chars=80)
+    edited_sentences = list(sentences)
+    edited_sentences[30] = '这一句被修改过了。'
+    edited = split_segments(''.join(edited_sentences), max_chars=80)
+    reused = set(original) & set(edited)
+    # 只有被修改句子附近的片段需要重新生成
+    assert len(reused) >= len(original) - 3
+    assert all(len(s) <= 80 for s in edited)
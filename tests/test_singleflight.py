@@ -0,0 +1,78 @@
+"""在途请求去重：并发相同键只执行一次，结果与异常共享"""
+import threading
+import time
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def _run_concurrently(flight, key, fn, count):
+    results = []
+    errors = []
+    lock = threading.Lock()
+
+    def worker():
+        try:
+            value = flight.do(key, fn)
+            with lock:
+                results.append(value)
+        except Exception as e:
+            with lock:
+                errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+def test_concurrent_calls_are_coalesced():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        release.wait(5)
+        return 'audio'
+
+    threading.Timer(0.2, release.set).start()
+    results, errors = _run_concurrently(flight, 'k', fn, 5)
+    assert not errors
+    assert len(calls) == 1
+    assert sorted(shared for _, shared in results) == [False, True, True, True, True]
+    assert all(value == 'audio' for value, _ in results)
+    assert flight.stats() == {'in_flight': 0, 'executed': 1, 'coalesced': 4}
+
+
+def test_error_is_shared_and_key_released():
+    flight = SingleFlight()
+
+    def fn():
+        time.sleep(0.2)
+        raise RuntimeError('boom')
+
+    results, errors = _run_concurrently(flight, 'k', fn, 3)
+    assert not results
+    assert len(errors) == 3
+    assert all(isinstance(e, RuntimeError) for e in errors)
+    # 失败后相同键重新执行
+    assert flight.do('k', lambda: 1) == (1, False)
+
+
+def test_sequential_calls_execute_again():
+    flight = SingleFlight()
+    assert flight.do('k', lambda: 1) == (1, False)
+    assert flight.do('k', lambda: 2) == (2, False)
+    assert flight.in_flight() == 0
+
+
+def test_different_keys_do_not_share():
+    flight = SingleFlight()
+    assert flight.do('a', lambda: 'a') == ('a', False)
+    assert flight.do('b', lambda: 'b') == ('b', False)
+    with pytest.raises(ValueError):
+        flight.do('c', lambda: int('x'))
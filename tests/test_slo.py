@@ -0,0 +1,60 @@
+"""延迟SLO：速度统计、完成时间估算与降级档位选择"""
+import pytest
+
+from slo import DEFAULT_SECONDS_PER_FRAME, ModelSpeedTracker, choose_tier, model_size
+
+
+def test_model_size():
+    assert model_size('1.7B VoiceDesign') == '1.7B'
+    assert model_size('') == ''
+
+
+def test_tracker_uses_prior_then_ewma():
+    tracker = ModelSpeedTracker()
+    assert tracker.seconds_per_frame('0.6B Base', '0.6b') == DEFAULT_SECONDS_PER_FRAME['0.6B']
+    tracker.record('0.6B Base', '0.6b', 10.0, 100)
+    assert tracker.seconds_per_frame('0.6B Base', '0.6b') == pytest.approx(0.1)
+    tracker.record('0.6B Base', '0.6b', 20.0, 100)
+    assert tracker.seconds_per_frame('0.6B Base', '0.6b') == pytest.approx(0.12)
+    # 同一模型其他采样档没有数据时借用已有数据
+    assert tracker.seconds_per_frame('0.6B Base', 'fast') == pytest.approx(0.12)
+    # 无效样本被忽略
+    tracker.record('0.6B Base', '0.6b', 0.0, 100)
+    assert tracker.stats()['0.6B Base|0.6b']['samples'] == 2
+
+
+def test_estimate_includes_queue_wait():
+    tracker = ModelSpeedTracker()
+    tracker.record('1.7B Base', '1.7b', 5.0, 100)
+    assert tracker.estimate('1.7B Base', '1.7b', 100, queue_depth=0) == pytest.approx(5.0)
+    assert tracker.estimate('1.7B Base', '1.7b', 100, queue_depth=2) == pytest.approx(15.0)
+    assert tracker.estimate('1.7B Base', '1.7b', 100, queue_depth=2, slots=2) == pytest.approx(10.0)
+
+
+def _estimates(values):
+    return lambda version, profile: values.get((version, profile))
+
+
+def test_choose_tier_keeps_requested_tier_without_deadline():
+    estimate = _estimates({('1.7b', '1.7b'): 30.0, ('0.6b', 'fast'): 2.0})
+    assert choose_tier('1.7b', None, estimate) == ('1.7b', '1.7b', 30.0, False)
+
+
+def test_choose_tier_downgrades_to_meet_deadline():
+    estimate = _estimates({
+        ('1.7b', '1.7b'): 12.0,
+        ('1.7b', 'fast'): 9.0,
+        ('0.6b', '0.6b'): 4.0,
+        ('0.6b', 'fast'): 3.0,
+    })
+    assert choose_tier('1.7b', 10.0, estimate) == ('1.7b', 'fast', 9.0, True)
+    assert choose_tier('1.7b', 5.0, estimate) == ('0.6b', '0.6b', 4.0, True)
+    # 起始档位按请求的模型版本
+    assert choose_tier('0.6b', 5.0, estimate) == ('0.6b', '0.6b', 4.0, False)
+
+
+def test_choose_tier_falls_back_to_fastest_available():
+    estimate = _estimates({('1.7b', '1.7b'): 12.0, ('1.7b', 'fast'): 9.0})
+    assert choose_tier('1.7b', 1.0, estimate) == ('1.7b', 'fast', 9.0, True)
+    # 没有可用模型时保持请求的档位
+    assert choose_tier('0.6b', 1.0, _estimates({})) == ('0.6b', '0.6b', None, False)
@@ -0,0 +1,72 @@
+"""文本分段：句子边界、短句合并与超长句切分"""
+from text_segmenter import SentenceBuffer, split_segments, split_sentences
+
+
+def test_split_sentences_keeps_punctuation():
+    assert split_sentences('你好。今天天气很好！真的吗？') == ['你好。', '今天天气很好！', '真的吗？']
+    assert split_sentences('Hello there. How are you?\nFine') == ['Hello there.', 'How are you?', 'Fine']
+
+
+def test_short_text_is_single_segment():
+    assert split_segments('  你好，世界。 ') == ['你好，世界。']
+    assert split_segments('   ') == []
+
+
+def test_segments_respect_max_chars():
+    text = '这是一个比较长的句子，用来测试分段。' * 20
+    segments = split_segments(text, max_chars=50)
+    assert len(segments) > 1
+    assert all(len(s) <= 50 for s in segments)
+    assert ''.join(segments) == text
+
+
+def test_short_sentences_are_merged():
+    text = '一。二。三。四。五。六。七。八。九。十。' * 3
+    segments = split_segments(text, max_chars=20)
+    assert all(len(s) <= 20 for s in segments)
+    assert len(segments) < len(split_sentences(text))
+
+
+def test_long_sentence_without_punctuation_is_hard_split():
+    text = '长' * 130
+    segments = split_segments(text, max_chars=50)
+    assert [len(s) for s in segments] == [50, 50, 30]
+
+
+def test_english_sentences_are_joined_with_space():
+    text = 'First sentence here. Second one follows. ' * 10
+    segments = split_segments(text, max_chars=60)
+    assert all(len(s) <= 60 for s in segments)
+    assert 'here. Second' in segments[0]
+
+
+def test_sentence_buffer_emits_complete_sentences():
+    buffer = SentenceBuffer()
+    assert buffer.push('今天') == []
+    assert buffer.push('天气很好。我们') == ['今天天气很好。']
+    assert buffer.push('去公园') == []
+    assert buffer.push('吧！') == ['我们去公园吧！']
+    assert buffer.push('最后一句') == []
+    assert buffer.flush() == ['最后一句']
+    assert buffer.flush() == []
+
+
+def test_sentence_buffer_merges_short_sentences():
+    buffer = SentenceBuffer()
+    assert buffer.push('嗯。') == []
+    assert buffer.push('好的，我们现在开始吧。') == ['嗯。好的，我们现在开始吧。']
+
+
+def test_sentence_buffer_cuts_first_clause_early():
+    buffer = SentenceBuffer(first_clause_chars=12)
+    # 首句在逗号处提前切出，缩短首段音频等待时间
+    assert buffer.push('这是一个很长的开头部分，后面还有') == ['这是一个很长的开头部分，']
+    assert buffer.push('很多内容') == []
+
+
+def test_sentence_buffer_limits_sentence_length():
+    buffer = SentenceBuffer(max_chars=30)
+    buffer.push('开始。')
+    pieces = buffer.push('长' * 70) + buffer.flush()
+    assert all(len(p) <= 30 for p in pieces)
+    assert ''.join(pieces) == '开始。' + '长' * 70
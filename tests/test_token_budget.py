@@ -0,0 +1,101 @@
+"""token 预算估计器：先验、在线学习、触顶统计与持久化"""
+import json
+import time
+
+import token_budget
+from token_budget import TokenBudgetEstimator
+
+MODEL = '1.7B VoiceDesign'
+SAMPLE_RATE = 24000
+
+
+def _samples(frames):
+    return int(frames / token_budget.CODEC_FRAME_RATE * SAMPLE_RATE)
+
+
+def test_detect_language():
+    assert token_budget.detect_language('你好，世界') == 'chinese'
+    assert token_budget.detect_language('こんにちは世界') == 'japanese'
+    assert token_budget.detect_language('안녕하세요') == 'korean'
+    assert token_budget.detect_language('hello world') == 'english'
+    assert token_budget.detect_language('hello', 'french') == 'french'
+
+
+def test_budget_uses_prior_without_samples():
+    estimator = TokenBudgetEstimator()
+    text = '今天天气很好' * 10
+    budget = estimator.budget(text, 'auto', MODEL)
+    assert budget >= len(text) * token_budget.DEFAULT_FRAMES_PER_CHAR['chinese']
+    assert budget <= token_budget.HARD_CAP
+    assert estimator.budget('好', 'auto', MODEL) == token_budget.MIN_TOKENS
+    assert estimator.budget(text * 100, 'auto', MODEL, hard_cap=500) == 500
+
+
+def test_budget_learns_from_records():
+    estimator = TokenBudgetEstimator()
+    text = 'a' * 100
+    prior = estimator.budget(text, 'english', MODEL)
+    for _ in range(token_budget.MIN_SAMPLES):
+        estimator.record(text, 'english', MODEL, '*', _samples(50 + token_budget.OVERHEAD_FRAMES),
+                         SAMPLE_RATE, prior)
+    learned = estimator.budget(text, 'english', MODEL)
+    # 学到 0.5 帧/字符，且方差为 0：预算收紧到均值加余量
+    expected = 100 * 0.5 * (1 + token_budget.SAFETY_MARGIN) + token_budget.OVERHEAD_FRAMES
+    assert learned < prior
+    assert abs(learned - expected) <= 2
+
+
+def test_record_detects_cap_hits():
+    estimator = TokenBudgetEstimator()
+    assert estimator.record('hello', 'english', MODEL, 'vivian', _samples(100), SAMPLE_RATE, 100)
+    assert not estimator.record('hello', 'english', MODEL, 'vivian', _samples(40), SAMPLE_RATE, 100)
+    summary = estimator.summary()
+    bucket = summary['buckets'][f'english|{MODEL}|*']
+    assert bucket['requests'] == 2
+    assert bucket['cap_hits'] == 1
+    # 触顶样本不参与比例学习
+    assert bucket['samples'] == 1
+
+
+def test_flush_persists_and_reloads(tmp_path):
+    path = str(tmp_path / 'stats.json')
+    estimator = TokenBudgetEstimator(path)
+    estimator.record('hello', 'english', MODEL, 'vivian', _samples(40), SAMPLE_RATE, 100)
+    assert not (tmp_path / 'stats.json').exists()
+    estimator.flush()
+    with open(path, encoding='utf-8') as f:
+        assert f'english|{MODEL}|vivian' in json.load(f)['buckets']
+    reloaded = TokenBudgetEstimator(path)
+    assert reloaded.summary()['buckets'] == estimator.summary()['buckets']
+
+
+def test_save_every_writes_on_record(tmp_path):
+    path = tmp_path / 'stats.json'
+    estimator = TokenBudgetEstimator(str(path), save_every=2)
+    estimator.record('hello', 'english', MODEL, '*', _samples(40), SAMPLE_RATE, 100)
+    assert not path.exists()
+    estimator.record('hello', 'english', MODEL, '*', _samples(40), SAMPLE_RATE, 100)
+    assert path.exists()
+
+
+def test_background_save(tmp_path):
+    path = tmp_path / 'stats.json'
+    estimator = TokenBudgetEstimator(str(path), save_interval=0.05)
+    estimator.record('hello', 'english', MODEL, '*', _samples(40), SAMPLE_RATE, 100)
+    deadline = time.time() + 5
+    while not path.exists() and time.time() < deadline:
+        time.sleep(0.02)
+    assert path.exists()
+
+
+def test_stale_snapshot_does_not_overwrite(tmp_path):
+    path = tmp_path / 'stats.json'
+    estimator = TokenBudgetEstimator(str(path))
+    estimator.record('hello', 'english', MODEL, '*', _samples(40), SAMPLE_RATE, 100)
+    with estimator._lock:
+        old = estimator._snapshot_locked()
+    estimator.record('hello', 'english', MODEL, '*', _samples(40), SAMPLE_RATE, 100)
+    estimator.flush()
+    estimator._write(old)
+    with open(path, encoding='utf-8') as f:
+        assert json.load(f)['buckets']['english|*|*']['requests'] == 2
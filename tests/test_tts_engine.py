@@ -0,0 +1,125 @@
+"""合成引擎：模型选择、生成参数回退与测试后端的种子确定性"""
+import threading
+
+import numpy as np
+import pytest
+
+pytest.importorskip('torch')
+
+from seeding import seeded
+from tts_engine import (EagerTorchEngine, StubEngine, SynthesisRequest, parse_model_keys,
+                        sampling_config)
+
+
+class StrictModel:
+    """只接受部分生成参数的模型"""
+
+    def __init__(self, accepted):
+        self.accepted = set(accepted)
+        self.calls = []
+
+    def generate_custom_voice(self, text, language, speaker, **config):
+        for key in config:
+            if key not in self.accepted:
+                raise TypeError(f"generate_custom_voice() got an unexpected keyword argument '{key}'")
+        self.calls.append(dict(config))
+        return [np.zeros(10, dtype=np.float32)], 24000
+
+
+def _request(**config):
+    return SynthesisRequest(text='你好', mode='tts-custom', generation_config=config)
+
+
+def test_parse_model_keys():
+    assert parse_model_keys('') is None
+    assert parse_model_keys('tts-custom:small, voice-clone') == {('tts-custom', '0.6b'), ('voice-clone', '1.7b')}
+    with pytest.raises(ValueError):
+        parse_model_keys('sing:1.7b')
+
+
+def test_select_model_falls_back_to_full_version():
+    engine = EagerTorchEngine()
+    engine.models[('tts-custom', '1.7b')] = object()
+    assert engine.select_model('tts-custom', '0.6b')[1] == '1.7B CustomVoice'
+    with pytest.raises(Exception):
+        engine.select_model('voice-design', '1.7b')
+
+
+def test_eager_retry_drops_only_unsupported_keys():
+    model = StrictModel({'max_new_tokens', 'stopping_criteria', 'temperature'})
+    engine = EagerTorchEngine()
+    engine.models[('tts-custom', '1.7b')] = model
+    stop = [lambda ids, scores: False]
+    engine.generate(_request(**sampling_config('1.7b'), max_new_tokens=99, stopping_criteria=stop))
+    assert model.calls == [{'temperature': 0.6, 'max_new_tokens': 99, 'stopping_criteria': stop}]
+
+
+def test_eager_retry_keeps_required_keys_when_error_is_unclear():
+    class OpaqueModel(StrictModel):
+        def generate_custom_voice(self, text, language, speaker, **config):
+            if set(config) - self.accepted:
+                raise TypeError('bad generation config')
+            return super().generate_custom_voice(text, language, speaker, **config)
+
+    model = OpaqueModel({'max_new_tokens'})
+    engine = EagerTorchEngine()
+    engine.models[('tts-custom', '1.7b')] = model
+    engine.generate(_request(top_k=5, max_new_tokens=7))
+    assert model.calls == [{'max_new_tokens': 7}]
+
+    # 必需参数本身不被支持时不再重试
+    model.accepted = set()
+    with pytest.raises(TypeError):
+        engine.generate(_request(max_new_tokens=7))
+
+
+def test_stub_respects_max_new_tokens():
+    engine = StubEngine()
+    engine.load({('tts-custom', '1.7b')})
+    full = engine.generate(_request()).audio
+    capped = engine.generate(_request(max_new_tokens=3)).audio
+    assert len(capped) == 3 * 24000 // 12 < len(full)
+
+
+def test_concurrent_seeded_stub_requests_are_deterministic():
+    engine = StubEngine()
+    engine.load({('tts-custom', '1.7b')})
+    config = sampling_config('1.7b')
+    seeds = [1, 2, 3, 4]
+    expected = {}
+    for seed in seeds:
+        with seeded(seed):
+            expected[seed] = engine.generate(_request(**config)).audio
+
+    results = {}
+    start = threading.Barrier(len(seeds))
+
+    def worker(seed):
+        start.wait()
+        with seeded(seed):
+            results[seed] = engine.generate(_request(**config)).audio
+
+    threads = [threading.Thread(target=worker, args=(seed,)) for seed in seeds]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for seed in seeds:
+        np.testing.assert_array_equal(results[seed], expected[seed])
+    assert not np.array_equal(expected[1], expected[2])
+
+
+def test_warmup_only_runs_when_enabled():
+    key = ('tts-custom', '1.7b')
+    model = StrictModel({'max_new_tokens', 'temperature', 'top_p', 'top_k', 'do_sample',
+                         'num_beams', 'early_stopping', 'use_cache'})
+    engine = EagerTorchEngine(warmup=False)
+    engine.models[key] = model
+    assert engine.warmup(key) is None
+    assert model.calls == []
+
+    engine.warmup_enabled = True
+    engine.warmup(key)
+    assert model.calls[0]['max_new_tokens'] > 0
+    # 克隆模型需要参考音频，不预热
+    assert engine.warmup(('voice-clone', '1.7b')) is None
@@ -0,0 +1,89 @@
+"""音色档案：元数据、克隆提示的保存/预加载（weights_only 读取）与淘汰"""
+import dataclasses
+import os
+from typing import Optional
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip('torch')
+
+import voice_profiles
+from voice_profiles import VoiceProfileLibrary
+
+
+@dataclasses.dataclass
+class FakePromptItem:
+    ref_code: Optional[torch.Tensor]
+    ref_spk_embedding: torch.Tensor
+    x_vector_only_mode: bool
+    icl_mode: bool
+    ref_text: Optional[str] = None
+
+
+def _build_prompt(calls):
+    def build(audio_data, sample_rate, text):
+        calls.append(text)
+        return [FakePromptItem(torch.arange(6).reshape(3, 2), torch.ones(4), False, True, text)]
+    return build
+
+
+def _fields(item):
+    if dataclasses.is_dataclass(item):
+        return {f.name: getattr(item, f.name) for f in dataclasses.fields(item)}
+    return dict(item)
+
+
+def _create(library):
+    return library.create('旁白', '温和的男声', '你好，欢迎收听。', 'chinese',
+                          np.zeros(1600, dtype=np.float32), 16000)
+
+
+def test_create_and_list(tmp_path):
+    library = VoiceProfileLibrary(str(tmp_path))
+    meta = _create(library)
+    assert library.get(meta['profile_id'])['name'] == '旁白'
+    assert [p['profile_id'] for p in library.list()] == [meta['profile_id']]
+    assert sorted(os.listdir(tmp_path / meta['profile_id'])) == ['profile.json', 'sample.wav']
+    with pytest.raises(KeyError):
+        library.get('../../etc')
+
+
+def test_prompt_is_cached_and_reloaded_with_weights_only(tmp_path, monkeypatch):
+    calls = []
+    library = VoiceProfileLibrary(str(tmp_path))
+    profile_id = _create(library)['profile_id']
+    first = library.prompt_for(profile_id, '1.7B Base', _build_prompt(calls))
+    assert library.prompt_for(profile_id, '1.7B Base', _build_prompt(calls)) is first
+    assert calls == ['你好，欢迎收听。']
+
+    # 提示文件只含张量与基本类型
+    path = library._prompt_path(profile_id, '1.7B Base')
+    saved = torch.load(path, map_location='cpu', weights_only=True)
+    assert saved['model_name'] == '1.7B Base'
+
+    # 新进程：从磁盘读取，不重新计算
+    monkeypatch.setattr(voice_profiles, 'VoiceClonePromptItem', FakePromptItem)
+    restarted = VoiceProfileLibrary(str(tmp_path))
+    assert restarted.preload() == 1
+    prompt = restarted.prompt_for(profile_id, '1.7B Base', _build_prompt(calls))
+    assert calls == ['你好，欢迎收听。']
+    assert isinstance(prompt[0], FakePromptItem)
+    restored, original = _fields(prompt[0]), _fields(first[0])
+    assert torch.equal(restored['ref_code'], original['ref_code'])
+    assert torch.equal(restored['ref_spk_embedding'], original['ref_spk_embedding'])
+    assert restored['ref_text'] == original['ref_text'] and restored['icl_mode'] is True
+
+
+def test_preload_configured_and_evict(tmp_path):
+    library = VoiceProfileLibrary(str(tmp_path))
+    profile_id = _create(library)['profile_id']
+    library.prompt_for(profile_id, '0.6B Base', _build_prompt([]))
+    restarted = VoiceProfileLibrary(str(tmp_path))
+    assert restarted.preload_configured('') == 0
+    assert restarted.preload_configured(profile_id) == 1
+    assert restarted.list()[0]['loaded_models'] == ['0.6B Base']
+    assert restarted.evict(profile_id)
+    assert not restarted.evict(profile_id)
+    assert restarted.delete(profile_id)
+    assert restarted.list() == []
@@ -0,0 +1,65 @@
+"""子模块共享：内容哈希、模型间去重与分组"""
+import types
+
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from codec_onnx import decoder_signature
+from weight_sharing import SharedModuleRegistry, module_digest, module_slots
+
+
+def _codec(seed):
+    torch.manual_seed(seed)
+    return torch.nn.Sequential(torch.nn.Linear(32, 32), torch.nn.Linear(32, 8))
+
+
+def _model(codec_seed, talker_seed):
+    """与 Qwen3TTSModel 一样，nn.Module 挂在普通对象上"""
+    torch.manual_seed(talker_seed)
+    talker = torch.nn.Linear(32, 32)
+    return types.SimpleNamespace(model=talker, speech_tokenizer=types.SimpleNamespace(decoder=_codec(codec_seed)))
+
+
+def test_module_digest_covers_content():
+    a, b = _codec(0), _codec(0)
+    assert module_digest(a, {})[0] == module_digest(b, {})[0]
+    assert module_digest(a, {})[1] == (32 * 32 + 32 + 32 * 8 + 8) * 4
+    with torch.no_grad():
+        b[1].bias[0] += 1
+    assert module_digest(a, {})[0] != module_digest(b, {})[0]
+    # ONNX解码器签名使用同一哈希
+    assert decoder_signature(a)['sha256'] == module_digest(a, {})[0]
+
+
+def test_module_slots_finds_modules_on_plain_objects():
+    model = _model(0, 0)
+    slots = module_slots(model)
+    decoder = model.speech_tokenizer.decoder
+    assert slots[id(decoder)][1] == [(model.speech_tokenizer, 'decoder')]
+    assert slots[id(decoder[0])][1] == [(decoder, '0')]
+
+
+def test_identical_submodules_are_shared():
+    registry = SharedModuleRegistry(min_bytes=0)
+    first, second = _model(0, 1), _model(0, 2)
+    assert registry.deduplicate(first, 'first') == 0
+    saved = registry.deduplicate(second, 'second')
+    assert second.speech_tokenizer.decoder is first.speech_tokenizer.decoder
+    assert second.model is not first.model
+    assert saved == module_digest(first.speech_tokenizer.decoder, {})[1]
+    assert registry.stats()['shared_modules'] == 1
+
+
+def test_sharing_respects_group_and_min_bytes():
+    registry = SharedModuleRegistry(min_bytes=0)
+    first, second = _model(0, 1), _model(0, 2)
+    registry.deduplicate(first, 'first', 'fp32')
+    registry.deduplicate(second, 'second', 'bf16')
+    assert second.speech_tokenizer.decoder is not first.speech_tokenizer.decoder
+
+    registry = SharedModuleRegistry(min_bytes=1 << 20)
+    first, second = _model(0, 1), _model(0, 2)
+    registry.deduplicate(first, 'first')
+    assert registry.deduplicate(second, 'second') == 0
+    assert second.speech_tokenizer.decoder is not first.speech_tokenizer.decoder
@@ -0,0 +1,169 @@
+"""
+文本分段
+将长文本按句子边界切分为适合单次生成的片段：先按句末标点断句，
+再把过短的句子合并、把过长的句子按逗号等次级标点继续切分。
+合并时的切分点由句子内容决定，局部修改文本后其余片段保持不变。
+"""
+import os
+import re
+import zlib
+
+# 单个片段的目标最大字符数
+SEGMENT_MAX_CHARS = int(os.environ.get('QWEN_TTS_SEGMENT_MAX_CHARS', 200))
+
+# 句末标点（中英文），保留标点在句子末尾
+_SENTENCE_END = re.compile(r'(?<=[。！？!?；;…])|(?<=[.])(?=\s)|\n+')
+# 次级断句标点
+_CLAUSE_END = re.compile(r'(?<=[，,、：:])')
+
+
+def split_sentences(text):
+    """按句末标点和换行切分，去除空白片段"""
+    return [s.strip() for s in _SENTENCE_END.split(text) if s and s.strip()]
+
+
+def _split_long(sentence, max_chars):
+    """超长句子按次级标点切分，仍然过长时按长度硬切"""
+    if len(sentence) <= max_chars:
+        return [sentence]
+    pieces = []
+    current = ''
+    for clause in _CLAUSE_END.split(sentence):
+        if not clause:
+            continue
+        if current and len(current) + len(clause) > max_chars:
+            pieces.append(current)
+            current = ''
+        current += clause
+    if current:
+        pieces.append(current)
+
+    result = []
+    for piece in pieces:
+        while len(piece) > max_chars:
+            result.append(piece[:max_chars])
+            piece = piece[max_chars:]
+        if piece.strip():
+            result.append(piece)
+    return [p.strip() for p in result if p.strip()]
+
+
+def _is_anchor(sentence):
+    """内容定义的切分点：约四分之一的句子作为片段结尾"""
+    return zlib.crc32(sentence.encode('utf-8')) % 4 == 0
+
+
+def split_segments(text, max_chars=SEGMENT_MAX_CHARS):
+    """
+    将文本切分为生成片段
+
+    Args:
+        text: 待合成文本
+        max_chars: 单个片段最大字符数
+
+    Returns:
+        list[str]: 片段列表；短文本返回仅含一个元素的列表
+    """
+    text = text.strip()
+    if not text:
+        return []
+    if len(text) <= max_chars:
+        return [text]
+
+    segments = []
+    current = ''
+    for sentence in split_sentences(text):
+        for piece in _split_long(sentence, max_chars):
+            # 合并过短的句子，减少生成调用次数
+            if current and len(current) + len(piece) + 1 > max_chars:
+                segments.append(current)
+                current = ''
+            current = f"{current} {piece}" if current and piece[0].isascii() else current + piece
+            # 由句子内容决定的切分点：修改一句话只影响附近的片段，
+            # 其余片段边界不变，可以复用已合成的片段音频
+            if len(current) >= max_chars // 4 and _is_anchor(piece):
+                segments.append(current)
+                current = ''
+    if current:
+        segments.append(current)
+    return segments
+
+
+class SentenceBuffer:
+    """
+    增量断句缓冲：文本片段（如LLM逐token输出）陆续到达，
+    凑成完整句子后立即交给合成，不必等待全文结束
+    """
+
+    def __init__(self, max_chars=SEGMENT_MAX_CHARS, min_chars=4, first_clause_chars=12):
+        """
+        Args:
+            max_chars: 单句最大字符数，未完成的句子超过该长度时按次级标点提前切出
+            min_chars: 过短的句子（如「嗯。」）与下一句合并，避免零碎的生成调用
+            first_clause_chars: 第一句在逗号处即可切出的最小长度，缩短首段音频的等待时间
+        """
+        self.max_chars = max_chars
+        self.min_chars = min_chars
+        self.first_clause_chars = first_clause_chars
+        self._text = ''
+        self.emitted = 0
+
+    def _join(self, current, piece):
+        return f"{current} {piece}" if current and piece[0].isascii() else current + piece
+
+    def _take(self, end):
+        """切出缓冲区前 end 个字符，按句子与长度整理后返回"""
+        complete, self._text = self._text[:end], self._text[end:]
+        result = []
+        current = ''
+        for sentence in split_sentences(complete):
+            for piece in _split_long(sentence, self.max_chars):
+                current = self._join(current, piece)
+                if len(current) >= self.min_chars:
+                    result.append(current)
+                    current = ''
+        if current:
+            # 过短的尾句留在缓冲区，与后续文本合并
+            self._text = self._join(current, self._text.lstrip()) if self._text.strip() else current
+        self.emitted += len(result)
+        return result
+
+    def push(self, fragment):
+        """
+        追加文本片段
+
+        Args:
+            fragment: 新到达的文本
+
+        Returns:
+            list[str]: 已经完整、可以立即合成的句子（可能为空）
+        """
+        self._text += fragment
+        boundary = 0
+        for match in _SENTENCE_END.finditer(self._text):
+            boundary = match.end()
+        if boundary and self._text[:boundary].strip():
+            sentences = self._take(boundary)
+            if sentences:
+                return sentences
+
+        # 尚无完整句子：首句或超长句在次级标点处提前切出
+        limit = self.first_clause_chars if self.emitted == 0 else self.max_chars
+        if len(self._text) < limit:
+            return []
+        cut = 0
+        for match in _CLAUSE_END.finditer(self._text):
+            if match.end() >= limit or len(self._text) >= self.max_chars:
+                cut = match.end()
+        if cut:
+            return self._take(cut)
+        if len(self._text) >= self.max_chars:
+            return self._take(self.max_chars)
+        return []
+
+    def flush(self):
+        """文本结束：返回缓冲区中剩余的全部内容"""
+        text, self._text = self._text, ''
+        pieces = [p for s in split_sentences(text) for p in _split_long(s, self.max_chars)]
+        self.emitted += len(pieces)
+        return pieces
@@ -0,0 +1,297 @@
+"""
+max_new_tokens 预算估计器
+根据已完成的生成结果，按 (语言, 模型, 说话人) 学习「每字符编解码帧数」，
+为后续请求给出带安全余量的紧凑 token 预算，并统计生成触顶（被截断）的比例。
+
+Qwen3-TTS 12Hz 编解码器每秒音频对应 12 帧，talker 每个解码步生成一帧，
+因此 max_new_tokens 与音频时长直接对应：帧数 = 时长(秒) × 12。
+"""
+import atexit
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+from request_log import get_logger, log_event
+
+logger = get_logger('token_budget')
+
+# 12Hz 编解码器帧率
+CODEC_FRAME_RATE = 12
+
+# 先验：各语言每字符帧数（中文约 4.5 字/秒，英文约 14 字符/秒）
+DEFAULT_FRAMES_PER_CHAR = {
+    'chinese': 2.7,
+    'japanese': 1.7,
+    'korean': 2.0,
+    'english': 0.9,
+    'french': 0.9,
+    'german': 0.9,
+    'spanish': 0.9,
+    'italian': 0.9,
+    'portuguese': 0.9,
+    'russian': 1.0,
+}
+FALLBACK_FRAMES_PER_CHAR = 1.5
+
+# 样本数不足时回退到上一级统计
+MIN_SAMPLES = 5
+# 基础安全余量（相对比例）与标准差倍数
+SAFETY_MARGIN = 0.15
+STD_MULTIPLIER = 2.0
+# 固定额外帧数，覆盖句首句尾停顿（约 1.5 秒）
+OVERHEAD_FRAMES = 18
+# 预算上下限
+MIN_TOKENS = 48
+HARD_CAP = int(os.environ.get('QWEN_TTS_MAX_NEW_TOKENS', 4096))
+# 服务中统计文件的保存间隔（秒），由后台线程写入，不在请求路径上
+SAVE_INTERVAL = float(os.environ.get('QWEN_TTS_BUDGET_SAVE_INTERVAL', 30))
+
+
+def detect_language(text, language='auto'):
+    """将 'auto' 解析为具体语言：按文字类别粗略判断，其余语言原样返回"""
+    if language and language != 'auto':
+        return language
+    han = kana = hangul = 0
+    for ch in text:
+        code = ord(ch)
+        if 0x4E00 <= code <= 0x9FFF or 0x3400 <= code <= 0x4DBF:
+            han += 1
+        elif 0x3040 <= code <= 0x30FF:
+            kana += 1
+        elif 0xAC00 <= code <= 0xD7AF:
+            hangul += 1
+    if kana:
+        return 'japanese'
+    if hangul > han:
+        return 'korean'
+    if han:
+        return 'chinese'
+    return 'english'
+
+
+def count_chars(text):
+    """有效字符数：忽略空白，避免换行缩进影响预算"""
+    return sum(1 for ch in text if not ch.isspace())
+
+
+class _RatioStats:
+    """单个统计桶：Welford 在线均值/方差 + 触顶计数"""
+
+    def __init__(self, count=0, mean=0.0, m2=0.0, requests=0, cap_hits=0):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+        self.requests = requests
+        self.cap_hits = cap_hits
+
+    def add(self, ratio):
+        self.count += 1
+        delta = ratio - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (ratio - self.mean)
+
+    @property
+    def std(self):
+        if self.count < 2:
+            return 0.0
+        return math.sqrt(self.m2 / (self.count - 1))
+
+    @property
+    def cap_hit_rate(self):
+        return self.cap_hits / self.requests if self.requests else 0.0
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'mean': self.mean,
+            'm2': self.m2,
+            'requests': self.requests,
+            'cap_hits': self.cap_hits,
+        }
+
+
+class TokenBudgetEstimator:
+    """
+    按 (语言, 模型, 说话人) 学习帧/字符比，给出每请求 token 预算
+
+    Args:
+        stats_path: 统计文件路径（None 时不保存）
+        save_every: 累计多少次记录后保存；为 None 时不按次数保存
+        save_interval: 后台线程定时保存的间隔（秒），设置后进程退出前也会保存
+    """
+
+    def __init__(self, stats_path=None, save_every=None, save_interval=None):
+        self.stats_path = stats_path
+        self.save_every = max(1, save_every) if save_every else None
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._stats = {}
+        self._dirty = 0
+        # 快照序号：并发保存时不让旧快照覆盖新快照
+        self._snapshots = 0
+        self._written = 0
+        self._load()
+        if stats_path and save_interval:
+            threading.Thread(target=self._save_loop, args=(save_interval,),
+                             name='token-budget-save', daemon=True).start()
+            atexit.register(self.flush)
+
+    @staticmethod
+    def _keys(language, model_name, speaker):
+        # 由细到粗：说话人级 → 模型级 → 语言级
+        return [
+            f"{language}|{model_name}|{speaker}",
+            f"{language}|{model_name}|*",
+            f"{language}|*|*",
+        ]
+
+    def _load(self):
+        if not self.stats_path or not os.path.exists(self.stats_path):
+            return
+        try:
+            with open(self.stats_path, 'r', encoding='utf-8') as f:
+                raw = json.load(f)
+            self._stats = {k: _RatioStats(**v) for k, v in raw.get('buckets', {}).items()}
+            log_event(logger, logging.INFO, '已加载 token 预算统计', path=self.stats_path, buckets=len(self._stats))
+        except Exception as e:
+            log_event(logger, logging.WARNING, 'token 预算统计加载失败，使用默认先验', path=self.stats_path, error=str(e))
+            self._stats = {}
+
+    def _snapshot_locked(self):
+        """取出待保存的统计（持有 _lock 时调用），写文件在锁外进行"""
+        self._dirty = 0
+        self._snapshots += 1
+        return self._snapshots, {
+            'updated_at': time.time(),
+            'buckets': {k: v.to_dict() for k, v in self._stats.items()},
+        }
+
+    def _write(self, snapshot):
+        if not self.stats_path:
+            return
+        number, payload = snapshot
+        tmp_path = f"{self.stats_path}.{os.getpid()}.tmp"
+        with self._save_lock:
+            if number < self._written:
+                return
+            self._written = number
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(payload, f, ensure_ascii=False)
+                os.replace(tmp_path, self.stats_path)
+            except Exception as e:
+                log_event(logger, logging.WARNING, 'token 预算统计保存失败', path=self.stats_path, error=str(e))
+
+    def _save_loop(self, interval):
+        while True:
+            time.sleep(interval)
+            self.flush()
+
+    def _lookup(self, language, model_name, speaker):
+        """返回 (帧/字符比, 波动幅度, 触顶比例)，样本不足时逐级回退到先验"""
+        ratio = DEFAULT_FRAMES_PER_CHAR.get(language, FALLBACK_FRAMES_PER_CHAR)
+        # 没有学到统计时使用更宽的余量
+        spread = ratio * 0.5
+        hit_rate = 0.0
+        with self._lock:
+            for key in self._keys(language, model_name, speaker):
+                stats = self._stats.get(key)
+                if stats is not None and stats.count >= MIN_SAMPLES:
+                    return stats.mean, STD_MULTIPLIER * stats.std, stats.cap_hit_rate
+        return ratio, spread, hit_rate
+
+    def expected_frames(self, text, language, model_name, speaker='*'):
+        """预计生成帧数（不含安全余量），用于估算剩余耗时"""
+        language = detect_language(text, language)
+        ratio, _, _ = self._lookup(language, model_name, speaker)
+        return max(1, count_chars(text)) * ratio + OVERHEAD_FRAMES
+
+    def budget(self, text, language, model_name, speaker='*', hard_cap=HARD_CAP):
+        """
+        计算本次请求的 max_new_tokens
+
+        Args:
+            text: 待合成文本
+            language: 语言（可为 'auto'）
+            model_name: 模型名称，如 "1.7B VoiceDesign"
+            speaker: 说话人/音色标识
+            hard_cap: 预算硬上限
+
+        Returns:
+            int: 带安全余量的 token 预算
+        """
+        language = detect_language(text, language)
+        chars = max(1, count_chars(text))
+        ratio, spread, hit_rate = self._lookup(language, model_name, speaker)
+
+        # 触顶比例越高，余量越大
+        margin = SAFETY_MARGIN + hit_rate
+        tokens = chars * (ratio + spread) * (1 + margin) + OVERHEAD_FRAMES
+        return int(min(hard_cap, max(MIN_TOKENS, math.ceil(tokens))))
+
+    def record(self, text, language, model_name, speaker, num_samples, sample_rate, budget):
+        """
+        记录一次完成的生成，更新统计
+
+        Args:
+            num_samples: 生成音频的采样点数
+            sample_rate: 采样率
+            budget: 本次使用的 max_new_tokens
+
+        Returns:
+            bool: 本次生成是否触顶（可能被截断）
+        """
+        language = detect_language(text, language)
+        chars = max(1, count_chars(text))
+        frames = num_samples / float(sample_rate) * CODEC_FRAME_RATE
+        # 允许少量帧数误差（编解码器首尾填充）
+        hit_cap = frames >= budget - 2
+
+        snapshot = None
+        with self._lock:
+            for key in self._keys(language, model_name, speaker):
+                stats = self._stats.setdefault(key, _RatioStats())
+                stats.requests += 1
+                if hit_cap:
+                    # 截断样本只是下界，不参与比例学习
+                    stats.cap_hits += 1
+                else:
+                    stats.add(max(0.0, frames - OVERHEAD_FRAMES) / chars)
+            self._dirty += 1
+            if self.save_every and self._dirty >= self.save_every:
+                snapshot = self._snapshot_locked()
+        if snapshot is not None:
+            self._write(snapshot)
+        return hit_cap
+
+    def flush(self):
+        with self._lock:
+            snapshot = self._snapshot_locked() if self._dirty else None
+        if snapshot is not None:
+            self._write(snapshot)
+
+    def summary(self):
+        """统计报告：每个统计桶的样本数、帧/字符比与触顶比例"""
+        with self._lock:
+            buckets = {
+                key: {
+                    'samples': stats.count,
+                    'frames_per_char': round(stats.mean, 3),
+                    'std': round(stats.std, 3),
+                    'requests': stats.requests,
+                    'cap_hits': stats.cap_hits,
+                    'cap_hit_rate': round(stats.cap_hit_rate, 4),
+                }
+                for key, stats in sorted(self._stats.items())
+            }
+        total_requests = sum(v['requests'] for k, v in buckets.items() if k.endswith('|*|*'))
+        total_hits = sum(v['cap_hits'] for k, v in buckets.items() if k.endswith('|*|*'))
+        return {
+            'requests': total_requests,
+            'cap_hits': total_hits,
+            'cap_hit_rate': round(total_hits / total_requests, 4) if total_requests else 0.0,
+            'buckets': buckets,
+        }
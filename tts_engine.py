@@ -0,0 +1,582 @@
+#!/usr/bin/env python3
+"""
+合成引擎
+三种模式（声音设计 / 声音克隆 / TTS预设）共用一套请求与结果类型，
+模型加载、模型选择与生成调用都集中在引擎中，Web服务与命令行工具只负责参数解析与输出。
+
+后端:
+    eager      直接调用 qwen_tts，参数不被支持时退回默认参数（标准版行为）
+    optimized  在 torch.no_grad() 下推理（高性能版默认）
+    stub       不加载模型，按文本长度生成测试音频并模拟解码循环，用于测试与服务开销基准
+
+使用方法:
+    python tts_engine.py --engine stub --text "你好" --runs 5     # 基准测试
+"""
+
+import os
+import sys
+import time
+import re
+import argparse
+import logging
+import warnings
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Callable, Optional
+
+import numpy as np
+
+import codec_pipeline
+import model_precision
+import weight_sharing
+from request_log import get_logger, log_event
+
+logger = get_logger('engine')
+
+# 模式与模型版本对应的模型目录与名称
+MODEL_SPECS = {
+    ('voice-design', '1.7b'): ("./Qwen3-TTS-12Hz-1.7B-VoiceDesign-Full", "1.7B VoiceDesign"),
+    ('voice-clone', '1.7b'): ("./Qwen3-TTS-12Hz-1.7B-Base", "1.7B Base"),
+    ('tts-custom', '1.7b'): ("./Qwen3-TTS-12Hz-1.7B-CustomVoice-Full", "1.7B CustomVoice"),
+    ('voice-design', '0.6b'): ("./Qwen3-TTS-12Hz-0.6B-VoiceDesign", "0.6B VoiceDesign"),
+    ('voice-clone', '0.6b'): ("./Qwen3-TTS-12Hz-0.6B-Base", "0.6B Base"),
+    ('tts-custom', '0.6b'): ("./Qwen3-TTS-12Hz-0.6B-CustomVoice", "0.6B CustomVoice"),
+}
+
+MODES = ('voice-design', 'voice-clone', 'tts-custom')
+
+# 各模式未加载时的错误信息
+_MISSING = {
+    'voice-design': "VoiceDesign模型未加载",
+    'voice-clone': "Base模型未加载，声音克隆功能不可用",
+    'tts-custom': "CustomVoice模型未加载",
+}
+
+# 旧版前端的模型版本写法
+_VERSION_ALIASES = {'full': '1.7b', 'small': '0.6b'}
+
+# 按请求计算的生成参数：模型不支持其他参数时也必须保留（长度上限、取消/进度钩子）
+_REQUIRED_GENERATION_KEYS = ('max_new_tokens', 'stopping_criteria')
+
+_UNEXPECTED_KEYWORD = re.compile(r"unexpected keyword argument '(\w+)'")
+
+# 默认后端（可用 QWEN_TTS_ENGINE 覆盖）
+DEFAULT_ENGINE = os.environ.get('QWEN_TTS_ENGINE', '')
+
+# 加载后预热生成以报告解码速度（默认关闭：每个模型多一次生成，延长启动时间）
+WARMUP = os.environ.get('QWEN_TTS_WARMUP', '0') == '1'
+WARMUP_TOKENS = int(os.environ.get('QWEN_TTS_WARMUP_TOKENS', 24))
+WARMUP_TEXT = '你好，欢迎使用语音合成服务。'
+
+# 只加载部分模型，如 "tts-custom:1.7b,voice-clone:0.6b"；为空时加载全部
+LOAD_MODELS = os.environ.get('QWEN_TTS_MODELS', '')
+
+
+def normalize_version(model_version):
+    return _VERSION_ALIASES.get(model_version, model_version)
+
+
+@lru_cache(maxsize=128)
+def _sampling_config(profile):
+    # 根据模型版本优化参数
+    if profile == '0.6b':
+        # 0.6B模型：更快的生成速度
+        temperature, top_p, top_k = 0.5, 0.75, 25
+    elif profile == 'fast':
+        # 极速模式：最快但质量稍低
+        temperature, top_p, top_k = 0.4, 0.7, 20
+    else:
+        # 1.7B完整版：最高质量
+        temperature, top_p, top_k = 0.6, 0.85, 40
+    return {
+        'do_sample': True,
+        'temperature': temperature,
+        'top_p': top_p,
+        'top_k': top_k,
+        'num_beams': 1,
+        'early_stopping': True,
+        'use_cache': True,  # 启用KV缓存加速
+    }
+
+
+def sampling_config(profile):
+    """采样参数档（1.7b / 0.6b / fast）的默认生成参数（max_new_tokens由调用方按请求计算）"""
+    return dict(_sampling_config(normalize_version(profile)))
+
+
+def parse_model_keys(value):
+    """解析 QWEN_TTS_MODELS：返回要加载的 (模式, 版本) 集合，None 表示全部"""
+    value = (value or '').strip()
+    if not value:
+        return None
+    keys = set()
+    for item in value.split(','):
+        mode, _, version = item.strip().partition(':')
+        key = (mode, normalize_version(version or '1.7b'))
+        if key not in MODEL_SPECS:
+            raise ValueError(f"未知模型: {item}")
+        keys.add(key)
+    return keys
+
+
+@dataclass
+class SynthesisRequest:
+    """
+    一次生成调用的输入，三种模式通用
+
+    text/language/speaker/style/voice_description 可以是列表（批量生成，
+    各列表长度一致）；克隆模式使用预先计算的 clone_prompt，或参考音频路径与参考文本。
+    """
+    text: Any
+    mode: str = 'voice-design'
+    language: Any = 'auto'
+    model_version: str = '1.7b'
+    speaker: Any = 'Vivian'
+    style: Any = ''
+    voice_description: Any = ''
+    reference_audio: Optional[str] = None
+    reference_text: str = ''
+    clone_prompt: Any = None
+    generation_config: dict = field(default_factory=dict)
+    # 可选回调 (音频片段, 采样率)：启用流水线时生成过程中逐窗口输出音频（仅单条请求）
+    on_audio: Optional[Callable] = None
+
+
+@dataclass
+class SynthesisResult:
+    """生成结果：音频列表（与请求文本一一对应）、采样率与实际使用的模型"""
+    wavs: list
+    sample_rate: int
+    model_name: str
+    seconds: float = 0.0
+    # 已通过 on_audio 输出的采样点数，调用方只需补发其后的部分
+    streamed_samples: int = 0
+
+    @property
+    def audio(self):
+        return self.wavs[0]
+
+
+class TTSEngine:
+    """引擎基类：模型登记、选择与按模式分派，具体调用方式由子类实现"""
+
+    name = 'base'
+
+    def __init__(self, warmup=None):
+        self.models = {}
+        self.warmup_enabled = WARMUP if warmup is None else warmup
+        self.dtype_overrides = model_precision.parse_model_dtypes()
+        self.load_reports = {}
+        # 模型之间相同的子模块（如编解码器）只保留一份
+        self.shared_modules = weight_sharing.SharedModuleRegistry()
+
+    # ---- 模型 ----
+
+    def load(self, keys=None, model_dir='.'):
+        """
+        加载模型
+
+        Args:
+            keys: 要加载的 (模式, 版本) 集合，None 表示全部
+            model_dir: 模型目录所在的根目录
+
+        Returns:
+            int: 成功加载的模型数
+        """
+        warnings.filterwarnings("ignore")
+        try:
+            from qwen_tts import Qwen3TTSModel
+        except Exception as e:
+            print(f"❌ 模型类导入失败: {e}")
+            return 0
+        print("✅ Qwen-TTS模型类导入成功！")
+
+        for key, (path, name) in MODEL_SPECS.items():
+            if keys is not None and key not in keys:
+                continue
+            try:
+                print(f"\n📁 加载 {name} 模型...")
+                start = time.time()
+                model_path = os.path.join(model_dir, path)
+                # 先按fp32加载，再把非敏感部分转换为目标精度
+                model = Qwen3TTSModel.from_pretrained(
+                    model_path,
+                    trust_remote_code=True,
+                    device_map="cpu"
+                )
+                precision = model_precision.apply_precision(model, self.dtype_for(key, name))
+                if weight_sharing.SHARE_WEIGHTS:
+                    self.shared_modules.deduplicate(model, name, precision['dtype'])
+                self.models[key] = self.prepare(model, name, model_path)
+                print(f"✅ {name} 模型加载成功！（{time.time() - start:.1f} 秒）")
+                self.load_reports[name] = self.report_load(key, name, precision)
+            except Exception as e:
+                self.models.pop(key, None)
+                print(f"❌ {name} 模型加载失败: {e}")
+        if self.shared_modules.bytes_saved:
+            print(f"🔗 模型间共享子模块共节省 {self.shared_modules.bytes_saved / 1024 ** 3:.2f} GB 内存")
+        return len(self.models)
+
+    def dtype_for(self, key, name):
+        """模型的推理精度，CPU不支持时依次退回 bf16 / fp32"""
+        dtype = model_precision.dtype_for(key[0], key[1], self.dtype_overrides)
+        fallbacks = {'fp16': ['fp16', 'bf16', 'fp32'], 'bf16': ['bf16', 'fp32'], 'fp32': ['fp32']}[dtype]
+        for candidate in fallbacks:
+            if model_precision.cpu_supports(candidate):
+                if candidate != dtype:
+                    print(f"⚠️ CPU不支持 {dtype}，{name} 使用 {candidate}")
+                return candidate
+        return 'fp32'
+
+    def report_load(self, key, name, precision):
+        """报告模型的精度、内存占用与预热解码速度"""
+        model = self.models[key]
+        report = {
+            'dtype': precision['dtype'],
+            'weights_gb': round(model_precision.model_memory_bytes(model) / 1024 ** 3, 2),
+            'fp32_params': precision['fp32'],
+            'tokens_per_second': self.warmup(key),
+        }
+        rss = model_precision.process_rss_bytes()
+        report['process_rss_gb'] = round(rss / 1024 ** 3, 2) if rss else None
+        speed = f"，解码 {report['tokens_per_second']:.1f} token/s" if report['tokens_per_second'] else ''
+        memory = f"，进程内存 {report['process_rss_gb']:.1f} GB" if rss else ''
+        print(f"📊 {name}: {report['dtype']}，权重 {report['weights_gb']:.2f} GB{memory}{speed}")
+        return report
+
+    def warmup(self, key):
+        """用短文本预热生成，返回解码速度（token/s）；未开启预热或克隆模型（需要参考音频）时返回None"""
+        mode, version = key
+        if not self.warmup_enabled or not WARMUP_TOKENS or mode == 'voice-clone':
+            return None
+        req = SynthesisRequest(
+            text=WARMUP_TEXT, mode=mode, language='chinese', model_version=version,
+            voice_description='温和的成年女声', generation_config=dict(sampling_config(version), max_new_tokens=WARMUP_TOKENS),
+        )
+        try:
+            result = self.generate(req)
+        except Exception as e:
+            print(f"⚠️ 预热失败: {e}")
+            return None
+        frames = len(result.audio) / float(result.sample_rate) * 12
+        return round(frames / result.seconds, 1) if result.seconds > 0 else None
+
+    def prepare(self, model, name, model_path):
+        """加载后的模型处理钩子（编译、量化、替换解码器等），默认原样返回"""
+        return model
+
+    def stats(self):
+        """引擎运行统计"""
+        return {
+            'engine': self.name,
+            'models': self.available(),
+            'load': self.load_reports,
+            'shared_modules': self.shared_modules.stats(),
+        }
+
+    def available(self):
+        """已加载的模型名称列表"""
+        return [MODEL_SPECS[key][1] for key in MODEL_SPECS if key in self.models]
+
+    def select_model(self, mode, model_version):
+        """按模式与模型版本选择已加载的模型，0.6B未加载时回退到1.7B，返回 (模型, 名称)"""
+        if mode not in MODES:
+            raise Exception(f"未知模式: {mode}")
+        versions = ['0.6b', '1.7b'] if normalize_version(model_version) == '0.6b' else ['1.7b']
+        for version in versions:
+            model = self.models.get((mode, version))
+            if model is not None:
+                return model, MODEL_SPECS[(mode, version)][1]
+        raise Exception(_MISSING[mode])
+
+    def model_by_name(self, model_name):
+        for key, (_, name) in MODEL_SPECS.items():
+            if name == model_name and key in self.models:
+                return self.models[key]
+        raise Exception(f"模型未加载: {model_name}")
+
+    # ---- 生成 ----
+
+    def generate(self, req):
+        """执行一次（或一批）生成，返回 SynthesisResult"""
+        model, model_name = self.select_model(req.mode, req.model_version)
+        start = time.time()
+        if req.mode == 'voice-design':
+            kwargs = {
+                'text': req.text,
+                'language': req.language,
+                'voice_description': req.voice_description,
+                'instruct': req.voice_description,
+            }
+            method = 'generate_voice_design'
+        elif req.mode == 'voice-clone':
+            kwargs = {'text': req.text, 'language': req.language}
+            if req.clone_prompt is not None:
+                kwargs['voice_clone_prompt'] = req.clone_prompt
+            else:
+                if not req.reference_audio:
+                    raise Exception("请上传参考音频文件")
+                kwargs.update(
+                    ref_audio=req.reference_audio,
+                    ref_text=req.reference_text or None,
+                    x_vector_only_mode=not req.reference_text,
+                )
+            method = 'generate_voice_clone'
+        else:
+            kwargs = {'text': req.text, 'language': req.language, 'speaker': req.speaker}
+            # 将style转换为instruct（如果提供了style）
+            if isinstance(req.style, list):
+                if any(req.style):
+                    kwargs['instruct'] = [s or None for s in req.style]
+            elif req.style:
+                kwargs['instruct'] = req.style
+            method = 'generate_custom_voice'
+        wavs, sample_rate = self.invoke(model, model_name, method, kwargs, dict(req.generation_config))
+        return SynthesisResult(list(wavs), sample_rate, model_name, time.time() - start)
+
+    def invoke(self, model, model_name, method, kwargs, generation_config):
+        """调用模型的生成方法，返回 (音频列表, 采样率)"""
+        raise NotImplementedError
+
+    def create_clone_prompt(self, model_name, ref_audio, ref_text, x_vector_only_mode=False):
+        """为参考音频（路径或 (音频, 采样率)）计算克隆提示"""
+        model = self.model_by_name(model_name)
+        return model.create_voice_clone_prompt(
+            ref_audio=ref_audio,
+            ref_text=ref_text,
+            x_vector_only_mode=x_vector_only_mode
+        )
+
+
+class EagerTorchEngine(TTSEngine):
+    """直接调用模型；模型不支持某些生成参数时去掉这些参数后重试"""
+
+    name = 'eager'
+
+    def invoke(self, model, model_name, method, kwargs, generation_config):
+        fn = getattr(model, method)
+        config = dict(generation_config)
+        while True:
+            try:
+                return fn(**kwargs, **config)
+            except TypeError as e:
+                config = self.drop_unsupported(config, e)
+                if config is None:
+                    raise
+                log_event(logger, logging.WARNING, '优化参数不支持，去掉后重试', model=model_name,
+                          error=str(e), kept=sorted(config))
+
+    @staticmethod
+    def drop_unsupported(config, error):
+        """
+        去掉模型不支持的生成参数
+
+        Args:
+            config: 当前的生成参数
+            error: 调用抛出的 TypeError
+
+        Returns:
+            dict | None: 重试用的生成参数；没有可去掉的参数时返回None
+        """
+        match = _UNEXPECTED_KEYWORD.search(str(error))
+        key = match.group(1) if match else None
+        if key in config and key not in _REQUIRED_GENERATION_KEYS:
+            return {k: v for k, v in config.items() if k != key}
+        # 无法确定是哪个参数：只保留按请求计算的参数
+        required = {k: v for k, v in config.items() if k in _REQUIRED_GENERATION_KEYS}
+        return required if len(required) < len(config) else None
+
+
+class OptimizedTorchEngine(TTSEngine):
+    """torch.no_grad() 下推理，可选 torch.compile / INT8 动态量化 / onnxruntime 解码"""
+
+    name = 'optimized'
+
+    def __init__(self, use_compile=None, use_quantization=None, use_onnx_codec=None, use_pipeline=None, warmup=None):
+        super().__init__(warmup)
+        self.use_compile = os.environ.get('QWEN_TTS_COMPILE', '0') == '1' if use_compile is None else use_compile
+        self.use_quantization = os.environ.get('QWEN_TTS_QUANTIZE', '0') == '1' if use_quantization is None else use_quantization
+        self.use_onnx_codec = os.environ.get('QWEN_TTS_ONNX_CODEC', '0') == '1' if use_onnx_codec is None else use_onnx_codec
+        self.use_pipeline = codec_pipeline.PIPELINE if use_pipeline is None else use_pipeline
+        self.codec_decoders = {}
+        self.pipelines = {}
+        self.decode_cores = codec_pipeline.parse_cores(codec_pipeline.DECODE_CORES)
+
+    def prepare(self, model, name, model_path):
+        # 注意：Qwen3TTSModel本身不是nn.Module，编译/量化失败时使用原始模型
+        import torch
+        if self.use_onnx_codec:
+            # 编解码器解码端改由onnxruntime运行，未导出/未验证/出错时自动使用torch
+            import codec_onnx
+            onnx_decoder = codec_onnx.install(model, model_path, name)
+            if onnx_decoder is not None:
+                self.codec_decoders[name] = onnx_decoder
+        if self.use_pipeline:
+            # talker 生成与波形解码并行（安装在ONNX解码之后，窗口解码同样使用onnxruntime）
+            try:
+                self.pipelines[name] = codec_pipeline.PipelineHooks(model, name)
+                print(f"✅ {name} 启用解码流水线（窗口 {codec_pipeline.WINDOW_FRAMES} 帧）")
+            except Exception as e:
+                print(f"⚠️ {name} 无法启用解码流水线: {e}，使用整段解码")
+        if self.use_quantization:
+            try:
+                print(f"🔧 正在量化 {name} 模型...")
+                model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+                print(f"✅ {name} 模型量化完成！")
+            except Exception as e:
+                print(f"⚠️ {name} 模型量化失败: {e}，使用原始模型")
+        if self.use_compile and hasattr(torch, 'compile'):
+            try:
+                print(f"⚡ 正在编译 {name} 模型以加速推理...")
+                model = torch.compile(model, mode="reduce-overhead")
+                print(f"✅ {name} 模型编译完成！")
+            except Exception as e:
+                print(f"⚠️ {name} 模型编译失败: {e}，使用原始模型")
+        return model
+
+    def stats(self):
+        stats = super().stats()
+        if self.codec_decoders:
+            stats['onnx_codec'] = {name: d.stats() for name, d in self.codec_decoders.items()}
+        if self.pipelines:
+            stats['pipeline'] = {name: h.stats() for name, h in self.pipelines.items()}
+        return stats
+
+    def generate(self, req):
+        _, model_name = self.select_model(req.mode, req.model_version)
+        hooks = self.pipelines.get(model_name)
+        if hooks is None or isinstance(req.text, list):
+            return super().generate(req)
+        pipeline = codec_pipeline.CodecPipeline(hooks.decode_frames, req.on_audio, cores=self.decode_cores)
+        with hooks.active(pipeline):
+            result = super().generate(req)
+        if req.on_audio is not None and pipeline.error is None:
+            result.streamed_samples = pipeline.samples
+        return result
+
+    def invoke(self, model, model_name, method, kwargs, generation_config):
+        import torch
+        with torch.no_grad():
+            return getattr(model, method)(**kwargs, **generation_config)
+
+
+class _StubModel:
+    """
+    测试用模型：按文本长度生成正弦音频，并逐帧调用停止条件模拟解码循环
+
+    do_sample 时叠加由 torch 默认随机数生成器采样的微弱噪声，与真实模型一样受请求种子控制。
+    """
+
+    SAMPLE_RATE = 24000
+    FRAME_RATE = 12
+    FRAMES_PER_CHAR = 3
+    SECONDS_PER_FRAME = float(os.environ.get('QWEN_TTS_STUB_SECONDS_PER_FRAME', 0))
+
+    class _Ids:
+        def __init__(self, batch, steps):
+            self.shape = (batch, steps)
+
+    def _generate(self, text, max_new_tokens=None, stopping_criteria=None, do_sample=False, **_):
+        texts = text if isinstance(text, list) else [text]
+        frames = max(len(t.strip()) for t in texts) * self.FRAMES_PER_CHAR
+        if max_new_tokens:
+            frames = min(frames, max_new_tokens)
+        done = frames
+        for step in range(frames):
+            if self.SECONDS_PER_FRAME:
+                time.sleep(self.SECONDS_PER_FRAME)
+            if stopping_criteria is not None and any(
+                    bool(c(self._Ids(len(texts), step + 1), None).all()) for c in stopping_criteria):
+                done = step + 1
+                break
+        wavs = []
+        for t in texts:
+            n = min(done, len(t.strip()) * self.FRAMES_PER_CHAR) * self.SAMPLE_RATE // self.FRAME_RATE
+            wav = 0.3 * np.sin(2 * np.pi * 440 * np.arange(n) / self.SAMPLE_RATE)
+            if do_sample:
+                import torch
+                wav = wav + 0.01 * torch.randn(n, dtype=torch.float64).numpy()
+            wavs.append(wav.astype(np.float32))
+        return wavs, self.SAMPLE_RATE
+
+    generate_voice_design = _generate
+    generate_voice_clone = _generate
+    generate_custom_voice = _generate
+
+    def create_voice_clone_prompt(self, ref_audio, ref_text=None, x_vector_only_mode=False):
+        return {'ref_text': ref_text, 'x_vector_only_mode': x_vector_only_mode}
+
+
+class StubEngine(TTSEngine):
+    """不加载模型的测试后端：所有模式都可用，输出正弦测试音"""
+
+    name = 'stub'
+
+    def load(self, keys=None, model_dir='.'):
+        for key in MODEL_SPECS:
+            if keys is None or key in keys:
+                self.models[key] = _StubModel()
+        print(f"🧪 测试后端已就绪（{len(self.models)} 个模拟模型）")
+        return len(self.models)
+
+    def invoke(self, model, model_name, method, kwargs, generation_config):
+        return getattr(model, method)(**kwargs, **generation_config)
+
+
+ENGINES = {
+    'eager': EagerTorchEngine,
+    'optimized': OptimizedTorchEngine,
+    'stub': StubEngine,
+}
+
+
+def create_engine(name=None, default='optimized'):
+    """按名称创建引擎（未指定时使用 QWEN_TTS_ENGINE，再退回 default）"""
+    name = name or DEFAULT_ENGINE or default
+    if name not in ENGINES:
+        raise ValueError(f"未知引擎: {name}，可选: {', '.join(ENGINES)}")
+    return ENGINES[name]()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="AIMAX395TTS - 合成引擎基准测试",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+示例:
+  python tts_engine.py --engine stub --runs 5
+  python tts_engine.py --engine optimized --mode tts-custom --model-version 0.6b
+        """
+    )
+    parser.add_argument('--engine', default='optimized', choices=sorted(ENGINES), help='后端')
+    parser.add_argument('--mode', default='tts-custom', choices=MODES, help='合成模式')
+    parser.add_argument('--model-version', default='1.7b', choices=['1.7b', '0.6b'], help='模型版本')
+    parser.add_argument('--text', default='欢迎使用Qwen3语音合成服务，这是一段用于基准测试的文本。', help='测试文本')
+    parser.add_argument('--runs', type=int, default=3, help='测试次数（首次为预热，不计入统计）')
+    args = parser.parse_args()
+
+    engine = create_engine(args.engine)
+    if not engine.load({(args.mode, args.model_version)}):
+        return 1
+    req = SynthesisRequest(
+        text=args.text, mode=args.mode, model_version=args.model_version,
+        voice_description='温和的成年女声，语速适中', generation_config=sampling_config(args.model_version),
+    )
+    if args.mode == 'voice-clone':
+        print("❌ 声音克隆需要参考音频，基准测试请使用其他模式")
+        return 1
+
+    times = []
+    for run in range(max(2, args.runs)):
+        result = engine.generate(req)
+        duration = len(result.audio) / float(result.sample_rate)
+        label = '预热' if run == 0 else f"第 {run} 次"
+        print(f"⏱️ {label}: {result.seconds:.2f} 秒，音频 {duration:.2f} 秒，RTF {result.seconds / max(duration, 1e-6):.3f}")
+        if run:
+            times.append(result.seconds)
+    print(f"📊 {engine.name}/{result.model_name}: 平均 {np.mean(times):.2f} 秒，最快 {np.min(times):.2f} 秒")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,205 @@
+"""
+持久化音色档案（一次设计，多次克隆）
+用 VoiceDesign 模型按描述生成一段样本音频后，用 Base 模型预先计算克隆提示
+（voice clone prompt），一起保存到本地档案库。之后的请求只需引用档案ID，
+即可走 Base 模型的克隆路径并直接使用缓存的提示，不再重复运行 VoiceDesign。
+
+档案目录结构：
+    voice_profiles/<profile_id>/profile.json         名称、描述、样本文本等元数据
+    voice_profiles/<profile_id>/sample.wav           设计生成的样本音频
+    voice_profiles/<profile_id>/prompt_<模型>.pt     各Base模型的克隆提示
+
+克隆提示以「张量 + 基本类型」的字典保存，读取时使用 torch.load(weights_only=True)，
+不会因为加载档案文件而执行任意代码。
+"""
+import dataclasses
+import io
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+
+import torch
+
+from disk_cache import write_atomic
+from request_log import get_logger, log_event
+from segment_store import read_wav, write_wav_atomic
+
+try:
+    from qwen_tts import VoiceClonePromptItem
+except ImportError:  # 未安装 qwen_tts 时克隆提示以字典形式返回
+    VoiceClonePromptItem = None
+
+logger = get_logger('voice_profiles')
+
+# 启动时预加载的档案：'all' 或逗号分隔的档案ID
+PRELOAD_PROFILES = os.environ.get('QWEN_TTS_PRELOAD_PROFILES', 'all')
+
+
+def _model_slug(model_name):
+    return re.sub(r'[^0-9A-Za-z]+', '_', model_name).strip('_')
+
+
+def _prompt_to_state(prompt):
+    """克隆提示（VoiceClonePromptItem 列表）→ 只含张量与基本类型的字典列表"""
+    return [
+        {field.name: getattr(item, field.name) for field in dataclasses.fields(item)}
+        if dataclasses.is_dataclass(item) else dict(item)
+        for item in prompt
+    ]
+
+
+def _prompt_from_state(state):
+    """字典列表 → 可传给 generate_voice_clone 的克隆提示"""
+    if VoiceClonePromptItem is None:
+        return state
+    return [VoiceClonePromptItem(**fields) for fields in state]
+
+
+def _load_prompt_file(path):
+    """读取克隆提示文件，返回 (模型名称, 克隆提示)"""
+    saved = torch.load(path, map_location='cpu', weights_only=True)
+    return saved['model_name'], _prompt_from_state(saved['items'])
+
+
+class VoiceProfileLibrary:
+    """音色档案库：保存、列举、预加载与淘汰克隆提示"""
+
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+        os.makedirs(root_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        # 内存中的克隆提示：{档案ID: {模型名称: 提示}}
+        self._prompts = {}
+
+    def _dir(self, profile_id):
+        if not re.fullmatch(r'[0-9a-f]{12}', profile_id or ''):
+            raise KeyError(profile_id)
+        return os.path.join(self.root_dir, profile_id)
+
+    def _prompt_path(self, profile_id, model_name):
+        return os.path.join(self._dir(profile_id), f"prompt_{_model_slug(model_name)}.pt")
+
+    def create(self, name, voice_description, sample_text, language, audio_data, sample_rate):
+        """保存设计好的样本音频，返回档案元数据"""
+        profile_id = uuid.uuid4().hex[:12]
+        profile_dir = self._dir(profile_id)
+        os.makedirs(profile_dir, exist_ok=True)
+        write_wav_atomic(os.path.join(profile_dir, 'sample.wav'), sample_rate, audio_data)
+        meta = {
+            'profile_id': profile_id,
+            'name': name or profile_id,
+            'voice_description': voice_description,
+            'sample_text': sample_text,
+            'language': language,
+            'sample_rate': sample_rate,
+            'created_at': time.time(),
+        }
+        # 原子写入，list() 不会读到半个 profile.json
+        write_atomic(os.path.join(profile_dir, 'profile.json'),
+                     json.dumps(meta, ensure_ascii=False, indent=2).encode('utf-8'))
+        log_event(logger, logging.INFO, '音色档案已创建', profile_id=profile_id, name=meta['name'])
+        return meta
+
+    def get(self, profile_id):
+        path = os.path.join(self._dir(profile_id), 'profile.json')
+        if not os.path.exists(path):
+            raise KeyError(profile_id)
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def sample_path(self, profile_id):
+        return os.path.join(self._dir(profile_id), 'sample.wav')
+
+    def list(self):
+        profiles = []
+        for profile_id in sorted(os.listdir(self.root_dir)):
+            try:
+                meta = self.get(profile_id)
+            except (KeyError, ValueError):
+                continue
+            with self._lock:
+                meta['loaded_models'] = sorted(self._prompts.get(profile_id, {}))
+            profiles.append(meta)
+        return profiles
+
+    def prompt_for(self, profile_id, model_name, build_prompt):
+        """
+        取得档案在指定Base模型上的克隆提示：内存 → 磁盘 → 现场计算并保存
+
+        Args:
+            profile_id: 档案ID
+            model_name: Base模型名称，如 "1.7B Base"
+            build_prompt: 回调 (样本音频, 采样率, 样本文本) → 克隆提示
+
+        Returns:
+            克隆提示（传给 generate_voice_clone 的 voice_clone_prompt）
+        """
+        with self._lock:
+            prompt = self._prompts.get(profile_id, {}).get(model_name)
+        if prompt is not None:
+            return prompt
+
+        meta = self.get(profile_id)
+        path = self._prompt_path(profile_id, model_name)
+        if os.path.exists(path):
+            _, prompt = _load_prompt_file(path)
+        else:
+            audio_data, sample_rate = read_wav(self.sample_path(profile_id))
+            prompt = build_prompt(audio_data, sample_rate, meta['sample_text'])
+            buffer = io.BytesIO()
+            torch.save({'model_name': model_name, 'items': _prompt_to_state(prompt)}, buffer)
+            write_atomic(path, buffer.getvalue())
+            log_event(logger, logging.INFO, '已保存克隆提示', profile_id=profile_id, model=model_name)
+
+        with self._lock:
+            self._prompts.setdefault(profile_id, {})[model_name] = prompt
+        return prompt
+
+    def preload(self, profile_ids=None):
+        """把磁盘上已计算好的克隆提示载入内存"""
+        if profile_ids is None:
+            profile_ids = [p['profile_id'] for p in self.list()]
+        loaded = 0
+        for profile_id in profile_ids:
+            profile_dir = self._dir(profile_id)
+            for filename in os.listdir(profile_dir):
+                if not (filename.startswith('prompt_') and filename.endswith('.pt')):
+                    continue
+                model_name, prompt = _load_prompt_file(os.path.join(profile_dir, filename))
+                with self._lock:
+                    self._prompts.setdefault(profile_id, {})[model_name] = prompt
+                loaded += 1
+        return loaded
+
+    def preload_configured(self, setting=PRELOAD_PROFILES):
+        """按 QWEN_TTS_PRELOAD_PROFILES 预加载"""
+        setting = (setting or '').strip()
+        if not setting:
+            return 0
+        ids = None if setting == 'all' else [p.strip() for p in setting.split(',') if p.strip()]
+        try:
+            loaded = self.preload(ids)
+        except Exception as e:
+            log_event(logger, logging.WARNING, '音色档案预加载失败', exc_info=True, error=str(e))
+            return 0
+        if loaded:
+            log_event(logger, logging.INFO, '已预加载音色克隆提示', prompts=loaded)
+        return loaded
+
+    def evict(self, profile_id):
+        """从内存中移除档案的克隆提示（磁盘文件保留）"""
+        with self._lock:
+            return self._prompts.pop(profile_id, None) is not None
+
+    def delete(self, profile_id):
+        profile_dir = self._dir(profile_id)
+        self.evict(profile_id)
+        if not os.path.isdir(profile_dir):
+            return False
+        shutil.rmtree(profile_dir)
+        return True
@@ -0,0 +1,160 @@
+"""
+模型间共享相同的子模块
+同尺寸的 Base / VoiceDesign / CustomVoice 模型（以及不同尺寸之间）包含相同的12Hz编解码器等组件，
+逐个加载时每个模型各有一份。加载后按权重哈希找出与已加载模型完全相同的子模块，
+让所有模型引用同一个实例，释放重复的内存。
+
+哈希自底向上计算：模块类型、自身参数与缓冲区的名称/形状/精度/内容，以及子模块的哈希，
+每个张量只读取一次；匹配自顶向下进行，整棵子树相同时直接共享，不再逐层比较。
+"""
+import hashlib
+import os
+import threading
+
+# 参与共享的最小子模块大小（字节），更小的模块节省有限
+MIN_SHARE_BYTES = int(os.environ.get('QWEN_TTS_SHARE_MIN_BYTES', 1 << 20))
+
+# 设为 0 关闭共享
+SHARE_WEIGHTS = os.environ.get('QWEN_TTS_SHARE_WEIGHTS', '1') == '1'
+
+
+def _tensor_bytes(tensor):
+    import torch
+    flat = tensor.detach().contiguous().reshape(-1)
+    return flat.view(torch.uint8).numpy()
+
+
+def _tensor_size(tensor):
+    return tensor.numel() * tensor.element_size()
+
+
+def module_slots(model):
+    """
+    模型中所有引用子模块的位置：{id(模块): (模块, [(所有者, 属性名), ...])}
+
+    包括 nn.Module 的子模块，以及 Qwen3TTSModel 等普通对象上直接引用的模块
+    """
+    import torch
+    slots = {}
+    seen_objects = set()
+
+    def add(owner, attr, module):
+        entry = slots.setdefault(id(module), (module, []))
+        entry[1].append((owner, attr))
+
+    def visit_object(obj, depth):
+        if id(obj) in seen_objects or depth > 2:
+            return
+        seen_objects.add(id(obj))
+        for attr, value in list(vars(obj).items()):
+            if isinstance(value, torch.nn.Module):
+                add(obj, attr, value)
+                visit_module(value)
+            elif hasattr(value, '__dict__') and not isinstance(value, type) and type(value).__module__ != 'builtins':
+                visit_object(value, depth + 1)
+
+    def visit_module(module):
+        if id(module) in seen_objects:
+            return
+        seen_objects.add(id(module))
+        for attr, child in module.named_children():
+            add(module, attr, child)
+            visit_module(child)
+
+    if isinstance(model, torch.nn.Module):
+        slots[id(model)] = (model, [])
+        visit_module(model)
+    else:
+        visit_object(model, 0)
+    return slots
+
+
+def module_digest(module, memo):
+    """子模块的内容哈希（memo: {id(模块): (哈希, 字节数)}）"""
+    key = id(module)
+    if key in memo:
+        return memo[key]
+    h = hashlib.sha256(type(module).__qualname__.encode('utf-8'))
+    size = 0
+    for kind, tensors in (('p', module._parameters), ('b', module._buffers)):
+        for name, tensor in sorted(tensors.items()):
+            if tensor is None:
+                continue
+            h.update(f"{kind}:{name}:{tuple(tensor.shape)}:{tensor.dtype}".encode('utf-8'))
+            h.update(_tensor_bytes(tensor))
+            size += _tensor_size(tensor)
+    for name, child in module.named_children():
+        digest, child_size = module_digest(child, memo)
+        h.update(f"m:{name}:{digest}".encode('utf-8'))
+        size += child_size
+    memo[key] = (h.hexdigest(), size)
+    return memo[key]
+
+
+class SharedModuleRegistry:
+    """已加载模型的子模块登记：新模型中与已有实例相同的子模块替换为共享实例"""
+
+    def __init__(self, min_bytes=MIN_SHARE_BYTES):
+        self.min_bytes = min_bytes
+        self._lock = threading.Lock()
+        # {(分组, 哈希): 模块}
+        self._modules = {}
+        # 已登记模块的哈希 {id(模块): (哈希, 字节数)}，共享实例不重复计算
+        self._digests = {}
+        self.shared = []
+        self.bytes_saved = 0
+
+    def deduplicate(self, model, name, group=''):
+        """
+        把模型中与已登记实例相同的子模块替换为共享实例，再登记本模型的子模块
+
+        Args:
+            model: 新加载的模型
+            name: 模型名称（用于日志）
+            group: 分组（如推理精度），只在同组模型之间共享——精度不同时子模块上的精度钩子不同
+
+        Returns:
+            int: 本次节省的字节数
+        """
+        slots = module_slots(model)
+        saved = 0
+        with self._lock:
+            memo = dict(self._digests)
+            replaced = set()
+            for module, owners in list(slots.values()):
+                if not owners or id(module) in replaced:
+                    continue
+                digest, size = module_digest(module, memo)
+                if size < self.min_bytes:
+                    continue
+                shared = self._modules.get((group, digest))
+                if shared is None or shared is module:
+                    continue
+                # 祖先已被整体替换时无需再处理
+                if any(id(owner) in replaced for owner, _ in owners):
+                    continue
+                for owner, attr in owners:
+                    setattr(owner, attr, shared)
+                replaced.add(id(module))
+                replaced.update(id(m) for m in module.modules())
+                saved += size
+                self.shared.append({'model': name, 'module': owners[0][1], 'bytes': size})
+                print(f"🔗 {name}: 子模块 {type(module).__name__} ({owners[0][1]}) 与已加载模型相同，"
+                      f"共享一份（{size / 1024 ** 2:.0f} MB）")
+
+            for module, owners in module_slots(model).values():
+                digest, size = module_digest(module, memo)
+                if size >= self.min_bytes and (group, digest) not in self._modules:
+                    self._modules[(group, digest)] = module
+                    self._digests[id(module)] = (digest, size)
+            self.bytes_saved += saved
+        return saved
+
+    def stats(self):
+        with self._lock:
+            return {
+                'shared_modules': len(self.shared),
+                'bytes_saved': self.bytes_saved,
+                'gb_saved': round(self.bytes_saved / 1024 ** 3, 2),
+                'details': list(self.shared),
+            }